@@ -0,0 +1,136 @@
+"""
+随行情自适应的分析间隔
+
+固定每5分钟分析一次，在没有波动的行情里白白消耗token，放量突破时又要等到下一个整5分钟才反应。
+每个周期结束后根据5分钟K线的指标判断行情状态，决定下一次分析的间隔:
+
+    breakout  收盘价突破前一根K线时的阻力位/跌破支撑位     -> 最短间隔
+    surge     最近两根K线的成交量比率达到激增阈值         -> 最短间隔
+    volatile  最近6根已收盘K线的平均波动明显高于整段均值    -> 最短与基准间隔之间
+    quiet     最近3根已收盘K线缩量且波动低于均值          -> 最长间隔
+    normal    其他                                      -> 基准间隔（由timeframe决定）
+
+有持仓时间隔不超过基准间隔；最近一小时的token用量加上预计的下一次用量超过预算时，
+间隔延长到窗口里有足够额度为止（预算优先于最长间隔）。每次间隔变化都记录原因。
+"""
+import time
+from collections import deque
+
+from event_log import event, log
+from startup import LazyModule
+
+np = LazyModule('numpy')
+
+TOKEN_WINDOW_S = 3600
+
+
+def classify_regime(df, surge_ratio=2.0, shrink_ratio=0.5, volatility_ratio=1.5):
+    """根据带聪明钱指标的Bars（最后一根是未收盘K线）返回 (状态, 原因说明)"""
+    if len(df) < 8:
+        return 'normal', "K线不足"
+    last, prev = df[-1], df[-2]
+
+    if prev['resistance'] == prev['resistance'] and last['close'] > prev['resistance']:
+        return 'breakout', f"价格 {last['close']:.2f} 突破阻力位 {prev['resistance']:.2f}"
+    if prev['support'] == prev['support'] and last['close'] < prev['support']:
+        return 'breakout', f"价格 {last['close']:.2f} 跌破支撑位 {prev['support']:.2f}"
+
+    volume_ratio = max(last['volume_ratio'], prev['volume_ratio'])
+    if volume_ratio >= surge_ratio:
+        return 'surge', f"成交量比率 {volume_ratio:.2f} ≥ {surge_ratio}"
+
+    # 未收盘K线的成交量和波动都不完整，波动和缩量只看已收盘的K线
+    close = df['close']
+    moves = np.abs(close[1:-1] / close[:-2] - 1)
+    baseline = np.nanmean(moves)
+    recent = np.nanmean(moves[-6:])
+    ratio = recent / baseline if baseline > 0 else 1.0
+    if ratio >= volatility_ratio:
+        return 'volatile', f"近6根平均波动为均值的 {ratio:.2f} 倍"
+
+    recent_volume = np.nanmean(df['volume_ratio'][-4:-1])
+    if recent_volume < shrink_ratio and ratio < 1.0:
+        return 'quiet', f"近3根成交量比率 {recent_volume:.2f} < {shrink_ratio}，波动为均值的 {ratio:.2f} 倍"
+    return 'normal', f"成交量比率 {volume_ratio:.2f}，波动为均值的 {ratio:.2f} 倍"
+
+
+class AdaptiveInterval:
+    """根据行情状态和token预算决定下一次分析的间隔（秒）"""
+
+    def __init__(self, base_interval_s, min_interval_s=60, max_interval_s=1800, hourly_token_budget=None,
+                 surge_ratio=2.0, shrink_ratio=0.5, volatility_ratio=1.5, clock=time):
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s
+        self.base_interval_s = min(max(base_interval_s, min_interval_s), max_interval_s)
+        self.hourly_token_budget = hourly_token_budget
+        self.surge_ratio = surge_ratio
+        self.shrink_ratio = shrink_ratio
+        self.volatility_ratio = volatility_ratio
+        self.clock = clock
+        self.interval_s = self.base_interval_s
+        self.regime = 'normal'
+        self.cause = "启动"
+        self.changes = 0
+        self._tokens = deque()  # (时间, token数)
+        self._observed = None
+
+    def record_tokens(self, tokens):
+        now = self.clock.time()
+        self._tokens.append((now, tokens))
+        while self._tokens[0][0] <= now - TOKEN_WINDOW_S:
+            self._tokens.popleft()
+
+    def _window(self):
+        """最近一小时的 [(时间, token数)]；复制后再遍历，metrics线程也会读取"""
+        cutoff = self.clock.time() - TOKEN_WINDOW_S
+        return [(ts, tokens) for ts, tokens in list(self._tokens) if ts > cutoff]
+
+    def tokens_last_hour(self):
+        return sum(tokens for _, tokens in self._window())
+
+    def observe(self, df):
+        """交易周期拿到5分钟K线指标后调用"""
+        self._observed = classify_regime(df, self.surge_ratio, self.shrink_ratio, self.volatility_ratio)
+
+    def _budget_wait(self):
+        """按预算还要等多少秒才能再做一次分析（预计用量取窗口内单次用量的均值）"""
+        window = self._window()
+        if not self.hourly_token_budget or not window:
+            return 0.0
+        used = sum(tokens for _, tokens in window)
+        excess = used + used / len(window) - self.hourly_token_budget
+        if excess <= 0:
+            return 0.0
+        now = self.clock.time()
+        for ts, tokens in window:
+            excess -= tokens
+            if excess <= 0:
+                return ts + TOKEN_WINDOW_S - now
+        return TOKEN_WINDOW_S
+
+    def next_interval(self, position_open=False):
+        """周期结束后调用，返回下一次分析的间隔；间隔变化时写日志"""
+        regime, cause = self._observed or ('normal', "本周期没有行情数据")
+        self._observed = None
+        interval = {
+            'breakout': self.min_interval_s,
+            'surge': self.min_interval_s,
+            'volatile': (self.min_interval_s + self.base_interval_s) / 2,
+            'quiet': self.max_interval_s,
+        }.get(regime, self.base_interval_s)
+        if position_open and interval > self.base_interval_s:
+            interval, cause = self.base_interval_s, f"{cause}；有持仓，不超过基准间隔"
+
+        wait = self._budget_wait()
+        if wait > interval:
+            interval = wait
+            cause = f"{cause}；最近一小时已用 {self.tokens_last_hour()} tokens，预算 {self.hourly_token_budget}"
+        interval = round(interval)
+
+        if interval != self.interval_s:
+            self.changes += 1
+            log.info(f"分析间隔 {self.interval_s}s -> {interval}s（{regime}: {cause}）",
+                     extra=event('cycle', interval_s=interval, previous_interval_s=self.interval_s, regime=regime,
+                                 cause=cause))
+        self.interval_s, self.regime, self.cause = interval, regime, cause
+        return interval
@@ -0,0 +1,505 @@
+"""
+事件驱动回测引擎
+
+把历史K线按5分钟收盘逐根回放，经过机器人真实的
+calculate_smart_money_indicators -> build_multi_timeframe_prompt -> 决策源 -> execute_trade
+流程，撮合在PaperExchange上完成，时间由SimClock推进（机器人里的time.sleep不会真正等待）。
+
+指标只在整段历史上计算一次，再按实盘的50根窗口切片；
+唯一依赖窗口起点的VWAP用累计和差值还原，结果与逐窗口调用一致。
+
+用法:
+    python backtest.py --data data/BTC-USDT-SWAP_5m.csv --signals signals.jsonl
+    python backtest.py --download --since 2024-01-01 --until 2024-04-01 --data data/BTC-USDT-SWAP_5m.csv
+"""
+import argparse
+import contextlib
+import csv
+import importlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+load_dotenv()
+# 回测不一定需要真实密钥，OpenAI客户端在缺少密钥时会直接报错
+os.environ.setdefault('DEEPSEEK_API_KEY', 'offline')
+
+import numpy as np
+import pandas as pd
+
+from bars import OHLCV_COLUMNS, Bars
+from event_log import setup_logging, silenced
+from llm_cache import MODES as LLM_CACHE_MODES, RecordingClient
+from paper_exchange import TIMEFRAME_MS, PaperExchange, SimClock
+
+bot = importlib.import_module('deepseek_ok版本')
+
+# 实盘每个周期获取50根K线，提示词使用最近20根
+WINDOW = 50
+PROMPT_BARS = 20
+
+
+def load_ohlcv_csv(path):
+    """读取K线CSV（timestamp为毫秒时间戳，列: timestamp,open,high,low,close,volume）"""
+    df = pd.read_csv(path)
+    df = df[['timestamp', 'open', 'high', 'low', 'close', 'volume']]
+    df['timestamp'] = df['timestamp'].astype('int64')
+    return df.drop_duplicates('timestamp').sort_values('timestamp').reset_index(drop=True)
+
+
+def download_ohlcv(symbol, timeframe, since, until, path):
+    """用交易所公共接口分页下载历史K线并保存为CSV"""
+    tf_ms = TIMEFRAME_MS[timeframe]
+    rows = []
+    cursor = since
+    while cursor < until:
+        batch = bot.exchange.fetch_ohlcv(symbol, timeframe, since=cursor, limit=100)
+        if not batch:
+            break
+        rows.extend(r for r in batch if r[0] < until)
+        cursor = batch[-1][0] + tf_ms
+        print(f"已下载 {len(rows)} 根K线 (至 {datetime.fromtimestamp(cursor / 1000, timezone.utc):%Y-%m-%d %H:%M})")
+        time.sleep(bot.exchange.rateLimit / 1000)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    df = pd.DataFrame(rows, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+    df.drop_duplicates('timestamp').to_csv(path, index=False)
+    return df
+
+
+def resample_ohlcv(df, timeframe):
+    """把5分钟K线合成为更大周期"""
+    rule = {'15m': '15min', '1h': '1h', '4h': '4h'}[timeframe]
+    indexed = df.set_index(pd.to_datetime(df['timestamp'], unit='ms'))
+    out = indexed.resample(rule, label='left', closed='left').agg({
+        'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'
+    }).dropna()
+    # 丢弃数据末尾不完整的大周期K线
+    counts = indexed['close'].resample(rule, label='left', closed='left').count()
+    out = out[counts.reindex(out.index) == TIMEFRAME_MS[timeframe] // TIMEFRAME_MS['5m']]
+    # 不依赖索引的时间精度（pandas不同版本可能是ns或ms）
+    out.insert(0, 'timestamp', (out.index - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1))
+    return out.reset_index(drop=True)
+
+
+class TimeframeSeries:
+    """单个周期的整段K线和预先计算好的指标"""
+
+    def __init__(self, timeframe, df):
+        self.timeframe = timeframe
+        self.tf_ms = TIMEFRAME_MS[timeframe]
+        self.bars = bot.calculate_smart_money_indicators(Bars.from_ohlcv(df[list(OHLCV_COLUMNS)].to_numpy()))
+        self.prompt_bars = self.bars.select(bot.KLINE_COLUMNS)
+
+        self.ts = self.bars['timestamp']
+        self.close_ts = self.ts + self.tf_ms
+        # 前缀和：cum[k] 为前k根的累计值，用于还原以窗口起点为锚的VWAP
+        self.cum_pv = np.concatenate(([0.0], np.cumsum(self.bars['close'] * self.bars['volume'])))
+        self.cum_v = np.concatenate(([0.0], np.cumsum(self.bars['volume'])))
+
+    def last_closed(self, now_ms):
+        """当前时间已收盘的最后一根K线下标，没有则为-1"""
+        return int(np.searchsorted(self.close_ts, now_ms, side='right')) - 1
+
+    def snapshot(self, i, timestamp):
+        """构造与get_multi_timeframe_data相同结构的周期数据（不含all_data）"""
+        anchor = i - WINDOW + 1
+        first = i - PROMPT_BARS + 1
+        vwap = (self.cum_pv[first + 1:i + 2] - self.cum_pv[anchor]) / (self.cum_v[first + 1:i + 2] - self.cum_v[anchor])
+
+        # 切片是整段指标数组的视图，只有依赖窗口起点的VWAP两列是新数组
+        kline_data = self.prompt_bars[first:i + 1]
+        kline_data['vwap'] = vwap
+        kline_data['price_vs_vwap'] = (kline_data['close'] - vwap) / vwap * 100
+
+        latest, prev_close = kline_data[-1], kline_data['close'][-2]
+        close = latest['close']
+        return {
+            'price': close,
+            'timestamp': timestamp,
+            'high': latest['high'],
+            'low': latest['low'],
+            'volume': latest['volume'],
+            'timeframe': self.timeframe,
+            'price_change': (close - prev_close) / prev_close * 100,
+            'kline_data': kline_data,
+        }
+
+
+class DecisionContext:
+    """传给决策源的单步上下文，提示词按需构建"""
+
+    def __init__(self, bar_time_ms, timestamp, multi_data):
+        self.bar_time_ms = bar_time_ms
+        self.timestamp = timestamp
+        self.multi_data = multi_data
+        self._prompt = None
+
+    @property
+    def prompt(self):
+        if self._prompt is None:
+            self._prompt = bot.build_multi_timeframe_prompt(
+                self.multi_data, bot.get_current_position(), bot.get_current_orders())
+        return self._prompt
+
+
+class DeepSeekDecisionSource:
+    """调用DeepSeek实时决策，可选把结果写成可回放的信号文件"""
+
+    def __init__(self, record_path=None):
+        self.record_file = open(record_path, 'a', encoding='utf-8') if record_path else None
+
+    def __call__(self, ctx):
+        result, usage = bot.request_deepseek([
+            {"role": "system", "content": bot.MULTI_TIMEFRAME_SYSTEM_PROMPT},
+            {"role": "user", "content": ctx.prompt}
+        ])
+        if usage is not None:
+            bot.update_token_stats(usage)
+        signal_data = bot.parse_signal_response(result)
+        if signal_data is not None and self.record_file:
+            self.record_file.write(json.dumps(dict(signal_data, bar_time=ctx.bar_time_ms), ensure_ascii=False) + "\n")
+            self.record_file.flush()
+        return signal_data
+
+
+class RecordedDecisionSource:
+    """按K线时间回放已记录的信号（JSONL，每行含bar_time毫秒或timestamp字符串）"""
+
+    def __init__(self, path, utc_offset_hours=0):
+        self.signals = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                signal_data = json.loads(line)
+                if 'bar_time' in signal_data:
+                    at = int(signal_data['bar_time'])
+                else:
+                    local = datetime.strptime(signal_data['timestamp'], '%Y-%m-%d %H:%M:%S')
+                    at = int(local.replace(tzinfo=timezone.utc).timestamp() * 1000) - int(utc_offset_hours * 3_600_000)
+                self.signals.append((at, signal_data))
+        self.signals.sort(key=lambda item: item[0])
+        self._pos = 0
+
+    def __call__(self, ctx):
+        # 取(上一步, 当前K线收盘]之间最后一个信号
+        found = None
+        while self._pos < len(self.signals) and self.signals[self._pos][0] <= ctx.bar_time_ms:
+            found = self.signals[self._pos][1]
+            self._pos += 1
+        return dict(found) if found else None
+
+
+class SmartMoneyRuleSource:
+    """不调用模型的规则基准：5分钟聪明钱流向且15分钟价格在VWAP同侧时开仓"""
+
+    def __init__(self, risk_pct=1.0, reward_ratio=2.0):
+        self.risk_pct = risk_pct
+        self.reward_ratio = reward_ratio
+
+    def __call__(self, ctx):
+        latest_5m = ctx.multi_data['5m']['kline_data'][-1]
+        latest_15m = ctx.multi_data['15m']['kline_data'][-1]
+        price = latest_5m['close']
+        risk = price * self.risk_pct / 100
+
+        if latest_5m['smart_money_flow'] == 1 and latest_15m['price_vs_vwap'] > 0:
+            signal, stop_loss, take_profit = 'BUY', price - risk, price + risk * self.reward_ratio
+        elif latest_5m['smart_money_flow'] == -1 and latest_15m['price_vs_vwap'] < 0:
+            signal, stop_loss, take_profit = 'SELL', price + risk, price - risk * self.reward_ratio
+        else:
+            return {'signal': 'HOLD', 'reason': '无聪明钱信号', 'confidence': 'LOW', 'order_suggestion': 'HOLD'}
+
+        return {
+            'signal': signal,
+            'reason': '聪明钱流向与15分钟VWAP同向',
+            'market_price': price,
+            'stop_loss': stop_loss,
+            'take_profit': take_profit,
+            'confidence': 'HIGH',
+        }
+
+
+@contextlib.contextmanager
+def override_config(trade_config=None):
+    """临时覆盖TRADE_CONFIG（嵌套的dict如strategy按键合并），退出时还原"""
+    saved_config = {k: dict(v) if isinstance(v, dict) else v for k, v in bot.TRADE_CONFIG.items()}
+    for key, value in (trade_config or {}).items():
+        if isinstance(value, dict) and isinstance(bot.TRADE_CONFIG.get(key), dict):
+            bot.TRADE_CONFIG[key].update(value)
+        else:
+            bot.TRADE_CONFIG[key] = value
+    try:
+        yield
+    finally:
+        bot.TRADE_CONFIG.clear()
+        bot.TRADE_CONFIG.update(saved_config)
+
+
+def backtest_risk_engine(exchange, clock):
+    """按当前（已覆盖的）TRADE_CONFIG和模拟交易所的合约面值创建风控，余额缓存按模拟时间过期"""
+    risk = bot.TRADE_CONFIG['risk']
+    return bot.RiskEngine(
+        bot.TRADE_CONFIG['leverage'],
+        contract_size=getattr(exchange, 'contract_size', bot.TRADE_CONFIG['paper']['contract_size']),
+        max_order_amount=risk['max_order_amount'], max_position_amount=risk['max_position_amount'],
+        max_price_deviation_pct=risk['max_price_deviation_pct'], liquidation_buffer=risk['liquidation_buffer'],
+        margin_buffer=risk['margin_buffer'], account_ttl_s=risk['account_ttl_s'], enabled=risk['enabled'],
+        clock=clock.time)
+
+
+# 每次运行换成新实例的有状态对象（止盈止损、推测分析、对话上下文等），退出时还原
+RUN_STATE = ('risk_engine', 'protection', 'speculation', 'speculation_turn', 'pending_protection', 'llm_session',
+             'cycle_interval')
+
+
+@contextlib.contextmanager
+def attach_bot(exchange, clock, trade_config=None):
+    """
+    把机器人模块的交易所、时间和日期替换为模拟对象，风控、止盈止损、推测分析、token统计等换成新的一份，
+    退出时还原：同一进程里多次回测（参数扫描）互不影响，结果与之前跑过什么无关
+    """
+    saved = {name: getattr(bot, name) for name in ('exchange', 'time', 'datetime') + RUN_STATE}
+    saved_signals = list(bot.signal_history)
+    saved_prices = list(bot.price_history)
+    saved_tokens = dict(bot.token_stats)
+    saved_trace_path = bot.tracer.path
+    saved_execution = bot.execution_recorder.enabled
+    bot.exchange = exchange
+    bot.time = clock
+    bot.datetime = clock.datetime_class()
+    bot.signal_history.clear()
+    bot.price_history.clear()
+    bot.token_stats.update(total_calls=0, total_tokens=0, total_cost=0.0, avg_tokens_per_call=0)
+    bot.tracer.path = None  # 模拟运行的周期只进内存直方图，不写实盘追踪文件
+    bot.execution_recorder.enabled = False  # 回测成交已由模拟交易所记录
+    try:
+        with override_config(trade_config):
+            # 杠杆、张数上限等按覆盖后的配置生效，不沿用实盘的风控实例
+            bot.risk_engine = backtest_risk_engine(exchange, clock)
+            bot.protection = bot.create_protection()
+            bot.speculation = bot.create_speculation()
+            bot.llm_session = bot.create_llm_session()
+            bot.cycle_interval = bot.create_cycle_interval()
+            bot.cycle_interval.clock = clock  # 最近一小时的token窗口按模拟时间过期
+            bot.speculation_turn = bot.pending_protection = None
+            yield
+    finally:
+        for name, value in saved.items():
+            setattr(bot, name, value)
+        bot.signal_history[:] = saved_signals
+        bot.price_history[:] = saved_prices
+        bot.token_stats.update(saved_tokens)
+        bot.tracer.path = saved_trace_path
+        bot.execution_recorder.enabled = saved_execution
+
+
+class Backtest:
+    """按5分钟K线收盘驱动的回测"""
+
+    def __init__(self, candles_5m, decision_source, initial_balance=10000.0, trade_config=None,
+                 exchange_config=None, quiet=True):
+        self.decision_source = decision_source
+        self.initial_balance = initial_balance
+        self.trade_config = trade_config or {}
+        # 透传给PaperExchange：contract_size、maker_fee、taker_fee、slippage_bps、latency_ms
+        self.exchange_config = exchange_config or {}
+        self.quiet = quiet
+
+        # 指标参数（strategy）在预计算时就要生效
+        with override_config(self.trade_config):
+            self.series = {'5m': TimeframeSeries('5m', candles_5m)}
+            for tf in bot.TIMEFRAMES:
+                if tf != '5m':
+                    self.series[tf] = TimeframeSeries(tf, resample_ohlcv(candles_5m, tf))
+
+        self.equity_curve = []
+        self.decisions = []
+
+    def build_multi_data(self, now_ms, timestamp):
+        multi_data = {}
+        for tf in bot.TIMEFRAMES:
+            series = self.series[tf]
+            i = series.last_closed(now_ms)
+            if i < WINDOW - 1:
+                return None  # 预热期：还不够50根K线
+            multi_data[tf] = series.snapshot(i, timestamp)
+        return multi_data
+
+    def run(self, start_ms=None, end_ms=None):
+        base = self.series['5m']
+        clock = SimClock(base.ts[0])
+        exchange = PaperExchange(
+            clock,
+            symbol=self.trade_config.get('symbol', bot.TRADE_CONFIG['symbol']),
+            initial_balance=self.initial_balance,
+            leverage=self.trade_config.get('leverage', bot.TRADE_CONFIG['leverage']),
+            **self.exchange_config
+        )
+        c = base.bars
+        started = time.perf_counter()
+        steps = 0
+
+        with attach_bot(exchange, clock, self.trade_config), (silenced() if self.quiet else contextlib.nullcontext()):
+            for k in range(len(base.ts)):
+                bar_close = int(base.close_ts[k])
+                if start_ms is not None and base.ts[k] < start_ms:
+                    exchange.last_price = c['close'][k]
+                    continue
+                if end_ms is not None and base.ts[k] >= end_ms:
+                    break
+
+                # 先用本根K线撮合上一步留下的挂单，再在收盘时刻做决策
+                exchange.on_bar(int(base.ts[k]), c['open'][k], c['high'][k], c['low'][k], c['close'][k])
+                clock.advance_to(bar_close)
+                timestamp = clock.strftime()
+                bot.protect_filled_entry()  # 与实盘周期开始时相同：已成交的入场挂单补上止盈止损
+
+                multi_data = self.build_multi_data(bar_close, timestamp)
+                if multi_data is not None:
+                    ctx = DecisionContext(bar_close, timestamp, multi_data)
+                    signal_data = self.decision_source(ctx)
+                    if signal_data:
+                        bot.record_signal(signal_data, timestamp)
+                        self.decisions.append(dict(signal_data, bar_time=bar_close))
+                        bot.execute_trade(signal_data, multi_data['5m'])
+                        bot.refresh_risk_account()  # 与实盘周期末相同，保证金检查用模拟账户的余额
+                    steps += 1
+
+                self.equity_curve.append((bar_close, exchange.equity(), exchange.position_qty))
+            risk = bot.risk_engine.snapshot()
+
+        elapsed = time.perf_counter() - started
+        return self.summarize(exchange, steps, elapsed, risk)
+
+    def summarize(self, exchange, steps, elapsed, risk=None):
+        equity = np.array([e for _, e, _ in self.equity_curve]) if self.equity_curve else np.array([self.initial_balance])
+        peak = np.maximum.accumulate(equity)
+        drawdown = (peak - equity) / peak * 100
+        closes = [f for f in exchange.fills if f['realized_pnl'] != 0]
+        wins = [f for f in closes if f['realized_pnl'] > 0]
+
+        self.fills = exchange.fills
+        return {
+            'initial_balance': self.initial_balance,
+            'final_equity': float(equity[-1]),
+            'total_return_pct': float((equity[-1] / self.initial_balance - 1) * 100),
+            'max_drawdown_pct': float(drawdown.max()),
+            'realized_pnl': exchange.realized_pnl,
+            'fees': exchange.total_fees,
+            'fills': len(exchange.fills),
+            'closing_fills': len(closes),
+            'win_rate_pct': len(wins) / len(closes) * 100 if closes else 0.0,
+            'decisions': len(self.decisions),
+            'risk_rejected': risk['rejected'] if risk else 0,
+            'risk_rejections': risk['rejections'] if risk else {},
+            'bars': steps,
+            'elapsed_s': elapsed,
+            'bars_per_sec': steps / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def save(self, out_dir, summary):
+        """保存汇总、权益曲线、成交记录和信号"""
+        os.makedirs(out_dir, exist_ok=True)
+        with open(os.path.join(out_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        with open(os.path.join(out_dir, 'equity.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['timestamp', 'equity', 'position'])
+            writer.writerows(self.equity_curve)
+        with open(os.path.join(out_dir, 'trades.csv'), 'w', newline='', encoding='utf-8') as f:
+            fields = ['timestamp', 'order_id', 'type', 'side', 'amount', 'price', 'fee', 'liquidity',
+                      'realized_pnl', 'reduce_only', 'tag', 'trigger', 'position_after']
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(self.fills)
+        with open(os.path.join(out_dir, 'signals.jsonl'), 'w', encoding='utf-8') as f:
+            for signal_data in self.decisions:
+                f.write(json.dumps(signal_data, ensure_ascii=False, default=str) + "\n")
+
+
+def print_summary(summary):
+    print("\n" + "=" * 50)
+    print("回测结果")
+    print("=" * 50)
+    print(f"初始资金: {summary['initial_balance']:.2f} USDT")
+    print(f"最终权益: {summary['final_equity']:.2f} USDT")
+    print(f"总收益率: {summary['total_return_pct']:+.2f}%")
+    print(f"最大回撤: {summary['max_drawdown_pct']:.2f}%")
+    print(f"已实现盈亏: {summary['realized_pnl']:.2f} USDT, 手续费: {summary['fees']:.2f} USDT")
+    print(f"成交笔数: {summary['fills']}, 平仓笔数: {summary['closing_fills']}, 胜率: {summary['win_rate_pct']:.1f}%")
+    if summary['risk_rejected']:
+        reasons = ', '.join(f"{reason} {count}" for reason, count in sorted(summary['risk_rejections'].items()))
+        print(f"风控拒绝: {summary['risk_rejected']} 笔（{reasons}）")
+    print(f"回放K线: {summary['bars']} 根, 耗时 {summary['elapsed_s']:.2f}s ({summary['bars_per_sec']:.0f} 根/秒)")
+    print("=" * 50)
+
+
+def parse_date_ms(value):
+    if value is None:
+        return None
+    return int(datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="聪明钱策略回测")
+    parser.add_argument('--data', required=True, help="5分钟K线CSV路径")
+    parser.add_argument('--download', action='store_true', help="先从交易所下载K线到--data")
+    parser.add_argument('--since', help="开始日期 YYYY-MM-DD (UTC)")
+    parser.add_argument('--until', help="结束日期 YYYY-MM-DD (UTC)")
+    parser.add_argument('--source', choices=['recorded', 'deepseek', 'rule'], default='recorded')
+    parser.add_argument('--signals', help="recorded模式读取 / deepseek模式追加写入的信号文件")
+    parser.add_argument('--llm-cache', help="deepseek模式使用的LLM录制/回放缓存目录")
+    parser.add_argument('--llm-cache-mode', choices=LLM_CACHE_MODES, default='record',
+                        help="strict: 未命中即失败，保证离线可复现")
+    parser.add_argument('--utc-offset', type=float, default=0, help="信号timestamp字符串所在时区")
+    parser.add_argument('--balance', type=float, default=10000.0)
+    parser.add_argument('--maker-fee', type=float, default=0.0002)
+    parser.add_argument('--taker-fee', type=float, default=0.0005)
+    parser.add_argument('--slippage-bps', type=float, default=0.0, help="市价单滑点（基点）")
+    parser.add_argument('--latency-ms', type=int, default=0, help="下单到达交易所的延迟")
+    parser.add_argument('--out', default='backtest_output')
+    parser.add_argument('--verbose', action='store_true', help="显示机器人的原始输出")
+    args = parser.parse_args()
+
+    if args.download and not args.since:
+        parser.error("--download需要--since（下载的起始日期）")
+    since, until = parse_date_ms(args.since), parse_date_ms(args.until)
+    if args.download:
+        download_ohlcv(bot.TRADE_CONFIG['symbol'], '5m', since, until or int(time.time() * 1000), args.data)
+
+    if args.source == 'recorded':
+        if not args.signals:
+            parser.error("recorded模式需要--signals")
+        source = RecordedDecisionSource(args.signals, args.utc_offset)
+    elif args.source == 'deepseek':
+        if args.llm_cache and not isinstance(bot.deepseek_client, RecordingClient):
+            bot.deepseek_client = RecordingClient(bot.deepseek_client, args.llm_cache, mode=args.llm_cache_mode)
+        source = DeepSeekDecisionSource(args.signals)
+    else:
+        source = SmartMoneyRuleSource()
+
+    exchange_config = {
+        'maker_fee': args.maker_fee,
+        'taker_fee': args.taker_fee,
+        'slippage_bps': args.slippage_bps,
+        'latency_ms': args.latency_ms,
+    }
+    if args.verbose:
+        setup_logging(path=None)  # 只输出到控制台，不写实盘日志文件
+    backtest = Backtest(load_ohlcv_csv(args.data), source, initial_balance=args.balance,
+                        exchange_config=exchange_config, quiet=not args.verbose)
+    summary = backtest.run(since, until)
+    backtest.save(args.out, summary)
+    print_summary(summary)
+    if isinstance(bot.deepseek_client, RecordingClient):
+        bot.deepseek_client.print_stats()
+    print(f"结果已保存到 {args.out}/")
+
+
+if __name__ == "__main__":
+    main()
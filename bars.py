@@ -0,0 +1,146 @@
+"""
+列式K线容器
+
+以前每个周期先把ccxt返回的K线转成DataFrame算指标，再 tail(20).to_dict('records') 复制出
+60个字典给提示词，all_data里再留一份DataFrame；回测又从DataFrame取出NumPy列逐步拼字典。
+Bars 只保存 {列名: 一维NumPy数组}，取数、指标、提示词、推测分析、自适应间隔和回测共用同一份数据:
+
+    bars['close']     整列（ndarray，不复制）
+    bars[-1]          一根K线的只读视图 Bar（__slots__，按需从列里取值）
+    bars[-20:]        切片仍是 Bars，各列都是原数组的视图
+    bars.select(cols) 只保留部分列的视图
+
+timestamp 列为毫秒时间戳（int64），其余为float64（smart_money_flow/book_pressure 为int64）。
+指标函数原地往 Bars 里加列；需要DataFrame时（调试、导出）调用 to_frame()。
+"""
+import sys
+
+from startup import LazyModule
+
+# 与机器人一样在第一次使用时才导入numpy
+np = LazyModule('numpy')
+
+OHLCV_COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+
+
+def rolling(values, window, reduce):
+    """与pandas的 rolling(window).mean()/max()/min() 对齐：前window-1个为NaN，reduce如np.mean"""
+    result = np.full(len(values), np.nan)
+    if len(values) >= window:
+        result[window - 1:] = reduce(np.lib.stride_tricks.sliding_window_view(values, window), axis=1)
+    return result
+
+
+def shift(values, periods=1):
+    """向后移动periods位，空出的位置为NaN（同pandas的shift）"""
+    result = np.full(len(values), np.nan)
+    if periods < len(values):
+        result[periods:] = values[:len(values) - periods]
+    return result
+
+
+class Bar:
+    """Bars 中一根K线的视图，支持 bar['close'] / bar.get() / 与另一根K线比较"""
+    __slots__ = ('_columns', '_index')
+
+    def __init__(self, columns, index):
+        self._columns = columns
+        self._index = index
+
+    def __getitem__(self, name):
+        return self._columns[name][self._index]
+
+    def get(self, name, default=None):
+        column = self._columns.get(name)
+        return default if column is None else column[self._index]
+
+    def keys(self):
+        return self._columns.keys()
+
+    def to_dict(self):
+        return {name: column[self._index].item() for name, column in self._columns.items()}
+
+    def __eq__(self, other):
+        if not isinstance(other, Bar):
+            return NotImplemented
+        if self._columns.keys() != other._columns.keys():
+            return False
+        for name in self._columns:
+            a, b = self[name], other[name]
+            if a != b and not (a != a and b != b):  # 两边都是NaN视为相同
+                return False
+        return True
+
+    def __repr__(self):
+        return f"Bar({self.to_dict()})"
+
+
+class Bars:
+    __slots__ = ('columns',)
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def from_ohlcv(cls, ohlcv):
+        """ccxt的 [[时间戳, 开, 高, 低, 收, 量], ...] -> Bars；价格列是同一块连续内存的视图"""
+        block = np.ascontiguousarray(np.asarray(ohlcv, dtype='float64').reshape(-1, len(OHLCV_COLUMNS)).T)
+        columns = {name: block[i] for i, name in enumerate(OHLCV_COLUMNS)}
+        columns['timestamp'] = block[0].astype('int64')
+        return cls(columns)
+
+    def __len__(self):
+        return len(self.columns['timestamp'])
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.columns[key]
+        if isinstance(key, slice):
+            return Bars({name: column[key] for name, column in self.columns.items()})
+        length = len(self)
+        index = key + length if key < 0 else key
+        if not 0 <= index < length:
+            raise IndexError(f"K线下标越界: {key}（共{length}根）")
+        return Bar(self.columns, index)
+
+    def __setitem__(self, name, values):
+        values = np.asarray(values)
+        if values.shape != (len(self),):
+            raise ValueError(f"列 {name} 长度 {values.shape} 与K线数 {len(self)} 不一致")
+        self.columns[name] = values
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield Bar(self.columns, index)
+
+    def records(self):
+        """逐根产生 {列名: Python数值} 字典，格式化大量字段时比逐个读Bar快（每列只转换一次，不保存）"""
+        names = list(self.columns)
+        for values in zip(*(column.tolist() for column in self.columns.values())):
+            yield dict(zip(names, values))
+
+    def tail(self, n):
+        return self[-n:] if n else self[:0]
+
+    def select(self, names):
+        return Bars({name: self.columns[name] for name in names})
+
+    def nbytes(self):
+        """对象本身、列字典和各列数组的大小；视图只计算它覆盖的那部分数据"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.columns)
+        for column in self.columns.values():
+            size += sys.getsizeof(column) + (column.nbytes if column.base is not None else 0)
+        return size
+
+    def to_frame(self):
+        import pandas as pd
+
+        frame = pd.DataFrame(self.columns)
+        frame['timestamp'] = pd.to_datetime(frame['timestamp'], unit='ms')
+        return frame
+
+    def __repr__(self):
+        return f"Bars({len(self)}根, 列: {', '.join(self.columns)})"
@@ -0,0 +1,172 @@
+"""
+多交易对批量分析
+
+每个交易对单独请求时，提示词里很长的固定分析要求和JSON格式说明要重复发送、重复计费N次。
+批量模式把多个交易对的精简快照放进一次请求，固定说明只在系统提示词里出现一次，模型按交易对回复一个信号数组:
+
+    parse_signal_array  从回复中取出数组（也接受 {"signals": [...]}）
+    validate_signal     单个条目的字段和取值检查
+    split_signals       按symbol拆分到各交易对；缺失、重复、未请求或不合法的条目记为失败
+    BatchAnalyzer       每max_symbols个交易对一次请求，失败的交易对（整批请求失败或条目无效）
+                        再调用fallback单独分析；按请求类型统计请求数、交易对数、token和耗时
+
+token用量取累计计数的差值，批量请求和单独重试都能算出每个交易对的平均token，与逐个请求的模式直接比较。
+"""
+import json
+import time
+from collections import Counter
+
+from event_log import event, log
+
+SIGNALS = ('BUY', 'SELL', 'HOLD')
+CONFIDENCES = ('HIGH', 'MEDIUM', 'LOW')
+ORDER_SUGGESTIONS = ('PLACE_ORDER', 'HOLD', 'CANCEL_EXISTING')
+PRICE_FIELDS = ('limit_price', 'market_price', 'stop_loss', 'take_profit')
+
+
+def parse_signal_array(content):
+    """从模型回复中取出信号数组，无法解析时返回None"""
+    if not content:
+        return None
+    start, end = content.find('['), content.rfind(']') + 1
+    candidates = [content[start:end]] if start != -1 and end > start else []
+    obj_start, obj_end = content.find('{'), content.rfind('}') + 1
+    if obj_start != -1 and obj_end > obj_start and (start == -1 or obj_start < start):
+        candidates.insert(0, content[obj_start:obj_end])  # {"signals": [...]} 包在对象里
+    for text in candidates:
+        try:
+            parsed = json.loads(text)
+        except ValueError:
+            continue
+        if isinstance(parsed, dict):
+            parsed = parsed.get('signals')
+        if isinstance(parsed, list):
+            return parsed
+    return None
+
+
+def validate_signal(entry):
+    """检查一个信号条目，合法返回None，否则返回原因"""
+    if not isinstance(entry, dict):
+        return "条目不是JSON对象"
+    if entry.get('signal') not in SIGNALS:
+        return f"signal无效: {entry.get('signal')!r}"
+    if entry.get('confidence') not in CONFIDENCES:
+        return f"confidence无效: {entry.get('confidence')!r}"
+    suggestion = entry.get('order_suggestion')
+    if suggestion is not None and suggestion not in ORDER_SUGGESTIONS:
+        return f"order_suggestion无效: {suggestion!r}"
+    for field in PRICE_FIELDS:
+        value = entry.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or not value > 0):
+            return f"{field}不是正数: {value!r}"
+    return None
+
+
+def split_signals(entries, symbols):
+    """按symbol把信号分到各交易对，返回 ({交易对: 信号}, {交易对: 失败原因})"""
+    if entries is None:
+        return {}, {symbol: "回复无法解析为信号数组" for symbol in symbols}
+    signals, errors = {}, {}
+    wanted = set(symbols)
+    for entry in entries:
+        symbol = entry.get('symbol') if isinstance(entry, dict) else None
+        if symbol not in wanted:
+            continue  # 未请求的交易对或缺少symbol，无法归属
+        if symbol in signals or symbol in errors:
+            signals.pop(symbol, None)
+            errors[symbol] = "同一交易对有多个条目"
+            continue
+        reason = validate_signal(entry)
+        if reason is None:
+            signals[symbol] = {key: value for key, value in entry.items() if key != 'symbol'}
+        else:
+            errors[symbol] = reason
+    for symbol in symbols:
+        if symbol not in signals and symbol not in errors:
+            errors[symbol] = "回复中缺少该交易对"
+    return signals, errors
+
+
+class BatchAnalyzer:
+    def __init__(self, request, system_prompt, max_symbols=8, tokens=None, clock=time.perf_counter):
+        self.request = request  # messages -> 回复内容
+        self.system_prompt = system_prompt
+        self.max_symbols = max_symbols
+        self.tokens = tokens or (lambda: 0)  # 累计token数，按差值统计
+        self.clock = clock
+        self.stats = {kind: {'requests': 0, 'symbols': 0, 'tokens': 0, 'latency_s': 0.0, 'failed': 0}
+                      for kind in ('batch', 'single')}
+        self.rejections = Counter()
+
+    def analyze(self, snapshots, fallback):
+        """
+        snapshots为 {交易对: 精简快照文本}，fallback(交易对) 单独分析并返回信号或None。
+        返回 {交易对: 信号或None}
+        """
+        symbols = list(snapshots)
+        results = {}
+        for i in range(0, len(symbols), self.max_symbols):
+            chunk = symbols[i:i + self.max_symbols]
+            if len(chunk) > 1:  # 只剩一个交易对时直接用完整提示词单独分析
+                results.update(self._ask(chunk, snapshots))
+        for symbol in symbols:
+            if results.get(symbol) is None:
+                results[symbol] = self._fallback(symbol, fallback)
+        return results
+
+    def _ask(self, chunk, snapshots):
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": "\n".join(snapshots[symbol] for symbol in chunk)
+                                        + f"\n请为以上{len(chunk)}个交易对按要求回复JSON数组。"},
+        ]
+        stats = self.stats['batch']
+        tokens_before, started = self.tokens(), self.clock()
+        try:
+            content = self.request(messages)
+        except Exception as e:
+            log.error(f"批量分析请求失败（{len(chunk)}个交易对），改为逐个分析: {e}",
+                      extra=event('error', symbols=len(chunk)))
+            content = None
+        latency, tokens = self.clock() - started, self.tokens() - tokens_before
+        stats['requests'] += 1
+        stats['symbols'] += len(chunk)
+        stats['tokens'] += tokens
+        stats['latency_s'] += latency
+
+        if content is None:
+            signals, errors = {}, {symbol: "请求失败" for symbol in chunk}
+        else:
+            signals, errors = split_signals(parse_signal_array(content), chunk)
+        stats['failed'] += len(errors)
+        for symbol, reason in errors.items():
+            self.rejections[reason.split(':')[0]] += 1
+            log.warning(f"批量分析中 {symbol} 无有效信号（{reason}），单独重试",
+                        extra=event('llm', symbol=symbol, batch_error=reason))
+        log.info(f"批量分析 {len(chunk)} 个交易对: 有效 {len(signals)} 个, {tokens} tokens, 耗时 {latency:.1f}s",
+                 extra=event('llm', batch=len(chunk), valid=len(signals), total_tokens=tokens, latency_s=latency))
+        return signals
+
+    def _fallback(self, symbol, fallback):
+        stats = self.stats['single']
+        tokens_before, started = self.tokens(), self.clock()
+        try:
+            signal_data = fallback(symbol)
+        except Exception as e:
+            log.error(f"{symbol} 单独分析失败: {e}", extra=event('error', symbol=symbol))
+            signal_data = None
+        stats['requests'] += 1
+        stats['symbols'] += 1
+        stats['tokens'] += self.tokens() - tokens_before
+        stats['latency_s'] += self.clock() - started
+        if signal_data is None:
+            stats['failed'] += 1
+        return signal_data
+
+    def snapshot(self):
+        """统计的副本，附每个交易对的平均token（metrics线程读取）"""
+        result = {}
+        for kind, stats in self.stats.items():
+            result[kind] = {**stats, 'tokens_per_symbol': stats['tokens'] / stats['symbols'] if stats['symbols'] else None}
+        return result
@@ -0,0 +1,227 @@
+"""
+每周期热路径基准测试
+
+只测机器人自身的开销（不含网络和LLM耗时）：
+- calculate_smart_money_indicators 在不同历史长度下
+- 多周期提示词构建
+- JSON信号解析
+- 取提示词用的最近20根K线视图（Bars.tail(20).select）
+- 完整的 trading_bot() 周期（模拟交易所 + 固定回复的假LLM客户端）
+
+结果以JSON保存为基线，--check 时任何一项比基线慢超过阈值即以非零退出码失败。
+
+用法:
+    python benchmark.py --save            # 记录基线到 bench_baseline.json
+    python benchmark.py --check           # 与基线比较，回退超过20%失败
+    python benchmark.py --check --threshold 0.3 --only indicators
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+from backtest import attach_bot, bot, resample_ohlcv
+from bars import OHLCV_COLUMNS, Bars
+from paper_exchange import PaperExchange, SimClock
+
+import numpy as np
+import pandas as pd
+
+HISTORY_LENGTHS = [50, 200, 1000, 5000]
+
+SAMPLE_RESPONSE = """分析如下：
+{"signal": "HOLD", "reason": "聪明钱流向不明确，等待确认", "limit_price": 60100.5, "market_price": 60250.0,
+ "stop_loss": 58900.0, "take_profit": 62600.0, "confidence": "MEDIUM",
+ "smart_money_analysis": "5分钟成交量萎缩", "risk_reward_ratio": "1:2", "key_levels": "阻力60800 支撑59500",
+ "timeframe_analysis": "1小时震荡", "order_suggestion": "HOLD", "order_reason": "等待回踩"}"""
+
+
+def synthetic_ohlcv(n, seed=7, start_ms=1704067200000, tf_ms=300_000):
+    """确定性的随机游走K线"""
+    rng = np.random.default_rng(seed)
+    close = 60000 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.001, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.001, n)))
+    volume = rng.lognormal(3, 0.6, n)
+    return pd.DataFrame({'timestamp': start_ms + np.arange(n) * tf_ms, 'open': open_, 'high': high,
+                         'low': low, 'close': close, 'volume': volume})
+
+
+def ohlcv_rows(raw):
+    """DataFrame -> ccxt fetch_ohlcv 返回的行列表"""
+    return raw[list(OHLCV_COLUMNS)].values.tolist()
+
+
+class FakeDeepSeek:
+    """返回固定内容的OpenAI兼容客户端"""
+
+    def __init__(self, content=SAMPLE_RESPONSE):
+        usage = SimpleNamespace(prompt_tokens=3000, completion_tokens=200, total_tokens=3200)
+        message = SimpleNamespace(role='assistant', content=content)
+        self._response = SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason='stop')], usage=usage)
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **kwargs):
+        return self._response
+
+
+def measure(func, min_time=0.2, repeat=7):
+    """自动确定循环次数，返回每次调用耗时的中位数/最小值（秒）"""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time / repeat or loops >= 1_000_000:
+            break
+        loops *= 10 if elapsed < min_time / repeat / 10 else 2
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        samples.append((time.perf_counter() - started) / loops)
+    return {'median_s': statistics.median(samples), 'min_s': min(samples), 'loops': loops, 'repeat': repeat}
+
+
+def build_cases():
+    """返回 {名称: 无参可调用对象}"""
+    cases = {}
+    # 日志按实盘方式入队（计入开销），后台线程直接丢弃
+    bot.setup_logging(console=False, path=None)
+
+    for n in HISTORY_LENGTHS:
+        rows = ohlcv_rows(synthetic_ohlcv(n))
+        cases[f'indicators[{n}]'] = lambda rows=rows: bot.calculate_smart_money_indicators(Bars.from_ohlcv(rows))
+
+    base = synthetic_ohlcv(3000)
+    candles = {'5m': base.values.tolist()}
+    for tf in ('15m', '1h'):
+        candles[tf] = resample_ohlcv(base, tf).values.tolist()
+    clock = SimClock(int(base['timestamp'].iloc[-1]) + 300_000)
+    exchange = PaperExchange(clock, symbol=bot.TRADE_CONFIG['symbol'], candles=candles)
+    exchange.on_price(float(base['close'].iloc[-1]), clock.now_ms)
+    exchange.create_limit_order(bot.TRADE_CONFIG['symbol'], 'buy', 0.1, float(base['close'].iloc[-1]) * 0.98)
+
+    with attach_bot(exchange, clock), open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        multi_data = bot.get_multi_timeframe_data()
+        current_pos = bot.get_current_position()
+        current_orders = bot.get_current_orders()
+
+    cases['prompt_build'] = lambda: bot.build_multi_timeframe_prompt(multi_data, current_pos, current_orders)
+    cases['signal_parse'] = lambda: bot.parse_signal_response(SAMPLE_RESPONSE)
+
+    indicator_bars = bot.calculate_smart_money_indicators(Bars.from_ohlcv(ohlcv_rows(synthetic_ohlcv(50))))
+    cases['kline_tail'] = lambda: indicator_bars.tail(20).select(bot.KLINE_COLUMNS)
+
+    fake_client = FakeDeepSeek()
+
+    def full_cycle():
+        saved_client = bot.deepseek_client
+        bot.deepseek_client = fake_client
+        try:
+            with attach_bot(exchange, clock):
+                bot.trading_bot()
+        finally:
+            bot.deepseek_client = saved_client
+
+    cases['trading_bot_cycle'] = full_cycle
+    return cases
+
+
+def run(only=None, min_time=0.2, repeat=7):
+    results = {}
+    cases = build_cases()
+    with open(os.devnull, 'w') as devnull:
+        for name, func in cases.items():
+            if only and not any(key in name for key in only):
+                continue
+            with contextlib.redirect_stdout(devnull):
+                results[name] = measure(func, min_time, repeat)
+            print(f"{name:<24} {results[name]['median_s'] * 1e6:>12.1f} µs  (min {results[name]['min_s'] * 1e6:.1f} µs)")
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'recorded_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def compare(results, baseline, threshold):
+    """返回回退项列表 [(名称, 基线, 当前, 比例)]"""
+    regressions = []
+    print("\n" + "=" * 60)
+    print(f"与基线比较（阈值 +{threshold * 100:.0f}%）")
+    print("=" * 60)
+    for name, current in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f"{name:<24} 新增，无基线")
+            continue
+        ratio = current['median_s'] / base['median_s']
+        flag = "回退" if ratio > 1 + threshold else ("提升" if ratio < 1 - threshold else "持平")
+        print(f"{name:<24} {base['median_s'] * 1e6:>10.1f} -> {current['median_s'] * 1e6:>10.1f} µs  {ratio:>6.2f}x  {flag}")
+        if ratio > 1 + threshold:
+            regressions.append((name, base['median_s'], current['median_s'], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="热路径基准测试")
+    parser.add_argument('--baseline', default='bench_baseline.json')
+    parser.add_argument('--save', action='store_true', help="把本次结果保存为基线")
+    parser.add_argument('--check', action='store_true', help="与基线比较，超过阈值则失败")
+    parser.add_argument('--threshold', type=float, default=0.2, help="允许的变慢比例")
+    parser.add_argument('--only', action='append', help="只运行名称包含该字符串的用例")
+    parser.add_argument('--min-time', type=float, default=0.2, help="每个用例的最短测量时间（秒）")
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--output', help="另存本次结果JSON")
+    args = parser.parse_args()
+
+    results = run(args.only, args.min_time, args.repeat)
+    report = {'environment': environment(), 'results': results}
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print(f"基线文件不存在: {args.baseline}，先运行 --save")
+            sys.exit(2)
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} 项性能回退超过阈值")
+            sys.exit(1)
+        print("\n无性能回退")
+
+    if args.save:
+        if os.path.exists(args.baseline) and args.only:
+            # 只跑了部分用例时合并到已有基线
+            with open(args.baseline, encoding='utf-8') as f:
+                merged = json.load(f)
+            merged['results'].update(results)
+            merged['environment'] = report['environment']
+            report = merged
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
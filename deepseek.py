@@ -1,3 +1,8 @@
+"""
+已弃用：币安合约单交易所版本，不再维护，缺少主程序后来加入的风控、限频、止盈止损等功能。
+在币安交易请运行 deepseek_ok版本.py，并在 TRADE_CONFIG['venues'] 里加入币安，行情和LLM决策共用一份（见 venues.py）。
+与主程序同时运行会各自下单、重复持仓，因此默认拒绝启动；确实需要单独运行旧版时设置环境变量 LEGACY_BINANCE_BOT=1。
+"""
 import os
 import time
 import schedule
@@ -326,6 +331,11 @@ def trading_bot():
 
 def main():
     """主函数"""
+    if os.getenv('LEGACY_BINANCE_BOT') != '1':
+        print("deepseek.py 已弃用：请运行 deepseek_ok版本.py，并在 TRADE_CONFIG['venues'] 中加入币安。"
+              "确实需要单独运行旧版时设置 LEGACY_BINANCE_BOT=1（不要与主程序同时运行）")
+        return
+    print("已弃用的币安单交易所版本（LEGACY_BINANCE_BOT=1），请勿与 deepseek_ok版本.py 同时运行")
     print("BTC/USDT 自动交易机器人启动成功！")
 
     if TRADE_CONFIG['test_mode']:
@@ -1,21 +1,57 @@
 import os
 import time
+from startup import LazyClient, LazyModule, StartupTimer, load_markets_cached, prewarm
+
+startup = StartupTimer()  # 从这里开始计算启动耗时
+
 import schedule
-from openai import OpenAI
 import ccxt
-import pandas as pd
 from datetime import datetime
 import json
 from dotenv import load_dotenv
-import numpy as np
+from tracing import TracedExchange, tracer
+from execution_analytics import TrackedExchange, recorder as execution_recorder
+from event_log import event, log, setup_logging, shutdown_logging
+from metrics_server import MetricsServer, metric, summary
+from profiling import profiler
+from request_scheduler import RequestScheduler, ScheduledExchange
+from adaptive_interval import AdaptiveInterval
+from protective_orders import PriceFeed, ProtectiveOrders
+from speculation import SpeculativeAnalysis
+from llm_ensemble import EnsembleMember, ModelEnsemble
+from llm_session import ConversationSession, cached_prompt_tokens
+from order_book import BookFeed, L2Book
+from derivatives_data import DerivativesData, build_sources
+from bars import Bars, rolling, shift
+from risk_engine import RiskEngine
+from venues import ADAPTERS, VenueExecutor
+from batch_analysis import BatchAnalyzer
+from http_transport import KeepAlive, connection_stats, create_http_client, mount_pool
+
+# numpy/openai在第一次使用时才导入，main()中会在后台线程提前预加载
+np = LazyModule('numpy')
 
 load_dotenv()
 
-# 初始化DeepSeek客户端
-deepseek_client = OpenAI(
-    api_key=os.getenv('DEEPSEEK_API_KEY'),
-    base_url="https://api.deepseek.com"
-)
+
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+
+# 所有OpenAI兼容客户端共用一个长连接池（第一次使用时创建）
+llm_http = LazyClient(lambda: create_http_client(**TRADE_CONFIG['http']['llm_pool']))
+
+
+def create_deepseek_client(api_key_env='DEEPSEEK_API_KEY', base_url=DEEPSEEK_BASE_URL):
+    from openai import OpenAI
+
+    return OpenAI(
+        api_key=os.getenv(api_key_env),
+        base_url=base_url,
+        http_client=llm_http.resolve(),
+    )
+
+
+# 初始化DeepSeek客户端（第一次调用时创建）
+deepseek_client = LazyClient(create_deepseek_client)
 
 # 初始化OKX交易所
 exchange = ccxt.okx({
@@ -33,14 +69,374 @@ TRADE_CONFIG = {
     'amount': 0.1,  # 交易张数 (每张=0.01 BTC)
     'leverage': 15,  # 杠杆倍数
     'timeframe': '5m',  # 使用5分钟K线
-    'test_mode': False,  # 测试模式
+    'test_mode': False,  # 测试模式：行情用真实交易所，下单在本地模拟交易所撮合
+    # 模拟交易所参数（仅测试模式）
+    'paper': {
+        'initial_balance': 10000.0,  # 初始USDT
+        'contract_size': 0.01,  # 每张合约的BTC数量
+        'maker_fee': 0.0002,
+        'taker_fee': 0.0005,
+        'slippage_bps': 2.0,  # 市价单滑点（基点）
+        'latency_ms': 200,  # 下单延迟
+    },
+    # 聪明钱策略参数
+    'strategy': {
+        'volume_surge_ratio': 2.0,  # 成交量比率高于此值视为激增
+        'volume_shrink_ratio': 0.5,  # 低于此值视为萎缩
+        'smart_money_ratio': 1.5,  # 聪明钱流入/流出要求的成交量比率
+        'sr_window': 20,  # 支撑阻力位回看K线数
+        'book_imbalance_ratio': 0.3,  # 中间价附近盘口失衡超过此值视为买盘/卖盘压力
+    },
+    # 永续合约辅助数据：后台按各自的更新频率并发刷新，分析时只读缓存
+    'derivatives_data': {
+        'enabled': True,
+        'ttl_s': {'funding': 60, 'open_interest': 300, 'long_short': 300, 'taker_volume': 300},
+        'stale_multiple': 3,  # 超过TTL的该倍数没有成功刷新视为过期
+    },
+    # 本地L2盘口：快照+增量维护，盘口失衡、价差、大单墙等特征加入指标和提示词
+    'order_book': {
+        'enabled': True,
+        'depth_levels': 20,  # 前N档失衡和大单墙的统计范围
+        'band_bps': 50,  # 中间价上下该范围（万分之）内的挂单量失衡
+        'wall_multiple': 5.0,  # 单档挂单量达到前N档中位数的倍数视为大单墙
+        'stale_after_s': 10,  # 盘口超过该时间没有更新时不使用
+        'record_path': None,  # 例如 'logs/depth.jsonl'，录制原始推送供 python order_book.py 回放
+    },
+    # LLM录制/回放缓存: None关闭, 'record'录制穿透, 'replay'只读回放, 'strict'未命中即失败
+    'llm_cache': {
+        'mode': os.getenv('LLM_CACHE_MODE') or None,
+        'dir': os.getenv('LLM_CACHE_DIR', 'llm_cache'),
+    },
+    'llm_stream': True,  # 流式请求LLM，用于统计首字耗时
+    # 对话模式：与模型保持多轮上下文，每轮只追加新K线和变化（多模型并行分析启用时不生效）
+    'llm_session': {
+        'enabled': False,
+        'reanchor_every': 12,  # 每N轮重新发送一次完整快照
+        'max_context_chars': 30000,  # 上下文超过该长度时也重新锚定
+    },
+    # 多交易对批量分析：一次请求带多个交易对的精简快照，固定说明和JSON格式只发送一次（见batch_analysis）
+    'llm_batch': {
+        'max_symbols': 8,  # 每次请求最多的交易对数
+        'kline_bars': 6,  # 精简快照中每个周期保留的最近K线数
+    },
+    # 多模型并行分析：同一提示词并发发给多个OpenAI兼容模型/不同temperature，按mode合并
+    'ensemble': {
+        'enabled': False,
+        'mode': 'vote',  # first_valid 截止前第一个有效回复 / vote 按signal多数表决 / merge 表决后按信心加权合并价格
+        'deadline_s': 20,  # 超过截止时间仍未返回的模型不参与本次决策
+        'min_votes': 2,  # vote/merge下得票少于该数时观望
+        'members': [
+            # 其他OpenAI兼容服务加上 'base_url' 和 'api_key_env'（存放密钥的环境变量名）
+            {'name': 'deepseek-t0', 'model': 'deepseek-chat', 'temperature': 0.0},
+            {'name': 'deepseek-t5', 'model': 'deepseek-chat', 'temperature': 0.5},
+            {'name': 'deepseek-t10', 'model': 'deepseek-chat', 'temperature': 1.0},
+        ],
+    },
+    # 分阶段耗时追踪
+    'tracing': {
+        'enabled': True,
+        'path': 'logs/traces.jsonl',  # 每周期一行JSON
+        'window': 1000,  # 分位数统计的滚动窗口（样本数）
+        'summary_every': 12,  # 每N个周期写一行p50/p95/p99汇总
+    },
+    # 信号到成交的延迟与滑点统计（python execution_analytics.py 查看日报）
+    'execution_analytics': {
+        'enabled': True,
+        'path': 'logs/executions.jsonl',  # 每个决策的订单都有结果后写一行
+        'max_pending_hours': 24,  # 挂单超过此时间仍未成交则按超时结案
+    },
+    # 结构化日志：后台线程写控制台和按大小轮转的JSON Lines文件，下单路径不等待日志I/O
+    'logging': {
+        'level': 'INFO',
+        'console': True,
+        'path': 'logs/bot.jsonl',
+        'max_bytes': 10 * 1024 * 1024,  # 单个文件上限，超过后轮转
+        'backup_count': 5,  # 保留的历史文件数
+    },
+    # 本地指标与健康检查端点（/metrics Prometheus文本, /metrics.json, /health）
+    'metrics': {
+        'enabled': True,
+        'host': '127.0.0.1',  # 只监听本机，需要远程抓取时改为0.0.0.0
+        'port': 9108,
+        'stale_after_s': 900,  # 超过此时间没有成功周期则/health返回503
+    },
+    # 按需性能剖析：启动时 BOT_PROFILE_CYCLES=N，或运行中 kill -USR1 <pid>
+    'profiling': {
+        'cycles': int(os.getenv('BOT_PROFILE_CYCLES', '0')),  # 启动后立即剖析的周期数
+        'signal_cycles': 3,  # 每次收到SIGUSR1剖析的周期数
+        'mode': os.getenv('BOT_PROFILE_MODE', 'cprofile'),  # cprofile确定性剖析 / sampling采样
+        'sample_interval_ms': 5,
+        'tracemalloc': True,  # 同时记录内存分配和DataFrame、历史列表的大小
+        'dir': 'logs/profiles',
+    },
+    # 交易所请求调度：按接口令牌桶限频，下单/撤单优先于行情读取，相同的在途读请求合并
+    'rate_limit': {
+        'enabled': True,
+        'headroom': 0.8,  # 只用交易所公布额度的80%
+        'order_reserve': 0.2,  # 共享桶中为下单/撤单预留的比例，读请求不能占用
+    },
+    # 自适应分析间隔：放量/突破时加快，缩量横盘时放慢；基准间隔由timeframe决定（默认关闭，按timeframe固定间隔）
+    'adaptive_interval': {
+        'enabled': False,
+        'min_interval_s': 60,
+        'max_interval_s': 1800,
+        'hourly_token_budget': 60000,  # 最近一小时LLM token用量上限，None不限制
+        'volatility_ratio': 1.5,  # 近6根K线平均波动达到均值的这一倍数视为波动放大
+    },
+    # 下单前本地风控：用缓存的余额、杠杆和合约规格校验订单，不合规的订单不发往交易所（见risk_engine）
+    'risk': {
+        'enabled': True,
+        'max_order_amount': 1.0,  # 单笔最大张数
+        'max_position_amount': 1.0,  # 开仓后最大持仓张数
+        'max_price_deviation_pct': 3.0,  # 挂单价相对最新价的最大偏离
+        'liquidation_buffer': 0.8,  # 止损距离不超过强平距离(1/杠杆)的该比例
+        'margin_buffer': 1.05,  # 所需保证金放大系数（手续费和滑点）
+        'account_ttl_s': 300,  # 缓存余额超过该时间（或下过单）在周期末刷新
+    },
+    # 多交易所执行：行情和LLM决策只在主交易所（上面的OKX）做一次，同一信号并发地在这些交易所下单（见venues）
+    # risk中的张数上限按各交易所自己的下单单位覆盖TRADE_CONFIG['risk']
+    'venues': [
+        # {'name': 'binance', 'exchange': 'binanceusdm', 'symbol': 'BTC/USDT:USDT', 'amount': 0.001, 'leverage': 10,
+        #  'api_key_env': 'BINANCE_API_KEY', 'secret_env': 'BINANCE_SECRET',
+        #  'risk': {'max_order_amount': 0.01, 'max_position_amount': 0.01}},
+    ],
+    # 止盈止损: native交易所条件单（OKX策略委托，触发后市价平仓）/ local本地盯价触发reduceOnly市价单
+    'protection': {
+        'mode': 'native',  # 交易所拒绝条件单时自动退回local
+        'stream': True,  # local模式用websocket推送行情，False只用REST轮询
+        'poll_interval_s': 1.0,  # 轮询间隔；推送超过stale_after_s没有更新时也用轮询补价
+        'stale_after_s': 3.0,
+    },
+    # 推测分析：收盘前lead_s秒先分析快完成的K线，收盘后核对没有实质变化就直接采用（需要按间隔循环执行）
+    'speculative': {
+        'enabled': False,
+        'lead_s': 20,
+        'settle_s': 2,  # 收盘后等交易所K线落定再取数据
+        'max_close_move_bps': 5.0,  # 最终收盘价相对推测时偏离超过该值（万分之）则重新分析
+    },
+    # 长连接：交易所和LLM客户端的连接池，周期之间按需保活，计划的周期开始前预热（见http_transport）
+    'http': {
+        'exchange_pool': {'pool_connections': 4, 'pool_maxsize': 10, 'tcp_keepalive': True},  # 每个主机最多10个连接
+        'llm_pool': {'max_connections': 10, 'max_keepalive_connections': 5, 'keepalive_expiry_s': 900.0},
+        'keepalive': True,
+        'idle_timeout_s': 60,  # 服务器关闭空闲连接的时间（按交易所和LLM服务中较短的估计）
+        'prewarm_lead_s': 3,  # 计划的周期开始前几秒预热
+        'prewarm_idle_s': 15,  # 预热时只ping空闲超过该时间的连接池
+    },
+    # 冷启动：后台预加载重量级模块，合约元数据快照到磁盘复用
+    'startup': {
+        'prewarm': ['numpy', 'openai'],
+        'market_cache': 'cache/markets_{exchange}.json',
+        'market_cache_ttl_hours': 12,
+        'market_types': ['swap'],  # 快照过期重新加载时只拉取这些类型的合约
+    },
 }
 
+tracer.configure(**TRADE_CONFIG['tracing'])
+connection_stats.tracer = tracer  # 新建连接的握手耗时记为 http_connect.<主机>
+profiler.configure(
+    dir=TRADE_CONFIG['profiling']['dir'],
+    mode=TRADE_CONFIG['profiling']['mode'],
+    sample_interval_ms=TRADE_CONFIG['profiling']['sample_interval_ms'],
+    tracemalloc=TRADE_CONFIG['profiling']['tracemalloc'],
+)
+execution_recorder.configure(**TRADE_CONFIG['execution_analytics'])
+
+if TRADE_CONFIG['llm_cache']['mode']:
+    from llm_cache import RecordingClient
+
+    deepseek_client = RecordingClient(deepseek_client, TRADE_CONFIG['llm_cache']['dir'],
+                                      mode=TRADE_CONFIG['llm_cache']['mode'])
+
+
+
+def create_ensemble_member(config):
+    """按配置创建参与多模型分析的成员；没有base_url时共用deepseek_client（含录制缓存）"""
+    client = deepseek_client
+    if config.get('base_url'):
+        client = LazyClient(lambda: create_deepseek_client(config.get('api_key_env', 'DEEPSEEK_API_KEY'),
+                                                           config['base_url']))
+        if TRADE_CONFIG['llm_cache']['mode']:
+            client = RecordingClient(client, TRADE_CONFIG['llm_cache']['dir'], mode=TRADE_CONFIG['llm_cache']['mode'])
+    return EnsembleMember(config['name'], client, config['model'], config.get('temperature'),
+                          config.get('weight', 1.0))
+
+
+def record_member_usage(name, usage):
+    """多模型分析中每个回复的token用量（截止后才到的回复同样计入）"""
+    log.info(f"模型 {name} Token消耗: 输入 {usage.prompt_tokens}, 输出 {usage.completion_tokens}",
+             extra=event('llm', model=name, prompt_tokens=usage.prompt_tokens,
+                         completion_tokens=usage.completion_tokens, total_tokens=usage.total_tokens))
+    update_token_stats(usage)
+
+
+# 各主周期对应的固定执行间隔（秒），也是自适应间隔的基准
+TIMEFRAME_SECONDS = {'5m': 300, '15m': 900, '1h': 3600}
+
+
+# create_*按当前TRADE_CONFIG创建有状态的对象；回测每次运行用它们新建一份，互不影响
+def create_cycle_interval():
+    return AdaptiveInterval(
+        TIMEFRAME_SECONDS.get(TRADE_CONFIG['timeframe'], 300),
+        min_interval_s=TRADE_CONFIG['adaptive_interval']['min_interval_s'],
+        max_interval_s=TRADE_CONFIG['adaptive_interval']['max_interval_s'],
+        hourly_token_budget=TRADE_CONFIG['adaptive_interval']['hourly_token_budget'],
+        surge_ratio=TRADE_CONFIG['strategy']['volume_surge_ratio'],
+        shrink_ratio=TRADE_CONFIG['strategy']['volume_shrink_ratio'],
+        volatility_ratio=TRADE_CONFIG['adaptive_interval']['volatility_ratio'],
+    )
+
+
+def create_speculation():
+    return SpeculativeAnalysis(
+        300,  # 核对的是5分钟K线
+        lead_s=TRADE_CONFIG['speculative']['lead_s'],
+        settle_s=TRADE_CONFIG['speculative']['settle_s'],
+        max_close_move_bps=TRADE_CONFIG['speculative']['max_close_move_bps'],
+        surge_ratio=TRADE_CONFIG['strategy']['volume_surge_ratio'],
+        enabled=TRADE_CONFIG['speculative']['enabled'],
+    )
+
+
+cycle_interval = create_cycle_interval()
+speculation = create_speculation()
+
+llm_ensemble = None
+if TRADE_CONFIG['ensemble']['enabled']:
+    llm_ensemble = ModelEnsemble(
+        [create_ensemble_member(member) for member in TRADE_CONFIG['ensemble']['members']],
+        parse=lambda content: parse_signal_response(content),  # 解析函数在下方定义
+        mode=TRADE_CONFIG['ensemble']['mode'],
+        deadline_s=TRADE_CONFIG['ensemble']['deadline_s'],
+        min_votes=TRADE_CONFIG['ensemble']['min_votes'],
+        on_usage=record_member_usage,
+        tracer=tracer,
+    )
+
+derivatives_data = None  # 启动时按交易所支持的接口创建，回测中不启用
+
+order_book = L2Book(TRADE_CONFIG['symbol'], depth_levels=TRADE_CONFIG['order_book']['depth_levels'],
+                    band_bps=TRADE_CONFIG['order_book']['band_bps'],
+                    wall_multiple=TRADE_CONFIG['order_book']['wall_multiple'])
+book_feed = None  # 启用盘口时在启动时创建，退出时停止以关闭录制文件
+
+market_exchange = exchange  # 原始ccxt实例，启动时在它上面加载市场元数据
+
+# 交易所连接池；保活请求直接走原始ccxt实例的公共接口，不经过限频调度和耗时追踪
+exchange_pool = mount_pool(market_exchange.session, **TRADE_CONFIG['http']['exchange_pool'])
+keepalive_targets = [(market_exchange.id, lambda: exchange_pool.last_used, market_exchange.fetch_time)]
+keepalive = None  # 启动时创建
+
+request_scheduler = None
+if TRADE_CONFIG['rate_limit']['enabled']:
+    request_scheduler = RequestScheduler.for_exchange(exchange, headroom=TRADE_CONFIG['rate_limit']['headroom'],
+                                                      order_reserve=TRADE_CONFIG['rate_limit']['order_reserve'],
+                                                      tracer=tracer)
+    exchange.enableRateLimit = False  # 由调度器限频，关掉ccxt全局的固定间隔节流
+    exchange = ScheduledExchange(exchange, request_scheduler)
+
+market_data = exchange  # 真实行情来源（模拟模式下单在本地撮合，行情仍取自交易所）
+
+if TRADE_CONFIG['test_mode']:
+    from paper_exchange import PaperExchange, WallClock
+
+    exchange = PaperExchange(
+        WallClock(),
+        symbol=TRADE_CONFIG['symbol'],
+        leverage=TRADE_CONFIG['leverage'],
+        market_data=market_data,
+        **TRADE_CONFIG['paper']
+    )
+
+
+def create_protection():
+    return ProtectiveOrders(TRADE_CONFIG['symbol'], TRADE_CONFIG['protection']['mode'],
+                            stop_tag='f1ee03b510d5SUDE_STOP', take_profit_tag='f1ee03b510d5SUDE_TP', tracer=tracer)
+
+
+protection = create_protection()
+
+if TRADE_CONFIG['execution_analytics']['enabled']:
+    exchange = TrackedExchange(exchange, execution_recorder)
+
+if TRADE_CONFIG['tracing']['enabled']:
+    exchange = TracedExchange(exchange, tracer)
+
+# 多周期分析使用的时间周期
+TIMEFRAMES = ['5m', '15m', '1h']
+
+# 传给提示词的K线字段（最后一行同时作为最新指标）
+KLINE_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'volume_ratio', 'vwap',
+                 'price_vs_vwap', 'smart_money_flow', 'resistance', 'support']
+
+# 多周期聪明钱分析的系统提示词
+MULTI_TIMEFRAME_SYSTEM_PROMPT = "您是一位专业的聪明钱策略分析师，专注于识别大资金流向和机构行为模式。请基于成交量、支撑阻力位和价格行为给出精准的交易建议，包括具体的入场价格、止损价格、止盈价格。所有价格必须是具体的数字。"
+
+# 批量分析的固定说明：逐个交易对请求时这些要求和JSON格式在每个提示词里重复发送
+BATCH_SYSTEM_PROMPT = MULTI_TIMEFRAME_SYSTEM_PROMPT + """
+下面给出多个交易对的精简多周期行情：每个周期最近几根K线（开/高/低/收 量比），以及最新的VWAP偏离、支撑阻力位、聪明钱流向、持仓和挂单。请逐个交易对独立分析:
+1. 5分钟捕捉短期聪明钱活动，15分钟确认趋势方向，1小时判断大趋势背景，避免逆势交易
+2. 结合成交量异常和支撑阻力位的有效性判断大资金流向，考虑当前持仓是否要减仓、挂单是否要重新挂
+3. 信心不足时给出挂单价格（基于支撑阻力位等待更好价格），信心十足时给出市价参考价格
+4. 止损基于关键支撑/阻力位，风险控制在3-5%；止盈的风险回报比1:2以上；所有价格必须是具体的数字
+只回复一个JSON数组，每个交易对一个元素，symbol与输入中的交易对完全一致:
+[{"symbol": "交易对", "signal": "BUY|SELL|HOLD", "reason": "聪明钱分析理由", "limit_price": 挂单价格, "market_price": 市价参考价格,
+  "stop_loss": 止损价格, "take_profit": 止盈价格, "confidence": "HIGH|MEDIUM|LOW", "risk_reward_ratio": "风险回报比",
+  "order_suggestion": "PLACE_ORDER|HOLD|CANCEL_EXISTING", "order_reason": "挂单理由"}]"""
+
+batch_analyzer = BatchAnalyzer(
+    lambda messages: request_batch(messages),  # 请求函数在下方定义
+    BATCH_SYSTEM_PROMPT,
+    max_symbols=TRADE_CONFIG['llm_batch']['max_symbols'],
+    tokens=lambda: token_stats['total_tokens'],
+    clock=lambda: time.perf_counter(),  # 回测/压测中time会被替换为模拟时钟
+)
+
+
+def create_llm_session():
+    """对话模式未启用（或启用了多模型分析）时返回None"""
+    if not TRADE_CONFIG['llm_session']['enabled'] or llm_ensemble is not None:
+        return None
+    return ConversationSession(MULTI_TIMEFRAME_SYSTEM_PROMPT,
+                               reanchor_every=TRADE_CONFIG['llm_session']['reanchor_every'],
+                               max_context_chars=TRADE_CONFIG['llm_session']['max_context_chars'])
+
+
+llm_session = create_llm_session()
+
+# 下单前本地风控（余额在setup_exchange和周期末刷新，合约规格在加载市场信息后读取）
+risk_config = TRADE_CONFIG['risk']
+risk_engine = RiskEngine(
+    TRADE_CONFIG['leverage'],
+    contract_size=TRADE_CONFIG['paper']['contract_size'],  # 加载合约元数据后以交易所的合约面值为准
+    max_order_amount=risk_config['max_order_amount'],
+    max_position_amount=risk_config['max_position_amount'],
+    max_price_deviation_pct=risk_config['max_price_deviation_pct'],
+    liquidation_buffer=risk_config['liquidation_buffer'],
+    margin_buffer=risk_config['margin_buffer'],
+    account_ttl_s=risk_config['account_ttl_s'],
+    enabled=risk_config['enabled'],
+)
+
+venue_executor = None  # 配置了额外交易所时在启动时创建
+venue_schedulers = {}  # 额外交易所的限频调度器 {名称: RequestScheduler}
+
 # 全局变量存储历史数据
 price_history = []
 signal_history = []
 position = None
 
+# 运行状态，供metrics端点读取（持仓和挂单取自最近一次查询，不在HTTP线程里访问交易所）
+runtime_stats = {
+    'started_ts': time.time(),
+    'cycles': 0,
+    'cycles_ok': 0,
+    'last_success_ts': None,
+    'position': None,
+    'open_orders': None,
+    'startup': {},  # 各启动阶段耗时（秒），首个周期完成后填入
+}
+
 # 添加token统计
 token_stats = {
     'total_calls': 0,
@@ -59,16 +455,15 @@ def update_token_stats(usage):
         token_stats['total_tokens'] += usage.total_tokens
         token_stats['total_cost'] += usage.total_tokens * 0.000002  # 假设每token $0.0001
         token_stats['avg_tokens_per_call'] = token_stats['total_tokens'] / token_stats['total_calls']
+        cycle_interval.record_tokens(usage.total_tokens)
         
-        print(f"Token统计更新:")
-        print(f"  总调用次数: {token_stats['total_calls']}")
-        print(f"  总token数: {token_stats['total_tokens']}")
-        print(f"  总成本: ¥{token_stats['total_cost']:.4f}")
-        print(f"  平均每次: {token_stats['avg_tokens_per_call']:.0f} tokens")
+        log.info(f"Token统计更新: 总调用 {token_stats['total_calls']} 次, 总token {token_stats['total_tokens']}, "
+                 f"总成本 ¥{token_stats['total_cost']:.4f}, 平均每次 {token_stats['avg_tokens_per_call']:.0f} tokens",
+                 extra=event('llm', **token_stats))
 
 
 def print_token_summary():
-    """打印token使用摘要"""
+    """打印token使用摘要（退出时在日志线程停止后调用）"""
     print("\n" + "="*50)
     print("Token使用摘要")
     print("="*50)
@@ -76,43 +471,148 @@ def print_token_summary():
     print(f"总token数: {token_stats['total_tokens']}")
     print(f"总成本: ${token_stats['total_cost']:.4f}")
     print(f"平均每次: {token_stats['avg_tokens_per_call']:.0f} tokens")
+    if not isinstance(deepseek_client, LazyClient) and hasattr(deepseek_client, 'print_stats'):
+        deepseek_client.print_stats()
+    if llm_ensemble is not None:
+        print(f"多模型分析({llm_ensemble.mode}): 决策 {llm_ensemble.decisions} 次, 无有效结果 {llm_ensemble.no_decision} 次")
+        llm_ensemble.print_stats()
+    if llm_session is not None:
+        print(f"对话模式: 锚定 {llm_session.anchors} 次")
+        llm_session.print_stats()
+    batch = batch_analyzer.snapshot()
+    if batch['batch']['requests']:
+        for mode, label in (('batch', '批量'), ('single', '单独')):
+            stats = batch[mode]
+            if stats['requests']:
+                print(f"{label}分析: {stats['requests']} 次请求 / {stats['symbols']} 个交易对，"
+                      f"每个交易对 {stats['tokens_per_symbol']:.0f} tokens、"
+                      f"{stats['latency_s'] / stats['symbols']:.2f}s，无有效信号 {stats['failed']} 个")
+    risk = risk_engine.snapshot()
+    if risk['checks']:
+        print(f"本地风控: 检查 {risk['checks']} 笔（平均 {risk['check_s'] / risk['checks'] * 1e6:.1f}µs），"
+              f"拒绝 {risk['rejected']} 笔 {risk['rejections'] or ''}")
+    for host, stats in sorted(connection_stats.snapshot().items()):
+        connects = stats['connects']
+        print(f"连接 {host}: 请求 {stats['requests']} 次，新建连接 {connects} 次"
+              f"（复用 {1 - connects / max(stats['requests'], 1):.0%}），平均握手 "
+              f"TCP {stats['tcp_s'] / max(connects, 1) * 1000:.0f}ms / TLS {stats['tls_s'] / max(connects, 1) * 1000:.0f}ms")
+    if venue_executor is not None:
+        for name, stats in venue_executor.snapshot().items():
+            print(f"交易所 {name}: 执行 {stats['executions']} 次（平均信号到下单 "
+                  f"{stats['latency_s'] / max(stats['executions'], 1) * 1000:.0f}ms），订单 {stats['orders']} 笔，"
+                  f"风控拒绝 {stats['rejected']} 次，失败 {stats['failed']} 次，止盈止损失败 {stats['protection_failed']} 次")
+    spec = speculation.stats
+    if spec['hits'] + spec['misses']:
+        print(f"推测分析: 命中 {spec['hits']} / 未命中 {spec['misses']}（命中率 {speculation.hit_rate():.0%}），"
+              f"节省LLM耗时 {spec['saved_s']:.1f}s")
+        if spec['decisions']:
+            print(f"收盘到决策平均耗时: {spec['close_to_decision_s'] / spec['decisions']:.1f}s")
     print("="*50)
 
 
-def calculate_smart_money_indicators(df):
-    """计算聪明钱指标"""
+def calculate_smart_money_indicators(bars, book_features=None):
+    """计算聪明钱指标，原地向Bars添加列并返回；book_features为当前盘口特征（只对应最新一根K线）"""
+    strategy = TRADE_CONFIG['strategy']
+    close, volume = bars['close'], bars['volume']
+
     # 1. 成交量移动平均
-    df['volume_ma_5'] = df['volume'].rolling(window=5).mean()
-    df['volume_ma_20'] = df['volume'].rolling(window=20).mean()
+    bars['volume_ma_5'] = rolling(volume, 5, np.mean)
+    bars['volume_ma_20'] = rolling(volume, 20, np.mean)
     
     # 2. 成交量比率 (当前成交量/平均成交量)
-    df['volume_ratio'] = df['volume'] / df['volume_ma_20']
+    bars['volume_ratio'] = volume / bars['volume_ma_20']
     
     # 3. 价格变化率
-    df['price_change'] = df['close'].pct_change()
+    previous_close = shift(close)
+    bars['price_change'] = close / previous_close - 1
     
     # 4. 成交量加权平均价格 (VWAP)
-    df['vwap'] = (df['close'] * df['volume']).cumsum() / df['volume'].cumsum()
+    bars['vwap'] = np.cumsum(close * volume) / np.cumsum(volume)
     
     # 5. 价格相对VWAP的位置
-    df['price_vs_vwap'] = (df['close'] - df['vwap']) / df['vwap'] * 100
+    bars['price_vs_vwap'] = (close - bars['vwap']) / bars['vwap'] * 100
     
     # 6. 聪明钱流入指标 (价格上涨+高成交量)
-    df['smart_money_flow'] = np.where(
-        (df['close'] > df['close'].shift(1)) & (df['volume_ratio'] > 1.5),
+    heavy = bars['volume_ratio'] > strategy['smart_money_ratio']
+    bars['smart_money_flow'] = np.where(
+        (close > previous_close) & heavy,
         1,  # 聪明钱流入
         np.where(
-            (df['close'] < df['close'].shift(1)) & (df['volume_ratio'] > 1.5),
+            (close < previous_close) & heavy,
             -1,  # 聪明钱流出
             0    # 无明确信号
         )
     )
     
-    # 7. 支撑阻力位 (最近20根K线的最高最低价)
-    df['resistance'] = df['high'].rolling(window=20).max()
-    df['support'] = df['low'].rolling(window=20).min()
+    # 7. 支撑阻力位 (最近sr_window根K线的最高最低价)
+    bars['resistance'] = rolling(bars['high'], strategy['sr_window'], np.max)
+    bars['support'] = rolling(bars['low'], strategy['sr_window'], np.min)
+
+    # 8. 盘口失衡 (中间价附近买卖挂单量之差/之和，历史K线没有盘口数据)
+    if book_features is not None:
+        imbalance = book_features['imbalance_band']
+        book_imbalance = np.full(len(bars), np.nan)
+        book_pressure = np.zeros(len(bars), dtype='int64')
+        book_imbalance[-1] = imbalance
+        if abs(imbalance) >= strategy['book_imbalance_ratio']:
+            book_pressure[-1] = 1 if imbalance > 0 else -1
+        bars['book_imbalance'] = book_imbalance
+        bars['book_pressure'] = book_pressure
     
-    return df
+    return bars
+
+
+def current_book_features():
+    """最新的盘口特征；盘口未同步或超过stale_after_s没有更新时返回None"""
+    features = order_book.features()
+    age = order_book.age_s()
+    if features is None or age is None or age > TRADE_CONFIG['order_book']['stale_after_s']:
+        return None
+    return features
+
+
+def format_derivatives(data):
+    """永续合约辅助数据的提示词文本；data为 derivatives_data.get() 的结果"""
+    if not data:
+        return ""
+    text = "【永续合约数据】\n"
+
+    def line(name, content):
+        item = data[name]
+        suffix = f"（数据过期，{item['age_s'] / 60:.0f}分钟前更新）" if item['stale'] else ""
+        return f"  {content}{suffix}\n"
+
+    if 'funding' in data and data['funding']['value']['rate'] is not None:
+        rate = data['funding']['value']['rate']
+        side = "多头付费给空头" if rate > 0 else "空头付费给多头" if rate < 0 else "无"
+        text += line('funding', f"资金费率: {rate * 100:+.4f}%（{side}）")
+    if 'open_interest' in data and data['open_interest']['value']['amount'] is not None:
+        oi = data['open_interest']['value']
+        change = f"，1小时变化 {oi['change_1h_pct']:+.2f}%" if oi['change_1h_pct'] is not None else ""
+        text += line('open_interest', f"持仓量: {oi['amount']:,.2f}{change}")
+    if 'long_short' in data and data['long_short']['value']['ratio'] is not None:
+        text += line('long_short', f"多空账户比: {data['long_short']['value']['ratio']:.2f}")
+    if 'taker_volume' in data and data['taker_volume']['value']['buy_sell_ratio'] is not None:
+        taker = data['taker_volume']['value']
+        text += line('taker_volume', f"近5分钟主动买/卖量: {taker['buy']:,.2f} / {taker['sell']:,.2f}"
+                                     f"（买卖比 {taker['buy_sell_ratio']:.2f}）")
+    return text if text != "【永续合约数据】\n" else ""
+
+
+def format_order_book(book):
+    """盘口特征的提示词文本"""
+    text = "【盘口深度】\n"
+    text += f"  买一/卖一: ${book['bid']:.2f} / ${book['ask']:.2f}，价差 {book['spread_bps']:.2f}bps，微观价格 ${book['microprice']:.2f}\n"
+    text += f"  前{order_book.depth_levels}档挂单量: 买 {book['bid_depth']:.2f} / 卖 {book['ask_depth']:.2f}\n"
+    text += (f"  盘口失衡(正数买盘占优): 前{order_book.depth_levels}档 {book['imbalance_top']:+.2f}，"
+             f"中间价±{order_book.band_bps:g}bps {book['imbalance_band']:+.2f}，全盘口 {book['imbalance_book']:+.2f}\n")
+    for key, label in (('bid_wall', '买墙'), ('ask_wall', '卖墙')):
+        wall = book[key]
+        if wall:
+            text += f"  {label}: ${wall['price']:.2f} 数量 {wall['size']:.2f}（距中间价 {wall['distance_bps']:.1f}bps，为中位数的 {wall['multiple']} 倍）\n"
+        else:
+            text += f"  无明显{label}\n"
+    return text
 
 
 def setup_exchange():
@@ -124,7 +624,7 @@ def setup_exchange():
             TRADE_CONFIG['symbol'],
             {'mgnMode': 'cross'}  # 全仓模式，也可用'isolated'逐仓
         )
-        print(f"设置杠杆倍数: {TRADE_CONFIG['leverage']}x")
+        log.info(f"设置杠杆倍数: {TRADE_CONFIG['leverage']}x", extra=event('system', leverage=TRADE_CONFIG['leverage']))
 
         # 获取余额
         try:
@@ -133,18 +633,18 @@ def setup_exchange():
             # 安全地获取USDT余额
             if 'USDT' in balance and 'free' in balance['USDT']:
                 usdt_balance = balance['USDT']['free']
-                print(f"当前USDT余额: {usdt_balance:.2f}")
+                risk_engine.update_balance(usdt_balance)
+                log.info(f"当前USDT余额: {usdt_balance:.2f}", extra=event('position', usdt_free=usdt_balance))
             else:
-                print("无法获取USDT余额信息")
-                print(f"可用币种: {list(balance.keys())}")
+                log.warning(f"无法获取USDT余额信息，可用币种: {list(balance.keys())}", extra=event('error'))
                 
         except Exception as e:
-            print(f"获取余额失败: {e}")
+            log.error(f"获取余额失败: {e}", extra=event('error'))
             return False
 
         return True
     except Exception as e:
-        print(f"交易所设置失败: {e}")
+        log.error(f"交易所设置失败: {e}", extra=event('error'))
         return False
 
 
@@ -152,20 +652,20 @@ def get_multi_timeframe_data():
     """获取多时间周期的K线数据"""
     try:
         # 获取不同时间周期的数据
-        timeframes = ['5m', '15m', '1h']  # 5分钟、15分钟、1小时
         multi_data = {}
+        book = current_book_features()
         
-        for tf in timeframes:
+        for tf in TIMEFRAMES:  # 5分钟、15分钟、1小时
             # 获取50根K线
             ohlcv = exchange.fetch_ohlcv(TRADE_CONFIG['symbol'], tf, limit=50)
-            df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+            bars = Bars.from_ohlcv(ohlcv)
             
             # 计算聪明钱指标
-            df = calculate_smart_money_indicators(df)
+            with tracer.span('indicators', timeframe=tf):
+                bars = calculate_smart_money_indicators(bars, book if tf == '5m' else None)
             
-            current_data = df.iloc[-1]
-            previous_data = df.iloc[-2] if len(df) > 1 else current_data
+            current_data = bars[-1]
+            previous_data = bars[-2] if len(bars) > 1 else current_data
             
             multi_data[tf] = {
                 'price': current_data['close'],
@@ -175,13 +675,18 @@ def get_multi_timeframe_data():
                 'volume': current_data['volume'],
                 'timeframe': tf,
                 'price_change': ((current_data['close'] - previous_data['close']) / previous_data['close']) * 100,
-                'kline_data': df[['timestamp', 'open', 'high', 'low', 'close', 'volume', 'volume_ratio', 'vwap', 'resistance', 'support']].tail(20).to_dict('records'),
-                'all_data': df
+                # 与all_data共用同一份数组的视图
+                'kline_data': bars.tail(20).select(KLINE_COLUMNS),
+                'all_data': bars
             }
+        if book is not None and '5m' in multi_data:
+            multi_data['5m']['order_book'] = book
+        if derivatives_data is not None and '5m' in multi_data:
+            multi_data['5m']['derivatives'] = derivatives_data.get()  # 只读缓存，不等待网络
         
         return multi_data
     except Exception as e:
-        print(f"获取多周期数据失败: {e}")
+        log.error(f"获取多周期数据失败: {e}", extra=event('error'))
         return None
 
 
@@ -191,15 +696,13 @@ def get_btc_ohlcv():
         # 获取最近50根K线
         ohlcv = exchange.fetch_ohlcv(TRADE_CONFIG['symbol'], TRADE_CONFIG['timeframe'], limit=50)
 
-        # 转换为DataFrame
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+        bars = Bars.from_ohlcv(ohlcv)
         
         # 计算聪明钱指标
-        df = calculate_smart_money_indicators(df)
+        bars = calculate_smart_money_indicators(bars)
 
-        current_data = df.iloc[-1]
-        previous_data = df.iloc[-2] if len(df) > 1 else current_data
+        current_data = bars[-1]
+        previous_data = bars[-2] if len(bars) > 1 else current_data
 
         return {
             'price': current_data['close'],
@@ -209,11 +712,11 @@ def get_btc_ohlcv():
             'volume': current_data['volume'],
             'timeframe': TRADE_CONFIG['timeframe'],
             'price_change': ((current_data['close'] - previous_data['close']) / previous_data['close']) * 100,
-            'kline_data': df[['timestamp', 'open', 'high', 'low', 'close', 'volume', 'volume_ratio', 'vwap', 'resistance', 'support']].tail(20).to_dict('records'),
-            'all_data': df
+            'kline_data': bars.tail(20).select(['timestamp', 'open', 'high', 'low', 'close', 'volume', 'volume_ratio', 'vwap', 'resistance', 'support']),
+            'all_data': bars
         }
     except Exception as e:
-        print(f"获取K线数据失败: {e}")
+        log.error(f"获取K线数据失败: {e}", extra=event('error'))
         return None
 
 
@@ -227,7 +730,7 @@ def get_current_position():
                 contracts = float(pos['contracts']) if pos['contracts'] else 0
 
                 if contracts > 0:
-                    return {
+                    runtime_stats['position'] = {
                         'side': pos['side'],  # 'long' or 'short'
                         'size': contracts,
                         'entry_price': float(pos['entryPrice']) if pos['entryPrice'] else 0,
@@ -235,13 +738,13 @@ def get_current_position():
                         'leverage': float(pos['leverage']) if pos['leverage'] else TRADE_CONFIG['leverage'],
                         'symbol': pos['symbol']
                     }
+                    return runtime_stats['position']
 
+        runtime_stats['position'] = None
         return None
 
     except Exception as e:
-        print(f"获取持仓失败: {e}")
-        import traceback
-        traceback.print_exc()
+        log.error(f"获取持仓失败: {e}", exc_info=True, extra=event('error'))
         return None
 
 
@@ -283,10 +786,11 @@ def get_current_orders():
         else:
             order_data['order_summary'] = "当前无挂单"
         
+        runtime_stats['open_orders'] = order_data['total_orders']
         return order_data
         
     except Exception as e:
-        print(f"获取挂单失败: {e}")
+        log.error(f"获取挂单失败: {e}", extra=event('error'))
         return {
             'total_orders': 0,
             'buy_orders': [],
@@ -295,41 +799,49 @@ def get_current_orders():
         }
 
 
-def analyze_with_deepseek_multi_timeframe(multi_data):
-    """使用聪明钱策略进行多周期分析"""
+def format_kline(label, kline):
+    """一根K线的提示词文本（完整快照和增量提示词共用）"""
+    surge_ratio = TRADE_CONFIG['strategy']['volume_surge_ratio']
+    shrink_ratio = TRADE_CONFIG['strategy']['volume_shrink_ratio']
+    trend = "阳线" if kline['close'] > kline['open'] else "阴线"
+    change = ((kline['close'] - kline['open']) / kline['open']) * 100
+
+    # 成交量分析
+    if kline['volume_ratio'] > surge_ratio:
+        volume_status = " (成交量激增)"
+    elif kline['volume_ratio'] < shrink_ratio:
+        volume_status = " (成交量萎缩)"
+    else:
+        volume_status = " (成交量正常)"
+
+    return (f"{label}: {trend} 开盘:{kline['open']:.2f} 收盘:{kline['close']:.2f} 涨跌:{change:+.2f}%{volume_status}\n"
+            f"  成交量:{kline['volume']:.2f} 最高:{kline['high']:.2f} 最低:{kline['low']:.2f}\n"
+            f"  VWAP:{kline['vwap']:.2f} 阻力位:{kline['resistance']:.2f} 支撑位:{kline['support']:.2f}\n")
+
+
+def build_multi_timeframe_prompt(multi_data, current_pos, current_orders):
+    """构建多周期聪明钱分析提示词（不做任何网络请求，便于回测复用）"""
     
+    surge_ratio = TRADE_CONFIG['strategy']['volume_surge_ratio']
+    shrink_ratio = TRADE_CONFIG['strategy']['volume_shrink_ratio']
+
     # 构建多周期K线数据文本
     analysis_text = ""
     
     for tf, data in multi_data.items():
         kline_text = f"【{tf}周期最近20根K线数据】\n"
-        for i, kline in enumerate(data['kline_data']):
-            trend = "阳线" if kline['close'] > kline['open'] else "阴线"
-            change = ((kline['close'] - kline['open']) / kline['open']) * 100
-            
-            # 成交量分析
-            volume_status = ""
-            if kline['volume_ratio'] > 2.0:
-                volume_status = " (成交量激增)"
-            elif kline['volume_ratio'] < 0.5:
-                volume_status = " (成交量萎缩)"
-            else:
-                volume_status = " (成交量正常)"
-            
-            kline_text += f"K线{i + 1}: {trend} 开盘:{kline['open']:.2f} 收盘:{kline['close']:.2f} 涨跌:{change:+.2f}%{volume_status}\n"
-            kline_text += f"  成交量:{kline['volume']:.2f} 最高:{kline['high']:.2f} 最低:{kline['low']:.2f}\n"
-            kline_text += f"  VWAP:{kline['vwap']:.2f} 阻力位:{kline['resistance']:.2f} 支撑位:{kline['support']:.2f}\n"
+        for i, kline in enumerate(data['kline_data'].records()):
+            kline_text += format_kline(f"K线{i + 1}", kline)
         
         analysis_text += kline_text + "\n"
     
     # 构建聪明钱分析文本
     smart_money_analysis = "【聪明钱策略分析】\n"
     for tf, data in multi_data.items():
-        df = data['all_data']
         current_price = data['price']
         
-        # 获取最新数据
-        latest = df.iloc[-1]
+        # 获取最新数据（kline_data最后一行即最新K线）
+        latest = data['kline_data'][-1]
         
         smart_money_analysis += f"{tf}周期:\n"
         smart_money_analysis += f"  当前价格: ${current_price:.2f}\n"
@@ -341,9 +853,9 @@ def analyze_with_deepseek_multi_timeframe(multi_data):
         smart_money_analysis += f"  聪明钱流向: {latest['smart_money_flow']}\n"
         
         # 成交量状态分析
-        if latest['volume_ratio'] > 2.0:
+        if latest['volume_ratio'] > surge_ratio:
             smart_money_analysis += f"  ⚠️ 成交量激增 - 大资金活动\n"
-        elif latest['volume_ratio'] < 0.5:
+        elif latest['volume_ratio'] < shrink_ratio:
             smart_money_analysis += f"  📉 成交量萎缩 - 观望情绪\n"
         else:
             smart_money_analysis += f"  📊 成交量正常\n"
@@ -355,6 +867,11 @@ def analyze_with_deepseek_multi_timeframe(multi_data):
             smart_money_analysis += f"  📉 价格跌破支撑位\n"
         else:
             smart_money_analysis += f"  📊 价格在支撑阻力区间内\n"
+
+    book = multi_data.get('5m', {}).get('order_book')
+    if book:
+        smart_money_analysis += format_order_book(book)
+    smart_money_analysis += format_derivatives(multi_data.get('5m', {}).get('derivatives'))
     
     # 添加上次交易信号
     signal_text = ""
@@ -369,11 +886,9 @@ def analyze_with_deepseek_multi_timeframe(multi_data):
             signal_text += f"\n止盈价格: ${last_signal.get('take_profit', 'N/A')}"
 
     # 添加当前持仓信息
-    current_pos = get_current_position()
     position_text = "无持仓" if not current_pos else f"{current_pos['side']}仓, 数量: {current_pos['size']}, 盈亏: {current_pos['unrealized_pnl']:.2f}USDT"
     
     # 添加当前挂单信息
-    current_orders = get_current_orders()
     orders_text = current_orders['order_summary']
     
     # 详细挂单信息
@@ -443,50 +958,265 @@ def analyze_with_deepseek_multi_timeframe(multi_data):
         "order_reason": "挂单理由说明"
     }}
     """
-    
-    try:
+    return prompt
+
+
+def prompt_snapshot(multi_data, current_pos, current_orders):
+    """增量提示词的比较基准：各周期已发送的K线、最新价格、持仓与挂单"""
+    return {
+        'bars': {tf: {int(kline['timestamp']): kline for kline in data['kline_data']} for tf, data in multi_data.items()},
+        'price': {tf: data['price'] for tf, data in multi_data.items()},
+        'position': (current_pos['side'], current_pos['size']) if current_pos else None,
+        'orders': sorted((o['side'], o['amount'], o['price']) for o in
+                         current_orders['buy_orders'] + current_orders['sell_orders']),
+    }
+
+
+def build_delta_prompt(multi_data, current_pos, current_orders, previous):
+    """
+    对话模式的增量提示词：只包含上一轮之后的新K线、上一轮未收盘K线的最终值、指标变化和持仓/挂单变化。
+    某个周期的K线与上一轮接不上（间隔太久）时返回None，由调用方改发完整快照
+    """
+    sections = []
+    for tf, data in multi_data.items():
+        sent = previous['bars'].get(tf)
+        if not sent:
+            return None
+        last_ts = max(sent)
+        timestamps = data['kline_data']['timestamp'].tolist()
+        if last_ts not in timestamps:
+            return None
+        index = timestamps.index(last_ts)
+
+        text = ""
+        if data['kline_data'][index] != sent[last_ts]:
+            text += format_kline("上一轮最后一根K线（最终值）", data['kline_data'][index])
+        for kline in data['kline_data'][index + 1:]:
+            text += format_kline("新K线", kline)
+
+        latest, previous_latest = data['kline_data'][-1], sent[last_ts]
+        price, previous_price = data['price'], previous['price'][tf]
+        text += (f"  当前价格: ${price:.2f}（{price - previous_price:+.2f}） "
+                 f"成交量比率: {latest['volume_ratio']:.2f}（{latest['volume_ratio'] - previous_latest['volume_ratio']:+.2f}） "
+                 f"价格相对VWAP: {latest['price_vs_vwap']:+.2f}%\n"
+                 f"  阻力位: ${latest['resistance']:.2f} 支撑位: ${latest['support']:.2f} "
+                 f"聪明钱流向: {latest['smart_money_flow']}\n")
+        sections.append(f"【{tf}周期】\n{text}")
+
+    position_text = "无持仓" if not current_pos else f"{current_pos['side']}仓, 数量: {current_pos['size']}, 盈亏: {current_pos['unrealized_pnl']:.2f}USDT"
+    position_key = (current_pos['side'], current_pos['size']) if current_pos else None
+    if position_key != previous['position']:
+        position_text = f"持仓已变化 -> {position_text}"
+
+    orders = sorted((o['side'], o['amount'], o['price']) for o in
+                    current_orders['buy_orders'] + current_orders['sell_orders'])
+    if orders == previous['orders']:
+        orders_text = "挂单无变化"
+    else:
+        orders_text = "挂单已变化: " + ("; ".join(f"{side} {amount} @ ${price:.2f}" for side, amount, price in orders)
+                                      if orders else "当前无挂单")
+
+    book = multi_data.get('5m', {}).get('order_book')
+    if book:
+        sections.append(format_order_book(book))
+    derivatives_text = format_derivatives(multi_data.get('5m', {}).get('derivatives'))
+    if derivatives_text:
+        sections.append(derivatives_text)
+
+    return ("【行情更新】以下是上一轮分析之后的新数据，之前发送的K线不再重复:\n\n"
+            + "\n".join(sections)
+            + f"\n【当前持仓】{position_text}\n【当前挂单】{orders_text}\n\n"
+            + "请结合之前的分析和以上更新重新判断，按相同的JSON格式回复。")
+
+
+def build_symbol_snapshot(symbol, multi_data, current_pos, current_orders, last_signal=None):
+    """批量分析中一个交易对的精简快照：每个周期最近几根K线各一行，加最新指标、持仓和挂单"""
+    bars = TRADE_CONFIG['llm_batch']['kline_bars']
+    lines = [f"【交易对 {symbol}】"]
+    for tf, data in multi_data.items():
+        klines = data['kline_data'].tail(bars)
+        latest = klines[-1]
+        candles = " ".join(f"{k['open']:.6g}/{k['high']:.6g}/{k['low']:.6g}/{k['close']:.6g}x{k['volume_ratio']:.1f}"
+                           for k in klines.records())
+        lines.append(f"{tf}: 价格{data['price']:.6g}({data['price_change']:+.2f}%) 量比{latest['volume_ratio']:.2f} "
+                     f"VWAP偏离{latest['price_vs_vwap']:+.2f}% 阻力{latest['resistance']:.6g} "
+                     f"支撑{latest['support']:.6g} 聪明钱{latest['smart_money_flow']}")
+        lines.append(f"  K线: {candles}")
+    book = multi_data.get('5m', {}).get('order_book')
+    if book:
+        lines.append(format_order_book(book).strip())
+    derivatives_text = format_derivatives(multi_data.get('5m', {}).get('derivatives'))
+    if derivatives_text:
+        lines.append(derivatives_text.strip())
+    position_text = "无" if not current_pos else f"{current_pos['side']} {current_pos['size']} 盈亏{current_pos['unrealized_pnl']:.2f}"
+    lines.append(f"持仓: {position_text}; 挂单: {current_orders['order_summary']}")
+    if last_signal:
+        lines.append(f"上次信号: {last_signal.get('signal', 'N/A')}/{last_signal.get('confidence', 'N/A')}")
+    return "\n".join(lines)
+
+
+def request_batch(messages):
+    """批量分析的一次请求，返回回复内容（token计入总统计）"""
+    result, usage = request_deepseek(messages)
+    if usage is not None:
+        update_token_stats(usage)
+    return result
+
+
+def analyze_batch_multi_timeframe(entries, fallback):
+    """
+    多交易对批量分析。entries为 {交易对: (multi_data, 持仓, 挂单, 上次信号)}，
+    每 TRADE_CONFIG['llm_batch']['max_symbols'] 个交易对一次请求；请求失败、缺失或不合法的交易对
+    调用 fallback(交易对) 单独分析。返回 {交易对: 信号或None}，不写入信号历史（由调用方按交易对记录）
+    """
+    with tracer.span('prompt_build'):
+        snapshots = {symbol: build_symbol_snapshot(symbol, *entry) for symbol, entry in entries.items()}
+    return batch_analyzer.analyze(snapshots, fallback)
+
+
+def parse_signal_response(result):
+    """从模型回复中安全解析JSON交易信号"""
+    start_idx = result.find('{')
+    end_idx = result.rfind('}') + 1
+    if start_idx != -1 and end_idx != 0:
+        json_str = result[start_idx:end_idx]
+        return json.loads(json_str)
+    log.warning(f"无法解析JSON: {result}", extra=event('error'))
+    return None
+
+
+def record_signal(signal_data, timestamp):
+    """保存信号到历史记录"""
+    signal_data['timestamp'] = timestamp
+    signal_history.append(signal_data)
+    if len(signal_history) > 30:
+        signal_history.pop(0)
+
+
+def request_deepseek(messages):
+    """请求DeepSeek，返回(回复内容, usage)，同时记录首字耗时和总耗时"""
+    with tracer.span('llm_total'):
+        started = tracer.clock()
+        if not TRADE_CONFIG['llm_stream']:
+            response = deepseek_client.chat.completions.create(
+                model="deepseek-chat",
+                messages=messages,
+                stream=False
+            )
+            return response.choices[0].message.content, getattr(response, 'usage', None)
+
         response = deepseek_client.chat.completions.create(
             model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "您是一位专业的聪明钱策略分析师，专注于识别大资金流向和机构行为模式。请基于成交量、支撑阻力位和价格行为给出精准的交易建议，包括具体的入场价格、止损价格、止盈价格。所有价格必须是具体的数字。"},
-                {"role": "user", "content": prompt}
-            ],
-            stream=False
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True}
         )
+        if hasattr(response, 'choices'):
+            # 缓存等包装直接返回了完整响应
+            return response.choices[0].message.content, getattr(response, 'usage', None)
+
+        parts = []
+        usage = None
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not parts:
+                    tracer.record_since('llm_ttft', started)
+                parts.append(chunk.choices[0].delta.content)
+            if getattr(chunk, 'usage', None):
+                usage = chunk.usage
+        return ''.join(parts), usage
+
+
+# 推测分析产生、尚未写入对话的一轮 (提示词, 类型, 信号, 快照, usage, 耗时)
+speculation_turn = None
+
+
+def commit_session_turn(turn):
+    """把一轮问答写入对话上下文，后续增量以这一轮的快照为基准"""
+    prompt, session_kind, signal_data, snapshot, usage, latency_s = turn
+    llm_session.commit(prompt, session_kind, signal_data, snapshot, usage, latency_s)
+    hit = cached_prompt_tokens(usage) if usage is not None else 0
+    log.info(f"对话模式({session_kind}): 新发送 {len(prompt)} 字符, 上下文 {llm_session.turns} 轮, "
+             f"输入命中缓存 {hit} tokens, 耗时 {latency_s:.1f}s",
+             extra=event('llm', session=session_kind, sent_chars=len(prompt), turns=llm_session.turns,
+                         cached_tokens=hit, latency_s=latency_s))
+
+
+def analyze_with_deepseek_multi_timeframe(multi_data, record=True):
+    """使用聪明钱策略进行多周期分析；record=False时不写入信号历史和对话上下文（推测分析）"""
+    global speculation_turn
+    current_pos = get_current_position()
+    current_orders = get_current_orders()
+    session_kind = None
+    with tracer.span('prompt_build'):
+        if llm_session is not None:
+            # 对话模式：能接上上一轮时只发增量，否则重新锚定完整快照
+            snapshot = prompt_snapshot(multi_data, current_pos, current_orders)
+            prompt = None
+            if not llm_session.needs_anchor():
+                prompt = build_delta_prompt(multi_data, current_pos, current_orders, llm_session.snapshot)
+            session_kind = 'full' if prompt is None else 'delta'
+            if prompt is None:
+                prompt = build_multi_timeframe_prompt(multi_data, current_pos, current_orders)
+            messages = llm_session.messages(prompt, session_kind)
+        else:
+            prompt = build_multi_timeframe_prompt(multi_data, current_pos, current_orders)
+            messages = [
+                {"role": "system", "content": MULTI_TIMEFRAME_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ]
+
+    try:
+        if llm_ensemble is not None:
+            # 多模型并行，token用量由record_member_usage逐个回复记录
+            with tracer.span('llm_total'):
+                signal_data = llm_ensemble.ask(messages)
+            if signal_data is None:
+                return None
+            if record:
+                record_signal(signal_data, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            return signal_data
+
+        started = time.perf_counter()
+        result, usage = request_deepseek(messages)
+        latency_s = time.perf_counter() - started
 
         # 添加token统计
-        if hasattr(response, 'usage'):
-            usage = response.usage
-            print(f"本次Token消耗:")
-            print(f"  输入: {usage.prompt_tokens} tokens")
-            print(f"  输出: {usage.completion_tokens} tokens")
-            print(f"  总计: {usage.total_tokens} tokens")
-            print(f"  成本: ${usage.total_tokens * 0.000002:.4f}")
+        if usage is not None:
+            log.info(f"本次Token消耗: 输入 {usage.prompt_tokens}, 输出 {usage.completion_tokens}, "
+                     f"总计 {usage.total_tokens} tokens, 成本 ${usage.total_tokens * 0.000002:.4f}",
+                     extra=event('llm', prompt_tokens=usage.prompt_tokens,
+                                 completion_tokens=usage.completion_tokens, total_tokens=usage.total_tokens))
             
             # 更新全局统计
             update_token_stats(usage)
 
         # 安全解析JSON
-        result = response.choices[0].message.content
-        start_idx = result.find('{')
-        end_idx = result.rfind('}') + 1
-        if start_idx != -1 and end_idx != 0:
-            json_str = result[start_idx:end_idx]
-            signal_data = json.loads(json_str)
-        else:
-            print(f"无法解析JSON: {result}")
+        with tracer.span('json_parse'):
+            signal_data = parse_signal_response(result)
+        if signal_data is None:
+            if llm_session is not None and record:
+                llm_session.reset()
             return None
 
+        if session_kind is not None:
+            turn = (prompt, session_kind, signal_data, snapshot, usage, latency_s)
+            if record:
+                commit_session_turn(turn)
+            else:
+                # 推测分析基于未收盘的K线：收盘后核对命中才写入对话，未命中时对话保持原样
+                speculation_turn = turn
+
         # 保存信号到历史记录
-        signal_data['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        signal_history.append(signal_data)
-        if len(signal_history) > 30:
-            signal_history.pop(0)
+        if record:
+            record_signal(signal_data, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 
         return signal_data
 
     except Exception as e:
-        print(f"DeepSeek分析失败: {e}")
+        log.error(f"DeepSeek分析失败: {e}", extra=event('error'))
+        if llm_session is not None and record:
+            llm_session.reset()
         return None
 
 
@@ -506,9 +1236,9 @@ def analyze_with_deepseek(price_data):
         
         # 成交量分析
         volume_status = ""
-        if 'volume_ratio' in kline and kline['volume_ratio'] > 2.0:
+        if 'volume_ratio' in kline and kline['volume_ratio'] > TRADE_CONFIG['strategy']['volume_surge_ratio']:
             volume_status = " (成交量激增)"
-        elif 'volume_ratio' in kline and kline['volume_ratio'] < 0.5:
+        elif 'volume_ratio' in kline and kline['volume_ratio'] < TRADE_CONFIG['strategy']['volume_shrink_ratio']:
             volume_status = " (成交量萎缩)"
         else:
             volume_status = " (成交量正常)"
@@ -528,7 +1258,7 @@ def analyze_with_deepseek(price_data):
         
         # 添加聪明钱分析
         if 'all_data' in price_data:
-            latest_bb = price_data['all_data'].iloc[-1]
+            latest_bb = price_data['all_data'][-1]
             indicator_text += f"\n成交量比率: {latest_bb['volume_ratio']:.2f}"
             indicator_text += f"\nVWAP: {latest_bb['vwap']:.2f}"
             indicator_text += f"\n价格相对VWAP: {latest_bb['price_vs_vwap']:+.2f}%"
@@ -594,11 +1324,10 @@ def analyze_with_deepseek(price_data):
         # 添加token统计
         if hasattr(response, 'usage'):
             usage = response.usage
-            print(f"本次Token消耗:")
-            print(f"  输入: {usage.prompt_tokens} tokens")
-            print(f"  输出: {usage.completion_tokens} tokens")
-            print(f"  总计: {usage.total_tokens} tokens")
-            print(f"  成本: ¥{usage.total_tokens * 0.000002:.4f}")
+            log.info(f"本次Token消耗: 输入 {usage.prompt_tokens}, 输出 {usage.completion_tokens}, "
+                     f"总计 {usage.total_tokens} tokens, 成本 ¥{usage.total_tokens * 0.000002:.4f}",
+                     extra=event('llm', prompt_tokens=usage.prompt_tokens,
+                                 completion_tokens=usage.completion_tokens, total_tokens=usage.total_tokens))
             
             # 更新全局统计
             update_token_stats(usage)
@@ -611,7 +1340,7 @@ def analyze_with_deepseek(price_data):
             json_str = result[start_idx:end_idx]
             signal_data = json.loads(json_str)
         else:
-            print(f"无法解析JSON: {result}")
+            log.warning(f"无法解析JSON: {result}", extra=event('error'))
             return None
 
         # 保存信号到历史记录
@@ -623,111 +1352,140 @@ def analyze_with_deepseek(price_data):
         return signal_data
 
     except Exception as e:
-        print(f"DeepSeek分析失败: {e}")
+        log.error(f"DeepSeek分析失败: {e}", extra=event('error'))
         return None
 
 
 def cancel_old_stop_orders():
-    """取消旧的止盈止损订单"""
+    """取消旧版本挂的限价止盈止损单；本进程的条件单/本地盯价由protection.protect替换时撤销"""
     try:
         orders = exchange.fetch_open_orders(TRADE_CONFIG['symbol'])
         cancelled_count = 0
         for order in orders:
-            if 'STOP' in order.get('tag', '') or 'TP' in order.get('tag', ''):
+            # ccxt统一订单结构里没有tag，原始字段在info里
+            tag = order.get('tag') or order.get('info', {}).get('tag') or ''
+            if 'STOP' in tag or 'TP' in tag:
                 exchange.cancel_order(order['id'], TRADE_CONFIG['symbol'])
-                print(f"已取消旧止盈止损订单: {order['id']}")
+                log.info(f"已取消旧止盈止损订单: {order['id']}", extra=event('order', action='cancel', order_id=order['id'], tag=tag))
                 cancelled_count += 1
         if cancelled_count > 0:
-            print(f"共取消了 {cancelled_count} 个旧止盈止损订单")
+            log.info(f"共取消了 {cancelled_count} 个旧止盈止损订单", extra=event('order', action='cancel', count=cancelled_count))
         return True
     except Exception as e:
-        print(f"取消旧止盈止损订单失败: {e}")
+        log.error(f"取消旧止盈止损订单失败: {e}", extra=event('error'))
         return False
 
 
 def set_stop_loss_take_profit(signal_data, position_side):
-    """设置止盈止损订单"""
+    """设置止盈止损：交易所条件单，或本地盯价触发市价单（见protective_orders）"""
     try:
         if 'stop_loss' not in signal_data or 'take_profit' not in signal_data:
-            print("缺少止盈止损价格信息")
+            log.warning("缺少止盈止损价格信息", extra=event('error'))
             return False
             
         stop_loss_price = signal_data['stop_loss']
         take_profit_price = signal_data['take_profit']
         
-        # 先取消旧的止盈止损订单
+        # 先清理旧版本遗留的限价止盈止损单（撤单请求返回即已撤销，不需要等待）
         cancel_old_stop_orders()
-        time.sleep(1)  # 等待取消完成
-        
-        if position_side == 'long':
-            # 多头持仓：止损价格低于入场价，止盈价格高于入场价
-            print(f"设置多头止盈止损: 止损${stop_loss_price:,.2f}, 止盈${take_profit_price:,.2f}")
-            
-            # 设置止损订单（卖出）
-            stop_loss_order = exchange.create_limit_order(
-                TRADE_CONFIG['symbol'],
-                'sell',
-                TRADE_CONFIG['amount'],
-                stop_loss_price,
-                params={'tag': 'f1ee03b510d5SUDE_STOP'}
-            )
-            print(f"止损订单设置成功: {stop_loss_order['id']}")
-            
-            # 设置止盈订单（卖出）
-            take_profit_order = exchange.create_limit_order(
-                TRADE_CONFIG['symbol'],
-                'sell',
-                TRADE_CONFIG['amount'],
-                take_profit_price,
-                params={'tag': 'f1ee03b510d5SUDE_TP'}
-            )
-            print(f"止盈订单设置成功: {take_profit_order['id']}")
-            
-        elif position_side == 'short':
-            # 空头持仓：止损价格高于入场价，止盈价格低于入场价
-            print(f"设置空头止盈止损: 止损${stop_loss_price:,.2f}, 止盈${take_profit_price:,.2f}")
-            
-            # 设置止损订单（买入）
-            stop_loss_order = exchange.create_limit_order(
-                TRADE_CONFIG['symbol'],
-                'buy',
-                TRADE_CONFIG['amount'],
-                stop_loss_price,
-                params={'tag': 'f1ee03b510d5SUDE_STOP'}
-            )
-            print(f"止损订单设置成功: {stop_loss_order['id']}")
-            
-            # 设置止盈订单（买入）
-            take_profit_order = exchange.create_limit_order(
-                TRADE_CONFIG['symbol'],
-                'buy',
-                TRADE_CONFIG['amount'],
-                take_profit_price,
-                params={'tag': 'f1ee03b510d5SUDE_TP'}
-            )
-            print(f"止盈订单设置成功: {take_profit_order['id']}")
-            
+
+        # 多头止损低于入场价、止盈高于入场价；空头相反
+        log.info(f"设置{'多头' if position_side == 'long' else '空头'}止盈止损: "
+                 f"止损${stop_loss_price:,.2f}, 止盈${take_profit_price:,.2f}",
+                 extra=event('order', action='protect', side=position_side, stop_loss=stop_loss_price,
+                             take_profit=take_profit_price))
+        mode = protection.protect(exchange, position_side, TRADE_CONFIG['amount'], stop_loss_price, take_profit_price)
+        log.info(f"止盈止损设置成功（{'交易所条件单' if mode == 'native' else '本地盯价'}）",
+                 extra=event('order', action='protect', mode=mode))
         return True
         
     except Exception as e:
-        print(f"设置止盈止损失败: {e}")
+        log.error(f"设置止盈止损失败: {e}", extra=event('error'))
         return False
 
 
-def execute_limit_order(signal_data):
+# 等待设置的止盈止损: (信号, 持仓方向, 入场挂单id)；市价开仓后设置失败等待重试时挂单id为None
+pending_protection = None
+
+
+def defer_protection(signal_data, position_side, order_id):
+    """
+    限价开仓：止盈止损是reduceOnly条件单，OKX对没有持仓的reduceOnly单直接拒绝（退回本地盯价后，
+    挂单成交前触发也会因为没有持仓而失败），所以先记下，每个周期由protect_filled_entry检查成交后再设置
+    """
+    global pending_protection
+    pending_protection = (dict(signal_data), position_side, order_id)
+    log.info(f"入场挂单 {order_id} 成交后再设置止盈止损" if order_id else "止盈止损下个周期重试",
+             extra=event('order', action='protect', pending=True, order_id=order_id, side=position_side))
+
+
+def protect_filled_entry():
+    """每个周期开始时调用（与是否拿到信号无关）：待保护的入场挂单已成交就设置止盈止损，已撤销则放弃"""
+    global pending_protection
+    if pending_protection is None:
+        return
+    signal_data, position_side, order_id = pending_protection
+    try:
+        # 先查订单再查持仓：两次查询之间成交时持仓里一定能看到
+        status = exchange.fetch_order(order_id, TRADE_CONFIG['symbol'])['status'] if order_id else 'closed'
+        current = get_current_position()
+    except Exception as e:
+        log.warning(f"查询入场挂单 {order_id} 失败，下个周期再检查: {e}", extra=event('error', order_id=order_id))
+        return
+    if current is not None and current['side'] == position_side:
+        # 部分成交也先保护，reduceOnly单按实际持仓裁剪
+        if set_stop_loss_take_profit(signal_data, position_side):
+            pending_protection = None
+    elif status != 'open':
+        pending_protection = None
+        log.info(f"入场订单 {order_id} 已{status}且无对应持仓，不再设置止盈止损",
+                 extra=event('order', action='protect', pending=False, order_id=order_id, status=status))
+
+
+def risk_check(side, amount, signal_data, price=None, position=None, reduce_only=False):
+    """下单前的本地风控校验；被拒绝时记录原因并返回False"""
+    rejection = risk_engine.check(side, amount, price, signal_data.get('stop_loss'), signal_data.get('take_profit'),
+                                  position, reduce_only)
+    if rejection is None:
+        return True
+    log.warning(f"风控拒绝{side}单（{rejection.reason}）: {rejection.message}",
+                extra=event('order', action='reject', reason=rejection.reason, side=side, amount=amount, price=price,
+                            reduce_only=reduce_only))
+    return False
+
+
+def refresh_risk_account():
+    """周期末刷新风控用的余额缓存（下过单或超过account_ttl_s时），不占用决策到下单的路径"""
+    if not risk_engine.needs_refresh():
+        return
+    try:
+        risk_engine.update_balance(exchange.fetch_balance()['USDT']['free'])
+    except Exception as e:
+        log.warning(f"刷新余额缓存失败，沿用上次的值: {e}", extra=event('error'))
+
+
+def execute_limit_order(signal_data, current_position=None):
     """执行挂单"""
     try:
         # 如果没有entry_price，尝试从limit_price获取
         if 'entry_price' not in signal_data or signal_data['entry_price'] is None:
             if 'limit_price' in signal_data and signal_data['limit_price'] is not None:
                 signal_data['entry_price'] = signal_data['limit_price']
-                print(f"使用挂单价格: ${signal_data['entry_price']:,.2f}")
+                log.info(f"使用挂单价格: ${signal_data['entry_price']:,.2f}", extra=event('order', price=signal_data['entry_price']))
             else:
-                print("挂单价格无效，无法执行挂单")
+                log.warning("挂单价格无效，无法执行挂单", extra=event('error'))
+                return False
+
+        if signal_data['signal'] in ('BUY', 'SELL'):
+            side = 'buy' if signal_data['signal'] == 'BUY' else 'sell'
+            signal_data['entry_price'] = risk_engine.normalize_price(signal_data['entry_price'])
+            if not risk_check(side, TRADE_CONFIG['amount'], signal_data, signal_data['entry_price'], current_position):
                 return False
             
         if signal_data['signal'] == 'BUY':
-            print(f"挂买单: {TRADE_CONFIG['amount']} @ ${signal_data['entry_price']:,.2f}")
+            log.info(f"挂买单: {TRADE_CONFIG['amount']} @ ${signal_data['entry_price']:,.2f}",
+                     extra=event('order', action='submit', type='limit', side='buy', amount=TRADE_CONFIG['amount'],
+                                 price=signal_data['entry_price']))
             order = exchange.create_limit_order(
                 TRADE_CONFIG['symbol'],
                 'buy',
@@ -735,14 +1493,15 @@ def execute_limit_order(signal_data):
                 signal_data['entry_price'],
                 params={'tag': 'f1ee03b510d5SUDE'}
             )
-            print(f"买单挂单成功: {order['id']}")
+            log.info(f"买单挂单成功: {order['id']}", extra=event('order', action='ack', order_id=order['id']))
             
-            # 设置止盈止损
-            time.sleep(2)  # 等待订单确认
-            set_stop_loss_take_profit(signal_data, 'long')
+            # 止盈止损等入场挂单成交后再设置
+            defer_protection(signal_data, 'long', order['id'])
             
         elif signal_data['signal'] == 'SELL':
-            print(f"挂卖单: {TRADE_CONFIG['amount']} @ ${signal_data['entry_price']:,.2f}")
+            log.info(f"挂卖单: {TRADE_CONFIG['amount']} @ ${signal_data['entry_price']:,.2f}",
+                     extra=event('order', action='submit', type='limit', side='sell', amount=TRADE_CONFIG['amount'],
+                                 price=signal_data['entry_price']))
             order = exchange.create_limit_order(
                 TRADE_CONFIG['symbol'],
                 'sell',
@@ -750,34 +1509,35 @@ def execute_limit_order(signal_data):
                 signal_data['entry_price'],
                 params={'tag': 'f1ee03b510d5SUDE'}
             )
-            print(f"卖单挂单成功: {order['id']}")
+            log.info(f"卖单挂单成功: {order['id']}", extra=event('order', action='ack', order_id=order['id']))
             
-            # 设置止盈止损
-            time.sleep(2)  # 等待订单确认
-            set_stop_loss_take_profit(signal_data, 'short')
+            # 止盈止损等入场挂单成交后再设置
+            defer_protection(signal_data, 'short', order['id'])
             
         return True
         
     except Exception as e:
-        print(f"挂单失败: {e}")
+        log.error(f"挂单失败: {e}", extra=event('error'))
         return False
 
 
 def cancel_existing_orders():
     """取消现有挂单"""
+    global pending_protection
     try:
         orders = exchange.fetch_open_orders(TRADE_CONFIG['symbol'])
         if orders:
-            print(f"取消 {len(orders)} 个现有挂单...")
+            log.info(f"取消 {len(orders)} 个现有挂单...", extra=event('order', action='cancel', count=len(orders)))
             for order in orders:
                 exchange.cancel_order(order['id'], TRADE_CONFIG['symbol'])
-                print(f"已取消挂单: {order['id']}")
+                log.info(f"已取消挂单: {order['id']}", extra=event('order', action='cancel', order_id=order['id']))
+            pending_protection = None  # 入场挂单已撤销，不会再成交
             return True
         else:
-            print("没有需要取消的挂单")
+            log.info("没有需要取消的挂单", extra=event('order', action='cancel', count=0))
             return True
     except Exception as e:
-        print(f"取消挂单失败: {e}")
+        log.error(f"取消挂单失败: {e}", extra=event('error'))
         return False
 
 
@@ -787,59 +1547,64 @@ def execute_trade(signal_data, price_data):
 
     current_position = get_current_position()
     current_orders = get_current_orders()
-
-    print(f"交易信号: {signal_data['signal']}")
-    print(f"信心程度: {signal_data['confidence']}")
-    print(f"理由: {signal_data['reason']}")
+    risk_engine.mark_price(price_data['price'])
+
+    # 信号详情作为一条signal事件输出：控制台显示为多行，JSON日志里是结构化字段
+    lines = [
+        f"交易信号: {signal_data['signal']}",
+        f"信心程度: {signal_data['confidence']}",
+        f"理由: {signal_data['reason']}",
+    ]
     
     # 显示价格信息
     if 'limit_price' in signal_data and signal_data['limit_price'] is not None:
-        print(f"挂单价格: ${signal_data['limit_price']:,.2f}")
+        lines.append(f"挂单价格: ${signal_data['limit_price']:,.2f}")
     if 'market_price' in signal_data and signal_data['market_price'] is not None:
-        print(f"市价参考: ${signal_data['market_price']:,.2f}")
+        lines.append(f"市价参考: ${signal_data['market_price']:,.2f}")
     if 'stop_loss' in signal_data and signal_data['stop_loss'] is not None:
-        print(f"止损价格: ${signal_data['stop_loss']:,.2f}")
+        lines.append(f"止损价格: ${signal_data['stop_loss']:,.2f}")
     if 'take_profit' in signal_data and signal_data['take_profit'] is not None:
-        print(f"止盈价格: ${signal_data['take_profit']:,.2f}")
+        lines.append(f"止盈价格: ${signal_data['take_profit']:,.2f}")
     if 'risk_reward_ratio' in signal_data and signal_data['risk_reward_ratio'] is not None:
-        print(f"风险回报比: {signal_data['risk_reward_ratio']}")
+        lines.append(f"风险回报比: {signal_data['risk_reward_ratio']}")
     
     # 显示挂单建议
     if 'order_suggestion' in signal_data:
-        print(f"挂单建议: {signal_data['order_suggestion']}")
-        print(f"挂单理由: {signal_data.get('order_reason', 'N/A')}")
+        lines.append(f"挂单建议: {signal_data['order_suggestion']}")
+        lines.append(f"挂单理由: {signal_data.get('order_reason', 'N/A')}")
     
-    print(f"当前持仓: {current_position}")
-    print(f"当前挂单: {current_orders['order_summary']}")
+    lines.append(f"当前持仓: {current_position}")
+    lines.append(f"当前挂单: {current_orders['order_summary']}")
+    log.info("\n".join(lines), extra=event('signal', signal=dict(signal_data), position=current_position,
+                                           orders=current_orders['order_summary']))
 
     if TRADE_CONFIG['test_mode']:
-        print("测试模式 - 仅模拟交易")
-        return
+        log.info("测试模式 - 在模拟交易所撮合", extra=event('system'))
 
     # 根据挂单建议执行操作
     if 'order_suggestion' in signal_data:
         if signal_data['order_suggestion'] == 'PLACE_ORDER':
-            print("执行挂单...")
-            execute_limit_order(signal_data)
+            log.info("执行挂单...", extra=event('signal'))
+            execute_limit_order(signal_data, current_position)
         elif signal_data['order_suggestion'] == 'CANCEL_EXISTING':
-            print("取消现有挂单...")
+            log.info("取消现有挂单...", extra=event('signal'))
             cancel_existing_orders()
         elif signal_data['order_suggestion'] == 'HOLD':
-            print("建议观望，不执行挂单")
+            log.info("建议观望，不执行挂单", extra=event('signal'))
         else:
-            print("不执行挂单")
+            log.info("不执行挂单", extra=event('signal'))
     else:
         # 根据信心程度选择交易方式
         if signal_data['confidence'] == 'HIGH' and 'market_price' in signal_data and signal_data['market_price'] is not None:
-            print("信心十足，使用市价交易...")
+            log.info("信心十足，使用市价交易...", extra=event('signal'))
             signal_data['entry_price'] = signal_data['market_price']
             execute_market_trade(signal_data, current_position)
         elif signal_data['confidence'] in ['MEDIUM', 'LOW'] and 'limit_price' in signal_data and signal_data['limit_price'] is not None:
-            print("信心不足，使用挂单价格...")
+            log.info("信心不足，使用挂单价格...", extra=event('signal'))
             signal_data['entry_price'] = signal_data['limit_price']
-            execute_limit_order(signal_data)
+            execute_limit_order(signal_data, current_position)
         else:
-            print("使用传统市价交易逻辑...")
+            log.info("使用传统市价交易逻辑...", extra=event('signal'))
             execute_market_trade(signal_data, current_position)
 
 
@@ -848,7 +1613,11 @@ def execute_market_trade(signal_data, current_position):
     try:
         if signal_data['signal'] == 'BUY':
             if current_position and current_position['side'] == 'short':
-                print("平空仓并开多仓...")
+                # 平仓和开仓两笔都通过风控才发送，避免只平了旧仓
+                if not (risk_check('buy', current_position['size'], signal_data, position=current_position, reduce_only=True)
+                        and risk_check('buy', TRADE_CONFIG['amount'], signal_data, position=current_position)):
+                    return
+                log.info("平空仓并开多仓...", extra=event('order'))
                 # 平空仓
                 exchange.create_market_order(
                     TRADE_CONFIG['symbol'],
@@ -865,7 +1634,9 @@ def execute_market_trade(signal_data, current_position):
                     params={'tag': 'f1ee03b510d5SUDE'}
                 )
             elif not current_position:
-                print("开多仓...")
+                if not risk_check('buy', TRADE_CONFIG['amount'], signal_data):
+                    return
+                log.info("开多仓...", extra=event('order'))
                 exchange.create_market_order(
                     TRADE_CONFIG['symbol'],
                     'buy',
@@ -873,17 +1644,21 @@ def execute_market_trade(signal_data, current_position):
                     params={'tag': 'f1ee03b510d5SUDE'}
                 )
             else:
-                print("已持有多仓，无需操作")
+                log.info("已持有多仓，无需操作", extra=event('order'))
                 return
 
-            print("订单执行成功")
-            # 设置止盈止损
-            time.sleep(2)  # 等待订单确认
-            set_stop_loss_take_profit(signal_data, 'long')
+            log.info("订单执行成功", extra=event('order'))
+            # 市价单已成交，持仓已存在，可以直接设置止盈止损；失败时下个周期重试
+            if not set_stop_loss_take_profit(signal_data, 'long'):
+                defer_protection(signal_data, 'long', None)
 
         elif signal_data['signal'] == 'SELL':
             if current_position and current_position['side'] == 'long':
-                print("平多仓并开空仓...")
+                # 平仓和开仓两笔都通过风控才发送，避免只平了旧仓
+                if not (risk_check('sell', current_position['size'], signal_data, position=current_position, reduce_only=True)
+                        and risk_check('sell', TRADE_CONFIG['amount'], signal_data, position=current_position)):
+                    return
+                log.info("平多仓并开空仓...", extra=event('order'))
                 # 平多仓
                 exchange.create_market_order(
                     TRADE_CONFIG['symbol'],
@@ -900,7 +1675,9 @@ def execute_market_trade(signal_data, current_position):
                     params={'tag': 'f1ee03b510d5SUDE'}
                 )
             elif not current_position:
-                print("开空仓...")
+                if not risk_check('sell', TRADE_CONFIG['amount'], signal_data):
+                    return
+                log.info("开空仓...", extra=event('order'))
                 exchange.create_market_order(
                     TRADE_CONFIG['symbol'],
                     'sell',
@@ -908,98 +1685,587 @@ def execute_market_trade(signal_data, current_position):
                     params={'tag': 'f1ee03b510d5SUDE'}
                 )
             else:
-                print("已持有空仓，无需操作")
+                log.info("已持有空仓，无需操作", extra=event('order'))
                 return
 
-            print("订单执行成功")
-            # 设置止盈止损
-            time.sleep(2)  # 等待订单确认
-            set_stop_loss_take_profit(signal_data, 'short')
+            log.info("订单执行成功", extra=event('order'))
+            # 市价单已成交，持仓已存在，可以直接设置止盈止损；失败时下个周期重试
+            if not set_stop_loss_take_profit(signal_data, 'short'):
+                defer_protection(signal_data, 'short', None)
 
         elif signal_data['signal'] == 'HOLD':
-            print("建议观望，不执行交易")
+            log.info("建议观望，不执行交易", extra=event('signal'))
             return
 
         # 更新持仓信息
         time.sleep(2)
-        position = get_current_position()
-        print(f"更新后持仓: {position}")
+        with tracer.span('order_confirm'):
+            position = get_current_position()
+        log.info(f"更新后持仓: {position}", extra=event('position', position=position))
 
     except Exception as e:
-        print(f"订单执行失败: {e}")
-        import traceback
-        traceback.print_exc()
+        log.error(f"订单执行失败: {e}", exc_info=True, extra=event('error'))
+
+
+def create_venue(config):
+    """按配置创建额外交易所的适配器（测试模式下在本地模拟交易所撮合，行情仍取自该交易所）"""
+    adapter = ADAPTERS.get(config['exchange'])
+    if adapter is None:
+        raise ValueError(f"不支持的交易所: {config['exchange']}，可选 {'/'.join(ADAPTERS)}")
+    venue_exchange = getattr(ccxt, config['exchange'])({
+        'options': config.get('options', {}),
+        'apiKey': os.getenv(config['api_key_env']),
+        'secret': os.getenv(config['secret_env']),
+        'password': os.getenv(config['password_env']) if config.get('password_env') else None,
+    })
+    venue_pool = mount_pool(venue_exchange.session, **TRADE_CONFIG['http']['exchange_pool'])
+    if venue_exchange.has.get('fetchTime'):
+        keepalive_targets.append((config.get('name', venue_exchange.id), lambda: venue_pool.last_used,
+                                  venue_exchange.fetch_time))
+    startup_config = TRADE_CONFIG['startup']
+    load_markets_cached(venue_exchange, startup_config['market_cache'].format(exchange=venue_exchange.id),
+                        startup_config['market_cache_ttl_hours'], startup_config['market_types'],
+                        symbols=[config['symbol']])
+    market = venue_exchange.market(config['symbol'])
+    name = config.get('name', venue_exchange.id)
+
+    # 与主交易所相同：按该交易所的限频规则（币安为共享权重桶和下单次数）调度所有请求
+    market_source = venue_exchange
+    if TRADE_CONFIG['rate_limit']['enabled']:
+        try:
+            scheduler = RequestScheduler.for_exchange(venue_exchange, headroom=TRADE_CONFIG['rate_limit']['headroom'],
+                                                      order_reserve=TRADE_CONFIG['rate_limit']['order_reserve'],
+                                                      tracer=tracer)
+        except ValueError as e:
+            log.warning(f"[{name}] {e}，沿用ccxt自带的限频", extra=event('system', venue=name))
+        else:
+            venue_exchange.enableRateLimit = False
+            market_source = ScheduledExchange(venue_exchange, scheduler)
+            venue_schedulers[name] = scheduler
 
+    risk = RiskEngine(config['leverage'], contract_size=market.get('contractSize') or 1.0,
+                      **{**TRADE_CONFIG['risk'], **config.get('risk', {})})
+    risk.load_market(market, venue_exchange.precisionMode)
 
-def trading_bot():
-    """主交易机器人函数"""
-    print("\n" + "=" * 60)
-    print(f"执行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print("=" * 60)
+    order_exchange = market_source
+    if TRADE_CONFIG['test_mode']:
+        from paper_exchange import PaperExchange, WallClock
 
-    # 1. 获取多周期K线数据
-    multi_data = get_multi_timeframe_data()
-    if not multi_data:
-        return
+        order_exchange = PaperExchange(WallClock(), symbol=config['symbol'], leverage=config['leverage'],
+                                       market_data=market_source,
+                                       **{**TRADE_CONFIG['paper'], 'contract_size': risk.contract_size})
+    return adapter(name, order_exchange, config['symbol'], config['amount'],
+                   config['leverage'], risk)
 
-    # 显示各周期当前价格
-    for tf, data in multi_data.items():
-        print(f"{tf}周期BTC价格: ${data['price']:,.2f} (变化: {data['price_change']:+.2f}%)")
 
-    # 2. 使用DeepSeek进行聪明钱策略分析
-    signal_data = analyze_with_deepseek_multi_timeframe(multi_data)
-    if not signal_data:
+def begin_execution_record(signal_data, price_data, prompt_ms):
+    """记录决策时间线的起点：K线收盘时间、提示词中的价格和决策时的最新价"""
+    if not execution_recorder.enabled:
         return
+    try:
+        decision_price = exchange.fetch_ticker(TRADE_CONFIG['symbol'])['last']
+    except Exception as e:
+        log.warning(f"获取决策时价格失败: {e}", extra=event('error'))
+        decision_price = None
+    # 最后一根是未收盘K线，它的开盘时间就是上一根的收盘时间
+    bar_close_ms = int(price_data['all_data']['timestamp'][-1])
+    execution_recorder.begin_decision(signal_data, bar_close_ms, prompt_ms, price_data['price'], decision_price)
+
+
+def position_context(refresh=True):
+    """持仓方向、数量和挂单数；推测分析的提示词依赖这些，变化后推测结果作废"""
+    if refresh:
+        get_current_position()
+        get_current_orders()
+    pos = runtime_stats['position']
+    return (pos['side'], pos['size']) if pos else None, runtime_stats['open_orders']
+
+
+def speculate():
+    """收盘前对快完成的K线提前分析，结果交给speculation在收盘后核对（不下单）"""
+    global speculation_turn
+    with tracer.span('speculation'):
+        multi_data = get_multi_timeframe_data()
+        if not multi_data:
+            return
+        started = time.perf_counter()
+        speculation_turn = None
+        signal_data = analyze_with_deepseek_multi_timeframe(multi_data, record=False)
+        # 分析时刚查询过持仓和挂单，直接取快照
+        speculation.store(multi_data['5m']['all_data'], signal_data, time.perf_counter() - started,
+                          context=position_context(refresh=False))
+
+
+def execute_decision(signal_data, multi_data, prompt_ms):
+    """执行一个决策（其他交易所在后台线程同时执行同一个信号），之后结算成交、刷新风控余额"""
+    venue_futures = venue_executor.submit(signal_data, multi_data['5m']['price']) if venue_executor else None
+    if signal_data.get('signal') in ('BUY', 'SELL'):
+        begin_execution_record(signal_data, multi_data['5m'], prompt_ms)
+    with tracer.span('execute_trade'):
+        try:
+            execute_trade(signal_data, multi_data['5m'])  # 使用5分钟数据作为主要参考
+        finally:
+            execution_recorder.end_decision()
+    if venue_futures:
+        with tracer.span('venues_wait'):
+            venue_executor.wait(venue_futures)
+    # 市价单此时一般已成交，直接结算
+    execution_recorder.poll(exchange, TRADE_CONFIG['symbol'])
+    refresh_risk_account()
+
+
+def trading_bot(bar_close_s=None):
+    """主交易机器人函数"""
+    global speculation_turn
+    started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    log.info("\n" + "=" * 60 + f"\n执行时间: {started_at}\n" + "=" * 60, extra=event('cycle', started_at=started_at))
+
+    runtime_stats['cycles'] += 1
+    with profiler.cycle(), tracer.cycle():
+        # 先结算之前订单的成交情况，已成交的入场挂单补上止盈止损
+        execution_recorder.poll(exchange, TRADE_CONFIG['symbol'])
+        protect_filled_entry()
+        if venue_executor is not None:
+            venue_executor.protect_pending()
+
+        # 1. 获取多周期K线数据
+        multi_data = get_multi_timeframe_data()
+        if not multi_data:
+            return
+        prompt_ms = execution_recorder.now_ms()
+        cycle_interval.observe(multi_data['5m']['all_data'])
+        profiler.watch(kline_frames={tf: data['all_data'] for tf, data in multi_data.items()},
+                       signal_history=signal_history, price_history=price_history)
+
+        # 显示各周期当前价格
+        for tf, data in multi_data.items():
+            log.info(f"{tf}周期BTC价格: ${data['price']:,.2f} (变化: {data['price_change']:+.2f}%)",
+                     extra=event('market', timeframe=tf, price=data['price'], price_change=data['price_change']))
+
+        # 2. 使用DeepSeek进行聪明钱策略分析（收盘前的推测结果核对通过时直接采用）
+        signal_data = None
+        if speculation.pending:
+            signal_data = speculation.resolve(multi_data['5m']['all_data'], position_context(), bar_close_s)
+            turn, speculation_turn = speculation_turn, None
+            if signal_data:
+                if turn is not None:
+                    commit_session_turn(turn)
+                record_signal(signal_data, started_at)
+        if signal_data is None:
+            signal_data = analyze_with_deepseek_multi_timeframe(multi_data)
+            if bar_close_s is not None:
+                speculation.record_decision(bar_close_s)
+        if not signal_data:
+            return
+
+        # 3. 执行交易
+        execute_decision(signal_data, multi_data, prompt_ms)
+
+    runtime_stats['cycles_ok'] += 1
+    runtime_stats['last_success_ts'] = time.time()
+
+
+def collect_metrics():
+    """组装metrics端点的指标（在HTTP线程里调用，只读内存中的统计）"""
+    now = time.time()
+    last_success = runtime_stats['last_success_ts']
+    metrics = [
+        metric('bot_uptime_seconds', 'gauge', "进程运行时长", now - runtime_stats['started_ts']),
+        metric('bot_cycles_total', 'counter', "交易周期执行次数", runtime_stats['cycles']),
+        metric('bot_cycles_succeeded_total', 'counter', "完整执行到交易环节的周期数", runtime_stats['cycles_ok']),
+        metric('bot_last_success_age_seconds', 'gauge', "距最近一次成功周期的秒数",
+               now - last_success if last_success else None),
+        metric('bot_llm_calls_total', 'counter', "LLM调用次数", token_stats['total_calls']),
+        metric('bot_llm_tokens_total', 'counter', "LLM消耗的token数", token_stats['total_tokens']),
+        metric('bot_llm_cost_total', 'counter', "LLM估算成本", token_stats['total_cost']),
+        metric('bot_cycle_interval_seconds', 'gauge', "当前分析间隔", cycle_interval.interval_s),
+        metric('bot_cycle_interval_changes_total', 'counter', "分析间隔调整次数", cycle_interval.changes),
+        metric('bot_llm_tokens_last_hour', 'gauge', "最近一小时LLM token用量", cycle_interval.tokens_last_hour()),
+        metric('bot_speculation_total', 'counter', "推测分析核对结果", samples=[
+            ({'result': 'hit'}, speculation.stats['hits']), ({'result': 'miss'}, speculation.stats['misses']),
+            ({'result': 'failed'}, speculation.stats['failed'])]),
+        metric('bot_speculation_saved_seconds_total', 'counter', "推测命中节省的LLM耗时",
+               speculation.stats['saved_s']),
+        metric('bot_close_to_decision_seconds_total', 'counter', "K线收盘到拿到决策的累计耗时",
+               speculation.stats['close_to_decision_s']),
+        metric('bot_close_to_decision_total', 'counter', "计入收盘到决策耗时的周期数",
+               speculation.stats['decisions']),
+        metric('bot_startup_seconds', 'gauge', "各启动阶段耗时",
+               samples=[({'phase': name}, seconds) for name, seconds in runtime_stats['startup'].items()]),
+    ]
+
+    # LLM缓存命中/未命中（启用录制回放缓存时）
+    # 只有RecordingClient有缓存统计；不能对LazyClient取属性，否则会在HTTP线程里创建客户端
+    cache_stats = None if isinstance(deepseek_client, LazyClient) else getattr(deepseek_client, 'stats', None)
+    if isinstance(cache_stats, dict):
+        metrics.append(metric('bot_llm_cache_requests_total', 'counter', "LLM缓存查询次数", samples=[
+            ({'result': 'hit'}, cache_stats['hits']), ({'result': 'miss'}, cache_stats['misses'])]))
+        metrics.append(metric('bot_llm_cache_saved_tokens_total', 'counter', "缓存命中节省的token数",
+                              cache_stats['saved_tokens']))
+
+    # 多模型分析：每个模型的调用、失败、解析失败、与最终信号一致的次数和累计延迟
+    if llm_ensemble is not None:
+        members = llm_ensemble.snapshot()
+        for name, field, help_text in (('calls', 'calls', "模型调用次数"), ('errors', 'errors', "模型请求失败次数"),
+                                       ('parse_failures', 'parse_failures', "模型回复无法解析的次数"),
+                                       ('agreed', 'agreed', "模型信号与最终信号一致的次数"),
+                                       ('latency_seconds', 'latency_s', "模型累计响应耗时")):
+            metrics.append(metric(f'bot_llm_model_{name}_total', 'counter', help_text,
+                                  samples=[({'model': model}, stats[field]) for model, stats in members.items()]))
+
+    # 对话模式：完整快照与增量两种请求的对比
+    if llm_session is not None:
+        session_stats = {kind: dict(stats) for kind, stats in llm_session.stats.items()}
+        for name, field, help_text in (('calls', 'calls', "对话模式请求次数"),
+                                       ('prompt_tokens', 'prompt_tokens', "对话模式输入token"),
+                                       ('uncached_prompt_tokens', 'uncached_prompt_tokens', "对话模式未命中前缀缓存的输入token"),
+                                       ('sent_chars', 'sent_chars', "对话模式新发送的字符数"),
+                                       ('latency_seconds', 'latency_s', "对话模式LLM累计耗时")):
+            metrics.append(metric(f'bot_llm_session_{name}_total', 'counter', help_text,
+                                  samples=[({'kind': kind}, stats[field]) for kind, stats in session_stats.items()]))
+
+    # 周期耗时和各阶段耗时（来自tracer的滚动窗口和累计值）
+    totals = tracer.totals_snapshot()
+    cycle = tracer.percentiles('trading_cycle')
+    if cycle:
+        count, total, _ = totals['trading_cycle']
+        metrics.append(summary('bot_cycle_duration_seconds', "交易周期耗时",
+                               {0.5: cycle['p50_ms'] / 1000, 0.95: cycle['p95_ms'] / 1000,
+                                0.99: cycle['p99_ms'] / 1000}, count, total))
+    stage_samples = []
+    for name, stats in tracer.summary().items():
+        if name != 'trading_cycle' and not name.startswith('exchange.'):
+            stage_samples += [({'stage': name, 'quantile': '0.5'}, stats['p50_ms'] / 1000),
+                              ({'stage': name, 'quantile': '0.95'}, stats['p95_ms'] / 1000)]
+    metrics.append(metric('bot_stage_duration_seconds', 'gauge', "各阶段耗时分位数（滚动窗口）",
+                          samples=stage_samples))
+
+    # 交易所请求按接口统计
+    endpoints = {name[len('exchange.'):]: values for name, values in totals.items() if name.startswith('exchange.')}
+    metrics.append(metric('bot_exchange_requests_total', 'counter', "交易所请求次数",
+                          samples=[({'endpoint': ep}, v[0]) for ep, v in sorted(endpoints.items())]))
+    metrics.append(metric('bot_exchange_errors_total', 'counter', "交易所请求失败次数",
+                          samples=[({'endpoint': ep}, v[2]) for ep, v in sorted(endpoints.items())]))
+    metrics.append(metric('bot_exchange_request_seconds_total', 'counter', "交易所请求累计耗时",
+                          samples=[({'endpoint': ep}, v[1]) for ep, v in sorted(endpoints.items())]))
+
+    # 限频调度：排队等待、被合并的读请求、交易所限频拒绝（额外交易所的带venue标签）
+    schedulers = [({}, request_scheduler)] if request_scheduler is not None else []
+    schedulers += [({'venue': name}, scheduler) for name, scheduler in venue_schedulers.items()]
+    if schedulers:
+        scheduled = [(dict(labels, endpoint=ep), v) for labels, scheduler in schedulers
+                     for ep, v in sorted(scheduler.snapshot().items())]
+        metrics.append(metric('bot_ratelimit_wait_seconds_total', 'counter', "限频排队累计等待",
+                              samples=[(labels, v['wait_s']) for labels, v in scheduled]))
+        metrics.append(metric('bot_ratelimit_delayed_requests_total', 'counter', "需要排队的请求数",
+                              samples=[(labels, v['delayed']) for labels, v in scheduled]))
+        metrics.append(metric('bot_ratelimit_max_wait_seconds', 'gauge', "单次最长排队等待",
+                              samples=[(labels, v['max_wait_s']) for labels, v in scheduled]))
+        metrics.append(metric('bot_coalesced_requests_total', 'counter', "与在途请求合并的读请求数",
+                              samples=[(labels, v['coalesced']) for labels, v in scheduled]))
+        metrics.append(metric('bot_rate_limited_total', 'counter', "被交易所限频拒绝的次数",
+                              samples=[(labels, v['rate_limited']) for labels, v in scheduled]))
+
+    # 止盈止损：设置次数（按模式），本地盯价的触发次数和行情推送状态；反应耗时见stop_reaction阶段分位数
+    metrics.append(metric('bot_protective_orders_total', 'counter', "设置止盈止损的次数",
+                          samples=[({'mode': mode}, protection.stats[mode]) for mode in ('native', 'local', 'fallback')]))
+    metrics.append(metric('bot_protective_cancel_failed_total', 'counter', "旧条件单未能撤销、暂缓替换止盈止损的次数",
+                          protection.stats['cancel_failed']))
+    metrics.append(metric('bot_local_stop_triggers_total', 'counter', "本地止盈止损触发次数",
+                          samples=[({'kind': kind}, count) for kind, count in protection.watcher.triggered.items()]))
+    feed = protection.feed
+    if feed is not None:
+        metrics.append(metric('bot_price_feed_age_seconds', 'gauge', "距最近一次行情推送的秒数",
+                              now - feed.last_tick_ms / 1000 if feed.last_tick_ms else None))
+        metrics.append(metric('bot_price_feed_ticks_total', 'counter', "收到的行情推送数", feed.ticks))
+
+    # 其他交易所的执行结果和信号到下单的累计延迟（分位数见 bot_stage_duration_seconds 的 venue.<名称>）
+    if venue_executor is not None:
+        venue_stats = venue_executor.snapshot()
+        metrics.append(metric('bot_venue_executions_total', 'counter', "各交易所执行信号的结果", samples=[
+            ({'venue': name, 'result': result}, s[key]) for name, s in venue_stats.items()
+            for result, key in (('executed', 'executions'), ('rejected', 'rejected'), ('failed', 'failed'),
+                                ('protection_failed', 'protection_failed'))]))
+        metrics.append(metric('bot_venue_orders_total', 'counter', "各交易所发送的订单数",
+                              samples=[({'venue': name}, s['orders']) for name, s in venue_stats.items()]))
+        metrics.append(metric('bot_venue_latency_seconds_total', 'counter', "各交易所信号到下单的累计延迟",
+                              samples=[({'venue': name}, s['latency_s']) for name, s in venue_stats.items()]))
+
+    # 长连接：按主机的请求数、新建连接数和握手耗时（分位数见 bot_stage_duration_seconds 的 http_connect.<主机>）
+    hosts = sorted(connection_stats.snapshot().items())
+    metrics.append(metric('bot_http_requests_total', 'counter', "HTTP请求数",
+                          samples=[({'host': host}, s['requests']) for host, s in hosts]))
+    metrics.append(metric('bot_http_connections_total', 'counter', "新建的HTTP连接数",
+                          samples=[({'host': host}, s['connects']) for host, s in hosts]))
+    metrics.append(metric('bot_http_connect_seconds_total', 'counter', "新建连接的累计握手耗时", samples=[
+        ({'host': host, 'phase': phase}, s[f'{phase}_s']) for host, s in hosts for phase in ('tcp', 'tls')]))
+    metrics.append(metric('bot_http_connect_max_seconds', 'gauge', "单次新建连接的最长耗时",
+                          samples=[({'host': host}, s['max_connect_s']) for host, s in hosts]))
+    if keepalive is not None:
+        metrics.append(metric('bot_http_keepalive_requests_total', 'counter', "保活/周期前预热请求（failed为失败次数）",
+                          samples=[({'target': name, 'kind': kind}, count)
+                                   for name, stats in keepalive.snapshot().items() for kind, count in stats.items()]))
+        metrics.append(metric('bot_http_keepalive_interval_seconds', 'gauge', "保活检查间隔（不需要时为空）",
+                              keepalive.ping_interval_s))
+
+    # 多交易对批量分析：批量请求和单独重试的请求数、交易对数、token与耗时
+    batch = batch_analyzer.snapshot()
+    if batch['batch']['requests']:
+        for name, field, help_text in (('requests', 'requests', "分析请求次数"), ('symbols', 'symbols', "分析的交易对数"),
+                                       ('tokens', 'tokens', "分析消耗的token数"),
+                                       ('latency_seconds', 'latency_s', "分析请求累计耗时"),
+                                       ('failed', 'failed', "没有得到有效信号的交易对数")):
+            metrics.append(metric(f'bot_llm_batch_{name}_total', 'counter', help_text,
+                                  samples=[({'mode': mode}, stats[field]) for mode, stats in batch.items()]))
+        metrics.append(metric('bot_llm_batch_rejections_total', 'counter', "批量回复中被拒的条目", samples=[
+            ({'reason': reason}, count) for reason, count in sorted(batch_analyzer.rejections.items())]))
+
+    # 下单前本地风控的检查/拒绝次数（按原因）和余额缓存年龄
+    risk = risk_engine.snapshot()
+    metrics.append(metric('bot_risk_checks_total', 'counter', "本地风控检查的订单数", risk['checks']))
+    metrics.append(metric('bot_risk_rejections_total', 'counter', "本地风控拒绝的订单数",
+                          samples=[({'reason': reason}, count) for reason, count in sorted(risk['rejections'].items())]))
+    metrics.append(metric('bot_risk_check_seconds_total', 'counter', "本地风控检查累计耗时", risk['check_s']))
+    metrics.append(metric('bot_risk_price_rounded_total', 'counter', "按最小变动单位取整的挂单价数", risk['price_rounded']))
+    metrics.append(metric('bot_risk_account_age_seconds', 'gauge', "风控余额缓存的年龄", risk['account_age_s']))
+
+    # 永续合约辅助数据的缓存年龄、过期状态和刷新结果
+    if derivatives_data is not None:
+        sources = derivatives_data.snapshot()
+        metrics.append(metric('bot_derivatives_age_seconds', 'gauge', "辅助数据距最近一次成功刷新的秒数",
+                              samples=[({'source': name}, s['age_s']) for name, s in sources.items()]))
+        metrics.append(metric('bot_derivatives_stale', 'gauge', "辅助数据是否过期",
+                              samples=[({'source': name}, int(s['stale'])) for name, s in sources.items()]))
+        metrics.append(metric('bot_derivatives_refresh_total', 'counter', "辅助数据刷新次数", samples=[
+            ({'source': name, 'result': result}, s[result]) for name, s in sources.items() for result in ('ok', 'failed')]))
+
+    # 本地盘口同步状态和主要特征
+    if TRADE_CONFIG['order_book']['enabled']:
+        book_stats = dict(order_book.stats)
+        metrics.append(metric('bot_order_book_synced', 'gauge', "本地盘口是否已同步", int(order_book.synced)))
+        metrics.append(metric('bot_order_book_age_seconds', 'gauge', "距盘口最近一次更新的秒数", order_book.age_s()))
+        metrics.append(metric('bot_order_book_messages_total', 'counter', "盘口快照/增量消息数", samples=[
+            ({'type': 'snapshot'}, book_stats['snapshots']), ({'type': 'update'}, book_stats['updates'])]))
+        metrics.append(metric('bot_order_book_resyncs_total', 'counter', "盘口失步次数", samples=[
+            ({'reason': 'gap'}, book_stats['gaps']), ({'reason': 'checksum'}, book_stats['checksum_failures'])]))
+        book = order_book.features()
+        if book is not None:
+            metrics.append(metric('bot_order_book_imbalance', 'gauge', "中间价附近盘口失衡", book['imbalance_band']))
+            metrics.append(metric('bot_order_book_spread_bps', 'gauge', "买卖价差（万分之）", book['spread_bps']))
+
+    # 最近一次查询到的持仓和挂单
+    pos = runtime_stats['position']
+    metrics.append(metric('bot_open_orders', 'gauge', "当前挂单数", runtime_stats['open_orders']))
+    metrics.append(metric('bot_position_contracts', 'gauge', "持仓张数，多为正空为负",
+                          (pos['size'] if pos['side'] == 'long' else -pos['size']) if pos else 0))
+    metrics.append(metric('bot_position_entry_price', 'gauge', "持仓均价", pos['entry_price'] if pos else None))
+    metrics.append(metric('bot_position_unrealized_pnl', 'gauge', "未实现盈亏", pos['unrealized_pnl'] if pos else 0))
+    return metrics
+
+
+def health_status():
+    """最近一次成功周期在stale_after_s以内视为健康；启动后第一个周期完成前按启动时间计算"""
+    stale_after = TRADE_CONFIG['metrics']['stale_after_s']
+    reference = runtime_stats['last_success_ts'] or runtime_stats['started_ts']
+    age = time.time() - reference
+    return age <= stale_after, {
+        'last_success_age_s': round(age, 1) if runtime_stats['last_success_ts'] else None,
+        'cycles': runtime_stats['cycles'],
+        'cycles_ok': runtime_stats['cycles_ok'],
+        'stale_after_s': stale_after,
+    }
+
+
+def load_markets():
+    """加载合约元数据（优先用磁盘快照）"""
+    config = TRADE_CONFIG['startup']
+    with startup.phase('markets') as fields:
+        try:
+            fields['source'] = load_markets_cached(
+                market_exchange, config['market_cache'].format(exchange=market_exchange.id),
+                config['market_cache_ttl_hours'], config['market_types'], symbols=[TRADE_CONFIG['symbol']])
+        except Exception as e:
+            # 交给后续第一次用到市场信息的请求再加载
+            fields['source'] = 'failed'
+            log.error(f"加载市场信息失败: {e}", extra=event('error'))
+
+
+def sleep_until(ts):
+    """按秒分段睡到指定时间，Ctrl+C能及时响应"""
+    while time.time() < ts:
+        time.sleep(min(1, max(0, ts - time.time())))
 
-    # 3. 执行交易
-    execute_trade(signal_data, multi_data['5m'])  # 使用5分钟数据作为主要参考
+
+def start_keepalive():
+    """交易所和LLM连接池的保活线程；录制回放模式不访问LLM服务"""
+    http_config = TRADE_CONFIG['http']
+    targets = list(keepalive_targets)
+    if TRADE_CONFIG['llm_cache']['mode'] not in ('replay', 'strict'):
+        targets.append(('deepseek', lambda: llm_http.pool.last_used, lambda: llm_http.head(DEEPSEEK_BASE_URL)))
+    return KeepAlive(targets, idle_timeout_s=http_config['idle_timeout_s'],
+                     prewarm_idle_s=http_config['prewarm_idle_s']).start()
 
 
 def main():
     """主函数"""
-    print("BTC/USDT OKX聪明钱策略自动交易机器人启动成功！")
+    global derivatives_data, venue_executor, keepalive, book_feed
+    imports_s = startup.elapsed()
+    setup_logging(**TRADE_CONFIG['logging'])
+    log.info("BTC/USDT OKX聪明钱策略自动交易机器人启动成功！", extra=event('system'))
+    startup.mark('imports', imports_s)
+    # 交易所设置是网络I/O，期间在后台导入第一个周期才用到的模块
+    prewarm(TRADE_CONFIG['startup']['prewarm'])
 
     if TRADE_CONFIG['test_mode']:
-        print("当前为模拟模式，不会真实下单")
+        log.info("当前为模拟模式，订单在本地模拟交易所撮合，不会真实下单", extra=event('system', test_mode=True))
     else:
-        print("实盘交易模式，请谨慎操作！")
+        log.info("实盘交易模式，请谨慎操作！", extra=event('system', test_mode=False))
+
+    if TRADE_CONFIG['profiling']['cycles'] > 0:
+        profiler.arm(TRADE_CONFIG['profiling']['cycles'])
+        log.info(f"将剖析接下来的 {TRADE_CONFIG['profiling']['cycles']} 个周期", extra=event('system'))
+    if profiler.install_signal(TRADE_CONFIG['profiling']['signal_cycles']):
+        log.info(f"发送 kill -USR1 {os.getpid()} 可剖析接下来的 {TRADE_CONFIG['profiling']['signal_cycles']} 个周期",
+                 extra=event('system', pid=os.getpid()))
 
-    print(f"主交易周期: {TRADE_CONFIG['timeframe']}")
-    print("已启用聪明钱策略分析、多周期K线数据和持仓跟踪功能")
-    print("分析周期: 5分钟、15分钟、1小时")
-    print("K线数据: 每个周期50根K线，分析最近20根")
-    print("策略重点: 成交量分析、支撑阻力位、聪明钱流向")
+    if TRADE_CONFIG['metrics']['enabled']:
+        try:
+            server = MetricsServer(collect_metrics, health_status, TRADE_CONFIG['metrics']['host'],
+                                   TRADE_CONFIG['metrics']['port']).start()
+            log.info(f"指标端点: http://{server.host}:{server.port}/metrics", extra=event('system', port=server.port))
+        except OSError as e:
+            log.error(f"指标端点启动失败: {e}", extra=event('error'))
+
+    log.info(f"主交易周期: {TRADE_CONFIG['timeframe']}\n"
+             "已启用聪明钱策略分析、多周期K线数据和持仓跟踪功能\n"
+             "分析周期: 5分钟、15分钟、1小时\n"
+             "K线数据: 每个周期50根K线，分析最近20根\n"
+             "策略重点: 成交量分析、支撑阻力位、聪明钱流向",
+             extra=event('system', timeframe=TRADE_CONFIG['timeframe']))
+
+    load_markets()
+    if market_exchange.markets:
+        risk_engine.load_market(market_exchange.markets.get(TRADE_CONFIG['symbol']), market_exchange.precisionMode)
 
     # 设置交易所
-    if not setup_exchange():
-        print("交易所初始化失败，程序退出")
+    with startup.phase('setup_exchange'):
+        ready = setup_exchange()
+    if not ready:
+        log.error("交易所初始化失败，程序退出", extra=event('error'))
+        shutdown_logging()
         return
 
+    # 止盈止损：接管上次运行遗留的条件单；本地盯价需要的行情推送在这里启动
+    protection_config = TRADE_CONFIG['protection']
+    protection.feed_factory = lambda: PriceFeed(
+        market_exchange.id, TRADE_CONFIG['symbol'], protection.watcher.on_price, market_data,
+        stream=protection_config['stream'], poll_interval_s=protection_config['poll_interval_s'],
+        stale_after_s=protection_config['stale_after_s'], markets=market_exchange.markets).start()
+    if protection.mode == 'native':
+        protection.adopt(exchange)
+    else:
+        protection.feed = protection.feed_factory()
+
+    if TRADE_CONFIG['venues']:
+        venues = []
+        with startup.phase('venues', count=len(TRADE_CONFIG['venues'])):
+            for config in TRADE_CONFIG['venues']:
+                try:
+                    venue = create_venue(config)
+                    venue.setup()
+                    venues.append(venue)
+                    log.info(f"已接入交易所 {venue.name}: {venue.symbol} x{venue.amount}",
+                             extra=event('system', venue=venue.name, symbol=venue.symbol))
+                except Exception as e:
+                    log.error(f"接入交易所 {config.get('name', config['exchange'])} 失败: {e}", extra=event('error'))
+        if venues:
+            venue_executor = VenueExecutor(venues, tracer)
+
+    if TRADE_CONFIG['derivatives_data']['enabled']:
+        sources = build_sources(market_data, TRADE_CONFIG['symbol'], TRADE_CONFIG['derivatives_data']['ttl_s'],
+                                TRADE_CONFIG['derivatives_data']['stale_multiple'])
+        derivatives_data = DerivativesData(sources)
+        with startup.phase('derivatives_data', sources=len(sources)):
+            derivatives_data.prime(timeout_s=3.0)
+        derivatives_data.start()
+
+    if TRADE_CONFIG['order_book']['enabled']:
+        book_feed = BookFeed(market_exchange.id, TRADE_CONFIG['symbol'], order_book, rest_exchange=market_data,
+                             markets=market_exchange.markets,
+                             record_path=TRADE_CONFIG['order_book']['record_path']).start()
+
+    if TRADE_CONFIG['http']['keepalive']:
+        keepalive = start_keepalive()
+        ping_interval = keepalive.size_to(cycle_interval.base_interval_s)
+        log.info(f"连接保活: 每{ping_interval:.0f}s检查一次空闲连接" if ping_interval
+                 else "连接保活: 周期间隔短于空闲超时，只在周期前预热", extra=event('system', ping_interval_s=ping_interval))
+    prewarm_lead_s = TRADE_CONFIG['http']['prewarm_lead_s']
+
+    adaptive = TRADE_CONFIG['adaptive_interval']['enabled']
+    if speculation.enabled:
+        log.info(f"推测分析: 收盘前{speculation.lead_s}s预先分析，收盘后{speculation.settle_s}s核对",
+                 extra=event('system'))
+    if adaptive:
+        log.info(f"执行频率: 自适应，基准{cycle_interval.base_interval_s}s，"
+                 f"范围{cycle_interval.min_interval_s}-{cycle_interval.max_interval_s}s", extra=event('system'))
     # 根据时间周期设置执行频率
-    if TRADE_CONFIG['timeframe'] == '5m':
+    elif speculation.enabled:
+        log.info(f"执行频率: 每{cycle_interval.base_interval_s}s一次，对齐K线收盘", extra=event('system'))
+    elif TRADE_CONFIG['timeframe'] == '5m':
         schedule.every(5).minutes.do(trading_bot)
-        print("执行频率: 每5分钟一次")
+        log.info("执行频率: 每5分钟一次", extra=event('system'))
     elif TRADE_CONFIG['timeframe'] == '1h':
         schedule.every().hour.at(":01").do(trading_bot)
-        print("执行频率: 每小时一次")
+        log.info("执行频率: 每小时一次", extra=event('system'))
     elif TRADE_CONFIG['timeframe'] == '15m':
         schedule.every(15).minutes.do(trading_bot)
-        print("执行频率: 每15分钟一次")
+        log.info("执行频率: 每15分钟一次", extra=event('system'))
     else:
         schedule.every(5).minutes.do(trading_bot)
-        print("执行频率: 每5分钟一次")
+        log.info("执行频率: 每5分钟一次", extra=event('system'))
 
     # 立即执行一次
-    trading_bot()
+    cycle_started = time.time()
+    with startup.phase('first_cycle'):
+        trading_bot()
+    startup.finish()
+    runtime_stats['startup'] = dict(startup.phases)
 
     # 循环执行
+    prewarmed_for = None
     try:
         while True:
-            schedule.run_pending()
-            time.sleep(1)
+            if adaptive or speculation.enabled:
+                interval = (cycle_interval.next_interval(position_open=bool(runtime_stats['position']))
+                            if adaptive else cycle_interval.base_interval_s)
+                next_run, speculate_at = speculation.plan(cycle_started + interval, interval)
+                if keepalive is not None:
+                    keepalive.size_to(interval)
+                if speculate_at is not None:
+                    sleep_until(speculate_at)
+                    speculate()
+                if keepalive is not None:
+                    sleep_until(next_run - prewarm_lead_s)
+                    keepalive.prewarm()
+                sleep_until(next_run)
+                cycle_started = time.time()
+                trading_bot(bar_close_s=next_run - speculation.settle_s if speculate_at is not None else None)
+            else:
+                # 距下一次计划执行不到prewarm_lead_s时预热一次
+                if keepalive is not None and schedule.idle_seconds() <= prewarm_lead_s \
+                        and prewarmed_for != schedule.next_run():
+                    prewarmed_for = schedule.next_run()
+                    keepalive.prewarm()
+                schedule.run_pending()
+                time.sleep(1)
     except KeyboardInterrupt:
+        log.info("程序已停止", extra=event('system'))
+        if book_feed is not None:
+            book_feed.stop()
+        # 先写完队列里的日志，再打印汇总，避免输出交错
+        shutdown_logging()
         print_token_summary()
-        print("程序已停止")
+        tracer.print_summary()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+"""
+永续合约辅助数据：资金费率、持仓量、多空比、主动买卖量
+
+这些数据对永续合约很有参考价值，但在周期里逐个同步请求会多出好几次串行的REST往返。
+DerivativesData 在后台线程里按各数据源自己的更新频率（TTL）并发刷新，分析阶段调用 get()
+只读内存里的缓存，从不等待网络:
+
+    funding        资金费率和下次结算时间         交易所约每分钟更新预测费率
+    open_interest  持仓量及最近一小时变化         5分钟粒度
+    long_short     账户多空比                   5分钟粒度
+    taker_volume   最近5分钟主动买入/卖出量（OKX） 5分钟粒度
+
+刷新失败时保留上一次的值并标记为过期（stale），超过TTL的stale_multiple倍没有成功刷新也算过期；
+提示词里会注明过期数据。
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from event_log import event, log
+
+
+class CachedSource:
+    def __init__(self, name, fetch, ttl_s, max_age_s):
+        self.name = name
+        self.fetch = fetch
+        self.ttl_s = ttl_s
+        self.max_age_s = max_age_s
+        self.value = None
+        self.fetched_at = None  # 最近一次成功刷新的时间
+        self.attempted_at = None
+        self.error = None  # 最近一次刷新的错误，成功后清空
+        self.in_flight = False
+        self.stats = {'ok': 0, 'failed': 0}
+
+
+class DerivativesData:
+    def __init__(self, sources, max_workers=4, tick_s=1.0, clock=time.time):
+        self.sources = {source.name: source for source in sources}
+        self.tick_s = tick_s
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='derivatives')
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='derivatives-refresh', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh_due()
+            self._stop.wait(self.tick_s)
+
+    def refresh_due(self):
+        """提交所有到期且没有在途请求的数据源，返回提交的Future列表"""
+        now = self.clock()
+        due = []
+        with self._lock:
+            for source in self.sources.values():
+                # 失败后同样等一个TTL再试，不在交易所出错时反复请求
+                if not source.in_flight and (source.attempted_at is None or now - source.attempted_at >= source.ttl_s):
+                    source.in_flight = True
+                    source.attempted_at = now
+                    due.append(source)
+        return [self._pool.submit(self._refresh, source) for source in due]
+
+    def _refresh(self, source):
+        try:
+            value = source.fetch()
+        except Exception as e:
+            with self._lock:
+                source.in_flight = False
+                source.error = str(e)
+                source.stats['failed'] += 1
+            log.warning(f"刷新{source.name}失败，继续使用上次的值: {e}", extra=event('market', source=source.name,
+                                                                           error=str(e)))
+            return
+        with self._lock:
+            source.in_flight = False
+            source.value = value
+            source.fetched_at = self.clock()
+            source.error = None
+            source.stats['ok'] += 1
+
+    def prime(self, timeout_s=5.0):
+        """启动时立即刷新一次，最多等待timeout_s（超时的数据源在后台继续）"""
+        deadline = time.monotonic() + timeout_s
+        for future in self.refresh_due():
+            try:
+                future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except Exception:
+                pass
+
+    def get(self):
+        """{名称: {'value', 'age_s', 'stale'}}，只包含至少成功刷新过一次的数据源；不做网络请求"""
+        now = self.clock()
+        result = {}
+        with self._lock:
+            for name, source in self.sources.items():
+                if source.fetched_at is None:
+                    continue
+                age = now - source.fetched_at
+                result[name] = {'value': source.value, 'age_s': age,
+                                'stale': source.error is not None or age > source.max_age_s}
+        return result
+
+    def snapshot(self):
+        """各数据源的刷新统计（metrics线程读取）"""
+        now = self.clock()
+        with self._lock:
+            return {name: {**source.stats, 'age_s': None if source.fetched_at is None else now - source.fetched_at,
+                           'stale': source.fetched_at is None or source.error is not None
+                           or now - source.fetched_at > source.max_age_s}
+                    for name, source in self.sources.items()}
+
+
+def _float(value):
+    return None if value is None else float(value)
+
+
+def build_sources(exchange, symbol, ttl_s, stale_multiple=3):
+    """按交易所支持的接口创建数据源；ttl_s为 {名称: 秒}，不在其中的数据源不启用"""
+    def fetch_funding():
+        rate = exchange.fetch_funding_rate(symbol)
+        return {'rate': _float(rate.get('fundingRate')),
+                'next_funding_ms': rate.get('fundingTimestamp') or rate.get('nextFundingTimestamp')}
+
+    def fetch_open_interest():
+        if exchange.has.get('fetchOpenInterestHistory'):
+            # 一次请求同时拿到当前值和一小时前的值
+            history = exchange.fetch_open_interest_history(symbol, '5m', limit=13)
+            current, first = history[-1], history[0]
+            amount = _float(current.get('openInterestAmount'))
+            base = _float(first.get('openInterestAmount'))
+            return {'amount': amount, 'value': _float(current.get('openInterestValue')),
+                    'change_1h_pct': (amount - base) / base * 100 if amount is not None and base else None}
+        current = exchange.fetch_open_interest(symbol)
+        return {'amount': _float(current.get('openInterestAmount')),
+                'value': _float(current.get('openInterestValue')), 'change_1h_pct': None}
+
+    def fetch_long_short():
+        latest = exchange.fetch_long_short_ratio_history(symbol, '5m', limit=1)[-1]
+        return {'ratio': _float(latest.get('longShortRatio'))}
+
+    def fetch_taker_volume():
+        # OKX: [[时间, 卖出量, 买入量]]，最新一条在最前
+        rows = exchange.public_get_rubik_stat_taker_volume_contract(
+            {'instId': exchange.market_id(symbol), 'period': '5m', 'limit': '1'})['data']
+        _, sell, buy = rows[0][:3]
+        sell, buy = float(sell), float(buy)
+        return {'buy': buy, 'sell': sell, 'buy_sell_ratio': buy / sell if sell else None}
+
+    candidates = {
+        'funding': (fetch_funding, exchange.has.get('fetchFundingRate')),
+        'open_interest': (fetch_open_interest, exchange.has.get('fetchOpenInterest')
+                          or exchange.has.get('fetchOpenInterestHistory')),
+        'long_short': (fetch_long_short, exchange.has.get('fetchLongShortRatioHistory')),
+        'taker_volume': (fetch_taker_volume, exchange.id == 'okx'),
+    }
+    return [CachedSource(name, fetch, ttl_s[name], ttl_s[name] * stale_multiple)
+            for name, (fetch, supported) in candidates.items() if supported and name in ttl_s]
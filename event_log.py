@@ -0,0 +1,124 @@
+"""
+结构化日志
+
+机器人的运行输出统一走 logging:
+- 调用方只把日志记录放进内存队列（QueueHandler），不做任何I/O，下单路径不会被慢的stdout管道或磁盘阻塞
+- 后台线程（QueueListener）负责写控制台（可读文本）和按大小轮转的JSON Lines文件
+- 每条记录带事件类型和结构化字段，便于事后筛选（如只看order/error事件）
+
+未调用setup_logging时（回测、基准测试导入机器人模块），INFO级日志直接丢弃，几乎没有开销。
+
+用法:
+    setup_logging(level='INFO', path='logs/bot.jsonl')
+    log.info("开多仓...", extra=event('order', side='buy', amount=0.1))
+"""
+import atexit
+import contextlib
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+EVENT_TYPES = {'system', 'cycle', 'market', 'llm', 'signal', 'order', 'position', 'error'}
+
+log = logging.getLogger('trading_bot')
+
+_listener = None
+_exc_formatter = logging.Formatter()
+
+
+def event(kind, **fields):
+    """构造logging的extra参数：事件类型和结构化字段"""
+    if kind not in EVENT_TYPES:
+        raise ValueError(f"未知的事件类型: {kind}")
+    return {'event': kind, 'fields': fields}
+
+
+class JsonFormatter(logging.Formatter):
+    """一条记录一行JSON: 时间、级别、事件类型、消息和结构化字段"""
+
+    def format(self, record):
+        line = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'event': getattr(record, 'event', 'system'),
+            'msg': record.getMessage(),
+        }
+        line.update(getattr(record, 'fields', None) or {})
+        if record.exc_text:
+            line['exc'] = record.exc_text
+        return json.dumps(line, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # 调用方线程里只合并消息参数、把异常堆栈转成文本（traceback对象不能跨线程保留）；
+        # 格式化和写入都留给后台线程
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level='INFO', console=True, path=None, max_bytes=10 * 1024 * 1024, backup_count=5):
+    """配置队列日志；可重复调用，会先停止之前的后台线程"""
+    global _listener
+    shutdown_logging()
+
+    handlers = []
+    if console:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        handlers.append(handler)
+    if path:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                       encoding='utf-8')
+        handler.setFormatter(JsonFormatter())
+        handlers.append(handler)
+
+    records = queue.SimpleQueue()  # 无界队列，put永不阻塞
+    log.handlers.clear()
+    log.addHandler(_QueueHandler(records))
+    log.setLevel(level)
+    log.propagate = False
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """写完队列中剩余的日志并关闭文件"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+
+def pending_records():
+    """队列中还没被后台线程写出的日志条数"""
+    return _listener.queue.qsize() if _listener is not None else 0
+
+
+@contextlib.contextmanager
+def silenced():
+    """临时关闭机器人日志（回测的静默模式）"""
+    saved = log.disabled
+    log.disabled = True
+    try:
+        yield
+    finally:
+        log.disabled = saved
+
+
+atexit.register(shutdown_logging)
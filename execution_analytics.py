@@ -0,0 +1,298 @@
+"""
+信号到成交的延迟与滑点统计
+
+每个BUY/SELL决策记录一条时间线:
+    bar_close_ms  最新一根已收盘5分钟K线的收盘时间
+    prompt_ms     行情数据取完、开始构建提示词的时间（此时价格为prompt_price）
+    decision_ms   LLM返回信号的时间（此时价格为decision_price）
+    submit_ms     下单请求发出时间（每个订单）
+    ack_ms        交易所返回订单号的时间
+    fill_ms       成交时间（交易所的lastTradeTimestamp，没有则取轮询到成交的时间）
+
+滑点按交易方向取正负，正数表示对我们不利（买得更贵/卖得更便宜），单位基点:
+    llm_drift_bps       prompt_price -> decision_price，LLM思考期间价格的不利变动
+    slippage_decision   decision_price -> 成交价，决策后的执行成本
+    slippage_llm        LLM给出的参考价(market_price/limit_price) -> 成交价
+    slippage_prompt     prompt_price -> 成交价，总成本
+
+决策的所有订单都有结果（成交/撤销/超时）后写入一行JSON（JSON Lines）。
+
+用法:
+    python execution_analytics.py                      # 按天汇总 logs/executions.jsonl
+    python execution_analytics.py --days 7 --json
+"""
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from event_log import event, log
+from tracing import percentile
+
+FINAL_STATUSES = {'closed', 'canceled', 'rejected', 'expired'}
+
+# 止盈止损单以自身限价成交，不属于决策的执行成本
+PROTECTIVE_TAGS = ('STOP', 'TP')
+
+
+def adverse_bps(side, reference, price):
+    """相对参考价的不利偏离（基点），买入价格更高/卖出价格更低为正"""
+    if not reference or price is None:
+        return None
+    diff = (price - reference) / reference * 10000
+    return round(diff if side == 'buy' else -diff, 3)
+
+
+class ExecutionRecorder:
+    """收集决策和订单时间线，轮询成交，写JSON Lines"""
+
+    def __init__(self, path=None, enabled=True, max_pending_hours=24, clock=time):
+        self.path = path
+        self.clock = clock  # 提供time()的对象，模拟运行时可换成SimClock
+        self.enabled = enabled
+        self.max_pending_hours = max_pending_hours
+        self.pending = []  # 已下单、等待成交结果的决策
+        self._current = None
+
+    def configure(self, enabled=None, path=None, max_pending_hours=None):
+        if enabled is not None:
+            self.enabled = enabled
+        if path is not None:
+            self.path = path or None
+        if max_pending_hours is not None:
+            self.max_pending_hours = max_pending_hours
+
+    def now_ms(self):
+        return int(self.clock.time() * 1000)
+
+    def begin_decision(self, signal_data, bar_close_ms, prompt_ms, prompt_price, decision_price):
+        if not self.enabled:
+            return
+        self._current = {
+            'signal': signal_data.get('signal'),
+            'confidence': signal_data.get('confidence'),
+            'bar_close_ms': bar_close_ms,
+            'prompt_ms': prompt_ms,
+            'decision_ms': self.now_ms(),
+            'prompt_price': prompt_price,
+            'decision_price': decision_price,
+            'llm_market_price': signal_data.get('market_price'),
+            'llm_limit_price': signal_data.get('limit_price'),
+            'orders': [],
+        }
+
+    def end_decision(self):
+        """决策执行完毕：有订单的进入等待成交队列"""
+        current, self._current = self._current, None
+        if current is not None and current['orders']:
+            self.pending.append(current)
+
+    def on_order(self, order, type, side, amount, price, params, submit_ms, ack_ms):
+        """TrackedExchange在下单返回后调用；不在决策内的订单（止盈止损等）忽略"""
+        if self._current is None:
+            return
+        params = params or {}
+        tag = params.get('tag', '')
+        if any(key in tag for key in PROTECTIVE_TAGS):
+            return
+        self._current['orders'].append({
+            'id': order.get('id'),
+            'type': type,
+            'side': side,
+            'amount': amount,
+            'price': price,
+            'role': 'close' if params.get('reduceOnly') else 'entry',
+            'submit_ms': submit_ms,
+            'ack_ms': ack_ms,
+            'exchange_ms': order.get('timestamp'),
+            'status': order.get('status') or 'open',
+            'filled': order.get('filled'),
+            'fill_price': order.get('average'),
+            'fill_ms': order.get('lastTradeTimestamp'),
+        })
+
+    def poll(self, exchange, symbol):
+        """查询未完结订单的成交情况，完结的决策写入文件"""
+        if not self.pending:
+            return
+        now = self.now_ms()
+        still_pending = []
+        for decision in self.pending:
+            for order in decision['orders']:
+                if order['status'] in FINAL_STATUSES:
+                    continue
+                try:
+                    self._update_order(order, exchange.fetch_order(order['id'], symbol), now)
+                except Exception as e:
+                    log.warning(f"查询订单 {order['id']} 成交情况失败: {e}", extra=event('error'))
+                if order['status'] not in FINAL_STATUSES and now - order['submit_ms'] > self.max_pending_hours * 3600_000:
+                    order['status'] = 'expired'
+            if all(order['status'] in FINAL_STATUSES for order in decision['orders']):
+                self._write(self.finalize(decision))
+            else:
+                still_pending.append(decision)
+        self.pending = still_pending
+
+    @staticmethod
+    def _update_order(order, fetched, now):
+        order['status'] = fetched.get('status') or order['status']
+        order['filled'] = fetched.get('filled')
+        if fetched.get('average'):
+            order['fill_price'] = fetched['average']
+        if order['filled'] and order['fill_ms'] is None:
+            order['fill_ms'] = fetched.get('lastTradeTimestamp') or now
+
+    @staticmethod
+    def finalize(decision):
+        """计算每个订单的延迟和滑点"""
+        for order in decision['orders']:
+            side, fill = order['side'], order['fill_price'] if order['filled'] else None
+            llm_reference = decision['llm_market_price'] if order['type'] == 'market' else decision['llm_limit_price']
+            order.update({
+                'decision_to_submit_ms': order['submit_ms'] - decision['decision_ms'],
+                'submit_to_ack_ms': order['ack_ms'] - order['submit_ms'],
+                'submit_to_fill_ms': order['fill_ms'] - order['submit_ms'] if fill else None,
+                'bar_to_fill_ms': order['fill_ms'] - decision['bar_close_ms'] if fill else None,
+                'slippage_decision_bps': adverse_bps(side, decision['decision_price'], fill),
+                'slippage_llm_bps': adverse_bps(side, llm_reference, fill),
+                'slippage_prompt_bps': adverse_bps(side, decision['prompt_price'], fill),
+            })
+        entry_side = 'buy' if decision['signal'] == 'BUY' else 'sell'
+        decision.update({
+            'type': 'decision',
+            'bar_to_decision_ms': decision['decision_ms'] - decision['bar_close_ms'],
+            'llm_ms': decision['decision_ms'] - decision['prompt_ms'],
+            'llm_drift_bps': adverse_bps(entry_side, decision['prompt_price'], decision['decision_price']),
+        })
+        return decision
+
+    def _write(self, line):
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(line, ensure_ascii=False, separators=(',', ':')) + "\n")
+        except OSError as e:
+            log.warning(f"写入成交统计失败: {e}", extra=event('error'))
+
+
+class TrackedExchange:
+    """拦截下单接口，把下单/回报时间和订单号记到当前决策上，其余接口透传"""
+
+    def __init__(self, exchange, recorder):
+        self._exchange = exchange
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._exchange, name)
+
+    def _submit(self, method, type, side, amount, price, params):
+        submit_ms = self._recorder.now_ms()
+        order = method()
+        self._recorder.on_order(order, type, side, amount, price, params, submit_ms, self._recorder.now_ms())
+        return order
+
+    def create_order(self, symbol, type, side, amount, price=None, params=None):
+        return self._submit(lambda: self._exchange.create_order(symbol, type, side, amount, price, params),
+                            type, side, amount, price, params)
+
+    def create_limit_order(self, symbol, side, amount, price, params=None):
+        return self._submit(lambda: self._exchange.create_limit_order(symbol, side, amount, price, params=params),
+                            'limit', side, amount, price, params)
+
+    def create_market_order(self, symbol, side, amount, price=None, params=None):
+        return self._submit(lambda: self._exchange.create_market_order(symbol, side, amount, price, params=params),
+                            'market', side, amount, None, params)
+
+
+# 全局默认记录器，由机器人按TRADE_CONFIG['execution_analytics']配置
+recorder = ExecutionRecorder()
+
+
+def load_records(path):
+    records = []
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    return records
+
+
+def _stats(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return {'n': len(values), 'mean': sum(values) / len(values), 'p50': percentile(values, 0.5),
+            'p95': percentile(values, 0.95)}
+
+
+def daily_report(records):
+    """按决策日期（UTC）汇总延迟和滑点"""
+    days = defaultdict(list)
+    for record in records:
+        day = datetime.fromtimestamp(record['decision_ms'] / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+        days[day].append(record)
+
+    report = {}
+    for day in sorted(days):
+        decisions = days[day]
+        orders = [order for d in decisions for order in d['orders']]
+        filled = [order for order in orders if order['filled']]
+        report[day] = {
+            'decisions': len(decisions),
+            'orders': len(orders),
+            'filled': len(filled),
+            'bar_to_decision_ms': _stats(d['bar_to_decision_ms'] for d in decisions),
+            'llm_ms': _stats(d['llm_ms'] for d in decisions),
+            'decision_to_submit_ms': _stats(o['decision_to_submit_ms'] for o in orders),
+            'submit_to_ack_ms': _stats(o['submit_to_ack_ms'] for o in orders),
+            'submit_to_fill_market_ms': _stats(o['submit_to_fill_ms'] for o in filled if o['type'] == 'market'),
+            'bar_to_fill_ms': _stats(o['bar_to_fill_ms'] for o in filled),
+            'llm_drift_bps': _stats(d['llm_drift_bps'] for d in decisions),
+            'slippage_decision_bps': _stats(o['slippage_decision_bps'] for o in filled),
+            'slippage_llm_bps': _stats(o['slippage_llm_bps'] for o in filled),
+            'slippage_prompt_bps': _stats(o['slippage_prompt_bps'] for o in filled),
+        }
+    return report
+
+
+def print_report(report):
+    if not report:
+        print("没有成交统计记录")
+        return
+    for day, row in report.items():
+        print("\n" + "=" * 60)
+        print(f"{day}  决策 {row['decisions']}  订单 {row['orders']}  成交 {row['filled']}")
+        print("=" * 60)
+        print(f"{'指标':<28}{'样本':>6}{'均值':>12}{'p50':>12}{'p95':>12}")
+        for name, stats in row.items():
+            if isinstance(stats, dict):
+                print(f"{name:<28}{stats['n']:>6}{stats['mean']:>12.1f}{stats['p50']:>12.1f}{stats['p95']:>12.1f}")
+            elif stats is None:
+                print(f"{name:<28}{0:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="信号到成交的延迟与滑点日报")
+    parser.add_argument('--path', default='logs/executions.jsonl')
+    parser.add_argument('--days', type=int, help="只看最近N天")
+    parser.add_argument('--json', action='store_true', help="输出JSON")
+    args = parser.parse_args()
+
+    report = daily_report(load_records(args.path))
+    if args.days:
+        report = dict(list(report.items())[-args.days:])
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+长连接HTTP传输层
+
+ccxt（requests.Session）和OpenAI客户端（httpx）默认各自维护连接，5分钟一个周期时两次周期之间的空闲
+往往超过服务器或中间NAT的空闲超时，连接被悄悄关闭，下一个周期里最敏感的那几个请求要重新做DNS、TCP和TLS握手。
+两个库的HTTP栈不同，无法共用同一个连接池，这里给它们装上同一套配置和统计:
+
+    ConnectionStats     按主机统计请求数、新建连接数和DNS+TCP/TLS握手耗时（tracer中的 http_connect.<主机>）
+    mount_pool          给ccxt的requests.Session挂上可配置大小、带TCP keepalive和握手计时的连接池
+    create_http_client  给OpenAI客户端的httpx.Client：连接数上限、空闲连接保留时间，同样按主机计时
+    KeepAlive           周期间隔长于服务器空闲超时时，把周期间隔均分成若干段，每段末尾对空闲的连接池发一个轻量请求；
+                        prewarm() 在计划的周期开始前几秒再检查一次，周期里的第一个请求不用重新握手
+
+握手只在新建连接时发生，请求数减去新建连接数就是复用的次数。
+"""
+import math
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from event_log import event, log
+
+
+class ConnectionStats:
+    def __init__(self, tracer=None):
+        self.tracer = tracer
+        self.hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        stats = self.hosts.get(host)
+        if stats is None:
+            stats = self.hosts[host] = {'requests': 0, 'connects': 0, 'tcp_s': 0.0, 'tls_s': 0.0, 'max_connect_s': 0.0}
+        return stats
+
+    def record_request(self, host):
+        with self._lock:
+            self._host(host)['requests'] += 1
+
+    def record_connect(self, host, started, tcp_s, tls_s=0.0):
+        """新建一个连接：DNS+TCP耗时和TLS握手耗时（秒），started为perf_counter时刻"""
+        with self._lock:
+            stats = self._host(host)
+            stats['connects'] += 1
+            stats['tcp_s'] += tcp_s
+            stats['tls_s'] += tls_s
+            stats['max_connect_s'] = max(stats['max_connect_s'], tcp_s + tls_s)
+        if self.tracer is not None:
+            self.tracer.record(f'http_connect.{host}', started, tcp_s + tls_s)
+
+    def snapshot(self):
+        with self._lock:
+            return {host: dict(stats) for host, stats in self.hosts.items()}
+
+
+connection_stats = ConnectionStats()
+
+
+# ---- requests / urllib3（ccxt同步版） ----
+
+class _TimedConnectionMixin:
+    def _new_conn(self):
+        # DNS解析和TCP连接
+        started = time.perf_counter()
+        sock = super()._new_conn()
+        self._tcp_s = time.perf_counter() - started
+        return sock
+
+    def connect(self):
+        self._tcp_s = 0.0
+        started = time.perf_counter()
+        super().connect()
+        tls_s = time.perf_counter() - started - self._tcp_s if isinstance(self, _TimedHTTPSConnection) else 0.0
+        connection_stats.record_connect(self.host, started, self._tcp_s, max(tls_s, 0.0))
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, urllib3.connection.HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, urllib3.connection.HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class PooledAdapter(HTTPAdapter):
+    """按主机缓存连接池，新建连接计时；last_used为最近一次请求的monotonic时刻"""
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, tcp_keepalive=True):
+        self.tcp_keepalive = tcp_keepalive
+        self.last_used = 0.0
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self.tcp_keepalive:
+            # TCP层保活探测，NAT和防火墙不会因为空闲丢掉连接表项
+            pool_kwargs['socket_options'] = urllib3.connection.HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _TimedHTTPConnectionPool,
+                                                   'https': _TimedHTTPSConnectionPool}
+
+    def send(self, request, **kwargs):
+        self.last_used = time.monotonic()
+        connection_stats.record_request(urlparse(request.url).hostname)
+        return super().send(request, **kwargs)
+
+
+def mount_pool(session, pool_connections=10, pool_maxsize=10, tcp_keepalive=True):
+    """给requests.Session（如ccxt交易所的exchange.session）换上计时的连接池，返回适配器"""
+    adapter = PooledAdapter(pool_connections, pool_maxsize, tcp_keepalive)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return adapter
+
+
+# ---- httpx（OpenAI客户端） ----
+
+class _ConnectTrace:
+    """httpcore的trace回调：新建连接时依次触发 connect_tcp 和 start_tls 事件"""
+
+    def __init__(self, host):
+        self.host = host
+        self.started = None
+        self.tcp_s = 0.0
+
+    def __call__(self, name, info):
+        now = time.perf_counter()
+        if name == 'connection.connect_tcp.started':
+            self.started = now
+        elif name == 'connection.connect_tcp.complete' and self.started is not None:
+            self.tcp_s = now - self.started
+        elif name == 'connection.start_tls.complete' and self.started is not None:
+            connection_stats.record_connect(self.host, self.started, self.tcp_s, now - self.started - self.tcp_s)
+            self.started = None
+
+
+def create_http_client(max_connections=10, max_keepalive_connections=5, keepalive_expiry_s=300.0, timeout_s=600.0,
+                       connect_timeout_s=5.0):
+    """OpenAI客户端共用的httpx.Client；keepalive_expiry_s为本地保留空闲连接的时间，超时默认与openai相同"""
+    import httpx
+
+    class TimedTransport(httpx.HTTPTransport):
+        last_used = 0.0
+
+        def handle_request(self, request):
+            self.last_used = time.monotonic()
+            host = request.url.host
+            connection_stats.record_request(host)
+            request.extensions = {**request.extensions, 'trace': _ConnectTrace(host)}
+            return super().handle_request(request)
+
+    transport = TimedTransport(limits=httpx.Limits(max_connections=max_connections,
+                                                   max_keepalive_connections=max_keepalive_connections,
+                                                   keepalive_expiry=keepalive_expiry_s))
+    client = httpx.Client(transport=transport, timeout=httpx.Timeout(timeout_s, connect=connect_timeout_s))
+    client.pool = transport  # pool.last_used为最近一次请求的monotonic时刻
+    return client
+
+
+# ---- 保活和预热 ----
+
+class KeepAlive:
+    """
+    targets: [(名称, last_used, ping)]，last_used() 返回连接池最近一次请求的monotonic时刻，ping() 发一个轻量请求
+    （响应内容不重要，只要连接被使用）。只有空闲超过ping间隔的连接池才会被ping，周期内和其他线程的请求都算作活动。
+    """
+
+    def __init__(self, targets, idle_timeout_s=60.0, margin=0.8, prewarm_idle_s=15.0):
+        self.targets = list(targets)
+        self.idle_timeout_s = idle_timeout_s  # 服务器/NAT关闭空闲连接的时间（取各主机中最短的）
+        self.margin = margin
+        self.prewarm_idle_s = prewarm_idle_s
+        self.ping_interval_s = None
+        self.stats = {name: {'ping': 0, 'prewarm': 0, 'failed': 0} for name, _, _ in self.targets}
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=max(len(self.targets), 1), thread_name_prefix='keepalive')
+
+    def size_to(self, cycle_interval_s):
+        """
+        按周期间隔确定ping间隔：间隔短于空闲超时时周期本身就能保持连接，不需要ping；
+        否则把周期间隔均分成若干段，每段都短于空闲超时
+        """
+        limit = self.idle_timeout_s * self.margin
+        if cycle_interval_s <= limit:
+            self.ping_interval_s = None
+        else:
+            self.ping_interval_s = cycle_interval_s / math.ceil(cycle_interval_s / limit)
+        return self.ping_interval_s
+
+    def start(self):
+        threading.Thread(target=self._run, name='keepalive', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(1.0):
+            if self.ping_interval_s is not None:
+                self._ping_idle(self.ping_interval_s)
+
+    def prewarm(self):
+        """计划的周期开始前调用：空闲较久的连接池先发一个请求，确保连接可用（不阻塞调用方）"""
+        return self._ping_idle(self.prewarm_idle_s, prewarm=True)
+
+    def _ping_idle(self, idle_s, prewarm=False):
+        now = time.monotonic()
+        submitted = 0
+        for name, last_used, ping in self.targets:
+            if now - last_used() < idle_s:
+                continue
+            with self._lock:
+                if name in self._in_flight:
+                    continue
+                self._in_flight.add(name)
+            self._pool.submit(self._ping, name, ping, prewarm)
+            submitted += 1
+        return submitted
+
+    def _ping(self, name, ping, prewarm):
+        try:
+            ping()
+            self.stats[name]['prewarm' if prewarm else 'ping'] += 1
+        except Exception as e:
+            self.stats[name]['failed'] += 1
+            log.warning(f"连接保活请求失败（{name}）: {e}", extra=event('error', target=name))
+        finally:
+            with self._lock:
+                self._in_flight.discard(name)
+
+    def snapshot(self):
+        return {name: dict(stats) for name, stats in self.stats.items()}
@@ -0,0 +1,144 @@
+"""
+LLM请求录制/回放缓存
+
+包装OpenAI兼容客户端，对 chat.completions.create 的模型、消息和参数做内容哈希，
+把回复内容和token用量追加写入 responses.jsonl（只存必要字段，不存整个响应对象）。
+
+模式:
+    record  录制穿透：命中直接返回，未命中请求模型并写入缓存
+    replay  只读回放：命中直接返回，未命中请求模型但不写入（共享的只读缓存）
+    strict  未命中即失败：命中直接返回，未命中抛出LLMCacheMiss，保证零网络（回测/CI）
+
+用法:
+    deepseek_client = RecordingClient(deepseek_client, 'llm_cache', mode='record')
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+
+MODES = ('record', 'replay', 'strict')
+
+# 不影响模型输出的请求参数，不参与哈希
+NON_SEMANTIC_PARAMS = {'stream', 'stream_options', 'timeout', 'extra_headers', 'extra_query', 'extra_body', 'user'}
+
+
+class LLMCacheMiss(Exception):
+    """strict模式下缓存未命中"""
+
+
+def request_key(kwargs):
+    """对请求内容做规范化哈希（键排序、紧凑JSON）"""
+    payload = {k: v for k, v in kwargs.items() if k not in NON_SEMANTIC_PARAMS}
+    canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _usage_dict(usage):
+    """token用量的数值字段，连同嵌套的明细（prompt_tokens_details.cached_tokens等，前缀缓存统计要用）"""
+    if usage is None:
+        return None
+    fields = usage if isinstance(usage, dict) else usage.model_dump() if hasattr(usage, 'model_dump') else vars(usage)
+    result = {}
+    for k, v in fields.items():
+        if isinstance(v, (int, float)):
+            result[k] = v
+        elif isinstance(v, dict) or hasattr(v, 'model_dump') or hasattr(v, '__dict__'):
+            nested = _usage_dict(v)
+            if nested:
+                result[k] = nested
+    return result
+
+
+def _namespace(fields):
+    return SimpleNamespace(**{k: _namespace(v) if isinstance(v, dict) else v for k, v in fields.items()})
+
+
+def _to_response(entry):
+    """把缓存记录还原成与OpenAI响应同样可访问的对象"""
+    message = SimpleNamespace(role='assistant', content=entry['content'])
+    choice = SimpleNamespace(index=0, message=message, finish_reason=entry.get('finish_reason'))
+    usage = _namespace(entry['usage']) if entry.get('usage') else None
+    return SimpleNamespace(id=f"cache-{entry['key'][:12]}", model=entry.get('model'), choices=[choice],
+                           usage=usage, cached=True)
+
+
+class _Completions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        return self._owner._create(kwargs)
+
+
+class RecordingClient:
+    """对外暴露 .chat.completions.create，行为与原客户端一致"""
+
+    def __init__(self, client, cache_dir='llm_cache', mode='record'):
+        if mode not in MODES:
+            raise ValueError(f"未知的缓存模式: {mode}，可选 {MODES}")
+        self.client = client
+        self.mode = mode
+        self.path = os.path.join(cache_dir, 'responses.jsonl')
+        self.entries = {}
+        self.stats = {'hits': 0, 'misses': 0, 'recorded': 0, 'saved_tokens': 0}
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+        os.makedirs(cache_dir, exist_ok=True)
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry['key']] = entry
+
+    def __getattr__(self, name):
+        # 其他接口（models等）透传给原客户端
+        return getattr(self.client, name)
+
+    def _create(self, kwargs):
+        if kwargs.get('stream'):
+            # 流式响应无法直接回放，按非流式录制
+            kwargs = {k: v for k, v in kwargs.items() if k != 'stream_options'}
+            kwargs['stream'] = False
+        key = request_key(kwargs)
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.stats['hits'] += 1
+            self.stats['saved_tokens'] += (entry.get('usage') or {}).get('total_tokens', 0)
+            return _to_response(entry)
+
+        self.stats['misses'] += 1
+        if self.mode == 'strict':
+            raise LLMCacheMiss(f"LLM缓存未命中: {key[:12]} (model={kwargs.get('model')})")
+
+        started = time.time()
+        response = self.client.chat.completions.create(**kwargs)
+        if self.mode == 'record':
+            choice = response.choices[0]
+            entry = {
+                'key': key,
+                'model': getattr(response, 'model', kwargs.get('model')),
+                'content': choice.message.content,
+                'finish_reason': getattr(choice, 'finish_reason', None),
+                'usage': _usage_dict(getattr(response, 'usage', None)),
+                'latency_s': round(time.time() - started, 3),
+                'recorded_at': int(started),
+            }
+            with self._lock:
+                self.entries[key] = entry
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n")
+            self.stats['recorded'] += 1
+        return response
+
+    def print_stats(self):
+        total = self.stats['hits'] + self.stats['misses']
+        hit_rate = self.stats['hits'] / total * 100 if total else 0.0
+        print(f"LLM缓存({self.mode}): 命中 {self.stats['hits']} / 未命中 {self.stats['misses']} "
+              f"(命中率 {hit_rate:.1f}%), 新录制 {self.stats['recorded']}, 节省 {self.stats['saved_tokens']} tokens")
@@ -0,0 +1,186 @@
+"""
+多模型并行分析
+
+同一份提示词并发发给多个OpenAI兼容的模型（或同一模型的不同temperature），按截止时间合并:
+
+    first_valid  截止时间内第一个能解析出信号的回复直接采用，其余回复到达后只计入统计
+    vote         截止时间内收齐的有效回复按signal多数表决（票数不足min_votes或平票时HOLD），
+                 采用得票方中信心最高的那份回复
+    merge        先按vote确定signal，再对得票方的价格字段（挂单/市价/止损/止盈）按信心加权平均
+
+单个模型超时、报错或返回无法解析的内容不会拖垮整个周期。每个模型的调用次数、失败/解析失败次数、
+延迟（tracer中的 llm_model.<名称>）以及与最终信号一致的次数都有统计。
+"""
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from event_log import event, log
+
+MODES = ('first_valid', 'vote', 'merge')
+CONFIDENCE_WEIGHTS = {'HIGH': 3.0, 'MEDIUM': 2.0, 'LOW': 1.0}
+PRICE_FIELDS = ('limit_price', 'market_price', 'stop_loss', 'take_profit')
+
+
+class EnsembleMember:
+    """一个参与分析的模型；client为OpenAI兼容客户端"""
+
+    def __init__(self, name, client, model, temperature=None, weight=1.0):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.temperature = temperature
+        self.weight = weight
+        self.stats = {'calls': 0, 'errors': 0, 'parse_failures': 0, 'late': 0, 'agreed': 0, 'latency_s': 0.0}
+
+    def complete(self, messages):
+        kwargs = {'model': self.model, 'messages': messages, 'stream': False}
+        if self.temperature is not None:
+            kwargs['temperature'] = self.temperature
+        response = self.client.chat.completions.create(**kwargs)
+        return response.choices[0].message.content, getattr(response, 'usage', None)
+
+
+def _confidence(signal_data):
+    return CONFIDENCE_WEIGHTS.get(str(signal_data.get('confidence', '')).upper(), 1.0)
+
+
+def _price(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ModelEnsemble:
+    """
+    parse(回复内容) 返回信号字典或None；on_usage(成员名, usage) 在每个回复到达时调用
+    （包括截止之后才到的回复，它们同样消耗了token）
+    """
+
+    def __init__(self, members, parse, mode='vote', deadline_s=20.0, min_votes=2, on_usage=None, tracer=None):
+        if mode not in MODES:
+            raise ValueError(f"未知的合并方式: {mode}，可选 {'/'.join(MODES)}")
+        if not members:
+            raise ValueError("至少需要一个模型")
+        self.members = members
+        self.parse = parse
+        self.mode = mode
+        self.deadline_s = deadline_s
+        self.min_votes = min(min_votes, len(members))
+        self.on_usage = on_usage
+        self.tracer = tracer
+        self.decisions = 0
+        self.no_decision = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=len(members) * 2, thread_name_prefix='llm-ensemble')
+
+    def _run(self, member, messages, round_state):
+        started = time.perf_counter()
+        try:
+            content, usage = member.complete(messages)
+        except Exception as e:
+            with self._lock:
+                member.stats['calls'] += 1
+                member.stats['errors'] += 1
+            log.warning(f"模型 {member.name} 请求失败: {e}", extra=event('llm', model=member.name, error=str(e)))
+            return member, None
+        duration = time.perf_counter() - started
+        if self.tracer is not None:
+            self.tracer.record(f'llm_model.{member.name}', started, duration)
+
+        signal_data = self.parse(content) if content else None
+        with self._lock:
+            member.stats['calls'] += 1
+            member.stats['latency_s'] += duration
+            if signal_data is None:
+                member.stats['parse_failures'] += 1
+            if round_state['decided'] is not None:
+                # 决策已经做出（first_valid或超过截止时间），只补记是否与决策一致
+                member.stats['late'] += 1
+                if signal_data is not None and signal_data.get('signal') == round_state['decided']:
+                    member.stats['agreed'] += 1
+            if usage is not None and self.on_usage is not None:
+                self.on_usage(member.name, usage)
+        return member, signal_data
+
+    def ask(self, messages):
+        """并发请求所有模型，按合并方式返回信号字典；没有可用回复时返回None"""
+        round_state = {'decided': None}
+        futures = {self._pool.submit(self._run, member, messages, round_state) for member in self.members}
+        deadline = time.monotonic() + self.deadline_s
+        answers = []  # [(成员, 信号)]
+        pending = futures
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                member, signal_data = future.result()
+                if signal_data is not None:
+                    answers.append((member, signal_data))
+            if self.mode == 'first_valid' and answers:
+                break
+
+        with self._lock:
+            result, votes = self._combine(answers)
+            round_state['decided'] = result.get('signal') if result else 'NONE'
+            for member, signal_data in answers:
+                if result is not None and signal_data.get('signal') == result.get('signal'):
+                    member.stats['agreed'] += 1
+            if result is None:
+                self.no_decision += 1
+            else:
+                self.decisions += 1
+
+        responded = {member.name: signal_data.get('signal') for member, signal_data in answers}
+        missing = [m.name for m in self.members if m.name not in responded]
+        log.info(f"多模型分析({self.mode}): {responded}"
+                 + (f"，未及时返回 {missing}" if missing else "")
+                 + f" -> {result.get('signal') if result else '无有效结果'}",
+                 extra=event('llm', mode=self.mode, votes=votes, answers=responded, missing=missing,
+                             signal=result.get('signal') if result else None))
+        return result
+
+    def _combine(self, answers):
+        """返回 (信号字典或None, {signal: 票数})"""
+        if not answers:
+            return None, {}
+        votes = Counter(signal_data.get('signal') for _, signal_data in answers)
+        if self.mode == 'first_valid':
+            return dict(answers[0][1]), dict(votes)
+
+        ranked = votes.most_common()
+        top_signal, top_votes = ranked[0]
+        tie = len(ranked) > 1 and ranked[1][1] == top_votes
+        if tie or top_votes < self.min_votes:
+            # 意见分歧或有效票不足时不开新仓
+            base = dict(max((s for _, s in answers), key=_confidence))
+            base.update(signal='HOLD', reason=f"多模型意见不一致 {dict(votes)}，观望；{base.get('reason', '')}")
+            return base, dict(votes)
+
+        winners = [(member, s) for member, s in answers if s.get('signal') == top_signal]
+        base = dict(max((s for _, s in winners), key=_confidence))
+        if self.mode == 'merge':
+            for field in PRICE_FIELDS:
+                weighted = [(_price(s.get(field)), _confidence(s) * member.weight) for member, s in winners]
+                weighted = [(p, w) for p, w in weighted if p is not None]
+                if weighted:
+                    base[field] = round(sum(p * w for p, w in weighted) / sum(w for _, w in weighted), 2)
+        return base, dict(votes)
+
+    def snapshot(self):
+        """各模型统计的副本（metrics线程读取）"""
+        with self._lock:
+            return {member.name: dict(member.stats) for member in self.members}
+
+    def print_stats(self):
+        for name, stats in self.snapshot().items():
+            calls = stats['calls'] or 1
+            answered = stats['calls'] - stats['errors'] - stats['parse_failures']
+            print(f"  {name}: 调用 {stats['calls']}, 失败 {stats['errors']}, 解析失败 {stats['parse_failures']} "
+                  f"({stats['parse_failures'] / calls:.0%}), 超时后到达 {stats['late']}, "
+                  f"平均延迟 {stats['latency_s'] / max(stats['calls'] - stats['errors'], 1):.1f}s, "
+                  f"与最终信号一致 {stats['agreed']}/{max(answered, 0)}")
@@ -0,0 +1,94 @@
+"""
+增量上下文的对话模式
+
+完整模式每个周期都重新发送三个周期共60根K线的文本，而两次分析之间通常只多了一根5分钟K线
+（偶尔多一根15分钟/1小时K线）。对话模式与模型保持多轮上下文:
+
+    锚定  第一轮（以及每reanchor_every轮、上下文超过max_context_chars、请求或解析失败之后）发送完整快照
+    增量  之后每轮只追加新K线、上一根未收盘K线的最终值、指标变化和持仓/挂单变化
+
+接口本身无状态，每次请求仍要带上整段对话；收益来自服务端的前缀缓存（DeepSeek的
+prompt_cache_hit_tokens、OpenAI的cached_tokens）：对话前缀不变，只有新追加的内容需要重新处理。
+完整模式的K线窗口每轮都在移动，前缀几乎无法命中缓存。
+历史里的模型回复只保留信号字段的紧凑JSON，控制上下文增长。
+
+按模式（full/delta）分别统计调用次数、输入token、未命中缓存的输入token、新发送的字符数和LLM耗时。
+"""
+import json
+
+SIGNAL_FIELDS = ('signal', 'confidence', 'limit_price', 'market_price', 'stop_loss', 'take_profit', 'reason')
+
+
+def cached_prompt_tokens(usage):
+    """从usage中取命中前缀缓存的输入token数（兼容DeepSeek与OpenAI的字段）"""
+    hit = getattr(usage, 'prompt_cache_hit_tokens', None)
+    if hit is None:
+        details = getattr(usage, 'prompt_tokens_details', None)
+        hit = getattr(details, 'cached_tokens', None) if details is not None else None
+    return hit or 0
+
+
+class ConversationSession:
+    def __init__(self, system_prompt, reanchor_every=12, max_context_chars=30000):
+        self.system_prompt = system_prompt
+        self.reanchor_every = reanchor_every
+        self.max_context_chars = max_context_chars
+        self.history = []  # 已完成的 user/assistant 消息
+        self.snapshot = None  # 上一轮发送时的行情/持仓快照，增量提示词以它为基准
+        self.turns = 0  # 自上次锚定以来的轮数
+        self.anchors = 0
+        self.stats = {kind: {'calls': 0, 'prompt_tokens': 0, 'uncached_prompt_tokens': 0, 'sent_chars': 0,
+                             'latency_s': 0.0} for kind in ('full', 'delta')}
+
+    def context_chars(self):
+        return sum(len(message['content']) for message in self.history)
+
+    def needs_anchor(self):
+        return (self.snapshot is None or self.turns >= self.reanchor_every
+                or self.context_chars() > self.max_context_chars)
+
+    def reset(self):
+        """丢弃上下文，下一轮重新锚定"""
+        self.history = []
+        self.snapshot = None
+        self.turns = 0
+
+    def messages(self, prompt, kind):
+        """本轮要发送的完整消息列表；kind为'full'时从新的完整快照开始"""
+        history = [] if kind == 'full' else self.history
+        return [{"role": "system", "content": self.system_prompt}, *history, {"role": "user", "content": prompt}]
+
+    def commit(self, prompt, kind, signal_data, snapshot, usage=None, latency_s=0.0):
+        """本轮成功解析出信号后调用，把这一轮追加进上下文"""
+        if kind == 'full':
+            self.history = []
+            self.turns = 0
+            self.anchors += 1
+        reply = json.dumps({k: signal_data.get(k) for k in SIGNAL_FIELDS if k in signal_data}, ensure_ascii=False)
+        self.history += [{"role": "user", "content": prompt}, {"role": "assistant", "content": reply}]
+        self.snapshot = snapshot
+        self.turns += 1
+
+        stats = self.stats[kind]
+        stats['calls'] += 1
+        stats['sent_chars'] += len(prompt)
+        stats['latency_s'] += latency_s
+        if usage is not None:
+            stats['prompt_tokens'] += usage.prompt_tokens
+            stats['uncached_prompt_tokens'] += usage.prompt_tokens - cached_prompt_tokens(usage)
+
+    def comparison(self):
+        """按模式的每次调用平均值"""
+        result = {}
+        for kind, stats in self.stats.items():
+            calls = stats['calls']
+            if calls:
+                result[kind] = {'calls': calls, **{k: round(v / calls, 1) for k, v in stats.items() if k != 'calls'}}
+        return result
+
+    def print_stats(self):
+        for kind, avg in self.comparison().items():
+            label = '完整快照' if kind == 'full' else '增量'
+            print(f"  {label}: {avg['calls']} 次, 平均输入 {avg['prompt_tokens']:.0f} tokens"
+                  f"（未命中缓存 {avg['uncached_prompt_tokens']:.0f}）, 新发送 {avg['sent_chars']:.0f} 字符, "
+                  f"平均耗时 {avg['latency_s']:.1f}s")
@@ -0,0 +1,624 @@
+"""
+端到端压力测试
+
+上线前回答"50个交易对×3个周期、LLM p99 5秒时还跟得上吗"这类问题。用生成的行情、注入延迟和错误的
+模拟交易所、假LLM，在加速的模拟时间里驱动完整的 trading_bot() 周期:
+
+    SyntheticMarket   每个交易对一条随机游走K线（波动率可配），5分钟K线随模拟时间生成并合成15分钟/1小时
+    FaultyExchange    在PaperExchange外面按对数正态分布注入接口延迟，按比例抛出超时/网络/限频错误
+    MockLLM           OpenAI兼容的假客户端，延迟按给定的p50/p99抽样再加上按输出token计的生成时间，
+                      按比例超时或回复无法解析的内容，正常时按当前价格给出随机的市价/挂单/撤单/观望信号；
+                      批量请求回复信号数组，其中按比例缺少或带有不合法的条目
+
+机器人一个模块只交易一个交易对，这里每根K线收盘时把所有交易对排队，轮到谁就把它的交易所、价格和信号历史、
+持仓、止盈止损、风控状态换入机器人模块再执行一个周期（相当于单进程串行处理多个交易对）。
+注入的延迟和机器人里的sleep只推进模拟时钟，周期本身的CPU耗时也计入模拟时间，
+所以"错过截止时间"反映的是能否在截止前（默认下一根K线收盘前）处理完所有交易对。
+--batch-size N 时先取所有交易对的数据，每N个交易对一次批量分析（见batch_analysis），再逐个执行；
+--compare 用同样的行情和随机种子先后跑逐个请求和批量两种模式，对比每个交易对的token和LLM耗时。
+
+报告:
+    吞吐        周期/秒（真实时间）、模拟时间加速倍数
+    队列深度    每次K线收盘时待处理的周期数、日志队列积压、模拟交易所在途订单
+    截止时间    收盘到周期结束的耗时分位数、错过截止时间的周期数、因积压被跳过的K线数
+    内存        RSS和各交易对历史数据大小随周期数的增长（后一半采样的每千周期斜率）
+    各阶段CPU   tracer中各阶段的真实耗时分位数（最近的滚动窗口，不含注入的延迟）
+
+用法:
+    python loadtest.py --symbols 50 --hours 24
+    python loadtest.py --symbols 10 --hours 6 --llm-p50 1.5 --llm-p99 5 --exchange-error-rate 0.02
+    python loadtest.py --symbols 50 --hours 48 --output load_report.json
+    python loadtest.py --symbols 40 --hours 6 --batch-size 8 --compare
+"""
+import argparse
+import contextlib
+import gc
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+from types import SimpleNamespace
+
+import ccxt
+
+from backtest import attach_bot, bot
+from event_log import pending_records, setup_logging
+from paper_exchange import TIMEFRAME_MS, PaperExchange, SimClock
+from profiling import object_size
+from tracing import TracedExchange, percentile
+
+BAR_MS = TIMEFRAME_MS['5m']
+BASES = ['BTC', 'ETH', 'SOL', 'XRP', 'DOGE', 'ADA', 'AVAX', 'LINK', 'DOT', 'LTC',
+         'BCH', 'TRX', 'TON', 'NEAR', 'APT', 'ARB', 'OP', 'SUI', 'FIL', 'ATOM']
+# 最大周期（1小时）也要有50根已收盘K线
+WARMUP_BARS = 52 * TIMEFRAME_MS['1h'] // BAR_MS
+BATCH_SYMBOL = re.compile(r'【交易对 ([^】]+)】')  # build_symbol_snapshot 的交易对标题
+
+
+def lognormal(rng, p50, p99):
+    """按中位数和p99构造对数正态分布的抽样函数（p99不大于p50时为常数）"""
+    if p50 <= 0:
+        return lambda: 0.0
+    mu = math.log(p50)
+    sigma = math.log(p99 / p50) / 2.326 if p99 > p50 else 0.0
+    return lambda: rng.lognormvariate(mu, sigma)
+
+
+def rss_bytes():
+    """当前进程常驻内存（Linux读/proc，其他平台退回峰值RSS，都不可用时为None）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def slope(points):
+    """最小二乘斜率，points为[(x, y)]"""
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var if var else 0.0
+
+
+class SyntheticMarket:
+    """一个交易对的随机游走K线，按模拟时间逐根生成，写进模拟交易所的candles供fetch_ohlcv回放"""
+
+    def __init__(self, exchange, rng, start_price, volatility, start_ms, keep=200):
+        self.exchange = exchange
+        self.rng = rng
+        self.price = start_price
+        self.volatility = volatility  # 每根5分钟K线对数收益率的标准差
+        self.next_ms = start_ms  # 下一根5分钟K线的开盘时间（需按1小时对齐）
+        self.keep = keep  # 每个周期保留的K线数，够机器人取50根即可
+        self.partial = {}  # {周期: [开盘时间, 开, 高, 低, 收, 量]} 正在合成的K线
+        for tf in bot.TIMEFRAMES:
+            exchange.candles.setdefault(tf, [])
+
+    def advance(self, now_ms):
+        """生成收盘时间不晚于now_ms的所有5分钟K线"""
+        while self.next_ms + BAR_MS <= now_ms:
+            self._bar(self.next_ms)
+            self.next_ms += BAR_MS
+
+    def _bar(self, ts):
+        rng, sigma = self.rng, self.volatility
+        open_ = self.price
+        close = open_ * math.exp(rng.gauss(0, sigma))
+        high = max(open_, close) * (1 + abs(rng.gauss(0, sigma / 2)))
+        low = min(open_, close) * (1 - abs(rng.gauss(0, sigma / 2)))
+        volume = rng.lognormvariate(3, 0.5) * (1 + abs(close / open_ - 1) / sigma)  # 波动大时放量
+        self.price = close
+        self.exchange.on_bar(ts, open_, high, low, close)
+        for tf in bot.TIMEFRAMES:
+            tf_ms = TIMEFRAME_MS[tf]
+            bucket = ts - ts % tf_ms
+            row = self.partial.get(tf)
+            if row is None or row[0] != bucket:
+                row = self.partial[tf] = [bucket, open_, high, low, close, volume]
+            else:
+                row[2], row[3], row[4] = max(row[2], high), min(row[3], low), close
+                row[5] += volume
+            if ts + BAR_MS == bucket + tf_ms:
+                rows = self.exchange.candles[tf]
+                rows.append(self.partial.pop(tf))
+                if len(rows) > 2 * self.keep:
+                    del rows[:-self.keep]
+
+
+class FaultyExchange:
+    """给模拟交易所的接口调用注入延迟（推进模拟时钟）和错误"""
+
+    ERRORS = (ccxt.RequestTimeout, ccxt.NetworkError, ccxt.ExchangeNotAvailable, ccxt.RateLimitExceeded)
+    REMOTE = ('fetch_', 'create_', 'cancel_', 'set_', 'edit_')
+
+    def __init__(self, exchange, clock, latency, error_rate, rng):
+        self._exchange = exchange
+        self._clock = clock
+        self._latency = latency
+        self._error_rate = error_rate
+        self._rng = rng
+        self.stats = {'calls': 0, 'errors': 0, 'latency_s': 0.0}
+
+    def __getattr__(self, name):
+        attr = getattr(self._exchange, name)
+        if not callable(attr) or not name.startswith(self.REMOTE):
+            return attr
+
+        def call(*args, **kwargs):
+            delay = self._latency()
+            self._clock.sleep(delay)
+            self.stats['calls'] += 1
+            self.stats['latency_s'] += delay
+            if self._rng.random() < self._error_rate:
+                self.stats['errors'] += 1
+                error = self._rng.choice(self.ERRORS)
+                raise error(f"模拟{error.__name__}: {name}")
+            return attr(*args, **kwargs)
+
+        return call
+
+
+class MockLLM:
+    """OpenAI兼容的假LLM客户端：延迟推进模拟时钟，按比例超时或回复无法解析的内容，否则给出随机信号"""
+
+    def __init__(self, clock, latency, error_rate, malformed_rate, rng, token_ms=0.0):
+        self.chat = SimpleNamespace(completions=self)
+        self.clock = clock
+        self.latency = latency  # 首个token之前的延迟
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate  # 单独请求按回复计，批量请求按条目计
+        self.rng = rng
+        self.token_ms = token_ms  # 每个输出token的生成时间，批量回复更长也更慢
+        self.price = None  # 单独请求前设为该交易对的最新价
+        self.prices = {}  # 批量请求前设为 {交易对: 最新价}
+        self.stats = {'calls': 0, 'errors': 0, 'malformed': 0, 'latency_s': 0.0, 'prompt_tokens': 0}
+
+    def create(self, model=None, messages=(), **kwargs):
+        prompt = (messages[-1].get('content') or '') if messages else ''
+        symbols = BATCH_SYMBOL.findall(prompt)
+        roll = self.rng.random()
+        content = None
+        if roll < self.error_rate:
+            pass
+        elif symbols:
+            content = self._batch_reply(symbols)
+        elif roll < self.error_rate + self.malformed_rate:
+            self.stats['malformed'] += 1
+            content = "行情不明朗，建议继续观望。"
+        else:
+            content = json.dumps(self._signal(self.price), ensure_ascii=False)
+
+        # 粗略按两个字符一个token估算
+        completion_tokens = len(content or '') // 2
+        delay = self.latency() + completion_tokens * self.token_ms / 1000
+        self.clock.sleep(delay)
+        self.stats['calls'] += 1
+        self.stats['latency_s'] += delay
+        if content is None:
+            self.stats['errors'] += 1
+            raise TimeoutError(f"模拟LLM请求超时（{delay:.1f}s）")
+        prompt_tokens = sum(len(message.get('content') or '') for message in messages) // 2
+        self.stats['prompt_tokens'] += prompt_tokens
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                total_tokens=prompt_tokens + completion_tokens)
+        message = SimpleNamespace(role='assistant', content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason='stop')], usage=usage)
+
+    def _batch_reply(self, symbols):
+        entries = []
+        for symbol in symbols:
+            if self.rng.random() < self.malformed_rate:
+                self.stats['malformed'] += 1
+                if self.rng.random() < 0.5:
+                    continue  # 漏掉这个交易对
+                entries.append({'symbol': symbol, 'signal': '观望', 'confidence': 'HIGH'})  # 取值不合法
+                continue
+            entries.append({'symbol': symbol, **self._signal(self.prices[symbol])})
+        return json.dumps(entries, ensure_ascii=False)
+
+    def _signal(self, price):
+        rng = self.rng
+        signal = rng.choices(('BUY', 'SELL', 'HOLD'), weights=(1, 1, 2))[0]
+        confidence = rng.choice(('HIGH', 'MEDIUM', 'LOW'))
+        long = signal != 'SELL'
+        risk = price * rng.uniform(0.003, 0.01)
+        signal_data = {
+            'signal': signal,
+            'reason': "压力测试随机信号",
+            'limit_price': price * (0.999 if long else 1.001),
+            'market_price': price,
+            'stop_loss': price - risk if long else price + risk,
+            'take_profit': price + 2 * risk if long else price - 2 * risk,
+            'confidence': confidence,
+            'risk_reward_ratio': "1:2",
+        }
+        # 高信心走市价/反手，中信心挂单，低信心撤单，观望不动
+        if signal == 'HOLD':
+            signal_data['order_suggestion'] = 'HOLD'
+        elif confidence == 'MEDIUM':
+            signal_data['order_suggestion'] = 'PLACE_ORDER'
+        elif confidence == 'LOW':
+            signal_data['order_suggestion'] = 'CANCEL_EXISTING'
+        return signal_data
+
+
+class SymbolState:
+    """一个交易对在机器人模块里的全部可变状态，轮到它时换入"""
+
+    NAMES = ('exchange', 'price_history', 'signal_history', 'position', 'protection', 'risk_engine',
+             'pending_protection')
+
+    def __init__(self, symbol, exchange, paper, market):
+        self.symbol = symbol
+        self.exchange = exchange
+        self.paper = paper
+        self.market = market
+        self.price_history = []
+        self.signal_history = []
+        self.position = None
+        self.pending_protection = None
+        self.protection = bot.ProtectiveOrders(symbol, 'native', stop_tag='LOAD_STOP', take_profit_tag='LOAD_TP')
+        risk = bot.TRADE_CONFIG['risk']
+        self.risk_engine = bot.RiskEngine(
+            bot.TRADE_CONFIG['leverage'], contract_size=paper.contract_size,
+            max_order_amount=risk['max_order_amount'], max_position_amount=risk['max_position_amount'],
+            max_price_deviation_pct=risk['max_price_deviation_pct'], liquidation_buffer=risk['liquidation_buffer'],
+            margin_buffer=risk['margin_buffer'], account_ttl_s=risk['account_ttl_s'], enabled=risk['enabled'],
+            clock=paper.clock.time)
+
+    def swap_in(self):
+        for name in self.NAMES:
+            setattr(bot, name, getattr(self, name))
+        bot.TRADE_CONFIG['symbol'] = self.symbol
+
+    def swap_out(self):
+        for name in self.NAMES:
+            setattr(self, name, getattr(bot, name))
+
+    @contextlib.contextmanager
+    def active(self):
+        self.swap_in()
+        try:
+            yield
+        finally:
+            self.swap_out()
+
+
+@contextlib.contextmanager
+def charged(clock):
+    """块内的CPU耗时计入模拟时间"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        clock.sleep(time.perf_counter() - started)
+
+
+class LoadTest:
+    def __init__(self, symbols=50, hours=6.0, volatility=0.002, exchange_p50_ms=80, exchange_p99_ms=400,
+                 exchange_error_rate=0.01, llm_p50_s=2.0, llm_p99_s=5.0, llm_error_rate=0.02,
+                 llm_malformed_rate=0.02, llm_token_ms=10.0, batch_size=1, deadline_s=300.0, memory_every=500,
+                 seed=7):
+        self.symbols = symbols
+        self.hours = hours
+        self.volatility = volatility
+        self.deadline_s = deadline_s
+        self.memory_every = memory_every
+        self.rng = random.Random(seed)
+        self.exchange_latency = lognormal(self.rng, exchange_p50_ms / 1000, exchange_p99_ms / 1000)
+        self.exchange_error_rate = exchange_error_rate
+        self.llm_args = (lognormal(self.rng, llm_p50_s, llm_p99_s), llm_error_rate, llm_malformed_rate)
+        self.llm_token_ms = llm_token_ms
+        self.batch_size = batch_size
+
+    def build(self, clock, start_ms):
+        states = []
+        for i in range(self.symbols):
+            base = BASES[i] if i < len(BASES) else f'SYN{i}'
+            symbol = f'{base}/USDT:USDT'
+            paper = PaperExchange(clock, symbol=symbol, leverage=bot.TRADE_CONFIG['leverage'],
+                                  **{**bot.TRADE_CONFIG['paper'], 'latency_ms': 0})
+            rng = random.Random(self.rng.random())
+            # 价格跨几个数量级，检验指标和提示词格式化
+            market = SyntheticMarket(paper, rng, 10 ** rng.uniform(-1, 4.8), self.volatility * rng.uniform(0.5, 2),
+                                     start_ms - WARMUP_BARS * BAR_MS)
+            market.advance(start_ms)
+            exchange = TracedExchange(FaultyExchange(paper, clock, self.exchange_latency, self.exchange_error_rate,
+                                                     self.rng), bot.tracer)
+            states.append(SymbolState(symbol, exchange, paper, market))
+        return states
+
+    def run(self):
+        hour_ms = TIMEFRAME_MS['1h']
+        start_ms = (int(time.time() * 1000) // hour_ms - 24 * 365) * hour_ms  # 对齐到整点
+        end_ms = start_ms + int(self.hours * hour_ms)
+        clock = SimClock(start_ms)
+        llm = MockLLM(clock, *self.llm_args, self.rng, token_ms=self.llm_token_ms)
+        build_started = time.perf_counter()
+        states = self.build(clock, start_ms)
+        build_s = time.perf_counter() - build_started
+
+        self.report = report = {'cycles': 0, 'cycle_errors': 0, 'missed_deadlines': 0, 'skipped_bars': 0}
+        self.close_to_done = close_to_done = []
+        self.log_backlog = log_backlog = []
+        self.memory = memory = []
+        queue_depths = []
+        in_flight = []
+        saved = {name: getattr(bot, name) for name in SymbolState.NAMES + ('deepseek_client',)}
+        saved_batch_size = bot.batch_analyzer.max_symbols
+        gc.collect()
+        rss_start = rss_bytes()
+        started = time.perf_counter()
+
+        with attach_bot(states[0].exchange, clock), open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            bot.deepseek_client = llm
+            bot.batch_analyzer.max_symbols = self.batch_size
+            try:
+                next_close = start_ms
+                depth = len(states)
+                while next_close <= end_ms:
+                    clock.advance_to(next_close)
+                    queue_depths.append(depth)
+                    if self.batch_size > 1:
+                        finishes = self._batched_bar(states, llm, clock, next_close)
+                    else:
+                        finishes = [self._cycle(state, states, llm, clock, next_close) for state in states]
+                    in_flight.append(sum(len(state.paper._in_flight) for state in states))
+
+                    # 处理这一批时又收盘的K线：记录收盘时的积压，只处理最新的一根，其余跳过
+                    done = clock.now_ms
+                    closed = []
+                    close = next_close + BAR_MS
+                    while close <= done:
+                        closed.append(close)
+                        close += BAR_MS
+                    if closed:
+                        queue_depths.extend(len(states) + sum(f > c for f in finishes) for c in closed[:-1])
+                        depth = len(states) + sum(f > closed[-1] for f in finishes)
+                        report['skipped_bars'] += len(closed) - 1
+                        next_close = closed[-1]
+                    else:
+                        depth = len(states)
+                        next_close += BAR_MS
+            finally:
+                tokens = bot.token_stats['total_tokens']  # attach_bot退出时还原token统计
+                for name, value in saved.items():
+                    setattr(bot, name, value)
+                bot.batch_analyzer.max_symbols = saved_batch_size
+
+        elapsed = time.perf_counter() - started
+        gc.collect()
+        rss_end = rss_bytes()
+        close_to_done.sort()
+        # 历史列表和滚动窗口在前期填满后就不再增长，增长率只看后一半的采样
+        steady = memory[len(memory) // 2:]
+        sim_s = (clock.now_ms - start_ms) / 1000
+        exchange_stats = [state.exchange._exchange.stats for state in states]
+        exchange_calls = sum(s['calls'] for s in exchange_stats)
+        cycles = max(report['cycles'], 1)
+        report.update({
+            'symbols': self.symbols,
+            'batch_size': self.batch_size,
+            'timeframes': list(bot.TIMEFRAMES),
+            'simulated_hours': sim_s / 3600,
+            'build_s': build_s,
+            'elapsed_s': elapsed,
+            'cycles_per_sec': report['cycles'] / elapsed if elapsed else 0.0,
+            'speedup': sim_s / elapsed if elapsed else 0.0,
+            'deadline_s': self.deadline_s,
+            'close_to_done_s': {
+                'p50': percentile(close_to_done, 0.50), 'p95': percentile(close_to_done, 0.95),
+                'p99': percentile(close_to_done, 0.99), 'max': close_to_done[-1],
+            } if close_to_done else None,
+            'queue_depth': {'max': max(queue_depths), 'mean': sum(queue_depths) / len(queue_depths)},
+            'log_backlog': {'max': max(log_backlog, default=0),
+                            'mean': sum(log_backlog) / len(log_backlog) if log_backlog else 0.0},
+            'exchange_in_flight_max': max(in_flight, default=0),
+            'exchange': {'calls': exchange_calls, 'errors': sum(s['errors'] for s in exchange_stats),
+                         'mean_latency_ms': sum(s['latency_s'] for s in exchange_stats) / exchange_calls * 1000
+                         if exchange_calls else 0.0},
+            'llm': {**llm.stats, 'mean_latency_s': llm.stats['latency_s'] / llm.stats['calls']
+                    if llm.stats['calls'] else 0.0},
+            # 每个交易对每次决策的平均LLM用量（批量请求按交易对数分摊）
+            'llm_per_symbol': {'tokens': tokens / cycles,
+                               'latency_s': llm.stats['latency_s'] / cycles},
+            'batch': bot.batch_analyzer.snapshot() if self.batch_size > 1 else None,
+            'fills': sum(len(state.paper.fills) for state in states),
+            'memory': {
+                'rss_start_mb': rss_start / 2 ** 20 if rss_start else None,
+                'rss_end_mb': rss_end / 2 ** 20 if rss_end else None,
+                'rss_growth_kb_per_1k_cycles': slope([(c, r) for c, r, _ in steady if r]) * 1000 / 1024,
+                'history_kb': memory[-1][2] / 1024 if memory else None,
+                'history_growth_kb_per_1k_cycles': slope([(c, h) for c, _, h in steady]) * 1000 / 1024,
+                'samples': memory,
+            },
+            'stages_ms': bot.tracer.summary(),
+        })
+        return report
+
+    def _cycle(self, state, states, llm, clock, close_ms):
+        """逐个请求模式：完整执行一次 trading_bot()"""
+        state.market.advance(clock.now_ms)
+        llm.price = state.market.price
+        with state.active(), charged(clock):
+            try:
+                bot.trading_bot(bar_close_s=close_ms / 1000)
+            except Exception:
+                self.report['cycle_errors'] += 1  # 实盘主循环会记录后继续
+        return self._finish(states, clock, close_ms)
+
+    def _batched_bar(self, states, llm, clock, close_ms):
+        """批量模式：先取所有交易对的数据，每batch_size个交易对一次分析请求，再逐个执行"""
+        fetched, entries, prompt_ms = {}, {}, {}
+        for state in states:
+            state.market.advance(clock.now_ms)
+            with state.active(), charged(clock):
+                multi_data = bot.get_multi_timeframe_data()
+                if multi_data:
+                    fetched[state.symbol] = multi_data
+                    prompt_ms[state.symbol] = bot.execution_recorder.now_ms()
+                    entries[state.symbol] = (multi_data, bot.get_current_position(), bot.get_current_orders(),
+                                             state.signal_history[-1] if state.signal_history else None)
+
+        by_symbol = {state.symbol: state for state in states}
+        llm.prices = {symbol: by_symbol[symbol].market.price for symbol in entries}
+
+        def fallback(symbol):
+            llm.price = llm.prices[symbol]
+            with by_symbol[symbol].active():
+                return bot.analyze_with_deepseek_multi_timeframe(fetched[symbol], record=False)
+
+        with charged(clock):
+            try:
+                signals = bot.analyze_batch_multi_timeframe(entries, fallback) if entries else {}
+            except Exception:
+                self.report['cycle_errors'] += 1
+                signals = {}
+
+        finishes = []
+        for state in states:
+            signal_data = signals.get(state.symbol)
+            if signal_data:
+                with state.active(), charged(clock):
+                    try:
+                        bot.record_signal(signal_data, bot.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                        bot.execute_decision(signal_data, fetched[state.symbol], prompt_ms[state.symbol])
+                    except Exception:
+                        self.report['cycle_errors'] += 1
+            finishes.append(self._finish(states, clock, close_ms))
+        return finishes
+
+    def _finish(self, states, clock, close_ms):
+        """一个交易对本根K线处理完：记录收盘到完成的耗时、截止时间、日志积压和内存采样"""
+        report = self.report
+        self.close_to_done.append((clock.now_ms - close_ms) / 1000)
+        if clock.now_ms - close_ms > self.deadline_s * 1000:
+            report['missed_deadlines'] += 1
+        report['cycles'] += 1
+        self.log_backlog.append(pending_records())
+        if report['cycles'] % self.memory_every == 0:
+            gc.collect()
+            self.memory.append((report['cycles'], rss_bytes(),
+                                sum(object_size(s.price_history) + object_size(s.signal_history) for s in states)))
+        return clock.now_ms
+
+
+def print_report(report):
+    print("\n" + "=" * 60)
+    print("压力测试结果")
+    print("=" * 60)
+    print(f"交易对: {report['symbols']} × 周期 {'/'.join(report['timeframes'])}，"
+          f"模拟 {report['simulated_hours']:.1f} 小时（生成行情 {report['build_s']:.1f}s）")
+    print(f"周期: {report['cycles']} 个，耗时 {report['elapsed_s']:.1f}s，{report['cycles_per_sec']:.0f} 周期/秒，"
+          f"模拟时间加速 {report['speedup']:.0f}x；未捕获异常 {report['cycle_errors']} 次")
+    latency = report['close_to_done_s']
+    if latency:
+        print(f"收盘到周期结束: p50 {latency['p50']:.1f}s  p95 {latency['p95']:.1f}s  p99 {latency['p99']:.1f}s  "
+              f"max {latency['max']:.1f}s")
+    print(f"错过截止时间（{report['deadline_s']:.0f}s）: {report['missed_deadlines']} 个周期，"
+          f"积压跳过的K线: {report['skipped_bars']} 根")
+    print(f"队列深度: 收盘时待处理周期 max {report['queue_depth']['max']} / mean {report['queue_depth']['mean']:.1f}，"
+          f"日志积压 max {report['log_backlog']['max']}，模拟交易所在途订单 max {report['exchange_in_flight_max']}")
+    exchange, llm = report['exchange'], report['llm']
+    print(f"交易所: {exchange['calls']} 次调用，注入错误 {exchange['errors']} 次，平均延迟 {exchange['mean_latency_ms']:.0f}ms；"
+          f"成交 {report['fills']} 笔")
+    print(f"LLM: {llm['calls']} 次调用，超时 {llm['errors']} 次，无法解析 {llm['malformed']} 次，"
+          f"平均延迟 {llm['mean_latency_s']:.2f}s；每个交易对 {report['llm_per_symbol']['tokens']:.0f} tokens、"
+          f"{report['llm_per_symbol']['latency_s']:.2f}s")
+    if report['batch']:
+        batch, single = report['batch']['batch'], report['batch']['single']
+        print(f"批量分析（每批最多 {report['batch_size']} 个）: {batch['requests']} 次请求覆盖 {batch['symbols']} 个交易对，"
+              f"无效 {batch['failed']} 个；单独重试 {single['requests']} 次，失败 {single['failed']} 次")
+    memory = report['memory']
+    if memory['rss_start_mb'] is not None:
+        print(f"内存: RSS {memory['rss_start_mb']:.0f}MB -> {memory['rss_end_mb']:.0f}MB，"
+              f"每千周期增长 {memory['rss_growth_kb_per_1k_cycles']:+.0f}KB；"
+              f"历史数据 {memory['history_kb'] or 0:.0f}KB（每千周期 {memory['history_growth_kb_per_1k_cycles']:+.1f}KB）")
+    print("\n各阶段CPU耗时（不含注入的延迟）:")
+    print(f"{'阶段':<36}{'次数':>6}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+    for name, stats in report['stages_ms'].items():
+        if stats:
+            print(f"{name:<36}{stats['count']:>6}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    print("=" * 60)
+
+
+def print_comparison(single, batched):
+    """逐个请求与批量模式的对比（同样的行情和随机种子）"""
+    print("\n" + "=" * 60)
+    print(f"逐个请求 vs 批量（每批最多 {batched['batch_size']} 个交易对）")
+    print("=" * 60)
+    rows = [
+        ("每个交易对token", single['llm_per_symbol']['tokens'], batched['llm_per_symbol']['tokens'], '.0f'),
+        ("每个交易对LLM耗时(s)", single['llm_per_symbol']['latency_s'], batched['llm_per_symbol']['latency_s'], '.2f'),
+        ("收盘到完成p50(s)", single['close_to_done_s']['p50'], batched['close_to_done_s']['p50'], '.1f'),
+        ("收盘到完成p99(s)", single['close_to_done_s']['p99'], batched['close_to_done_s']['p99'], '.1f'),
+        ("LLM调用次数", single['llm']['calls'], batched['llm']['calls'], '.0f'),
+        ("错过截止时间", single['missed_deadlines'], batched['missed_deadlines'], '.0f'),
+    ]
+    print(f"{'':<24}{'逐个':>12}{'批量':>12}{'变化':>10}")
+    for name, before, after, fmt in rows:
+        change = f"{(after - before) / before:+.0%}" if before else '-'
+        print(f"{name:<24}{before:>12{fmt}}{after:>12{fmt}}{change:>10}")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端压力测试（生成行情 + 模拟交易所 + 假LLM，加速时间）")
+    parser.add_argument('--symbols', type=int, default=50, help="交易对数量")
+    parser.add_argument('--hours', type=float, default=6.0, help="模拟运行的小时数")
+    parser.add_argument('--volatility', type=float, default=0.002, help="每根5分钟K线收益率的标准差（各交易对在0.5-2倍间浮动）")
+    parser.add_argument('--exchange-p50-ms', type=float, default=80)
+    parser.add_argument('--exchange-p99-ms', type=float, default=400)
+    parser.add_argument('--exchange-error-rate', type=float, default=0.01, help="交易所调用失败的比例")
+    parser.add_argument('--llm-p50', type=float, default=2.0, help="LLM延迟中位数（秒）")
+    parser.add_argument('--llm-p99', type=float, default=5.0, help="LLM延迟p99（秒）")
+    parser.add_argument('--llm-error-rate', type=float, default=0.02, help="LLM超时的比例")
+    parser.add_argument('--llm-malformed-rate', type=float, default=0.02, help="LLM回复无法解析的比例（批量时按条目计）")
+    parser.add_argument('--llm-token-ms', type=float, default=10.0, help="每个输出token的生成时间（毫秒）")
+    parser.add_argument('--batch-size', type=int, default=1, help="每次LLM请求分析的交易对数，1为逐个请求")
+    parser.add_argument('--compare', action='store_true', help="先逐个请求再按--batch-size批量各跑一次并对比")
+    parser.add_argument('--deadline', type=float, default=300.0, help="收盘后多少秒内必须完成周期")
+    parser.add_argument('--memory-every', type=int, default=500, help="每N个周期采样一次内存")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help="报告另存为JSON")
+    args = parser.parse_args()
+
+    setup_logging(console=False, path=None)  # 日志照常入队（计入开销和积压），后台线程直接丢弃
+
+    def run(batch_size):
+        return LoadTest(args.symbols, args.hours, args.volatility, args.exchange_p50_ms, args.exchange_p99_ms,
+                        args.exchange_error_rate, args.llm_p50, args.llm_p99, args.llm_error_rate,
+                        args.llm_malformed_rate, llm_token_ms=args.llm_token_ms, batch_size=batch_size,
+                        deadline_s=args.deadline, memory_every=args.memory_every, seed=args.seed).run()
+
+    if args.compare:
+        single = run(1)
+        print_report(single)
+        report = run(max(args.batch_size, 2))
+        print_report(report)
+        print_comparison(single, report)
+        report = {'single': single, 'batched': report}
+    else:
+        report = run(args.batch_size)
+        print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"报告已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+本地指标与健康检查HTTP端点
+
+后台守护线程里运行一个 ThreadingHTTPServer，只有请求到来时才调用collect()从内存中的统计组装指标，
+交易周期本身不做任何额外工作，也不会在HTTP线程里访问交易所。
+
+    GET /metrics       Prometheus文本格式
+    GET /metrics.json  同样的指标，JSON格式
+    GET /health        健康返回200，否则503（JSON说明原因）
+
+用法:
+    MetricsServer(collect_metrics, health_status, port=9108).start()
+"""
+import json
+import threading
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from event_log import event, log
+
+# samples: [(样本名, {标签}, 值)]，summary类型的 _sum/_count 样本名与指标名不同
+Metric = namedtuple('Metric', 'name kind help samples')
+
+
+def metric(name, kind, help, value=None, samples=None):
+    """单值指标传value；带标签的指标传samples=[({标签}, 值), ...]"""
+    if samples is None:
+        samples = [({}, value)]
+    return Metric(name, kind, help, [(name, labels, v) for labels, v in samples])
+
+
+def summary(name, help, quantiles, count, total, labels=None):
+    """quantiles为 {分位: 秒}，count/total为累计次数和总耗时"""
+    labels = labels or {}
+    samples = [(name, dict(labels, quantile=str(q)), v) for q, v in quantiles.items()]
+    samples.append((f"{name}_sum", labels, total))
+    samples.append((f"{name}_count", labels, count))
+    return Metric(name, 'summary', help, samples)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(metrics):
+    lines = []
+    for m in metrics:
+        samples = [s for s in m.samples if s[2] is not None]
+        if not samples:
+            continue
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        for name, labels, value in samples:
+            label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {float(value)!r}" if label_text else f"{name} {float(value)!r}")
+    return "\n".join(lines) + "\n"
+
+
+def render_json(metrics):
+    """无标签的样本直接给值，带标签的给 [{标签..., 'value': 值}] 列表"""
+    data = {}
+    for m in metrics:
+        for name, labels, value in m.samples:
+            if value is None:
+                continue
+            if labels:
+                data.setdefault(name, []).append(dict(labels, value=value))
+            else:
+                data[name] = value
+    return data
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'TradingBotMetrics/1.0'
+
+    def do_GET(self):
+        owner = self.server.owner
+        path = self.path.split('?', 1)[0]
+        try:
+            if path == '/metrics':
+                self._send(200, 'text/plain; version=0.0.4; charset=utf-8', render_prometheus(owner.collect()))
+            elif path == '/metrics.json':
+                self._send(200, 'application/json', json.dumps(render_json(owner.collect()), ensure_ascii=False))
+            elif path == '/health':
+                ok, details = owner.health() if owner.health else (True, {})
+                self._send(200 if ok else 503, 'application/json',
+                           json.dumps(dict(details, status='ok' if ok else 'unhealthy'), ensure_ascii=False))
+            else:
+                self._send(404, 'text/plain; charset=utf-8', "not found\n")
+        except Exception as e:
+            log.error(f"指标端点处理请求失败: {e}", exc_info=True, extra=event('error'))
+            self._send(500, 'text/plain; charset=utf-8', "internal error\n")
+
+    def _send(self, status, content_type, body):
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # 默认实现每个请求写一行stderr，抓取频繁时会刷屏
+        pass
+
+
+class MetricsServer:
+    """collect() -> [Metric]；health() -> (是否健康, 说明字典)"""
+
+    def __init__(self, collect, health=None, host='127.0.0.1', port=9108):
+        self.collect = collect
+        self.health = health
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._server.daemon_threads = True
+        self._server.owner = self
+        self.port = self._server.server_address[1]  # port=0时取实际分配的端口
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
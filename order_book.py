@@ -0,0 +1,346 @@
+"""
+本地L2盘口
+
+K线成交量看不到挂着的流动性。这里用"快照 + 增量"在本地维护一份L2盘口:
+
+- L2Book 按OKX books频道的消息格式应用快照和增量（价格和数量保留原始字符串，用于校验和），
+  seqId/prevSeqId接不上或CRC32校验和不一致时标记为失步，丢弃增量直到下一个快照；
+  OKX只在订阅后推送一次快照，BookFeed发现失步后关闭连接重新订阅，拿到新快照
+- 每个变动只更新对应档位（字典 + 有序价格列表，bisect定位）和两侧总量；
+  盘口特征按版本号缓存，没有新变动时读取不重新计算
+- 特征: 买卖价差、微观价格、前N档/中间价附近band_bps内/整个盘口的买卖量失衡、两侧最近的大单墙
+- BookFeed 在后台线程里接收推送（OKX通过ccxt.pro拿到原始增量消息，其他交易所定时拉取快照），
+  可以把原始消息录制成JSON Lines；replay() 用录制的数据回放，便于离线验证
+
+    python order_book.py logs/depth.jsonl     回放录制的盘口数据，输出同步统计、处理耗时和最终特征
+"""
+import asyncio
+import json
+import sys
+import threading
+import time
+import zlib
+from bisect import bisect_left, bisect_right, insort
+
+from event_log import event, log
+
+SIDES = ('bids', 'asks')
+
+
+def okx_checksum(bids, asks, levels=25):
+    """OKX盘口校验和：前25档买卖交替拼接 "价格:数量"，CRC32按有符号32位整数"""
+    parts = []
+    for i in range(levels):
+        if i < len(bids):
+            parts.append(f"{bids[i][0]}:{bids[i][1]}")
+        if i < len(asks):
+            parts.append(f"{asks[i][0]}:{asks[i][1]}")
+    crc = zlib.crc32(':'.join(parts).encode())
+    return crc - (1 << 32) if crc >= (1 << 31) else crc
+
+
+class L2Book:
+    def __init__(self, symbol=None, depth_levels=20, band_bps=50.0, wall_multiple=5.0, checksum_levels=25):
+        self.symbol = symbol
+        self.depth_levels = depth_levels
+        self.band_bps = band_bps
+        self.wall_multiple = wall_multiple
+        self.checksum_levels = checksum_levels
+        self._levels = {side: {} for side in SIDES}  # 价格 -> (数量, 价格原文, 数量原文)
+        self._prices = {side: [] for side in SIDES}  # 升序；买一在末尾，卖一在开头
+        self._totals = {side: 0.0 for side in SIDES}
+        self.seq = None
+        self.ts = None  # 交易所时间ms
+        self.received_ms = None
+        self.synced = False
+        self.version = 0
+        self.stats = {'snapshots': 0, 'updates': 0, 'levels_changed': 0, 'gaps': 0, 'checksum_failures': 0,
+                      'dropped': 0}
+        self._features = None
+        self._features_version = -1
+        self._lock = threading.Lock()
+
+    def _set_level(self, side, price_str, size_str):
+        price, size = float(price_str), float(size_str)
+        levels, prices = self._levels[side], self._prices[side]
+        old = levels.get(price)
+        if old is not None:
+            self._totals[side] -= old[0]
+        if size == 0:
+            if old is not None:
+                del levels[price]
+                del prices[bisect_left(prices, price)]
+            return
+        if old is None:
+            insort(prices, price)
+        levels[price] = (size, price_str, size_str)
+        self._totals[side] += size
+
+    def _top(self, side, n):
+        prices = self._prices[side]
+        ordered = prices[:-n - 1:-1] if side == 'bids' else prices[:n]
+        return [(price,) + self._levels[side][price] for price in ordered]  # (价格, 数量, 价格原文, 数量原文)
+
+    def _checksum(self):
+        bids = [(p_str, s_str) for _, _, p_str, s_str in self._top('bids', self.checksum_levels)]
+        asks = [(p_str, s_str) for _, _, p_str, s_str in self._top('asks', self.checksum_levels)]
+        return okx_checksum(bids, asks, self.checksum_levels)
+
+    def _mark(self, seq, ts):
+        self.seq = seq
+        self.ts = ts
+        self.received_ms = int(time.time() * 1000)
+        self.version += 1
+
+    def apply_snapshot(self, bids, asks, seq=None, ts=None, checksum=None):
+        """bids/asks为 [[价格, 数量, ...]]（字符串或数字）；返回快照是否通过校验"""
+        with self._lock:
+            for side, rows in (('bids', bids), ('asks', asks)):
+                self._levels[side], self._prices[side], self._totals[side] = {}, [], 0.0
+                for row in rows:
+                    self._set_level(side, str(row[0]), str(row[1]))
+            self.stats['snapshots'] += 1
+            self._mark(seq, ts)
+            self.synced = self._verify(checksum)
+            return self.synced
+
+    def apply_update(self, bids, asks, seq=None, prev_seq=None, ts=None, checksum=None):
+        """应用增量；失步时丢弃并返回False，等待下一个快照"""
+        with self._lock:
+            if not self.synced:
+                self.stats['dropped'] += 1
+                return False
+            if prev_seq not in (None, -1) and self.seq is not None and prev_seq != self.seq:
+                self.stats['gaps'] += 1
+                self.synced = False
+                log.warning(f"盘口增量不连续: 本地seq {self.seq}, 收到prevSeqId {prev_seq}，等待重新快照",
+                            extra=event('market', book='gap', seq=self.seq, prev_seq=prev_seq))
+                return False
+            for side, rows in (('bids', bids), ('asks', asks)):
+                for row in rows:
+                    self._set_level(side, str(row[0]), str(row[1]))
+                self.stats['levels_changed'] += len(rows)
+            self.stats['updates'] += 1
+            self._mark(seq, ts)
+            self.synced = self._verify(checksum)
+            return self.synced
+
+    def _verify(self, checksum):
+        if checksum is None or self._checksum() == int(checksum):
+            return True
+        self.stats['checksum_failures'] += 1
+        log.warning(f"盘口校验和不一致（seq {self.seq}），等待重新快照",
+                    extra=event('market', book='checksum', seq=self.seq))
+        return False
+
+    def on_okx_message(self, message):
+        """处理OKX books/books5/books-l2-tbt频道的原始推送"""
+        action = message.get('action', 'snapshot')  # books5每次推送都是完整快照，没有action
+        for data in message.get('data', []):
+            args = (data.get('bids', []), data.get('asks', []))
+            kwargs = {'seq': data.get('seqId'), 'ts': int(data['ts']) if data.get('ts') else None,
+                      'checksum': data.get('checksum')}
+            if action == 'snapshot':
+                self.apply_snapshot(*args, **kwargs)
+            else:
+                self.apply_update(*args, prev_seq=data.get('prevSeqId'), **kwargs)
+
+    def age_s(self):
+        return None if self.received_ms is None else time.time() - self.received_ms / 1000
+
+    def features(self):
+        """盘口特征（按版本缓存）；未同步或一侧为空时返回None"""
+        with self._lock:
+            if not self.synced or not self._prices['bids'] or not self._prices['asks']:
+                return None
+            if self._features_version != self.version:
+                self._features = self._compute()
+                self._features_version = self.version
+            return self._features
+
+    def _compute(self):
+        bid, bid_size = self._prices['bids'][-1], self._levels['bids'][self._prices['bids'][-1]][0]
+        ask, ask_size = self._prices['asks'][0], self._levels['asks'][self._prices['asks'][0]][0]
+        mid = (bid + ask) / 2
+        top = {side: self._top(side, self.depth_levels) for side in SIDES}
+        top_qty = {side: sum(level[1] for level in top[side]) for side in SIDES}
+
+        # 中间价上下band_bps范围内的挂单量（有序价格列表上二分定位边界）
+        band = mid * self.band_bps / 10000
+        bid_prices, ask_prices = self._prices['bids'], self._prices['asks']
+        band_qty = {
+            'bids': sum(self._levels['bids'][p][0] for p in bid_prices[bisect_left(bid_prices, mid - band):]),
+            'asks': sum(self._levels['asks'][p][0] for p in ask_prices[:bisect_right(ask_prices, mid + band)]),
+        }
+
+        def imbalance(qty):
+            total = qty['bids'] + qty['asks']
+            return (qty['bids'] - qty['asks']) / total if total else 0.0
+
+        def wall(side):
+            sizes = sorted(level[1] for level in top[side])
+            if len(sizes) < 3:
+                return None
+            median = sizes[len(sizes) // 2]
+            price, size = max(((level[0], level[1]) for level in top[side]), key=lambda level: level[1])
+            if size < median * self.wall_multiple:
+                return None
+            return {'price': price, 'size': size, 'distance_bps': round(abs(price - mid) / mid * 10000, 2),
+                    'multiple': round(size / median, 1)}
+
+        return {
+            'ts': self.ts,
+            'bid': bid,
+            'ask': ask,
+            'mid': mid,
+            'spread': ask - bid,
+            'spread_bps': (ask - bid) / mid * 10000,
+            'microprice': (bid * ask_size + ask * bid_size) / (bid_size + ask_size),
+            'imbalance_top': imbalance(top_qty),
+            'imbalance_band': imbalance(band_qty),
+            'imbalance_book': imbalance(self._totals),
+            'bid_depth': top_qty['bids'],
+            'ask_depth': top_qty['asks'],
+            'bid_wall': wall('bids'),
+            'ask_wall': wall('asks'),
+        }
+
+
+class BookFeed:
+    """后台线程维护盘口: OKX用websocket原始增量，其他交易所或推送中断时定时拉取REST快照"""
+
+    def __init__(self, exchange_id, symbol, book, rest_exchange=None, markets=None, record_path=None,
+                 poll_interval_s=2.0, retry_after_s=30.0, poll_limit=100, resync_delay_s=1.0):
+        self.exchange_id = exchange_id
+        self.symbol = symbol
+        self.book = book
+        self.rest_exchange = rest_exchange
+        self.markets = markets
+        self.record_path = record_path
+        self.poll_interval_s = poll_interval_s
+        self.retry_after_s = retry_after_s
+        self.poll_limit = poll_limit
+        self.resync_delay_s = resync_delay_s  # 重新订阅前的等待，快照本身校验失败时不会密集重连
+        self.resyncs = 0
+        self.source = None  # 'stream' / 'poll'
+        self._record = None
+        self._record_lock = threading.Lock()  # stop()关闭文件时推送线程可能正在写
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='order-book', daemon=True)
+
+    def start(self):
+        if self.record_path:
+            # 行缓冲：每条推送写完即落盘，进程被杀时录制也是完整的若干行
+            self._record = open(self.record_path, 'a', encoding='utf-8', buffering=1)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._record_lock:
+            if self._record is not None:
+                self._record.close()
+                self._record = None
+
+    def _on_message(self, message):
+        self.source = 'stream'
+        with self._record_lock:
+            if self._record is not None:
+                self._record.write(json.dumps({'recv_ms': int(time.time() * 1000), 'message': message},
+                                              separators=(',', ':')) + "\n")
+        try:
+            self.book.on_okx_message(message)
+        except Exception as e:
+            log.error(f"处理盘口推送失败: {e}", exc_info=True, extra=event('error'))
+
+    def _poll_for(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            try:
+                ob = self.rest_exchange.fetch_order_book(self.symbol, self.poll_limit)
+                self.book.apply_snapshot(ob['bids'], ob['asks'], ts=ob.get('timestamp'))
+                self.source = 'poll'
+            except Exception as e:
+                log.warning(f"拉取盘口快照失败: {e}", extra=event('error'))
+            self._stop.wait(self.poll_interval_s)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.exchange_id == 'okx':
+                try:
+                    asyncio.run(self._stream())
+                except Exception as e:
+                    log.warning(f"盘口推送中断，{self.retry_after_s:.0f}秒内改用快照轮询: {e}", extra=event('error'))
+            if self.rest_exchange is None:
+                self._stop.wait(self.retry_after_s)
+            else:
+                self._poll_for(self.retry_after_s if self.exchange_id == 'okx' else float('inf'))
+
+    async def _connect(self):
+        import ccxt.pro
+
+        feed = self
+
+        class RawBookClient(ccxt.pro.okx):
+            # ccxt.pro自己也维护一份盘口；在它处理之前把原始消息交给本地盘口
+            def handle_order_book(self, client, message):
+                feed._on_message(message)
+                return super().handle_order_book(client, message)
+
+        client = RawBookClient()
+        if self.markets:
+            client.set_markets(self.markets)
+        else:
+            await client.load_markets()
+        return client
+
+    async def _stream(self):
+        while not self._stop.is_set():
+            client = await self._connect()
+            try:
+                while not self._stop.is_set():
+                    await client.watch_order_book(self.symbol)
+                    if not self.book.synced:
+                        break  # 同一个订阅上不会再有快照
+            finally:
+                await client.close()
+            if not self._stop.is_set():
+                self.resyncs += 1
+                log.warning(f"盘口失步，重新订阅以获取新快照（第{self.resyncs}次）",
+                            extra=event('market', book='resync', resyncs=self.resyncs))
+                await asyncio.sleep(self.resync_delay_s)
+
+
+def replay(path, book=None):
+    """把录制的原始盘口消息按顺序喂给盘口，返回 (盘口, 每条消息处理耗时秒数列表)"""
+    book = book or L2Book()
+    durations = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            message = json.loads(line)['message']
+            started = time.perf_counter()
+            book.on_okx_message(message)
+            book.features()
+            durations.append(time.perf_counter() - started)
+    return book, durations
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print(__doc__)
+        return 2
+    book, durations = replay(argv[0])
+    durations.sort()
+    print(f"消息 {len(durations)} 条，统计 {book.stats}，当前{'已同步' if book.synced else '失步'}")
+    if durations:
+        print(f"每条消息处理+特征计算: p50 {durations[len(durations) // 2] * 1e6:.1f}µs, "
+              f"p99 {durations[int(len(durations) * 0.99)] * 1e6:.1f}µs")
+    print(json.dumps(book.features(), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,467 @@
+"""
+模拟交易所（纸面交易）
+
+实现机器人用到的ccxt方法子集：fetch_ohlcv、fetch_positions、fetch_open_orders、
+create_limit_order、create_market_order、cancel_order、set_leverage、fetch_balance。
+
+条件单按ccxt统一参数 stopLossPrice / takeProfitPrice 下单（可同时给出，即OCO）：
+不进挂单簿，价格穿越触发价时以市价成交；与OKX策略委托一样，
+fetch_open_orders 需传 params={'trigger': True} 才返回条件单。
+
+内部是按价格-时间优先的撮合引擎：
+- 挂单簿：买单按价格从高到低、卖单按价格从低到高，同价按下单先后
+- 回放K线时按 开->低->高->收（阴线为 开->高->低->收）的路径逐段撮合
+- 可配置挂单/吃单手续费、市价滑点（基点）和下单延迟（毫秒）
+- 可由回放K线驱动（回测），也可轮询真实交易所的1分钟K线驱动（实盘纸面交易）
+
+时间全部来自时钟对象：回测用SimClock（sleep只推进时间），纸面实盘用WallClock。
+"""
+import bisect
+import functools
+import itertools
+import threading
+import time
+from datetime import datetime, timezone
+
+import ccxt
+
+
+TIMEFRAME_MS = {
+    '1m': 60_000,
+    '5m': 300_000,
+    '15m': 900_000,
+    '1h': 3_600_000,
+    '4h': 14_400_000,
+    '1d': 86_400_000,
+}
+
+
+class SimClock:
+    """模拟时钟：替换机器人模块里的time，sleep只推进时间不阻塞"""
+
+    def __init__(self, start_ms=0):
+        self.now_ms = int(start_ms)
+
+    def time(self):
+        return self.now_ms / 1000
+
+    def monotonic(self):
+        return self.now_ms / 1000
+
+    def perf_counter(self):
+        return self.now_ms / 1000
+
+    def sleep(self, seconds):
+        self.now_ms += int(seconds * 1000)
+
+    def advance_to(self, ts_ms):
+        # 机器人内部的sleep可能已经把时钟推过了目标时间
+        self.now_ms = max(self.now_ms, int(ts_ms))
+
+    def strftime(self, fmt='%Y-%m-%d %H:%M:%S'):
+        return datetime.fromtimestamp(self.time(), timezone.utc).strftime(fmt)
+
+    def datetime_class(self):
+        """返回now()读取模拟时钟的datetime类（UTC，无时区信息）"""
+        clock = self
+
+        class SimDatetime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                dt = datetime.fromtimestamp(clock.time(), timezone.utc)
+                return dt.astimezone(tz) if tz else dt.replace(tzinfo=None)
+
+        return SimDatetime
+
+
+class WallClock:
+    """真实时钟，纸面实盘交易使用"""
+
+    @property
+    def now_ms(self):
+        return int(time.time() * 1000)
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+def _locked(method):
+    """本地止损线程和交易周期可能同时下单，公开方法串行执行"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _polled(method):
+    """先在锁外轮询行情，再持锁执行：网络请求期间不阻塞其他线程下单"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self.poll()
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class PaperExchange:
+    """单向持仓（净持仓）模式的模拟永续合约交易所"""
+
+    def __init__(self, clock, symbol='BTC/USDT:USDT', initial_balance=10000.0, contract_size=0.01,
+                 leverage=15, maker_fee=0.0002, taker_fee=0.0005, slippage_bps=0.0, latency_ms=0,
+                 candles=None, market_data=None):
+        self.clock = clock
+        self.symbol = symbol
+        self.contract_size = contract_size
+        self.leverage = leverage
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.slippage_bps = slippage_bps
+        self.latency_ms = latency_ms
+        # {timeframe: [[ts, o, h, l, c, v], ...]} 供fetch_ohlcv回放
+        self.candles = candles or {}
+        # 纸面实盘：行情从真实交易所读取，下单只在本地撮合
+        self.market_data = market_data
+        self._last_poll_ms = None
+
+        self.wallet = float(initial_balance)
+        self.position_qty = 0.0  # 带符号的合约张数，多为正空为负
+        self.entry_price = 0.0
+        self.last_price = None
+        self.orders = {}  # 所有未完成订单（含尚未到达交易所的）
+        self._history = {}  # 全部订单（含已成交/已撤销），供fetch_order查询
+        self._bids = []  # [(-price, seq, id)]
+        self._asks = []  # [(price, seq, id)]
+        self._in_flight = []  # [(到达时间, seq, id)]
+        self._triggers = []  # 已生效、等待触发的条件单id
+        self.fills = []
+        self.total_fees = 0.0
+        self.realized_pnl = 0.0
+        self._seq = itertools.count(1)
+        self._lock = threading.RLock()
+        self._poll_lock = threading.Lock()  # 同一时间只有一个线程拉取行情，避免重复回放
+
+    # ---- 行情驱动 ----
+
+    @_locked
+    def on_bar(self, ts_ms, open_, high, low, close):
+        """用一根K线撮合：按K线内的价格路径逐段推进"""
+        path = (open_, low, high, close) if close >= open_ else (open_, high, low, close)
+        for price in path:
+            self.on_price(price, ts_ms)
+
+    @_locked
+    def on_price(self, price, ts_ms):
+        """处理一个成交价事件：先让到达的订单生效，再撮合被穿越的挂单"""
+        self.last_price = price
+        self._activate_arrived(ts_ms)
+        self._match_book(price, ts_ms)
+        self._check_triggers(price, ts_ms)
+
+    def poll(self):
+        """纸面实盘：把上次轮询以来的1分钟K线回放进撮合引擎；K线在撮合锁外拉取，只有回放时持锁"""
+        if self.market_data is None:
+            return
+        with self._poll_lock:
+            now = self.clock.now_ms
+            if self._last_poll_ms is not None and now - self._last_poll_ms < 1000:
+                return
+            # 从上次轮询所在的那一分钟开始取；未收盘的当前分钟会被重复回放，只影响同一分钟内的精度
+            since = self._last_poll_ms - self._last_poll_ms % TIMEFRAME_MS['1m'] if self._last_poll_ms else None
+            rows = self.market_data.fetch_ohlcv(self.symbol, '1m', since=since, limit=None if since else 1)
+            with self._lock:
+                for ts, o, h, l, c, _ in rows:
+                    self.on_bar(min(ts + TIMEFRAME_MS['1m'], now), o, h, l, c)
+            self._last_poll_ms = now
+
+    # ---- ccxt接口 ----
+
+    @_locked
+    def set_leverage(self, leverage, symbol=None, params=None):
+        self.leverage = leverage
+        return {'leverage': leverage}
+
+    @_polled
+    def fetch_balance(self, params=None):
+        used = self._used_margin()
+        total = self.wallet + self.unrealized_pnl()
+        usdt = {'free': total - used, 'used': used, 'total': total}
+        return {'USDT': usdt, 'free': {'USDT': usdt['free']}, 'used': {'USDT': used}, 'total': {'USDT': total}}
+
+    def fetch_ohlcv(self, symbol, timeframe='5m', since=None, limit=None, params=None):
+        if self.market_data is not None:
+            self.poll()
+            return self.market_data.fetch_ohlcv(symbol, timeframe, since=since, limit=limit)
+        with self._lock:
+            rows = self.candles.get(timeframe, [])
+            tf_ms = TIMEFRAME_MS[timeframe]
+            # 只返回在当前模拟时间已收盘的K线
+            closed = [row for row in rows if row[0] + tf_ms <= self.clock.now_ms and (since is None or row[0] >= since)]
+        return closed[-limit:] if limit else closed
+
+    @_polled
+    def fetch_positions(self, symbols=None, params=None):
+        if self.position_qty == 0:
+            return []
+        return [{
+            'symbol': self.symbol,
+            'side': 'long' if self.position_qty > 0 else 'short',
+            'contracts': abs(self.position_qty),
+            'contractSize': self.contract_size,
+            'entryPrice': self.entry_price,
+            'markPrice': self.last_price,
+            'unrealizedPnl': self.unrealized_pnl(),
+            'leverage': self.leverage,
+            'info': {},
+        }]
+
+    @_polled
+    def fetch_ticker(self, symbol, params=None):
+        if self.last_price is None:
+            raise ccxt.ExchangeNotAvailable("模拟交易所尚无行情")
+        return {'symbol': symbol, 'timestamp': self.clock.now_ms, 'last': self.last_price,
+                'bid': self.last_price, 'ask': self.last_price, 'close': self.last_price}
+
+    @_polled
+    def fetch_order(self, id, symbol=None, params=None):
+        order = self._history.get(id)
+        if order is None:
+            raise ccxt.OrderNotFound(f"订单不存在: {id}")
+        return self._public(order)
+
+    @_polled
+    def fetch_open_orders(self, symbol=None, since=None, limit=None, params=None):
+        trigger = bool((params or {}).get('trigger'))
+        return [self._public(order) for order in sorted(self.orders.values(), key=lambda o: o['_seq'])
+                if order['_trigger'] == trigger]
+
+    @_polled
+    def create_order(self, symbol, type, side, amount, price=None, params=None):
+        params = params or {}
+        if amount is None or amount <= 0:
+            raise ccxt.InvalidOrder(f"无效的下单数量: {amount}")
+        if type == 'limit' and (price is None or price <= 0):
+            raise ccxt.InvalidOrder(f"无效的挂单价格: {price}")
+        stop_loss, take_profit = params.get('stopLossPrice'), params.get('takeProfitPrice')
+        trigger = stop_loss is not None or take_profit is not None
+        if trigger and type != 'market':
+            raise ccxt.NotSupported("模拟交易所的条件单只支持触发后市价成交")
+        if self.last_price is None:
+            raise ccxt.ExchangeNotAvailable("模拟交易所尚无行情")
+
+        seq = next(self._seq)
+        order = {
+            'id': str(seq),
+            'symbol': symbol,
+            'type': type,
+            'side': side,
+            'amount': float(amount),
+            'price': float(price) if price is not None else None,
+            'status': 'open',
+            'filled': 0.0,
+            'average': None,
+            'timestamp': self.clock.now_ms,
+            'lastTradeTimestamp': None,
+            'reduceOnly': bool(params.get('reduceOnly')),
+            'stopLossPrice': float(stop_loss) if stop_loss is not None else None,
+            'takeProfitPrice': float(take_profit) if take_profit is not None else None,
+            'info': {'tag': params.get('tag', '')},
+            '_seq': seq,
+            '_trigger': trigger,
+        }
+        # 条件单下单时可能还没有持仓（挂单入场时同时设置止盈止损），触发时再裁剪
+        if order['reduceOnly'] and not trigger:
+            self._clamp_reduce_only(order)
+        self._check_margin(order)
+
+        self.orders[order['id']] = order
+        self._history[order['id']] = order
+        if self.latency_ms > 0:
+            # 订单在途：到达时间之后的第一个价格事件才生效
+            bisect.insort(self._in_flight, (self.clock.now_ms + self.latency_ms, seq, order['id']))
+        else:
+            self._activate(order, self.clock.now_ms)
+        return self._public(order)
+
+    def create_limit_order(self, symbol, side, amount, price, params=None):
+        return self.create_order(symbol, 'limit', side, amount, price, params)
+
+    def create_market_order(self, symbol, side, amount, price=None, params=None):
+        return self.create_order(symbol, 'market', side, amount, None, params)
+
+    def create_market_buy_order(self, symbol, amount, params=None):
+        return self.create_order(symbol, 'market', 'buy', amount, None, params)
+
+    def create_market_sell_order(self, symbol, amount, params=None):
+        return self.create_order(symbol, 'market', 'sell', amount, None, params)
+
+    @_polled
+    def cancel_order(self, id, symbol=None, params=None):
+        order = self.orders.pop(id, None)
+        if order is None:
+            raise ccxt.OrderNotFound(f"订单不存在: {id}")
+        self._remove_from_book(order)
+        self._in_flight = [item for item in self._in_flight if item[2] != id]
+        if id in self._triggers:
+            self._triggers.remove(id)
+        order['status'] = 'canceled'
+        return self._public(order)
+
+    # ---- 账户计算 ----
+
+    def unrealized_pnl(self):
+        if self.position_qty == 0 or self.last_price is None:
+            return 0.0
+        return self.position_qty * self.contract_size * (self.last_price - self.entry_price)
+
+    def equity(self):
+        return self.wallet + self.unrealized_pnl()
+
+    def _used_margin(self):
+        return abs(self.position_qty) * self.contract_size * self.entry_price / self.leverage
+
+    # ---- 撮合引擎 ----
+
+    def _activate_arrived(self, ts_ms):
+        while self._in_flight and self._in_flight[0][0] <= ts_ms:
+            _, _, order_id = self._in_flight.pop(0)
+            order = self.orders.get(order_id)
+            if order is not None:
+                self._activate(order, ts_ms)
+
+    def _activate(self, order, ts_ms):
+        """订单到达交易所：市价单和可立即成交的限价单吃单，其余进入挂单簿"""
+        price = self.last_price
+        if order['_trigger']:
+            self._triggers.append(order['id'])
+            self._check_triggers(price, ts_ms)  # 生效时已越过触发价则立即触发
+        elif order['type'] == 'market':
+            self._fill(order, self._slipped(order['side'], price), ts_ms, 'taker')
+        elif (order['side'] == 'buy' and order['price'] >= price) or (order['side'] == 'sell' and order['price'] <= price):
+            # 限价保护：滑点后的成交价不超过限价
+            slipped = self._slipped(order['side'], price)
+            fill_price = min(slipped, order['price']) if order['side'] == 'buy' else max(slipped, order['price'])
+            self._fill(order, fill_price, ts_ms, 'taker')
+        elif order['side'] == 'buy':
+            bisect.insort(self._bids, (-order['price'], order['_seq'], order['id']))
+        else:
+            bisect.insort(self._asks, (order['price'], order['_seq'], order['id']))
+
+    def _match_book(self, price, ts_ms):
+        """价格穿越挂单价时按价格-时间优先逐个成交（挂单以挂单价成交）"""
+        while self._bids and -self._bids[0][0] >= price:
+            _, _, order_id = self._bids.pop(0)
+            order = self.orders.get(order_id)
+            if order is not None:
+                self._fill(order, order['price'], ts_ms, 'maker')
+        while self._asks and self._asks[0][0] <= price:
+            _, _, order_id = self._asks.pop(0)
+            order = self.orders.get(order_id)
+            if order is not None:
+                self._fill(order, order['price'], ts_ms, 'maker')
+
+    def _check_triggers(self, price, ts_ms):
+        """平多的卖单：跌到止损价或涨到止盈价触发；平空的买单相反。触发后以当前价市价成交"""
+        for order_id in list(self._triggers):
+            order = self.orders.get(order_id)
+            if order is None:
+                self._triggers.remove(order_id)
+                continue
+            sell = order['side'] == 'sell'
+            stop, take = order['stopLossPrice'], order['takeProfitPrice']
+            hit_stop = stop is not None and (price <= stop if sell else price >= stop)
+            hit_take = take is not None and (price >= take if sell else price <= take)
+            if hit_stop or hit_take:
+                self._triggers.remove(order_id)
+                order['triggered'] = 'stop_loss' if hit_stop else 'take_profit'
+                order['triggerTimestamp'] = ts_ms
+                self._fill(order, self._slipped(order['side'], price), ts_ms, 'taker')
+
+    def _remove_from_book(self, order):
+        if order['price'] is None:
+            return
+        book, key = (self._bids, -order['price']) if order['side'] == 'buy' else (self._asks, order['price'])
+        i = bisect.bisect_left(book, (key, order['_seq'], order['id']))
+        if i < len(book) and book[i][2] == order['id']:
+            book.pop(i)
+
+    def _slipped(self, side, price):
+        slip = price * self.slippage_bps / 10000
+        return price + slip if side == 'buy' else price - slip
+
+    def _clamp_reduce_only(self, order):
+        closing_side = 'sell' if self.position_qty > 0 else 'buy'
+        if self.position_qty == 0 or order['side'] != closing_side:
+            raise ccxt.InvalidOrder("reduceOnly订单不会减少持仓")
+        order['amount'] = min(order['amount'], abs(self.position_qty))
+
+    def _check_margin(self, order):
+        if order['reduceOnly']:
+            return
+        # 反向订单先抵消现有持仓，只有超出部分需要保证金
+        opening = order['amount']
+        if self.position_qty and (order['side'] == 'buy') != (self.position_qty > 0):
+            opening = max(0.0, opening - abs(self.position_qty))
+        price = order['price'] or self.last_price
+        required = opening * self.contract_size * price / self.leverage
+        # 下单前已轮询过行情，这里直接按当前账户计算，不再拉取一次
+        if required > self.equity() - self._used_margin():
+            raise ccxt.InsufficientFunds(f"保证金不足: 需要{required:.2f}USDT")
+
+    def _fill(self, order, price, ts_ms, liquidity):
+        self.orders.pop(order['id'], None)
+        qty = order['amount'] if order['side'] == 'buy' else -order['amount']
+        if order['reduceOnly']:
+            # 挂单期间持仓可能已变化，重新裁剪；已无可减持仓则撤单
+            if self.position_qty == 0 or (qty > 0) == (self.position_qty > 0):
+                order['status'] = 'canceled'
+                return
+            qty = min(qty, -self.position_qty) if qty > 0 else max(qty, -self.position_qty)
+
+        fee_rate = self.maker_fee if liquidity == 'maker' else self.taker_fee
+        fee = abs(qty) * self.contract_size * price * fee_rate
+        realized = 0.0
+        pos = self.position_qty
+        new_pos = round(pos + qty, 10)  # 避免浮点残差留下极小持仓
+        if pos == 0 or (pos > 0) == (qty > 0):
+            self.entry_price = (abs(pos) * self.entry_price + abs(qty) * price) / abs(new_pos)
+        else:
+            closed = min(abs(qty), abs(pos))
+            realized = closed * self.contract_size * (price - self.entry_price) * (1 if pos > 0 else -1)
+            if new_pos == 0:
+                self.entry_price = 0.0
+            elif (new_pos > 0) != (pos > 0):
+                # 反手：剩余部分以成交价开新仓
+                self.entry_price = price
+        self.position_qty = new_pos
+        self.wallet += realized - fee
+        self.realized_pnl += realized
+        self.total_fees += fee
+
+        order.update({'status': 'closed', 'filled': abs(qty), 'average': price, 'lastTradeTimestamp': ts_ms})
+        self.fills.append({
+            'timestamp': ts_ms,
+            'order_id': order['id'],
+            'type': order['type'],
+            'side': order['side'],
+            'amount': abs(qty),
+            'price': price,
+            'fee': fee,
+            'liquidity': liquidity,
+            'realized_pnl': realized,
+            'reduce_only': order['reduceOnly'],
+            'tag': order['info'].get('tag', ''),
+            'trigger': order.get('triggered'),  # 条件单触发原因: stop_loss / take_profit
+            'position_after': self.position_qty,
+        })
+
+    @staticmethod
+    def _public(order):
+        return {k: v for k, v in order.items() if not k.startswith('_')}
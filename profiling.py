@@ -0,0 +1,228 @@
+"""
+按需性能剖析
+
+平时不做任何剖析，只有被"武装"后才剖析接下来的N个交易周期:
+- 启动时设置环境变量 BOT_PROFILE_CYCLES=N
+- 运行中发送信号 kill -USR1 <pid>（每次武装 TRADE_CONFIG['profiling']['signal_cycles'] 个周期）
+
+每个被剖析的周期输出到 logs/profiles/，文件名带时间戳:
+    cycle-<时间>-<序号>.prof / .txt    cProfile统计（.prof可用pstats/snakeviz打开，.txt为按累计耗时前40项）
+    cycle-<时间>-<序号>.collapsed      采样模式的折叠栈（可直接喂给flamegraph.pl/speedscope）
+    cycle-<时间>-<序号>.mem.txt        tracemalloc本周期内存分配前30项，以及DataFrame、历史列表等对象的实际大小
+
+采样模式由后台线程每隔sample_interval_ms读取一次主线程调用栈，开销与周期长度无关，适合排查长达数十秒的周期；
+cProfile为确定性剖析，数据精确但会让周期本身变慢。
+"""
+import cProfile
+import io
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from bars import Bars
+from event_log import event, log
+
+
+class _NoopCycle:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopCycle()
+
+
+def object_size(obj, seen=None):
+    """对象的深度大小（字节）；DataFrame用memory_usage(deep=True)，Bars用nbytes()"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, Bars):
+        return obj.nbytes()
+    if hasattr(obj, 'memory_usage') and hasattr(obj, 'columns'):
+        return int(obj.memory_usage(deep=True).sum())
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(object_size(k, seen) + object_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(object_size(item, seen) for item in obj)
+    return size
+
+
+class _Sampler:
+    """后台线程定时采样目标线程的调用栈，统计折叠栈出现次数"""
+
+    def __init__(self, interval_s, thread_id):
+        self.interval_s = interval_s
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='cycle-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+class _ProfiledCycle:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def __enter__(self):
+        owner = self.owner
+        owner.remaining -= 1
+        owner.captured += 1
+        self.index = owner.captured
+        self.started = time.perf_counter()
+        self.label = f"cycle-{time.strftime('%Y%m%d-%H%M%S')}-{self.index}"
+        owner._watched = {}
+
+        if owner.tracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(owner.tracemalloc_frames)
+                owner._started_tracemalloc = True
+            self.baseline = tracemalloc.take_snapshot()
+
+        if owner.mode == 'sampling':
+            self.sampler = _Sampler(owner.sample_interval_ms / 1000, threading.get_ident())
+            self.sampler.start()
+        else:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        owner = self.owner
+        if owner.mode == 'sampling':
+            self.sampler.stop()
+        else:
+            self.profile.disable()
+        elapsed = time.perf_counter() - self.started
+        # 先取内存快照，避免把写剖析结果时的分配算进去
+        snapshot = tracemalloc.take_snapshot() if owner.tracemalloc else None
+
+        try:
+            os.makedirs(owner.out_dir, exist_ok=True)
+            base = os.path.join(owner.out_dir, self.label)
+            files = self._write_cpu(base) if owner.mode != 'sampling' else self._write_samples(base)
+            if snapshot is not None:
+                files.append(self._write_memory(base, snapshot))
+            log.info(f"已剖析第 {self.index} 个周期（{elapsed:.2f}s），结果: {', '.join(files)}",
+                     extra=event('system', profile_files=files, elapsed_s=elapsed))
+        except OSError as e:
+            log.error(f"写入剖析结果失败: {e}", extra=event('error'))
+        finally:
+            owner._watched = None
+            if owner.remaining <= 0 and owner._started_tracemalloc:
+                tracemalloc.stop()
+                owner._started_tracemalloc = False
+        return False
+
+    def _write_cpu(self, base):
+        self.profile.dump_stats(base + '.prof')
+        text = io.StringIO()
+        pstats.Stats(self.profile, stream=text).sort_stats('cumulative').print_stats(40)
+        with open(base + '.txt', 'w', encoding='utf-8') as f:
+            f.write(text.getvalue())
+        return [base + '.prof', base + '.txt']
+
+    def _write_samples(self, base):
+        with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+            for stack, count in self.sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return [base + '.collapsed']
+
+    def _write_memory(self, base, snapshot):
+        # 排除剖析器自身的分配
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, path) for path in
+                                           (tracemalloc.__file__, cProfile.__file__, pstats.__file__, __file__)])
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"tracemalloc: 当前 {current / 1024:.1f} KiB, 峰值 {peak / 1024:.1f} KiB", "",
+                 "本周期新增分配（前30项）:"]
+        lines += [str(stat) for stat in snapshot.compare_to(self.baseline, 'lineno')[:30]]
+        lines += ["", "对象大小:"]
+        for name, obj in (self.owner._watched or {}).items():
+            size = object_size(obj)
+            count = f", {len(obj)} 项" if hasattr(obj, '__len__') else ""
+            lines.append(f"  {name}: {size / 1024:.1f} KiB{count}")
+        with open(base + '.mem.txt', 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        return base + '.mem.txt'
+
+
+class CycleProfiler:
+    """剖析被武装后的接下来N个周期；未武装时cycle()返回空上下文"""
+
+    def __init__(self, out_dir='logs/profiles', mode='cprofile', sample_interval_ms=5, tracemalloc=True,
+                 tracemalloc_frames=10):
+        self.out_dir = out_dir
+        self.mode = mode
+        self.sample_interval_ms = sample_interval_ms
+        self.tracemalloc = tracemalloc
+        self.tracemalloc_frames = tracemalloc_frames
+        self.remaining = 0
+        self.captured = 0
+        self._watched = None
+        self._started_tracemalloc = False
+
+    def configure(self, dir=None, mode=None, sample_interval_ms=None, tracemalloc=None):
+        if dir is not None:
+            self.out_dir = dir
+        if mode is not None:
+            if mode not in ('cprofile', 'sampling'):
+                raise ValueError(f"未知的剖析模式: {mode}，可选 cprofile/sampling")
+            self.mode = mode
+        if sample_interval_ms is not None:
+            self.sample_interval_ms = sample_interval_ms
+        if tracemalloc is not None:
+            self.tracemalloc = tracemalloc
+
+    def arm(self, cycles):
+        """剖析接下来的cycles个周期（信号处理函数里也只做这一步）"""
+        self.remaining = max(self.remaining, 0) + cycles
+
+    def install_signal(self, cycles, signum=None):
+        """收到信号（默认SIGUSR1）时武装；不支持该信号的平台直接跳过"""
+        signum = signum or getattr(signal, 'SIGUSR1', None)
+        if signum is None:
+            return False
+        signal.signal(signum, lambda *_: self.arm(cycles))
+        return True
+
+    def cycle(self):
+        if self.remaining <= 0:
+            return _NOOP
+        return _ProfiledCycle(self)
+
+    def watch(self, **objects):
+        """登记要在内存报告里统计大小的对象（只在剖析中的周期里保存引用）"""
+        if self._watched is not None:
+            self._watched.update(objects)
+
+
+# 全局默认剖析器，由机器人按TRADE_CONFIG['profiling']配置
+profiler = CycleProfiler()
@@ -0,0 +1,293 @@
+"""
+止盈止损保护
+
+之前止损用普通限价单挂在止损价：多头的卖出止损价低于市价，一挂出去就立即成交；
+跳空时价格直接越过限价，止损又可能挂着不成交。这里提供两种真正的条件触发:
+
+native  交易所条件单：ccxt统一参数 stopLossPrice/takeProfitPrice + reduceOnly，
+        两个都给时OKX下成一个OCO策略委托，触发后市价平仓，由交易所撮合引擎盯价
+local   本地盯价：PriceFeed推送最新成交价（ccxt.pro websocket，推送中断时退回REST轮询），
+        LocalStopWatcher在价格越过止损/止盈价时立即下reduceOnly市价单
+
+native下单被拒（交易所或账户不支持）时自动退回local。
+
+local模式的反应耗时逐次记录:
+    feed_lag_ms       交易所成交时间 -> 本地收到推送
+    detect_ms         收到推送 -> 判断触发、开始下单
+    submit_to_ack_ms  下单 -> 交易所确认
+    reaction_ms       收到推送 -> 交易所确认（tracer里的stop_reaction分位数）
+行情推送超过stale_after_s没有更新时每poll_interval_s用REST查一次，反应时间上限约为
+轮询间隔加一次往返。
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+
+import ccxt
+
+from event_log import event, log
+
+MODES = ('native', 'local')
+
+
+class PriceFeed:
+    """后台线程推送最新成交价: on_price(价格, 交易所时间ms, 本地接收perf_counter, 本地接收ms)"""
+
+    def __init__(self, exchange_id, symbol, on_price, rest_exchange, stream=True, poll_interval_s=1.0,
+                 stale_after_s=3.0, retry_after_s=30.0, markets=None):
+        self.exchange_id = exchange_id
+        self.markets = markets  # 已加载的市场信息，传入后推送客户端不必再请求一次
+        self.symbol = symbol
+        self.on_price = on_price
+        self.rest_exchange = rest_exchange
+        self.stream = stream
+        self.poll_interval_s = poll_interval_s
+        self.stale_after_s = stale_after_s
+        self.retry_after_s = retry_after_s
+        self.source = None  # 'stream' / 'poll'
+        self.last_tick_ms = None
+        self.ticks = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='price-feed', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _emit(self, price, tick_ms, source):
+        if price is None:
+            return
+        recv_perf, recv_ms = time.perf_counter(), int(time.time() * 1000)
+        self.source = source
+        self.last_tick_ms = recv_ms
+        self.ticks += 1
+        try:
+            self.on_price(float(price), tick_ms or recv_ms, recv_perf, recv_ms)
+        except Exception as e:
+            log.error(f"处理行情推送失败: {e}", exc_info=True, extra=event('error'))
+
+    def _poll_once(self):
+        try:
+            ticker = self.rest_exchange.fetch_ticker(self.symbol)
+            self._emit(ticker.get('last'), ticker.get('timestamp'), 'poll')
+        except Exception as e:
+            log.warning(f"轮询行情失败: {e}", extra=event('error'))
+
+    def _poll_for(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            self._poll_once()
+            self._stop.wait(self.poll_interval_s)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.stream:
+                try:
+                    asyncio.run(self._stream())
+                except Exception as e:
+                    log.warning(f"行情推送中断，{self.retry_after_s:.0f}秒内改用轮询: {e}", extra=event('error'))
+            self._poll_for(self.retry_after_s if self.stream else float('inf'))
+
+    async def _stream(self):
+        import ccxt.pro
+
+        client = getattr(ccxt.pro, self.exchange_id)()
+        if self.markets:
+            client.set_markets(self.markets)
+        else:
+            await client.load_markets()
+        pending = None
+        loop = asyncio.get_running_loop()
+        try:
+            while not self._stop.is_set():
+                if pending is None:
+                    pending = asyncio.ensure_future(client.watch_ticker(self.symbol))
+                done, _ = await asyncio.wait({pending}, timeout=self.stale_after_s)
+                if done:
+                    ticker, pending = pending.result(), None
+                    self._emit(ticker.get('last'), ticker.get('timestamp'), 'stream')
+                else:
+                    # 推送卡住时不等它恢复，先用REST补一次价格
+                    await loop.run_in_executor(None, self._poll_once)
+        finally:
+            if pending is not None:
+                pending.cancel()
+            await client.close()
+
+
+class LocalStopWatcher:
+    """本地止损/止盈：价格越过触发价时下reduceOnly市价单，每次只触发一次"""
+
+    def __init__(self, symbol, stop_tag, take_profit_tag, tracer=None, history=200):
+        self.symbol = symbol
+        self.tags = {'stop_loss': stop_tag, 'take_profit': take_profit_tag}
+        self.tracer = tracer
+        self.armed = None
+        self.reactions = deque(maxlen=history)
+        self.triggered = {'stop_loss': 0, 'take_profit': 0}
+        self._lock = threading.Lock()
+
+    def arm(self, exchange, position_side, amount, stop_loss, take_profit):
+        with self._lock:
+            self.armed = {'exchange': exchange, 'side': position_side, 'amount': amount,
+                          'stop_loss': stop_loss, 'take_profit': take_profit}
+
+    def disarm(self):
+        with self._lock:
+            self.armed = None
+
+    def on_price(self, price, tick_ms, recv_perf, recv_ms):
+        with self._lock:
+            armed = self.armed
+            if armed is None:
+                return
+            long = armed['side'] == 'long'
+            stop, take = armed['stop_loss'], armed['take_profit']
+            if stop is not None and (price <= stop if long else price >= stop):
+                kind, trigger_price = 'stop_loss', stop
+            elif take is not None and (price >= take if long else price <= take):
+                kind, trigger_price = 'take_profit', take
+            else:
+                return
+            self.armed = None
+        self._fire(armed, kind, trigger_price, price, tick_ms, recv_perf, recv_ms)
+
+    def _has_position(self, armed):
+        """武装方向的持仓是否还在；查询失败返回None"""
+        try:
+            positions = armed['exchange'].fetch_positions([self.symbol])
+        except Exception as e:
+            log.warning(f"查询持仓失败: {e}", extra=event('error'))
+            return None
+        return any(pos['symbol'] == self.symbol and float(pos.get('contracts') or 0) > 0
+                   and pos.get('side') == armed['side'] for pos in positions)
+
+    def _fire(self, armed, kind, trigger_price, price, tick_ms, recv_perf, recv_ms):
+        close_side = 'sell' if armed['side'] == 'long' else 'buy'
+        submit = time.perf_counter()
+        try:
+            order = armed['exchange'].create_market_order(self.symbol, close_side, armed['amount'],
+                                                          params={'reduceOnly': True, 'tag': self.tags[kind]})
+        except ccxt.InvalidOrder as e:
+            # 一般是已经没有持仓（被平仓或入场挂单未成交）；持仓还在（或查询失败）时保持武装，下一个价格再试
+            if self._has_position(armed) is False:
+                log.warning(f"本地{kind}触发但已无持仓，已解除: {e}", extra=event('order', action=kind, error=str(e)))
+                return
+            with self._lock:
+                if self.armed is None:
+                    self.armed = armed
+            log.error(f"本地{kind}下单被拒但持仓仍在，保持盯价: {e}", extra=event('error', action=kind))
+            return
+        except Exception as e:
+            with self._lock:
+                if self.armed is None:
+                    self.armed = armed  # 下单失败保持武装，下一个价格再试
+            log.error(f"本地{kind}下单失败: {e}", extra=event('error', action=kind))
+            return
+        ack = time.perf_counter()
+
+        reaction = {
+            'trigger': kind,
+            'trigger_price': trigger_price,
+            'price': price,
+            'order_id': order.get('id'),
+            'feed_lag_ms': recv_ms - tick_ms,
+            'detect_ms': round((submit - recv_perf) * 1000, 3),
+            'submit_to_ack_ms': round((ack - submit) * 1000, 3),
+            'reaction_ms': round((ack - recv_perf) * 1000, 3),
+        }
+        self.reactions.append(reaction)
+        self.triggered[kind] += 1
+        if self.tracer is not None:
+            self.tracer.record('stop_reaction', recv_perf, ack - recv_perf, {'kind': kind})
+        log.warning(f"本地{'止损' if kind == 'stop_loss' else '止盈'}触发: 价格 {price:,.2f} 越过 {trigger_price:,.2f}，"
+                    f"已市价平仓 {order.get('id')}，反应 {reaction['reaction_ms']:.0f}ms（推送延迟 {reaction['feed_lag_ms']}ms）",
+                    extra=event('order', action='protective_close', **reaction))
+
+
+class ProtectiveOrders:
+    """为当前持仓设置止盈止损；优先交易所条件单，不支持时本地盯价"""
+
+    def __init__(self, symbol, mode='native', stop_tag='STOP', take_profit_tag='TP', tracer=None):
+        if mode not in MODES:
+            raise ValueError(f"未知的止盈止损模式: {mode}，可选 {'/'.join(MODES)}")
+        self.symbol = symbol
+        self.mode = mode
+        self.stop_tag = stop_tag
+        self.watcher = LocalStopWatcher(symbol, stop_tag, take_profit_tag, tracer)
+        self.feed_factory = None  # 需要本地盯价时调用，返回已启动的PriceFeed
+        self.feed = None
+        self.native_ids = []
+        self.stats = {'native': 0, 'local': 0, 'fallback': 0, 'cancel_failed': 0}
+
+    def protect(self, exchange, position_side, amount, stop_loss, take_profit):
+        """替换现有的止盈止损，返回实际使用的模式；旧条件单没能全部撤销时不叠加新的一套，抛出异常由调用方下次重试"""
+        if not self.cancel(exchange):
+            self.stats['cancel_failed'] += 1
+            raise ccxt.ExchangeError(f"旧条件单未能全部撤销（{', '.join(self.native_ids)}），暂不设置新的止盈止损")
+        if self.mode == 'native':
+            try:
+                self._place_native(exchange, position_side, amount, stop_loss, take_profit)
+                self.stats['native'] += 1
+                return 'native'
+            except (ccxt.NotSupported, ccxt.InvalidOrder, ccxt.BadRequest) as e:
+                self.stats['fallback'] += 1
+                log.warning(f"交易所条件单被拒，改用本地盯价: {e}", extra=event('order', action='protect', error=str(e)))
+        self._ensure_feed()
+        self.watcher.arm(exchange, position_side, amount, stop_loss, take_profit)
+        self.stats['local'] += 1
+        return 'local'
+
+    def _place_native(self, exchange, position_side, amount, stop_loss, take_profit):
+        close_side = 'sell' if position_side == 'long' else 'buy'
+        params = {'reduceOnly': True, 'tag': self.stop_tag}
+        if stop_loss is not None:
+            params['stopLossPrice'] = stop_loss
+        if take_profit is not None:
+            params['takeProfitPrice'] = take_profit
+        order = exchange.create_order(self.symbol, 'market', close_side, amount, None, params)
+        self.native_ids.append(order['id'])
+        log.info(f"条件单已设置: {order['id']}", extra=event('order', action='protect', mode='native',
+                                                        order_id=order['id'], stop_loss=stop_loss,
+                                                        take_profit=take_profit))
+
+    def _ensure_feed(self):
+        if self.feed is None and self.feed_factory is not None:
+            self.feed = self.feed_factory()
+        if self.feed is None:
+            log.warning("没有行情推送，本地止盈止损不会触发", extra=event('error'))
+
+    def cancel(self, exchange):
+        """撤销本进程设置的条件单并解除本地盯价；撤销失败的条件单保留在native_ids里下次重试，全部撤销返回True"""
+        self.watcher.disarm()
+        remaining = []
+        for order_id in self.native_ids:
+            try:
+                exchange.cancel_order(order_id, self.symbol, {'trigger': True})
+            except ccxt.OrderNotFound:
+                pass  # 已触发或已被撤销
+            except Exception as e:
+                remaining.append(order_id)
+                log.warning(f"撤销条件单 {order_id} 失败: {e}", extra=event('error'))
+        self.native_ids = remaining
+        return not remaining
+
+    def adopt(self, exchange, order_types=('oco', 'conditional')):
+        """启动时接管上次运行遗留的条件单（按标签识别）：重启后持仓仍受保护，下次设置止盈止损时一并替换"""
+        for order_type in order_types:
+            try:
+                orders = exchange.fetch_open_orders(self.symbol, params={'trigger': True, 'ordType': order_type})
+            except Exception as e:
+                log.warning(f"查询遗留条件单失败: {e}", extra=event('error'))
+                continue
+            for order in orders:
+                tag = order.get('tag') or order.get('info', {}).get('tag') or ''
+                if self.stop_tag in tag and order['id'] not in self.native_ids:
+                    self.native_ids.append(order['id'])
+        if self.native_ids:
+            log.info(f"接管 {len(self.native_ids)} 个遗留条件单", extra=event('order', order_ids=self.native_ids))
+        return len(self.native_ids)
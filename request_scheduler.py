@@ -0,0 +1,297 @@
+"""
+限频感知的交易所请求调度
+
+所有交易所调用都经过一个调度器:
+- 按交易所的限频规则建模令牌桶。OKX是每个接口独立的"N次/2秒"；
+  币安是共享的IP权重(2400/分钟，K线按limit计权重)加上下单次数限制
+- 优先级: 下单/撤单 > 账户查询 > 行情读取；低优先级请求不能用掉共享桶里为下单预留的那部分令牌，
+  排队时高优先级请求插到同桶的低优先级请求前面
+- 相同参数的读请求如果已经在途（多线程时），后来者直接等待并共享同一个结果，不重复请求
+- 被交易所限频（RateLimitExceeded）时清空对应的桶，等待后重试一次（请求未被受理，重试不会重复下单）
+- 每次请求的排队等待时间计入tracer的ratelimit_wait分位数，累计值通过metrics端点导出
+
+接管后应关闭ccxt自带的固定间隔节流（enableRateLimit），否则会被重复限速。
+
+用法:
+    scheduler = RequestScheduler.for_exchange(exchange, tracer=tracer)
+    exchange = ScheduledExchange(exchange, scheduler)
+"""
+import threading
+import time
+
+import ccxt
+
+from event_log import event, log
+
+PRIORITY_ORDER = 0
+PRIORITY_ACCOUNT = 1
+PRIORITY_MARKET = 2
+
+
+def _binance_kline_weight(args, kwargs):
+    # 币安U本位合约 /fapi/v1/klines 的权重随limit增加
+    limit = kwargs.get('limit', args[3] if len(args) > 3 else None) or 500
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+
+def _binance_open_orders_weight(args, kwargs):
+    # 带symbol权重1，不带symbol是40
+    symbol = kwargs.get('symbol', args[0] if args else None)
+    return 1 if symbol else 40
+
+
+_ORDER_METHODS = ('create_order', 'create_limit_order', 'create_market_order',
+                  'create_market_buy_order', 'create_market_sell_order')
+
+# 桶: {名称: (容量, 每秒补充)}；接口: {方法: (优先级, [(桶名, 消耗或消耗函数)])}
+EXCHANGE_LIMITS = {
+    'okx': {
+        'buckets': {
+            'candles': (40, 20),  # GET /market/candles 40次/2秒
+            'ticker': (20, 10),
+            'positions': (10, 5),
+            'balance': (10, 5),
+            'orders_pending': (60, 30),
+            'order_query': (60, 30),
+            'place_order': (60, 30),
+            'cancel_order': (60, 30),
+            'leverage': (20, 10),
+            'funding_rate': (20, 10),
+            'open_interest': (20, 10),
+            'rubik': (5, 2.5),  # 交易大数据接口 5次/2秒
+            'default': (10, 5),
+        },
+        'endpoints': dict({
+            'fetch_ohlcv': (PRIORITY_MARKET, [('candles', 1)]),
+            'fetch_ticker': (PRIORITY_MARKET, [('ticker', 1)]),
+            'fetch_positions': (PRIORITY_ACCOUNT, [('positions', 1)]),
+            'fetch_balance': (PRIORITY_ACCOUNT, [('balance', 1)]),
+            'fetch_open_orders': (PRIORITY_ACCOUNT, [('orders_pending', 1)]),
+            'fetch_order': (PRIORITY_ACCOUNT, [('order_query', 1)]),
+            'cancel_order': (PRIORITY_ORDER, [('cancel_order', 1)]),
+            'set_leverage': (PRIORITY_ACCOUNT, [('leverage', 1)]),
+            'fetch_funding_rate': (PRIORITY_MARKET, [('funding_rate', 1)]),
+            'fetch_open_interest': (PRIORITY_MARKET, [('open_interest', 1)]),
+            'fetch_open_interest_history': (PRIORITY_MARKET, [('rubik', 1)]),
+            'fetch_long_short_ratio_history': (PRIORITY_MARKET, [('rubik', 1)]),
+            'public_get_rubik_stat_taker_volume_contract': (PRIORITY_MARKET, [('rubik', 1)]),
+        }, **{name: (PRIORITY_ORDER, [('place_order', 1)]) for name in _ORDER_METHODS}),
+    },
+    'binanceusdm': {
+        'buckets': {
+            'weight': (2400, 40),  # IP权重 2400/分钟
+            'orders_10s': (300, 30),  # 下单 300次/10秒
+            'orders_1m': (1200, 20),  # 下单 1200次/分钟
+        },
+        'endpoints': dict({
+            'fetch_ohlcv': (PRIORITY_MARKET, [('weight', _binance_kline_weight)]),
+            'fetch_ticker': (PRIORITY_MARKET, [('weight', 1)]),
+            'fetch_positions': (PRIORITY_ACCOUNT, [('weight', 5)]),
+            'fetch_balance': (PRIORITY_ACCOUNT, [('weight', 5)]),
+            'fetch_open_orders': (PRIORITY_ACCOUNT, [('weight', _binance_open_orders_weight)]),
+            'fetch_order': (PRIORITY_ACCOUNT, [('weight', 1)]),
+            'cancel_order': (PRIORITY_ORDER, [('weight', 1)]),
+            'set_leverage': (PRIORITY_ACCOUNT, [('weight', 1)]),
+            'fetch_funding_rate': (PRIORITY_MARKET, [('weight', 1)]),
+            'fetch_open_interest': (PRIORITY_MARKET, [('weight', 1)]),
+            'fetch_open_interest_history': (PRIORITY_MARKET, [('weight', 1)]),
+            'fetch_long_short_ratio_history': (PRIORITY_MARKET, [('weight', 1)]),
+        }, **{name: (PRIORITY_ORDER, [('orders_10s', 1), ('orders_1m', 1)]) for name in _ORDER_METHODS}),
+    },
+}
+EXCHANGE_LIMITS['binance'] = EXCHANGE_LIMITS['binanceusdm']
+
+
+class TokenBucket:
+    def __init__(self, capacity, refill_per_s, clock=time.monotonic):
+        self.capacity = float(capacity)
+        self.refill_per_s = float(refill_per_s)
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_s)
+        self.updated = now
+
+    def wait_time(self, cost, reserve=0.0):
+        """还要等多少秒才能在保留reserve个令牌的前提下拿到cost个令牌"""
+        self._refill()
+        missing = cost + reserve - self.tokens
+        return max(0.0, missing / self.refill_per_s)
+
+    def consume(self, cost):
+        self.tokens -= cost
+
+    def drain(self):
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class _InFlight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RequestScheduler:
+    """令牌桶限频 + 优先级排队 + 在途读请求合并"""
+
+    def __init__(self, limits, headroom=0.8, order_reserve=0.2, tracer=None, clock=time.monotonic):
+        # headroom: 只使用交易所额度的这一比例，给其他进程/手动操作留余量
+        self.buckets = {name: TokenBucket(capacity * headroom, rate * headroom, clock)
+                        for name, (capacity, rate) in limits['buckets'].items()}
+        self.endpoints = limits['endpoints']
+        self.order_reserve = order_reserve
+        self.tracer = tracer
+        self.stats = {}
+        self._cond = threading.Condition()
+        self._waiting = []  # [(优先级, 序号, 桶名集合)]
+        self._seq = 0
+        self._in_flight = {}
+
+    @classmethod
+    def for_exchange(cls, exchange, **kwargs):
+        limits = EXCHANGE_LIMITS.get(getattr(exchange, 'id', None))
+        if limits is None:
+            raise ValueError(f"没有 {getattr(exchange, 'id', exchange)} 的限频规则")
+        return cls(limits, **kwargs)
+
+    def _plan(self, name, args, kwargs):
+        priority, costs = self.endpoints.get(name, (PRIORITY_ACCOUNT, [('default', 1)]))
+        plan = []
+        for bucket, cost in costs:
+            if bucket not in self.buckets:
+                bucket = next(iter(self.buckets))  # 没有default桶的交易所（币安）计入共享权重桶
+            plan.append((bucket, cost(args, kwargs) if callable(cost) else cost))
+        return priority, plan
+
+    def _stat(self, name):
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = {'calls': 0, 'delayed': 0, 'wait_s': 0.0, 'max_wait_s': 0.0,
+                                       'coalesced': 0, 'rate_limited': 0}
+        return stat
+
+    def acquire(self, name, args=(), kwargs=None):
+        """阻塞直到拿到令牌，返回排队等待的秒数"""
+        priority, plan = self._plan(name, args, kwargs or {})
+        buckets = {bucket for bucket, _ in plan}
+        started = time.perf_counter()
+        with self._cond:
+            self._seq += 1
+            ticket = (priority, self._seq, buckets)
+            self._waiting.append(ticket)
+            self._waiting.sort(key=lambda t: t[:2])
+            try:
+                while True:
+                    # 同桶里排在前面（优先级更高或先到）的请求先走
+                    blocked = any(t is not ticket and t[:2] < ticket[:2] and t[2] & buckets for t in self._waiting)
+                    if not blocked:
+                        wait = max(self.buckets[bucket].wait_time(
+                            cost, 0.0 if priority == PRIORITY_ORDER else self.buckets[bucket].capacity * self.order_reserve)
+                            for bucket, cost in plan)
+                        if wait <= 0:
+                            for bucket, cost in plan:
+                                self.buckets[bucket].consume(cost)
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+
+            waited = time.perf_counter() - started
+            stat = self._stat(name)
+            stat['calls'] += 1
+            stat['wait_s'] += waited
+            if waited > 0.001:
+                stat['delayed'] += 1
+                stat['max_wait_s'] = max(stat['max_wait_s'], waited)
+        if self.tracer is not None:
+            self.tracer.record('ratelimit_wait', started, waited)
+        return waited
+
+    def penalize(self, name, args=(), kwargs=None):
+        """交易所返回限频错误：清空该接口相关的桶"""
+        _, plan = self._plan(name, args, kwargs or {})
+        with self._cond:
+            for bucket, _ in plan:
+                self.buckets[bucket].drain()
+            self._stat(name)['rate_limited'] += 1
+
+    def call(self, name, func, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        priority, _ = self._plan(name, args, kwargs)
+        if priority == PRIORITY_ORDER:
+            return self._execute(name, func, args, kwargs)
+
+        # 读请求：相同参数的在途请求直接共享结果（调用方不应修改返回对象）
+        key = (name, repr(args), repr(sorted(kwargs.items())))
+        with self._cond:
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _InFlight()
+            else:
+                self._stat(name)['coalesced'] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = self._execute(name, func, args, kwargs)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._cond:
+                self._in_flight.pop(key, None)
+            flight.done.set()
+
+    def _execute(self, name, func, args, kwargs):
+        for attempt in range(2):
+            self.acquire(name, args, kwargs)
+            try:
+                return func(*args, **kwargs)
+            except ccxt.RateLimitExceeded as e:
+                self.penalize(name, args, kwargs)
+                if attempt:
+                    raise
+                log.warning(f"{name} 被交易所限频，等待后重试: {e}", extra=event('error', endpoint=name))
+
+    def snapshot(self):
+        with self._cond:
+            return {name: dict(stat) for name, stat in self.stats.items()}
+
+
+class ScheduledExchange:
+    """有限频规则的接口经调度器执行，其余属性透传"""
+
+    def __init__(self, exchange, scheduler):
+        self._exchange = exchange
+        self._scheduler = scheduler
+
+    def __getattr__(self, name):
+        attr = getattr(self._exchange, name)
+        if name not in self._scheduler.endpoints or not callable(attr):
+            return attr
+        scheduler = self._scheduler
+
+        def scheduled(*args, **kwargs):
+            return scheduler.call(name, attr, args, kwargs)
+
+        return scheduled
@@ -0,0 +1,219 @@
+"""
+下单前本地风控
+
+以前余额不足、数量精度不对、止损止盈放反方向、数量过大这类问题要等交易所拒单才知道，
+每次拒单多一个往返，平仓再反手时还可能只做了一半（平了旧仓，新仓被拒）。
+RiskEngine 用内存里缓存的可用余额、杠杆和合约规格在本地校验每一笔订单，只做算术比较（微秒级）:
+
+    invalid_amount / invalid_price     数量或价格不是正数
+    amount_precision                   数量不是最小变动单位的整数倍
+    amount_below_min / amount_above_max / price_limits / notional_below_min   超出合约规格的限制
+    size_excessive                     单笔或开仓后的持仓张数超过配置上限
+    reduce_exceeds_position            只减仓单的数量超过持仓，或方向与持仓相同
+    price_off_market                   挂单价相对最新价偏离过大
+    stop_wrong_side / take_profit_wrong_side   多头止损不低于入场价、止盈不高于入场价（空头相反）
+    stop_beyond_liquidation            止损距离超过按杠杆估算的强平距离，止损来不及触发
+    insufficient_margin                所需保证金超过缓存的可用余额（反手时计入平仓释放的保证金）
+
+挂单价先按价格最小变动单位取整（normalize_price），取整不算拒绝。余额在启动时和每个周期末
+（下过单或超过account_ttl_s）刷新，两次刷新之间已通过的开仓单先从可用余额里预扣。
+没有加载合约元数据（如回测）时跳过精度和限制检查；没有余额缓存时跳过保证金检查。
+"""
+import math
+import threading
+import time
+from collections import Counter, namedtuple
+
+Rejection = namedtuple('Rejection', 'reason message')
+
+DECIMAL_PLACES = 2  # ccxt.DECIMAL_PLACES；其余精度模式按最小变动单位（TICK_SIZE）处理
+
+
+def _step(value, precision_mode):
+    if value is None:
+        return None
+    return 10 ** -value if precision_mode == DECIMAL_PLACES else float(value)
+
+
+def _decimals(step):
+    """最小变动单位的小数位数，取整后按它再舍入一次，消除浮点乘法的残差"""
+    return len(f'{step:.12f}'.rstrip('0').split('.')[1])
+
+
+def _off_step(value, step):
+    units = value / step
+    return abs(units - round(units)) > 1e-6
+
+
+class RiskEngine:
+    def __init__(self, leverage, contract_size=1.0, max_order_amount=None, max_position_amount=None,
+                 max_price_deviation_pct=3.0, liquidation_buffer=0.8, margin_buffer=1.05, account_ttl_s=300,
+                 enabled=True, clock=time.time):
+        self.leverage = leverage
+        self.contract_size = contract_size
+        self.max_order_amount = max_order_amount
+        self.max_position_amount = max_position_amount
+        self.max_price_deviation_pct = max_price_deviation_pct
+        self.liquidation_buffer = liquidation_buffer
+        self.margin_buffer = margin_buffer
+        self.account_ttl_s = account_ttl_s
+        self.enabled = enabled
+        self.clock = clock
+        # 合约规格（load_market之前不检查）
+        self.price_step = self.amount_step = None
+        self.min_amount = self.max_amount = self.min_price = self.max_price = self.min_cost = None
+        # 账户缓存
+        self.free = None
+        self.account_at = None
+        self.reserved = 0.0  # 上次刷新余额之后已通过的开仓单占用的保证金
+        self.dirty = False
+        self.reference_price = None
+        self._lock = threading.Lock()
+        self.stats = {'checks': 0, 'passed': 0, 'rejected': 0, 'price_rounded': 0, 'check_s': 0.0,
+                      'account_refreshes': 0}
+        self.rejections = Counter()
+
+    def configure(self, **settings):
+        for key, value in settings.items():
+            setattr(self, key, value)
+
+    def load_market(self, market, precision_mode=None):
+        """从ccxt市场结构读取合约面值、精度和限制"""
+        if not market:
+            return
+        precision, limits = market.get('precision') or {}, market.get('limits') or {}
+        self.contract_size = market.get('contractSize') or self.contract_size
+        self.price_step = _step(precision.get('price'), precision_mode)
+        self.amount_step = _step(precision.get('amount'), precision_mode)
+        amount, price, cost = limits.get('amount') or {}, limits.get('price') or {}, limits.get('cost') or {}
+        self.min_amount, self.max_amount = amount.get('min'), amount.get('max')
+        self.min_price, self.max_price = price.get('min'), price.get('max')
+        self.min_cost = cost.get('min')
+
+    # ---- 缓存的账户状态 ----
+
+    def update_balance(self, free):
+        with self._lock:
+            self.free = float(free)
+            self.account_at = self.clock()
+            self.reserved = 0.0
+            self.dirty = False
+            self.stats['account_refreshes'] += 1
+
+    def needs_refresh(self):
+        return self.enabled and (self.dirty or self.account_at is None
+                                 or self.clock() - self.account_at >= self.account_ttl_s)
+
+    def account_age_s(self):
+        return None if self.account_at is None else self.clock() - self.account_at
+
+    def mark_price(self, price):
+        """最新价，作为市价单的入场价和挂单价偏离的基准"""
+        self.reference_price = float(price)
+
+    def normalize_price(self, price):
+        """按价格最小变动单位取整"""
+        if price is None or not self.price_step:
+            return price
+        rounded = round(round(price / self.price_step) * self.price_step, _decimals(self.price_step))
+        if rounded != price:
+            self.stats['price_rounded'] += 1
+        return rounded
+
+    def position_margin(self, position):
+        if not position:
+            return 0.0
+        entry = position.get('entry_price') or self.reference_price or 0.0
+        return position['size'] * self.contract_size * entry / (position.get('leverage') or self.leverage)
+
+    # ---- 校验 ----
+
+    def check(self, side, amount, price=None, stop_loss=None, take_profit=None, position=None, reduce_only=False):
+        """
+        校验一笔订单，通过返回None，否则返回Rejection并计数。
+        price为None时按市价单处理（入场价取mark_price）；position为下单前的持仓（get_current_position的结构）。
+        与持仓反向的开仓单视为反手（先平仓），计入平仓释放的保证金
+        """
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        try:
+            rejection = self._check(side, amount, price, stop_loss, take_profit, position, reduce_only)
+        except (TypeError, ValueError) as e:  # 模型给出的价格不是数字
+            rejection = Rejection('invalid_price', f"价格无法比较: {e}")
+        with self._lock:
+            self.stats['checks'] += 1
+            self.stats['check_s'] += time.perf_counter() - started
+            if rejection is None:
+                self.stats['passed'] += 1
+                self.dirty = True  # 余额已变化，周期末刷新
+            else:
+                self.stats['rejected'] += 1
+                self.rejections[rejection.reason] += 1
+        return rejection
+
+    def _check(self, side, amount, price, stop_loss, take_profit, position, reduce_only):
+        if amount is None or not amount > 0 or math.isinf(amount):
+            return Rejection('invalid_amount', f"数量无效: {amount}")
+        if price is not None and (not price > 0 or math.isinf(price)):
+            return Rejection('invalid_price', f"价格无效: {price}")
+
+        if self.amount_step and _off_step(amount, self.amount_step):
+            return Rejection('amount_precision', f"数量 {amount} 不是最小单位 {self.amount_step} 的整数倍")
+        if self.min_amount is not None and amount < self.min_amount:
+            return Rejection('amount_below_min', f"数量 {amount} 小于最小下单量 {self.min_amount}")
+        if self.max_amount is not None and amount > self.max_amount:
+            return Rejection('amount_above_max', f"数量 {amount} 超过最大下单量 {self.max_amount}")
+        if price is not None and ((self.min_price is not None and price < self.min_price)
+                                  or (self.max_price is not None and price > self.max_price)):
+            return Rejection('price_limits', f"价格 {price} 超出允许范围 {self.min_price}-{self.max_price}")
+
+        long = side == 'buy'
+        held = position['size'] if position else 0.0
+        same_side = bool(position) and (position['side'] == 'long') == long
+        if reduce_only:
+            if not position or same_side or amount > held + 1e-12:
+                return Rejection('reduce_exceeds_position', f"只减仓单 {side} {amount} 与持仓 {position} 不符")
+            return None  # 平仓单只释放保证金，不检查价格和止损止盈
+
+        if self.max_order_amount is not None and amount > self.max_order_amount:
+            return Rejection('size_excessive', f"单笔数量 {amount} 超过上限 {self.max_order_amount}")
+        after = held + amount if same_side else amount
+        if self.max_position_amount is not None and after > self.max_position_amount + 1e-12:
+            return Rejection('size_excessive', f"开仓后持仓 {after} 超过上限 {self.max_position_amount}")
+
+        entry = price if price is not None else self.reference_price
+        if entry is None:
+            return None  # 没有价格基准，无法做价格相关的检查
+        reference = self.reference_price
+        if price is not None and reference and abs(price / reference - 1) * 100 > self.max_price_deviation_pct:
+            return Rejection('price_off_market', f"挂单价 {price} 偏离最新价 {reference} 超过 {self.max_price_deviation_pct}%")
+        notional = amount * self.contract_size * entry
+        if self.min_cost is not None and notional < self.min_cost:
+            return Rejection('notional_below_min', f"名义价值 {notional:.2f} 小于最小值 {self.min_cost}")
+
+        if stop_loss is not None:
+            if (stop_loss >= entry) if long else (stop_loss <= entry):
+                return Rejection('stop_wrong_side', f"{'多头' if long else '空头'}止损 {stop_loss} 在入场价 {entry} 的错误一侧")
+            limit = self.liquidation_buffer / self.leverage
+            if abs(entry - stop_loss) / entry > limit:
+                return Rejection('stop_beyond_liquidation',
+                                 f"止损距离 {abs(entry - stop_loss) / entry:.2%} 超过 {self.leverage}x 杠杆下的安全距离 {limit:.2%}")
+        if take_profit is not None and ((take_profit <= entry) if long else (take_profit >= entry)):
+            return Rejection('take_profit_wrong_side', f"{'多头' if long else '空头'}止盈 {take_profit} 在入场价 {entry} 的错误一侧")
+
+        if self.free is not None:
+            required = notional / self.leverage * self.margin_buffer
+            released = 0.0 if same_side else self.position_margin(position)
+            available = self.free - self.reserved + released
+            if required > available:
+                return Rejection('insufficient_margin', f"所需保证金 {required:.2f} 超过可用 {available:.2f}")
+            with self._lock:
+                self.reserved += required - released
+        return None
+
+    def snapshot(self):
+        """统计的副本（metrics线程读取）"""
+        with self._lock:
+            return {**self.stats, 'rejections': dict(self.rejections), 'account_age_s': self.account_age_s(),
+                    'free': self.free}
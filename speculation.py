@@ -0,0 +1,125 @@
+"""
+收盘前的推测分析
+
+正常流程是K线收盘后才取数据、问LLM，信号要到新K线开始10多秒后才出来。推测模式:
+- 在K线收盘前lead_s秒，用"快完成"的K线提前完整地跑一次分析（只分析不下单，也不进信号历史）
+- 收盘后settle_s秒照常取数据，只做廉价的比较: 同一根K线的最终收盘价与推测时的偏离、
+  推测之后是否出现突破提示词中阻力/支撑位的新高新低、成交量比率是否越过激增阈值、持仓/挂单是否变化
+- 没有实质变化就直接采用推测的信号（命中），否则重新请求LLM（未命中）
+
+命中时节省的延迟即推测那次LLM分析的耗时；统计命中率、节省的总时长和收盘到决策的耗时。
+分析间隔短于一根K线时（放量等行情，见adaptive_interval）不对齐收盘，也不做推测。
+"""
+import math
+import time
+
+from event_log import event, log
+
+
+def _bps(a, b):
+    return abs(a - b) / b * 10000 if b else 0.0
+
+
+class SpeculativeAnalysis:
+    def __init__(self, timeframe_s=300, lead_s=20, settle_s=2, max_close_move_bps=5.0, surge_ratio=2.0,
+                 enabled=False):
+        self.timeframe_s = timeframe_s
+        self.lead_s = lead_s
+        self.settle_s = settle_s
+        self.max_close_move_bps = max_close_move_bps
+        self.surge_ratio = surge_ratio
+        self.enabled = enabled
+        self.pending = None
+        self.stats = {'hits': 0, 'misses': 0, 'failed': 0, 'saved_s': 0.0, 'close_to_decision_s': 0.0,
+                      'decisions': 0}
+        self.miss_reasons = {}
+
+    def configure(self, enabled=None, lead_s=None, settle_s=None, max_close_move_bps=None):
+        if enabled is not None:
+            self.enabled = enabled
+        if lead_s is not None:
+            self.lead_s = lead_s
+        if settle_s is not None:
+            self.settle_s = settle_s
+        if max_close_move_bps is not None:
+            self.max_close_move_bps = max_close_move_bps
+
+    def plan(self, next_run, interval_s, now=None):
+        """
+        把下一次运行时间对齐到最近的K线收盘后settle_s秒，返回 (运行时间, 推测时间)；
+        未启用或间隔短于一根K线时原样返回，推测时间为None
+        """
+        if not self.enabled or interval_s < self.timeframe_s:
+            return next_run, None
+        now = time.time() if now is None else now
+        close = round(next_run / self.timeframe_s) * self.timeframe_s
+        if close - self.lead_s <= now:
+            close += self.timeframe_s * math.ceil((now - close + self.lead_s) / self.timeframe_s)
+        return close + self.settle_s, close - self.lead_s
+
+    def store(self, frame, signal_data, llm_s, context):
+        """保存推测结果；frame为推测时带指标的5分钟Bars（最后一根是未收盘的K线）"""
+        if signal_data is None:
+            self.stats['failed'] += 1
+            self.pending = None
+            return
+        last = frame[-1]
+        self.pending = {
+            'bar_ts': int(last['timestamp']),
+            'close': float(last['close']),
+            'high': float(last['high']),
+            'low': float(last['low']),
+            'resistance': float(last['resistance']),
+            'support': float(last['support']),
+            'volume_ratio': float(last['volume_ratio']),
+            'signal': signal_data,
+            'llm_s': llm_s,
+            'context': context,
+        }
+        log.info(f"推测分析完成: {signal_data.get('signal')}（LLM {llm_s:.1f}s），收盘后核对",
+                 extra=event('llm', speculative=True, signal=signal_data.get('signal'), llm_s=llm_s))
+
+    def _miss_reason(self, spec, frame, context):
+        if context != spec['context']:
+            return 'position_changed'
+        matches = (frame['timestamp'] == spec['bar_ts']).nonzero()[0]
+        if not len(matches) or matches[-1] == len(frame) - 1:
+            return 'bar_not_closed'
+        final = frame[int(matches[-1])]
+        if _bps(final['close'], spec['close']) > self.max_close_move_bps:
+            return 'close_moved'
+        if final['high'] > max(spec['high'], spec['resistance']) or final['low'] < min(spec['low'], spec['support']):
+            return 'new_extreme'
+        if spec['volume_ratio'] < self.surge_ratio <= final['volume_ratio']:
+            return 'volume_surge'
+        return None
+
+    def resolve(self, frame, context, bar_close_s=None):
+        """收盘后调用：命中返回推测的信号，否则返回None（调用方重新分析）"""
+        spec, self.pending = self.pending, None
+        if spec is None:
+            return None
+        reason = self._miss_reason(spec, frame, context)
+        if reason is not None:
+            self.stats['misses'] += 1
+            self.miss_reasons[reason] = self.miss_reasons.get(reason, 0) + 1
+            log.info(f"推测未命中（{reason}），重新分析", extra=event('llm', speculative=True, hit=False, reason=reason))
+            return None
+
+        self.stats['hits'] += 1
+        self.stats['saved_s'] += spec['llm_s']
+        if bar_close_s is not None:
+            self.record_decision(bar_close_s)
+        log.info(f"推测命中，采用收盘前的信号 {spec['signal'].get('signal')}，节省 {spec['llm_s']:.1f}s；"
+                 f"命中率 {self.hit_rate():.0%}",
+                 extra=event('llm', speculative=True, hit=True, saved_s=spec['llm_s'], hit_rate=self.hit_rate()))
+        return spec['signal']
+
+    def record_decision(self, bar_close_s):
+        """记录收盘到拿到决策的耗时（命中和未命中都记，便于对比）"""
+        self.stats['decisions'] += 1
+        self.stats['close_to_decision_s'] += max(0.0, time.time() - bar_close_s)
+
+    def hit_rate(self):
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else None
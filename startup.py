@@ -0,0 +1,143 @@
+"""
+冷启动加速
+
+崩溃后由supervisor重启时，第一个周期之前的时间主要花在:
+- 导入openai（约1秒）、pandas、numpy
+- load_markets: OKX默认逐个拉取现货/交割/永续/期权四类合约列表
+
+对应的处理:
+- LazyModule / LazyClient 把重量级导入推迟到第一次使用，prewarm() 在后台线程里提前导入，
+  与交易所设置等网络I/O重叠，而不是串行排在启动路径上
+- load_markets_cached() 把合约元数据（合约面值、价格/数量精度）快照到磁盘，TTL内直接复用；
+  过期时只拉取配置的合约类型
+- StartupTimer 记录各启动阶段耗时并写日志
+
+ccxt包的 __init__ 会导入所有交易所类，无法按需拆分，仍在模块顶部导入。
+"""
+import importlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from event_log import event, log
+
+
+class LazyModule:
+    """第一次访问属性时才导入模块；导入后把模块属性复制到自身，之后的访问没有额外开销"""
+
+    def __init__(self, name):
+        self._lazy_name = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._lazy_name)  # 并发导入由import锁保证只执行一次
+        self.__dict__.update({k: v for k, v in vars(module).items() if not k.startswith('__')})
+        return getattr(module, attr)
+
+
+class LazyClient:
+    """第一次使用时才调用factory创建客户端（例如OpenAI客户端）"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        """返回（必要时创建）实际的客户端，用于需要真实对象而不是代理的地方"""
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+                client = self._client
+        return client
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+
+def prewarm(modules):
+    """后台线程导入模块，返回线程；失败只记日志，第一次使用时会再次抛出"""
+
+    def run():
+        for name in modules:
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                log.warning(f"预加载 {name} 失败: {e}", extra=event('error'))
+
+    thread = threading.Thread(target=run, name='import-prewarm', daemon=True)
+    thread.start()
+    return thread
+
+
+def load_markets_cached(exchange, path, ttl_hours=24, types=None, symbols=()):
+    """
+    优先用磁盘上的市场快照；不存在、过期或缺少所需交易对时从交易所加载并写回。
+    types限制重新加载时拉取的合约类型（如['swap']），返回数据来源 'cache' 或 'network'
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            snapshot = json.load(f)
+        fresh = time.time() - snapshot['saved_at'] < ttl_hours * 3600
+        if fresh and snapshot['exchange'] == exchange.id and all(s in snapshot['markets'] for s in symbols):
+            exchange.set_markets(snapshot['markets'], snapshot.get('currencies') or None)
+            return 'cache'
+    except (OSError, ValueError, KeyError) as e:
+        if not isinstance(e, FileNotFoundError):
+            log.warning(f"市场快照不可用，重新加载: {e}", extra=event('system'))
+
+    if types:
+        option = exchange.options.get('fetchMarkets')
+        if isinstance(option, dict):
+            exchange.options['fetchMarkets'] = dict(option, types=list(types))
+        elif isinstance(option, list):
+            exchange.options['fetchMarkets'] = list(types)
+    markets = exchange.load_markets()
+
+    snapshot = {'exchange': exchange.id, 'saved_at': time.time(), 'markets': markets,
+                'currencies': exchange.currencies}
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'), default=str)
+        os.replace(tmp, path)  # 原子替换，崩溃时不会留下半个文件
+    except OSError as e:
+        log.warning(f"写入市场快照失败: {e}", extra=event('error'))
+    return 'network'
+
+
+class StartupTimer:
+    """按阶段记录启动耗时（秒）；started为进程开始执行机器人代码的perf_counter时刻"""
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.phases = {}
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def mark(self, name, seconds, **fields):
+        self.phases[name] = seconds
+        log.info(f"启动阶段 {name}: {seconds * 1000:.0f}ms", extra=event('system', phase=name, ms=seconds * 1000, **fields))
+
+    @contextmanager
+    def phase(self, name, **fields):
+        start = time.perf_counter()
+        try:
+            yield fields  # 调用方可以往里补充字段（如市场数据来源）
+        finally:
+            self.mark(name, time.perf_counter() - start, **fields)
+
+    def finish(self):
+        total = self.elapsed()
+        self.phases['total'] = total
+        detail = ', '.join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases.items() if name != 'total')
+        log.info(f"启动到首个周期完成共 {total:.2f}s（{detail}）",
+                 extra=event('system', startup_ms={k: round(v * 1000, 1) for k, v in self.phases.items()}))
+        return total
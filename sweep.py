@@ -0,0 +1,261 @@
+"""
+参数扫描
+
+在回测之上对策略和执行参数做网格搜索或随机搜索，多进程并行。
+5分钟K线只在主进程读取一次，放进共享内存，各工作进程只读映射，不复制。
+每跑完一组参数就追加写入结果文件，中断后重新运行会跳过已完成的组合。结果按"K线数据+运行选项+参数"
+的指纹区分，换了数据、决策源、日期范围或初始资金时不会复用旧结果，排名也只包含本次的参数组合。
+
+参数名:
+    leverage / amount               交易参数 (TRADE_CONFIG)
+    strategy.<键>                   策略参数 (TRADE_CONFIG['strategy'])，如 strategy.sr_window
+    risk.<键>                       本地风控参数 (TRADE_CONFIG['risk'])，如 risk.max_order_amount
+    exchange.<键>                   模拟交易所参数，如 exchange.slippage_bps
+    rule.<键>                       规则决策源参数 (risk_pct, reward_ratio)
+
+取值写法:
+    name=1,2,3        离散取值（网格搜索全部组合，随机搜索从中抽取）
+    name=1.2:2.5      连续区间（仅随机搜索）
+    name=10:30:int    整数区间（仅随机搜索）
+
+用法:
+    python sweep.py --data data/BTC-USDT-SWAP_5m.csv \\
+        --param leverage=5,10,15 --param strategy.smart_money_ratio=1.2,1.5,2.0 --param strategy.sr_window=10,20,30
+    python sweep.py --data data/BTC-USDT-SWAP_5m.csv --random 200 \\
+        --param strategy.volume_surge_ratio=1.5:3.0 --param strategy.sr_window=10:30:int --rank -max_drawdown_pct
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+# 工作进程内的只读数据
+_worker = {}
+
+
+def parse_param(spec):
+    """解析 name=取值 形式的参数说明"""
+    name, _, values = spec.partition('=')
+    if ':' in values:
+        parts = values.split(':')
+        kind = parts[2] if len(parts) > 2 else 'float'
+        return name, {'range': (float(parts[0]), float(parts[1])), 'kind': kind}
+    return name, {'choices': [json.loads(v) for v in values.split(',')]}
+
+
+def grid_points(params):
+    names = list(params)
+    for name in names:
+        if 'choices' not in params[name]:
+            raise ValueError(f"网格搜索需要离散取值: {name}")
+    for combo in itertools.product(*(params[n]['choices'] for n in names)):
+        yield dict(zip(names, combo))
+
+
+def random_points(params, n, seed):
+    rng = random.Random(seed)
+    for _ in range(n):
+        point = {}
+        for name, spec in params.items():
+            if 'choices' in spec:
+                point[name] = rng.choice(spec['choices'])
+            elif spec['kind'] == 'int':
+                point[name] = rng.randint(int(spec['range'][0]), int(spec['range'][1]))
+            else:
+                point[name] = round(rng.uniform(*spec['range']), 4)
+        yield point
+
+
+def run_fingerprint(data, options):
+    """K线数据和运行选项（决策源、信号文件、日期范围、初始资金等）的指纹"""
+    digest = hashlib.sha1(np.ascontiguousarray(data).tobytes())
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:16]
+
+
+def point_key(point, fingerprint):
+    return hashlib.sha1(json.dumps([fingerprint, point], sort_keys=True).encode()).hexdigest()[:16]
+
+
+def split_point(point):
+    """把扁平参数拆成 trade_config / exchange_config / 规则源参数"""
+    trade_config, exchange_config, rule_config = {}, {}, {}
+    for name, value in point.items():
+        scope, _, key = name.partition('.')
+        if not key:
+            trade_config[scope] = value
+        elif scope in ('strategy', 'risk'):
+            trade_config.setdefault(scope, {})[key] = value
+        elif scope == 'exchange':
+            exchange_config[key] = value
+        elif scope == 'rule':
+            rule_config[key] = value
+        else:
+            raise ValueError(f"未知的参数前缀: {name}")
+    return trade_config, exchange_config, rule_config
+
+
+def _init_worker(shm_name, shape, options):
+    # 每个工作进程只导入一次机器人模块，并映射共享的K线数组（按列存放，每列连续）
+    import backtest
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    candles = np.ndarray(shape, dtype='float64', buffer=shm.buf)
+    candles.flags.writeable = False
+    if options['source'] == 'cached':
+        # 只用录制好的LLM回复，未命中即失败，保证扫描零网络
+        backtest.bot.deepseek_client = backtest.RecordingClient(
+            backtest.bot.deepseek_client, options['llm_cache'], mode='strict')
+    _worker.update(shm=shm, candles=candles, options=options, backtest=backtest)
+
+
+def _run_point(point):
+    backtest = _worker['backtest']
+    options = _worker['options']
+    candles = _worker['candles']
+    df = pd.DataFrame({name: candles[i] for i, name in enumerate(COLUMNS)}, copy=False)
+    df['timestamp'] = df['timestamp'].astype('int64')
+
+    trade_config, exchange_config, rule_config = split_point(point)
+    if options['source'] == 'recorded':
+        source = backtest.RecordedDecisionSource(options['signals'])
+    elif options['source'] == 'cached':
+        source = backtest.DeepSeekDecisionSource()
+    else:
+        source = backtest.SmartMoneyRuleSource(**rule_config)
+
+    bt = backtest.Backtest(df, source, initial_balance=options['balance'], trade_config=trade_config,
+                           exchange_config=exchange_config)
+    summary = bt.run(options['start_ms'], options['end_ms'])
+    summary['return_over_drawdown'] = (summary['total_return_pct'] / summary['max_drawdown_pct']
+                                       if summary['max_drawdown_pct'] > 0 else 0.0)
+    return summary
+
+
+def load_checkpoint(path):
+    done = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    if 'metrics' in row:  # 失败的组合下次重跑
+                        done[row['key']] = row
+    return done
+
+
+def rank(rows, metrics):
+    """按指标排序，指标前加'-'表示越小越好"""
+    def sort_key(row):
+        key = []
+        for metric in metrics:
+            value = row['metrics'].get(metric.lstrip('-'))
+            if value is None or math.isnan(value):
+                key.append((1, 0.0))  # 缺失或NaN的指标排在最后
+            else:
+                key.append((0, value if metric.startswith('-') else -value))
+        return key
+    return sorted((r for r in rows if 'metrics' in r), key=sort_key)
+
+
+def run_sweep(candles, points, options, checkpoint_path, workers):
+    """运行尚未完成的组合，返回本次points对应的结果行（结果文件里其他运行的行不返回）"""
+    data = np.ascontiguousarray(candles[COLUMNS].to_numpy(dtype='float64').T)
+    fingerprint = run_fingerprint(data, options)
+    keys = [point_key(p, fingerprint) for p in points]
+    done = load_checkpoint(checkpoint_path)
+    todo = [p for p, key in zip(points, keys) if key not in done]
+    print(f"共 {len(points)} 组参数，已完成 {len(points) - len(todo)}，待运行 {len(todo)}，进程数 {workers}")
+    if not todo:
+        return [done[key] for key in keys]
+
+    failed = 0
+    shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    try:
+        np.ndarray(data.shape, dtype='float64', buffer=shm.buf)[:] = data
+        started = time.time()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(shm.name, data.shape, options)) as pool, \
+                open(checkpoint_path, 'a', encoding='utf-8') as out:
+            futures = {pool.submit(_run_point, p): p for p in todo}
+            for n, future in enumerate(as_completed(futures), 1):
+                point = futures[future]
+                row = {'key': point_key(point, fingerprint), 'run': fingerprint, 'params': point}
+                try:
+                    row['metrics'] = future.result()
+                except Exception as e:
+                    row['error'] = str(e)
+                    failed += 1
+                    print(f"参数 {point} 运行失败: {e}")
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                out.flush()
+                if 'metrics' in row:
+                    done[row['key']] = row
+                elapsed = time.time() - started
+                print(f"[{n}/{len(todo)}] {elapsed:.0f}s 预计剩余 {elapsed / n * (len(todo) - n):.0f}s  {point}")
+    finally:
+        shm.close()
+        shm.unlink()
+    if failed:
+        print(f"失败 {failed} 组，下次运行会重试，错误详见 {checkpoint_path}")
+    return [done[key] for key in keys if key in done]
+
+
+def main():
+    import backtest  # 主进程只用它读数据和解析日期
+
+    parser = argparse.ArgumentParser(description="策略参数扫描")
+    parser.add_argument('--data', required=True, help="5分钟K线CSV路径")
+    parser.add_argument('--param', action='append', required=True, help="参数说明，可重复")
+    parser.add_argument('--random', type=int, help="随机搜索次数（不填为网格搜索）")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--source', choices=['rule', 'recorded', 'cached'], default='rule')
+    parser.add_argument('--signals', help="recorded模式的信号文件")
+    parser.add_argument('--llm-cache', default='llm_cache', help="cached模式的LLM缓存目录")
+    parser.add_argument('--since', help="开始日期 YYYY-MM-DD (UTC)")
+    parser.add_argument('--until', help="结束日期 YYYY-MM-DD (UTC)")
+    parser.add_argument('--balance', type=float, default=10000.0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--rank', default='total_return_pct,-max_drawdown_pct',
+                        help="排序指标，逗号分隔，前加'-'表示越小越好")
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--checkpoint', default='sweep_results.jsonl')
+    args = parser.parse_args()
+
+    params = dict(parse_param(spec) for spec in args.param)
+    points = list(random_points(params, args.random, args.seed) if args.random else grid_points(params))
+    options = {
+        'source': args.source,
+        'signals': args.signals,
+        'llm_cache': args.llm_cache,
+        'balance': args.balance,
+        'start_ms': backtest.parse_date_ms(args.since),
+        'end_ms': backtest.parse_date_ms(args.until),
+    }
+
+    rows = run_sweep(backtest.load_ohlcv_csv(args.data), points, options, args.checkpoint, args.workers)
+    metrics = [m.strip() for m in args.rank.split(',')]
+    ranked = rank(rows, metrics)
+
+    print("\n" + "=" * 60)
+    print(f"排名前{args.top} (按 {', '.join(metrics)})")
+    print("=" * 60)
+    for i, row in enumerate(ranked[:args.top], 1):
+        m = row['metrics']
+        print(f"{i:>2}. 收益 {m['total_return_pct']:+.2f}%  回撤 {m['max_drawdown_pct']:.2f}%  "
+              f"胜率 {m['win_rate_pct']:.1f}%  成交 {m['fills']}  风控拒绝 {m.get('risk_rejected', 0)}  {row['params']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import backtest
+from bars import Bars, OHLCV_COLUMNS, rolling, shift
+
+bot = backtest.bot
+BAR_MS = 300_000
+# 改用Bars之前由pandas计算的指标列
+INDICATORS = ('volume_ma_5', 'volume_ma_20', 'volume_ratio', 'price_change', 'vwap', 'price_vs_vwap',
+              'smart_money_flow', 'resistance', 'support')
+
+
+def ohlcv(n=120, seed=11):
+    """固定种子的5分钟K线（ccxt格式）的前n根，带平盘和放量K线，覆盖聪明钱流入/流出/无信号三种情况"""
+    rng = np.random.default_rng(seed)
+    total = 120
+    close = 40000 * np.exp(np.cumsum(rng.normal(0, 0.003, total)))
+    close[30:33] = close[29]  # 平盘：既不算流入也不算流出
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.001, total)) * close
+    high = np.maximum(open_, close) + spread
+    low = np.minimum(open_, close) - spread
+    volume = rng.lognormal(3, 0.8, total)
+    volume[[25, 31, 60, 61, 90]] *= 8
+    ts = 1_704_067_200_000 + np.arange(total) * BAR_MS
+    return np.column_stack([ts, open_, high, low, close, volume])[:n].tolist()
+
+
+def pandas_indicators(rows, book_features=None):
+    """改用Bars之前的pandas实现，作为对照"""
+    strategy = bot.TRADE_CONFIG['strategy']
+    df = pd.DataFrame(rows, columns=list(OHLCV_COLUMNS))
+    df['volume_ma_5'] = df['volume'].rolling(window=5).mean()
+    df['volume_ma_20'] = df['volume'].rolling(window=20).mean()
+    df['volume_ratio'] = df['volume'] / df['volume_ma_20']
+    df['price_change'] = df['close'].pct_change()
+    df['vwap'] = (df['close'] * df['volume']).cumsum() / df['volume'].cumsum()
+    df['price_vs_vwap'] = (df['close'] - df['vwap']) / df['vwap'] * 100
+    df['smart_money_flow'] = np.where(
+        (df['close'] > df['close'].shift(1)) & (df['volume_ratio'] > strategy['smart_money_ratio']), 1,
+        np.where((df['close'] < df['close'].shift(1)) & (df['volume_ratio'] > strategy['smart_money_ratio']), -1, 0))
+    df['resistance'] = df['high'].rolling(window=strategy['sr_window']).max()
+    df['support'] = df['low'].rolling(window=strategy['sr_window']).min()
+    if book_features is not None:
+        imbalance = book_features['imbalance_band']
+        df['book_imbalance'] = np.nan
+        df['book_pressure'] = 0
+        df.loc[df.index[-1], 'book_imbalance'] = imbalance
+        if abs(imbalance) >= strategy['book_imbalance_ratio']:
+            df.loc[df.index[-1], 'book_pressure'] = 1 if imbalance > 0 else -1
+    return df
+
+
+def assert_columns_match(bars, df, names):
+    for name in names:
+        np.testing.assert_allclose(bars[name], df[name].to_numpy(dtype='float64'), rtol=1e-12, atol=0,
+                                   equal_nan=True, err_msg=name)
+
+
+def test_indicators_match_previous_pandas_implementation():
+    rows = ohlcv()
+    bars = bot.calculate_smart_money_indicators(Bars.from_ohlcv(rows))
+    expected = pandas_indicators(rows)
+
+    assert_columns_match(bars, expected, OHLCV_COLUMNS[1:] + INDICATORS)
+    assert bars['timestamp'].tolist() == expected['timestamp'].astype('int64').tolist()
+    assert set(bars['smart_money_flow'].tolist()) == {-1, 0, 1}
+    assert np.isnan(bars['volume_ratio'][:19]).all() and np.isnan(bars['price_change'][0])
+
+
+@pytest.mark.parametrize('imbalance', [0.6, -0.6, 0.05])
+def test_book_columns_match_previous_pandas_implementation(imbalance):
+    rows = ohlcv(n=40)
+    features = {'imbalance_band': imbalance}
+    bars = bot.calculate_smart_money_indicators(Bars.from_ohlcv(rows), features)
+    expected = pandas_indicators(rows, features)
+
+    assert_columns_match(bars, expected, ('book_imbalance', 'book_pressure'))
+    assert bars['book_pressure'].dtype == np.int64
+
+
+def test_short_history_matches_pandas():
+    # 比均线窗口还短的K线（刚上线的合约）：整列NaN，与pandas一致
+    rows = ohlcv(n=8)
+    bars = bot.calculate_smart_money_indicators(Bars.from_ohlcv(rows))
+    assert_columns_match(bars, pandas_indicators(rows), INDICATORS)
+
+
+@pytest.mark.parametrize('window', [1, 3, 7, 10, 12])
+def test_rolling_and_shift_match_pandas(window):
+    values = np.random.default_rng(window).normal(size=10)
+    series = pd.Series(values)
+
+    for reduce, method in ((np.mean, 'mean'), (np.max, 'max'), (np.min, 'min')):
+        expected = getattr(series.rolling(window=window), method)().to_numpy()
+        np.testing.assert_allclose(rolling(values, window, reduce), expected, rtol=1e-12, equal_nan=True)
+    np.testing.assert_array_equal(shift(values, window), series.shift(window).to_numpy())
+
+
+def test_backtest_snapshot_matches_live_window():
+    # 回测用前缀和还原以窗口起点为锚的VWAP，应与实盘拉取最近WINDOW根K线后计算的结果相同
+    rows = ohlcv()
+    frame = pd.DataFrame(rows, columns=list(OHLCV_COLUMNS))
+    series = backtest.TimeframeSeries('5m', frame)
+    i = len(rows) - 1
+
+    kline_data = series.snapshot(i, 'now')['kline_data']
+    live = bot.calculate_smart_money_indicators(Bars.from_ohlcv(rows[i - backtest.WINDOW + 1:i + 1]))
+    expected = live.tail(backtest.PROMPT_BARS).select(bot.KLINE_COLUMNS)
+
+    assert list(kline_data.columns) == list(expected.columns)
+    for name in expected.columns:
+        np.testing.assert_allclose(kline_data[name], expected[name], rtol=1e-9, equal_nan=True, err_msg=name)
+
+
+def test_slices_are_views_and_to_frame_round_trips():
+    rows = ohlcv(n=30)
+    bars = bot.calculate_smart_money_indicators(Bars.from_ohlcv(rows))
+    window = bars[-10:]
+
+    assert np.shares_memory(window['close'], bars['close'])
+    assert window[-1] == bars[-1] and window[0] != bars[0]
+    assert next(window.records()) == window[0].to_dict()
+    frame = bars.to_frame()
+    assert_columns_match(bars, frame, INDICATORS)
+    assert frame['timestamp'].iloc[0] == pd.Timestamp(rows[0][0], unit='ms')
@@ -0,0 +1,89 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from openai.types.completion_usage import CompletionUsage, PromptTokensDetails
+
+from llm_cache import LLMCacheMiss, RecordingClient, request_key
+from llm_session import cached_prompt_tokens
+
+REQUEST = {'model': 'deepseek-chat', 'messages': [{'role': 'user', 'content': '分析BTC'}], 'temperature': 0.1}
+
+
+class FakeClient:
+    """OpenAI兼容客户端：每次调用返回带前缀缓存明细的响应"""
+
+    def __init__(self):
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        usage = CompletionUsage(prompt_tokens=1000, completion_tokens=50, total_tokens=1050,
+                                prompt_tokens_details=PromptTokensDetails(cached_tokens=768))
+        message = SimpleNamespace(role='assistant', content='{"signal": "HOLD"}')
+        return SimpleNamespace(model=kwargs['model'], usage=usage,
+                               choices=[SimpleNamespace(message=message, finish_reason='stop')])
+
+
+def test_record_then_replay_keeps_cached_token_details(tmp_path):
+    upstream = FakeClient()
+    recorder = RecordingClient(upstream, tmp_path, mode='record')
+    live = recorder.chat.completions.create(**REQUEST)
+
+    replayed = RecordingClient(FakeClient(), tmp_path, mode='strict').chat.completions.create(**REQUEST)
+
+    assert len(upstream.calls) == 1
+    assert replayed.cached and replayed.choices[0].message.content == live.choices[0].message.content
+    assert replayed.usage.total_tokens == 1050
+    assert cached_prompt_tokens(replayed.usage) == cached_prompt_tokens(live.usage) == 768
+    entry = json.loads((tmp_path / 'responses.jsonl').read_text(encoding='utf-8'))
+    assert entry['usage']['prompt_tokens_details'] == {'cached_tokens': 768}
+
+
+def test_record_hit_does_not_call_upstream(tmp_path):
+    upstream = FakeClient()
+    recorder = RecordingClient(upstream, tmp_path, mode='record')
+    recorder.chat.completions.create(**REQUEST)
+    recorder.chat.completions.create(**REQUEST, stream=True, timeout=30)  # 不影响输出的参数不参与哈希
+
+    assert len(upstream.calls) == 1
+    assert recorder.stats == {'hits': 1, 'misses': 1, 'recorded': 1, 'saved_tokens': 1050}
+
+
+def test_replay_miss_passes_through_without_writing(tmp_path):
+    upstream = FakeClient()
+    replay = RecordingClient(upstream, tmp_path, mode='replay')
+
+    response = replay.chat.completions.create(**REQUEST)
+    replay.chat.completions.create(**REQUEST)
+
+    assert response.usage.total_tokens == 1050
+    assert len(upstream.calls) == 2
+    assert replay.stats['recorded'] == 0
+    assert not (tmp_path / 'responses.jsonl').exists()
+
+
+def test_strict_miss_raises(tmp_path):
+    upstream = FakeClient()
+    strict = RecordingClient(upstream, tmp_path, mode='strict')
+
+    with pytest.raises(LLMCacheMiss):
+        strict.chat.completions.create(**REQUEST)
+    assert upstream.calls == []
+    assert strict.stats['misses'] == 1
+
+
+def test_flat_usage_from_older_recordings_still_replays(tmp_path):
+    entry = {'key': request_key(REQUEST), 'model': 'deepseek-chat', 'content': '{}', 'finish_reason': 'stop',
+             'usage': {'prompt_tokens': 10, 'completion_tokens': 2, 'total_tokens': 12, 'prompt_cache_hit_tokens': 8}}
+    (tmp_path / 'responses.jsonl').write_text(json.dumps(entry) + "\n", encoding='utf-8')
+
+    replayed = RecordingClient(FakeClient(), tmp_path, mode='strict').chat.completions.create(**REQUEST)
+
+    assert cached_prompt_tokens(replayed.usage) == 8
+
+
+def test_unknown_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        RecordingClient(FakeClient(), tmp_path, mode='offline')
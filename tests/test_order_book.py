@@ -0,0 +1,124 @@
+import asyncio
+
+from order_book import BookFeed, L2Book, okx_checksum, replay
+
+
+def message(action, seq, prev_seq, bids, asks, book_levels):
+    """按OKX books频道格式构造推送；book_levels为推送后的完整盘口，用于计算校验和"""
+    bids_after, asks_after = book_levels
+    return {'action': action, 'data': [{
+        'bids': [[price, size, '0', '1'] for price, size in bids],
+        'asks': [[price, size, '0', '1'] for price, size in asks],
+        'seqId': seq, 'prevSeqId': prev_seq, 'ts': '1700000000000',
+        'checksum': okx_checksum(bids_after, asks_after),
+    }]}
+
+
+SNAPSHOT_LEVELS = ([('100.0', '2')], [('101.0', '3')])
+UPDATED_LEVELS = ([('100.0', '5')], [('101.0', '3')])
+
+
+class FakeClient:
+    """一次订阅：watch_order_book每次把一条推送交给feed，推完后停止feed"""
+
+    def __init__(self, feed, messages):
+        self.feed = feed
+        self.messages = list(messages)
+        self.closed = False
+
+    async def watch_order_book(self, symbol):
+        if not self.messages:
+            self.feed.stop()
+            return
+        self.feed._on_message(self.messages.pop(0))
+
+    async def close(self):
+        self.closed = True
+
+
+class ScriptedFeed(BookFeed):
+    def __init__(self, book, sessions):
+        super().__init__('okx', 'BTC/USDT:USDT', book, resync_delay_s=0)
+        self.sessions = list(sessions)
+        self.clients = []
+
+    async def _connect(self):
+        client = FakeClient(self, self.sessions.pop(0))
+        self.clients.append(client)
+        return client
+
+
+def test_gap_triggers_resubscribe_and_recovers():
+    book = L2Book()
+    first = [
+        message('snapshot', 10, -1, *SNAPSHOT_LEVELS, SNAPSHOT_LEVELS),
+        message('update', 11, 10, [('100.0', '5')], [], UPDATED_LEVELS),
+        message('update', 13, 12, [('100.0', '7')], [], ([('100.0', '7')], [('101.0', '3')])),  # 丢了seq 12
+        message('update', 14, 13, [('100.0', '8')], [], ([('100.0', '8')], [('101.0', '3')])),  # 订阅不会再推快照
+    ]
+    second = [
+        message('snapshot', 20, -1, *UPDATED_LEVELS, UPDATED_LEVELS),
+        message('update', 21, 20, [], [('101.0', '1')], ([('100.0', '5')], [('101.0', '1')])),
+    ]
+    feed = ScriptedFeed(book, [first, second])
+
+    asyncio.run(feed._stream())
+
+    assert book.stats['gaps'] == 1
+    assert feed.resyncs == 1
+    assert len(feed.clients) == 2 and all(client.closed for client in feed.clients)
+    assert feed.clients[0].messages  # 失步后没有继续消费旧订阅的增量
+    assert book.synced and book.seq == 21
+    features = book.features()
+    assert features is not None
+    assert book.stats['checksum_failures'] == 0
+
+
+def test_checksum_failure_also_resubscribes():
+    book = L2Book()
+    bad = message('update', 11, 10, [('100.0', '5')], [], UPDATED_LEVELS)
+    bad['data'][0]['checksum'] += 1
+    first = [message('snapshot', 10, -1, *SNAPSHOT_LEVELS, SNAPSHOT_LEVELS), bad]
+    second = [message('snapshot', 30, -1, *UPDATED_LEVELS, UPDATED_LEVELS)]
+    feed = ScriptedFeed(book, [first, second])
+
+    asyncio.run(feed._stream())
+
+    assert book.stats['checksum_failures'] == 1
+    assert feed.resyncs == 1
+    assert book.synced and book.seq == 30
+
+
+class RecordingFeed(ScriptedFeed):
+    """每处理完一条推送就读一次录制文件，检查是否已经落盘"""
+
+    def __init__(self, book, sessions, path):
+        super().__init__(book, sessions)
+        self.record_path = str(path)
+        self.lines_seen = []
+        self.record = None
+
+    def _on_message(self, message):
+        self.record = self._record
+        super()._on_message(message)
+        with open(self.record_path, encoding='utf-8') as f:
+            self.lines_seen.append(len(f.readlines()))
+
+
+def test_recording_is_flushed_per_message_and_closed_on_stop(tmp_path):
+    path = tmp_path / 'book.jsonl'
+    messages = [
+        message('snapshot', 10, -1, *SNAPSHOT_LEVELS, SNAPSHOT_LEVELS),
+        message('update', 11, 10, [('100.0', '5')], [], UPDATED_LEVELS),
+    ]
+    feed = RecordingFeed(L2Book(), [messages], path)
+
+    feed.start()
+    feed._thread.join(2.0)  # 推送完后FakeClient调用stop()
+
+    assert not feed._thread.is_alive()
+    assert feed.lines_seen == [1, 2]  # 不必等到关闭就已落盘
+    assert feed.record.closed and feed._record is None
+    feed._on_message(messages[1])  # 停止后迟到的推送不再写入
+    book, durations = replay(path)
+    assert len(durations) == 2 and book.synced and book.seq == 11
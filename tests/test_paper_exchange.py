@@ -0,0 +1,169 @@
+import threading
+import time
+
+import ccxt
+import pytest
+
+from paper_exchange import PaperExchange, SimClock, WallClock
+
+SYMBOL = 'BTC/USDT:USDT'
+
+
+def exchange(price=100.0, **kwargs):
+    """已有一笔成交价的模拟交易所；合约面值1便于核对金额"""
+    ex = PaperExchange(SimClock(0), symbol=SYMBOL, contract_size=1.0, leverage=10, maker_fee=0.0, taker_fee=0.0,
+                       **kwargs)
+    ex.on_price(price, 0)
+    return ex
+
+
+def test_limit_orders_fill_by_price_then_time():
+    ex = exchange()
+    first = ex.create_limit_order(SYMBOL, 'buy', 1, 98.0)
+    better = ex.create_limit_order(SYMBOL, 'buy', 1, 99.0)
+    second = ex.create_limit_order(SYMBOL, 'buy', 1, 98.0)
+
+    ex.on_price(98.0, 1000)
+
+    assert [f['order_id'] for f in ex.fills] == [better['id'], first['id'], second['id']]
+    assert [f['price'] for f in ex.fills] == [99.0, 98.0, 98.0]  # 挂单按挂单价成交
+    assert all(f['liquidity'] == 'maker' for f in ex.fills)
+    assert ex.position_qty == 3
+
+
+def test_marketable_limit_order_takes_at_current_price():
+    ex = exchange()
+    ex.create_limit_order(SYMBOL, 'buy', 1, 105.0)
+
+    assert ex.fills[0]['liquidity'] == 'taker'
+    assert ex.fills[0]['price'] == 100.0
+
+
+def test_bar_path_matches_low_before_high_on_up_bar():
+    ex = exchange()
+    buy = ex.create_limit_order(SYMBOL, 'buy', 1, 95.0)
+    sell = ex.create_limit_order(SYMBOL, 'sell', 1, 105.0)
+
+    ex.on_bar(1000, 100.0, 106.0, 94.0, 104.0)  # 阳线：开->低->高->收
+
+    assert [f['order_id'] for f in ex.fills] == [buy['id'], sell['id']]
+    assert ex.position_qty == 0
+    assert ex.realized_pnl == pytest.approx(10.0)
+
+
+def test_stop_loss_trigger_closes_long_at_market():
+    ex = exchange()
+    ex.create_market_order(SYMBOL, 'buy', 2)
+    ex.create_order(SYMBOL, 'market', 'sell', 2, None,
+                    {'reduceOnly': True, 'stopLossPrice': 95.0, 'takeProfitPrice': 110.0})
+
+    assert ex.fetch_open_orders(SYMBOL) == []  # 条件单不在普通挂单里
+    assert len(ex.fetch_open_orders(SYMBOL, params={'trigger': True})) == 1
+
+    ex.on_price(97.0, 1000)
+    assert ex.position_qty == 2
+    ex.on_price(94.0, 2000)
+
+    close = ex.fills[-1]
+    assert close['trigger'] == 'stop_loss' and close['price'] == 94.0
+    assert ex.position_qty == 0
+    assert ex.fetch_open_orders(SYMBOL, params={'trigger': True}) == []
+
+
+def test_take_profit_trigger_closes_short():
+    ex = exchange()
+    ex.create_market_order(SYMBOL, 'sell', 1)
+    ex.create_order(SYMBOL, 'market', 'buy', 1, None,
+                    {'reduceOnly': True, 'stopLossPrice': 105.0, 'takeProfitPrice': 90.0})
+
+    ex.on_price(89.0, 1000)
+
+    assert ex.fills[-1]['trigger'] == 'take_profit'
+    assert ex.position_qty == 0
+    assert ex.realized_pnl == pytest.approx(11.0)
+
+
+def test_reduce_only_is_clamped_to_position():
+    ex = exchange()
+    ex.create_market_order(SYMBOL, 'buy', 1)
+
+    order = ex.create_market_order(SYMBOL, 'sell', 3, params={'reduceOnly': True})
+
+    assert order['filled'] == 1
+    assert ex.position_qty == 0
+
+
+def test_reduce_only_without_position_is_rejected():
+    ex = exchange()
+    with pytest.raises(ccxt.InvalidOrder):
+        ex.create_market_order(SYMBOL, 'sell', 1, params={'reduceOnly': True})
+
+
+def test_reduce_only_trigger_is_recut_when_position_shrinks():
+    ex = exchange()
+    ex.create_market_order(SYMBOL, 'buy', 2)
+    ex.create_order(SYMBOL, 'market', 'sell', 2, None, {'reduceOnly': True, 'stopLossPrice': 95.0})
+    ex.create_market_order(SYMBOL, 'sell', 1, params={'reduceOnly': True})
+
+    ex.on_price(94.0, 1000)
+
+    assert ex.fills[-1]['amount'] == 1
+    assert ex.position_qty == 0
+
+
+def test_margin_check_rejects_oversized_order():
+    ex = exchange(initial_balance=100.0)
+    with pytest.raises(ccxt.InsufficientFunds):
+        ex.create_market_order(SYMBOL, 'buy', 20)  # 需要 20*100/10 = 200 USDT
+    ex.create_market_order(SYMBOL, 'buy', 9)
+
+
+def test_latency_delays_activation():
+    ex = exchange(latency_ms=500)
+    ex.create_market_order(SYMBOL, 'buy', 1)
+    ex.on_price(101.0, 400)
+    assert ex.fills == []
+    ex.on_price(102.0, 600)
+    assert ex.fills[0]['price'] == 102.0
+
+
+class SlowMarketData:
+    """纸面实盘的行情来源：每次拉取K线都要等一段时间"""
+
+    def __init__(self, delay_s):
+        self.delay_s = delay_s
+        self.calls = 0
+        self.fetching = threading.Event()
+
+    def fetch_ohlcv(self, symbol, timeframe, since=None, limit=None):
+        self.calls += 1
+        self.fetching.set()
+        time.sleep(self.delay_s)
+        minute = int(time.time() * 1000) // 60_000 * 60_000
+        return [[minute, 100.0, 100.0, 100.0, 100.0, 1.0]]
+
+
+def test_poll_fetches_outside_the_matching_lock():
+    data = SlowMarketData(0.3)
+    ex = PaperExchange(WallClock(), symbol=SYMBOL, contract_size=1.0, market_data=data)
+    poller = threading.Thread(target=ex.fetch_positions)
+    poller.start()
+    assert data.fetching.wait(1.0)
+
+    started = time.perf_counter()
+    with ex._lock:  # 拉取行情期间其他线程仍能拿到撮合锁
+        waited = time.perf_counter() - started
+    poller.join()
+
+    assert waited < 0.1
+    assert ex.last_price == 100.0
+
+
+def test_order_polls_market_data_once():
+    data = SlowMarketData(0.0)
+    ex = PaperExchange(WallClock(), symbol=SYMBOL, contract_size=1.0, market_data=data)
+
+    ex.create_market_order(SYMBOL, 'buy', 1)  # 保证金检查不再额外轮询一次
+
+    assert data.calls == 1
+    assert ex.position_qty == 1
@@ -0,0 +1,177 @@
+import threading
+import time
+
+import ccxt
+import pytest
+
+from request_scheduler import PRIORITY_MARKET, PRIORITY_ORDER, RequestScheduler, TokenBucket
+
+LIMITS = {
+    'buckets': {'shared': (10, 5)},
+    'endpoints': {
+        'fetch_ticker': (PRIORITY_MARKET, [('shared', 1)]),
+        'create_order': (PRIORITY_ORDER, [('shared', 1)]),
+    },
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def scheduler(clock, order_reserve=0.2):
+    return RequestScheduler(LIMITS, headroom=1.0, order_reserve=order_reserve, clock=clock)
+
+
+def advance(sched, clock, seconds):
+    """推进假时钟并唤醒排队的请求"""
+    with sched._cond:
+        clock.now += seconds
+        sched._cond.notify_all()
+
+
+def wait_until(predicate, timeout_s=2.0):
+    deadline = time.monotonic() + timeout_s
+    while not predicate():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.005)
+
+
+def test_bucket_refills_over_time_up_to_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(10, 5, clock)
+    bucket.consume(10)
+
+    assert bucket.wait_time(1) == pytest.approx(0.2)
+    clock.now += 1.0
+    assert bucket.wait_time(5) == 0.0
+    assert bucket.wait_time(6) == pytest.approx(0.2)
+    clock.now += 100
+    bucket.wait_time(0)
+    assert bucket.tokens == 10
+
+
+def test_market_reads_leave_the_order_reserve():
+    clock = FakeClock()
+    sched = scheduler(clock)
+    for _ in range(8):
+        sched.acquire('fetch_ticker')  # 10个令牌里2个留给下单
+
+    reader = threading.Thread(target=sched.acquire, args=('fetch_ticker',))
+    reader.start()
+    wait_until(lambda: len(sched._waiting) == 1)
+    assert sched.acquire('create_order') < 0.1  # 下单直接用预留的令牌
+    assert reader.is_alive()
+
+    advance(sched, clock, 1.0)
+    reader.join(2.0)
+    assert not reader.is_alive()
+
+
+def test_orders_jump_ahead_of_queued_reads():
+    clock = FakeClock()
+    sched = scheduler(clock, order_reserve=0.0)
+    for _ in range(10):
+        sched.acquire('fetch_ticker')
+    order = []
+
+    def request(name):
+        sched.acquire(name)
+        order.append(name)
+
+    reader = threading.Thread(target=request, args=('fetch_ticker',))
+    reader.start()
+    wait_until(lambda: len(sched._waiting) == 1)
+    writer = threading.Thread(target=request, args=('create_order',))
+    writer.start()
+    wait_until(lambda: len(sched._waiting) == 2)
+
+    advance(sched, clock, 0.2)  # 只补充一个令牌：先到的读请求也要让给下单
+    wait_until(lambda: order)
+    assert order == ['create_order']
+    advance(sched, clock, 0.2)
+    reader.join(2.0)
+    writer.join(2.0)
+    assert order == ['create_order', 'fetch_ticker']
+    assert sched.snapshot()['fetch_ticker']['delayed'] == 1
+
+
+def test_identical_in_flight_reads_are_coalesced():
+    sched = scheduler(FakeClock())
+    release = threading.Event()
+    calls = []
+
+    def fetch_ticker(symbol):
+        calls.append(symbol)
+        release.wait(2.0)
+        return {'symbol': symbol, 'last': 100.0}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(sched.call('fetch_ticker', fetch_ticker, ('BTC',))))
+               for _ in range(3)]
+    threads[0].start()
+    wait_until(lambda: calls)
+    for thread in threads[1:]:
+        thread.start()
+    wait_until(lambda: sched.snapshot()['fetch_ticker']['coalesced'] == 2)
+    release.set()
+    for thread in threads:
+        thread.join(2.0)
+
+    assert calls == ['BTC']
+    assert len(results) == 3 and all(result is results[0] for result in results)
+    # 结果返回后不再合并，新的请求重新发送
+    sched.call('fetch_ticker', fetch_ticker, ('BTC',))
+    assert calls == ['BTC', 'BTC']
+
+
+def test_different_arguments_and_orders_are_not_coalesced():
+    sched = scheduler(FakeClock())
+    calls = []
+
+    def record(*args):
+        calls.append(args)
+        return args
+
+    sched.call('fetch_ticker', record, ('BTC',))
+    sched.call('fetch_ticker', record, ('ETH',))
+    sched.call('create_order', record, ('BTC', 'market', 'buy', 1))
+    sched.call('create_order', record, ('BTC', 'market', 'buy', 1))
+
+    assert len(calls) == 4
+    assert sched.snapshot()['fetch_ticker']['coalesced'] == 0
+
+
+def test_rate_limited_request_drains_bucket_and_retries_once():
+    sched = RequestScheduler({'buckets': {'shared': (10, 1000)}, 'endpoints': LIMITS['endpoints']}, headroom=1.0)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ccxt.RateLimitExceeded('50011')
+        return 'ok'
+
+    assert sched.call('create_order', flaky) == 'ok'
+    assert len(attempts) == 2
+    assert sched.snapshot()['create_order']['rate_limited'] == 1
+
+    def always_limited():
+        raise ccxt.RateLimitExceeded('50011')
+
+    with pytest.raises(ccxt.RateLimitExceeded):
+        sched.call('create_order', always_limited)
+
+
+def test_for_exchange_requires_known_limits():
+    class Exchange:
+        id = 'unknown'
+
+    with pytest.raises(ValueError):
+        RequestScheduler.for_exchange(Exchange())
+    Exchange.id = 'okx'
+    assert 'place_order' in RequestScheduler.for_exchange(Exchange()).buckets
@@ -0,0 +1,101 @@
+import pytest
+
+from risk_engine import RiskEngine
+
+MARKET = {
+    'contractSize': 0.01,
+    'precision': {'amount': 0.01, 'price': 0.1},
+    'limits': {'amount': {'min': 0.01, 'max': 100}, 'price': {'min': 1000, 'max': 1_000_000}, 'cost': {'min': 5}},
+}
+LONG = {'side': 'long', 'size': 1.0, 'entry_price': 50000.0, 'leverage': 10}
+SHORT = {'side': 'short', 'size': 1.0, 'entry_price': 50000.0, 'leverage': 10}
+
+
+def engine(free=1000.0, **settings):
+    """10倍杠杆、最新价50000，单笔上限2张、持仓上限3张"""
+    risk = RiskEngine(10, max_order_amount=2, max_position_amount=3, **settings)
+    risk.load_market(MARKET, precision_mode=4)  # TICK_SIZE
+    risk.mark_price(50000.0)
+    if free is not None:
+        risk.update_balance(free)
+    return risk
+
+
+# (说明, 下单参数, 预期拒绝原因；None为通过)
+CASES = [
+    ('市价开多', dict(side='buy', amount=1), None),
+    ('带止损止盈的挂单', dict(side='buy', amount=1, price=49900.0, stop_loss=48000.0, take_profit=53000.0), None),
+    ('空头止损止盈', dict(side='sell', amount=1, stop_loss=51000.0, take_profit=47000.0), None),
+    ('平多', dict(side='sell', amount=1, position=LONG, reduce_only=True), None),
+    ('反手释放原持仓的保证金', dict(side='sell', amount=2, position=LONG), None),  # 105 <= 100 + 50
+    ('数量为零', dict(side='buy', amount=0), 'invalid_amount'),
+    ('价格为负', dict(side='buy', amount=1, price=-1.0), 'invalid_price'),
+    ('价格不是数字', dict(side='buy', amount=1, stop_loss='abc'), 'invalid_price'),
+    ('数量精度', dict(side='buy', amount=1.005), 'amount_precision'),
+    ('不足一个最小单位', dict(side='buy', amount=0.001), 'amount_precision'),
+    ('价格超出合约限制', dict(side='buy', amount=1, price=999.0), 'price_limits'),
+    ('单笔超过上限', dict(side='buy', amount=2.5), 'size_excessive'),
+    ('加仓后超过持仓上限', dict(side='buy', amount=2, position={**LONG, 'size': 1.5}), 'size_excessive'),
+    ('只减仓单方向与持仓相同', dict(side='buy', amount=1, position=LONG, reduce_only=True), 'reduce_exceeds_position'),
+    ('只减仓单超过持仓', dict(side='buy', amount=2, position=SHORT, reduce_only=True), 'reduce_exceeds_position'),
+    ('没有持仓的只减仓单', dict(side='sell', amount=1, reduce_only=True), 'reduce_exceeds_position'),
+    ('挂单价偏离最新价', dict(side='buy', amount=1, price=45000.0), 'price_off_market'),
+    ('多头止损在入场价上方', dict(side='buy', amount=1, stop_loss=50500.0), 'stop_wrong_side'),
+    ('空头止损在入场价下方', dict(side='sell', amount=1, stop_loss=49500.0), 'stop_wrong_side'),
+    ('止损超过强平距离', dict(side='buy', amount=1, stop_loss=45000.0), 'stop_beyond_liquidation'),
+    ('多头止盈在入场价下方', dict(side='buy', amount=1, take_profit=49000.0), 'take_profit_wrong_side'),
+    ('保证金不足', dict(side='buy', amount=2), 'insufficient_margin'),
+]
+
+
+@pytest.mark.parametrize('order, expected', [case[1:] for case in CASES], ids=[case[0] for case in CASES])
+def test_rejection_reasons(order, expected):
+    risk = engine(free=100.0)  # 1张需要 1*0.01*50000/10*1.05 = 52.5 USDT
+    rejection = risk.check(**order)
+    assert (rejection and rejection.reason) == expected
+    snapshot = risk.snapshot()
+    assert snapshot['rejections'] == ({expected: 1} if expected else {})
+    assert snapshot['passed'] == (expected is None)
+
+
+def test_below_min_amount_and_notional():
+    risk = engine()
+    risk.amount_step = None  # 只看数量和名义价值限制
+    assert risk.check('buy', 0.001).reason == 'amount_below_min'
+    risk.min_amount = None
+    assert risk.check('buy', 0.005).reason == 'notional_below_min'  # 0.005*0.01*50000 = 2.5 USDT
+
+
+def test_amount_above_exchange_max():
+    risk = engine()
+    risk.max_order_amount = risk.max_position_amount = None
+    assert risk.check('buy', 200).reason == 'amount_above_max'
+
+
+def test_passed_orders_reserve_margin_until_refresh():
+    risk = engine(free=150.0)
+    assert risk.check('buy', 1) is None
+    assert risk.check('buy', 1) is None
+    assert risk.check('buy', 1).reason == 'insufficient_margin'  # 前两笔已预扣 105 USDT
+    assert risk.needs_refresh()
+    risk.update_balance(150.0)
+    assert risk.check('buy', 1) is None
+
+
+def test_without_cached_balance_skips_margin_check():
+    assert engine(free=None).check('buy', 2) is None
+
+
+def test_disabled_engine_passes_everything():
+    risk = engine(enabled=False)
+    assert risk.check('buy', -1) is None
+    assert risk.snapshot()['checks'] == 0
+
+
+def test_normalize_price_rounds_to_tick():
+    risk = engine()
+    assert risk.normalize_price(50000.04) == 50000.0
+    assert risk.normalize_price(50000.1) == 50000.1
+    assert risk.stats['price_rounded'] == 1
+    risk.price_step = 0.25
+    assert risk.normalize_price(50000.3) == 50000.25
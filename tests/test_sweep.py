@@ -0,0 +1,38 @@
+import numpy as np
+
+import backtest
+import sweep
+
+BAR_MS = 300_000
+TIMING = ('elapsed_s', 'bars_per_sec')  # 墙钟耗时，每次都不同
+
+
+def candles(n=2000, seed=7):
+    """固定种子的随机游走5分钟K线，按sweep共享内存的布局（每列一行）"""
+    rng = np.random.default_rng(seed)
+    close = 40000 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.001, n)) * close
+    high = np.maximum(open_, close) + spread
+    low = np.minimum(open_, close) - spread
+    volume = rng.lognormal(3, 0.8, n)
+    ts = 1_704_067_200_000 + np.arange(n) * BAR_MS
+    return np.vstack([ts, open_, high, low, close, volume]).astype('float64')
+
+
+def test_same_point_twice_in_one_process_gives_identical_results():
+    # 与工作进程相同：一个进程里导入一次机器人模块，连续跑多个参数组合
+    sweep._worker.update(candles=candles(), backtest=backtest, options={
+        'source': 'rule', 'balance': 10000.0, 'start_ms': None, 'end_ms': None})
+    protection = backtest.bot.protection
+    live_stats = dict(protection.stats)
+    point = {'leverage': 10, 'rule.risk_pct': 0.5}
+
+    first = sweep._run_point(point)
+    sweep._run_point({'leverage': 5, 'amount': 0.2, 'rule.risk_pct': 1.5, 'exchange.latency_ms': 500})
+    second = sweep._run_point(point)
+
+    assert first['fills'] > 0
+    assert {k: v for k, v in first.items() if k not in TIMING} == {k: v for k, v in second.items() if k not in TIMING}
+    assert backtest.bot.protection is protection and protection.stats == live_stats
+    assert backtest.bot.pending_protection is None
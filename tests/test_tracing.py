@@ -0,0 +1,71 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import TracedExchange, Tracer
+
+
+class FakeExchange:
+    def fetch_ticker(self, symbol):
+        return {'symbol': symbol, 'last': 100.0}
+
+
+def in_thread(target, name):
+    thread = threading.Thread(target=target, name=name)
+    thread.start()
+    thread.join()
+
+
+def cycle_lines(path):
+    return [line for line in map(json.loads, path.read_text(encoding='utf-8').splitlines()) if line['type'] == 'cycle']
+
+
+def test_background_spans_stay_out_of_the_cycle(tmp_path):
+    tracer = Tracer(path=str(tmp_path / 'trace.jsonl'), summary_every=0)
+
+    with tracer.cycle():
+        with tracer.span('indicators'):
+            pass
+        in_thread(lambda: tracer.record('stop_reaction', tracer.clock(), 0.5), 'price-feed')
+        with ThreadPoolExecutor(thread_name_prefix='venue') as pool:
+            pool.submit(tracer.record, 'venue.binance', tracer.clock(), 0.2).result()
+
+    (line,) = cycle_lines(tmp_path / 'trace.jsonl')
+    assert [span['name'] for span in line['spans']] == ['indicators']
+    # 后台线程的耗时仍进入各自名称的分位数
+    assert tracer.percentiles('stop_reaction')['count'] == 1
+    assert tracer.percentiles('venue.binance')['count'] == 1
+
+
+def test_exchange_calls_from_other_threads_are_tagged(tmp_path):
+    tracer = Tracer(path=str(tmp_path / 'trace.jsonl'), summary_every=0)
+    exchange = TracedExchange(FakeExchange(), tracer)
+
+    with tracer.cycle():
+        exchange.fetch_ticker('BTC')
+        in_thread(lambda: exchange.fetch_ticker('BTC'), 'order-book')
+        with ThreadPoolExecutor(thread_name_prefix='derivatives') as pool:
+            pool.submit(exchange.fetch_ticker, 'BTC').result()
+
+    assert set(tracer.totals_snapshot()) == {'trading_cycle', 'exchange.fetch_ticker',
+                                             'exchange.fetch_ticker@order-book', 'exchange.fetch_ticker@derivatives'}
+    assert tracer.percentiles('exchange.fetch_ticker')['count'] == 1
+    (line,) = cycle_lines(tmp_path / 'trace.jsonl')
+    assert [span['name'] for span in line['spans']] == ['exchange.fetch_ticker']
+
+
+def test_cycles_run_from_a_worker_thread():
+    # 周期不在主线程上运行时，以运行周期的线程为准
+    tracer = Tracer()
+    exchange = TracedExchange(FakeExchange(), tracer)
+
+    def run_cycle():
+        with tracer.cycle():
+            exchange.fetch_ticker('BTC')
+            assert len(tracer._current['spans']) == 1
+
+    in_thread(run_cycle, 'bot')
+    exchange.fetch_ticker('BTC')
+
+    assert 'exchange.fetch_ticker' in tracer.totals_snapshot()
+    assert 'exchange.fetch_ticker@MainThread' in tracer.totals_snapshot()
@@ -0,0 +1,148 @@
+import pytest
+
+from paper_exchange import PaperExchange, SimClock
+from risk_engine import RiskEngine
+from venues import BinanceAdapter, OkxAdapter, VenueExecutor, plan_orders
+
+SYMBOL = 'BTC/USDT:USDT'
+PRICE = 50000.0
+MARKET = {
+    'contractSize': 0.01,
+    'precision': {'amount': 0.01, 'price': 0.1},
+    'limits': {'amount': {'min': 0.01, 'max': 100}, 'price': {'min': 1000, 'max': 1_000_000}, 'cost': {'min': 5}},
+}
+LONG = {'side': 'long', 'size': 1.5, 'entry_price': PRICE}
+SHORT = {'side': 'short', 'size': 1.5, 'entry_price': PRICE}
+BUY = {'signal': 'BUY', 'confidence': 'HIGH'}
+
+
+# (说明, 信号, 持仓, 预期订单)
+CASES = [
+    ('无持仓市价开多', BUY, None, [{'type': 'market', 'side': 'buy', 'amount': 2}]),
+    ('反手先平空再开多', BUY, SHORT, [{'type': 'market', 'side': 'buy', 'amount': 1.5, 'reduce_only': True},
+                              {'type': 'market', 'side': 'buy', 'amount': 2}]),
+    ('已有同向持仓', BUY, LONG, []),
+    ('反手平多再开空', {'signal': 'SELL', 'confidence': 'HIGH'}, LONG,
+     [{'type': 'market', 'side': 'sell', 'amount': 1.5, 'reduce_only': True},
+      {'type': 'market', 'side': 'sell', 'amount': 2}]),
+    ('信心不足且有挂单价', {'signal': 'BUY', 'confidence': 'MEDIUM', 'limit_price': 49900.0}, None,
+     [{'type': 'limit', 'side': 'buy', 'amount': 2, 'price': 49900.0}]),
+    ('信心不足但没有挂单价', {'signal': 'SELL', 'confidence': 'LOW'}, None, [{'type': 'market', 'side': 'sell', 'amount': 2}]),
+    ('挂单建议优先用入场价', {'signal': 'SELL', 'order_suggestion': 'PLACE_ORDER', 'entry_price': 50100.0,
+                    'limit_price': 50200.0}, LONG, [{'type': 'limit', 'side': 'sell', 'amount': 2, 'price': 50100.0}]),
+    ('挂单建议没有价格', {'signal': 'BUY', 'order_suggestion': 'PLACE_ORDER'}, None, []),
+    ('撤销挂单', {'signal': 'HOLD', 'order_suggestion': 'CANCEL_EXISTING'}, LONG, [{'type': 'cancel'}]),
+    ('观望', {'signal': 'HOLD', 'confidence': 'HIGH'}, None, []),
+    ('观望时的挂单建议', {'signal': 'HOLD', 'order_suggestion': 'PLACE_ORDER', 'entry_price': 50000.0}, None, []),
+]
+
+
+@pytest.mark.parametrize('signal_data, position, expected', [case[1:] for case in CASES], ids=[case[0] for case in CASES])
+def test_plan_orders(signal_data, position, expected):
+    assert plan_orders(signal_data, position, 2) == expected
+
+
+def venue(name='paper', amount=1.0, adapter=BinanceAdapter):
+    """最新价50000的模拟交易所，合约面值0.01、数量精度0.01、价格精度0.1"""
+    exchange = PaperExchange(SimClock(0), symbol=SYMBOL, contract_size=0.01, leverage=10, maker_fee=0.0, taker_fee=0.0)
+    exchange.on_price(PRICE, 0)
+    risk = RiskEngine(10)
+    risk.load_market(MARKET, precision_mode=4)  # TICK_SIZE
+    result = adapter(name, exchange, SYMBOL, amount, 10, risk)
+    result.setup()
+    return result
+
+
+def execute(venues, signal_data):
+    executor = VenueExecutor(venues)
+    return executor, executor.wait(executor.submit(signal_data, PRICE), timeout_s=5)
+
+
+def test_each_venue_trades_its_own_amount():
+    small, large = venue('small', amount=0.25), venue('large', amount=3)
+    _, results = execute([small, large], {**BUY, 'stop_loss': 49000.0, 'take_profit': 52000.0})
+
+    assert results == {'small': 'executed', 'large': 'executed'}
+    assert small.exchange.position_qty == 0.25 and large.exchange.position_qty == 3
+    for v in (small, large):
+        stops = v.exchange.fetch_open_orders(SYMBOL, params={'trigger': True})
+        assert sorted(o['stopLossPrice'] or o['takeProfitPrice'] for o in stops) == [49000.0, 52000.0]
+        assert all(o['amount'] == v.amount for o in stops)
+        assert v.pending_protection is None
+
+
+@pytest.mark.parametrize('amount, reason', [(0.005, 'amount_precision'), (0.015, 'amount_precision'),
+                                            (0.01, 'notional_below_min')])
+def test_min_size_and_precision_are_rejected_per_venue(amount, reason):
+    tiny, normal = venue('tiny', amount=amount), venue('normal', amount=1)
+    if reason == 'notional_below_min':
+        tiny.risk.min_cost = 6  # 0.01张 = 0.01*0.01*50000 = 5 USDT
+    _, results = execute([tiny, normal], BUY)
+
+    assert results == {'tiny': 'rejected', 'normal': 'executed'}  # 一个交易所被拒不影响其他交易所
+    assert tiny.exchange.fills == [] and tiny.stats['rejected'] == 1 and tiny.stats['orders'] == 0
+    assert tiny.risk.snapshot()['rejections'] == {reason: 1}
+    assert normal.exchange.position_qty == 1
+
+
+def test_reversal_is_rejected_as_a_whole():
+    # 平仓单能过风控，开仓单超过余额：两笔都不发送，不会只平仓不开仓
+    v = venue(amount=5)
+    v.exchange.create_market_order(SYMBOL, 'buy', 1)
+    v.risk.update_balance(10.0)
+    _, results = execute([v], {'signal': 'SELL', 'confidence': 'HIGH'})
+
+    assert results == {'paper': 'rejected'}
+    assert v.exchange.position_qty == 1
+
+
+def test_reversal_closes_then_opens():
+    v = venue(amount=0.5)
+    v.exchange.create_market_order(SYMBOL, 'buy', 1.5)
+    _, results = execute([v], {'signal': 'SELL', 'confidence': 'HIGH'})
+
+    assert results == {'paper': 'executed'}
+    assert [(f['side'], f['amount']) for f in v.exchange.fills[1:]] == [('sell', 1.5), ('sell', 0.5)]
+    assert v.exchange.position_qty == -0.5
+
+
+def test_limit_price_rounded_to_tick_and_protected_after_fill():
+    v = venue(amount=1, adapter=OkxAdapter)
+    signal_data = {'signal': 'BUY', 'confidence': 'MEDIUM', 'limit_price': 49950.04, 'stop_loss': 49000.0}
+    executor, results = execute([v], signal_data)
+
+    assert results == {'paper': 'executed'}
+    (order,) = v.exchange.fetch_open_orders(SYMBOL)
+    assert order['price'] == 49950.0 and order['info']['tag']
+    assert v.pending_protection == ('long', 49000.0, None, order['id'])
+    assert signal_data['limit_price'] == 49950.04  # 各交易所取整不改动主流程的信号
+
+    executor.protect_pending()
+    assert v.pending_protection is not None  # 未成交时不挂只减仓条件单
+    v.exchange.on_price(49940.0, 1000)
+    executor.protect_pending()
+
+    (stop,) = v.exchange.fetch_open_orders(SYMBOL, params={'trigger': True})
+    assert stop['stopLossPrice'] == 49000.0 and v.pending_protection is None
+
+
+def test_cancelled_limit_entry_drops_pending_protection():
+    v = venue(amount=1)
+    executor, _ = execute([v], {'signal': 'BUY', 'confidence': 'LOW', 'limit_price': 49000.0, 'take_profit': 51000.0})
+    (order,) = v.exchange.fetch_open_orders(SYMBOL)
+
+    v.exchange.cancel_order(order['id'], SYMBOL)
+    executor.protect_pending()
+
+    assert v.pending_protection is None
+    assert v.exchange.fetch_open_orders(SYMBOL, params={'trigger': True}) == []
+
+
+def test_hold_does_not_query_the_venue():
+    class Untouchable:
+        def __getattr__(self, name):
+            raise AssertionError(f"观望时不应调用 {name}")
+
+    v = BinanceAdapter('idle', Untouchable(), SYMBOL, 1, 10)
+    _, results = execute([v], {'signal': 'HOLD', 'confidence': 'HIGH'})
+    assert results == {'idle': 'skipped'}
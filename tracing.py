@@ -0,0 +1,267 @@
+"""
+分阶段耗时追踪
+
+每个交易周期是一个cycle，周期内的各阶段（K线获取、指标计算、提示词构建、LLM首字/总耗时、
+JSON解析、账户查询、下单与确认）记为span。
+- 每个span的耗时进入按名称分组的滚动窗口，随时可算p50/p95/p99
+- 每个周期结束时把该周期全部span写成一行JSON（JSON Lines）
+- 每隔summary_every个周期额外写一行分位数汇总
+
+记录一次span只是两次perf_counter加一次append，生产环境可常开。
+
+只有运行交易周期的线程上的span计入该周期；盘口推送、衍生品刷新、其他交易所等后台线程的span只进
+按名称分组的分位数，不会混进当时正在进行的周期。TracedExchange 在后台线程上的调用名称带线程名后缀
+（如 exchange.fetch_ticker@order-book），不与周期内同一接口的耗时混在一起。
+
+用法:
+    with tracer.cycle():
+        with tracer.span('indicators', timeframe='5m'):
+            ...
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from event_log import event, log
+
+
+def percentile(sorted_values, q):
+    """线性插值分位数，sorted_values已排序"""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'attrs', 'start')
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        attrs = self.attrs
+        if exc_type is not None:
+            attrs = dict(attrs, error=exc_type.__name__)
+        self.tracer.record(self.name, self.start, time.perf_counter() - self.start, attrs)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _Cycle:
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.tracer._begin_cycle(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._end_cycle(exc_type)
+        return False
+
+
+class Tracer:
+    """span记录、滚动分位数和JSON Lines输出"""
+
+    def __init__(self, path=None, window=1000, summary_every=12, enabled=True):
+        self.path = path
+        self.window = window
+        self.summary_every = summary_every
+        self.enabled = enabled
+        self.histograms = {}
+        # 进程启动以来的累计值（不受滚动窗口影响），供metrics端点导出
+        self.counts = {}
+        self.totals = {}
+        self.errors = {}
+        self.cycles = 0
+        self._current = None
+        # 运行交易周期的线程；第一个周期开始前默认为主线程
+        self._cycle_thread = threading.main_thread().ident
+        self._lock = threading.Lock()
+
+    def configure(self, enabled=None, path=None, window=None, summary_every=None):
+        if enabled is not None:
+            self.enabled = enabled
+        if path is not None:
+            self.path = path or None
+        if window is not None and window != self.window:
+            self.window = window
+            self.histograms = {name: deque(values, maxlen=window) for name, values in self.histograms.items()}
+        if summary_every is not None:
+            self.summary_every = summary_every
+
+    def clock(self):
+        return time.perf_counter()
+
+    def span(self, name, **attrs):
+        if not self.enabled:
+            return _NOOP
+        return _Span(self, name, attrs)
+
+    def cycle(self, name='trading_cycle'):
+        return _Cycle(self, name)
+
+    def thread_tag(self):
+        """在交易周期线程上返回None，否则返回线程名（线程池去掉序号，如 venue_0 -> venue）"""
+        thread = threading.current_thread()
+        if thread.ident == self._cycle_thread:
+            return None
+        return re.sub(r'_\d+$', '', thread.name)
+
+    def record(self, name, start, duration, attrs=None):
+        """记录一段耗时（秒）；start为perf_counter时刻。其他线程的span不计入当前周期"""
+        if not self.enabled:
+            return
+        own_thread = threading.get_ident() == self._cycle_thread
+        with self._lock:
+            self._accumulate(name, duration, attrs and 'error' in attrs)
+            if self._current is not None and own_thread:
+                self._current['spans'].append((name, start, duration, attrs))
+
+    def _accumulate(self, name, duration, failed):
+        values = self.histograms.get(name)
+        if values is None:
+            values = self.histograms[name] = deque(maxlen=self.window)
+        values.append(duration)
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.totals[name] = self.totals.get(name, 0.0) + duration
+        if failed:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def record_since(self, name, start, **attrs):
+        self.record(name, start, time.perf_counter() - start, attrs)
+
+    def percentiles(self, name):
+        with self._lock:  # metrics端点在其他线程读取，复制后再排序
+            values = sorted(self.histograms.get(name, ()))
+        if not values:
+            return None
+        return {
+            'count': len(values),
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'max_ms': values[-1] * 1000,
+        }
+
+    def summary(self):
+        with self._lock:
+            names = list(self.histograms)
+        return {name: self.percentiles(name) for name in sorted(names)}
+
+    def totals_snapshot(self):
+        """累计的 {名称: (次数, 总耗时秒, 失败次数)}"""
+        with self._lock:
+            return {name: (count, self.totals[name], self.errors.get(name, 0)) for name, count in self.counts.items()}
+
+    def print_summary(self):
+        summary = self.summary()
+        if not summary:
+            return
+        print(f"{'阶段':<36}{'次数':>6}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+        for name, stats in summary.items():
+            print(f"{name:<36}{stats['count']:>6}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+
+    def _begin_cycle(self, name):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._cycle_thread = threading.get_ident()
+            self._current = {'name': name, 'wall': time.time(), 'start': time.perf_counter(), 'spans': []}
+
+    def _end_cycle(self, exc_type):
+        if not self.enabled or self._current is None:
+            return
+        end = time.perf_counter()
+        with self._lock:
+            current, self._current = self._current, None
+            duration = end - current['start']
+            self._accumulate(current['name'], duration, exc_type is not None)
+            self.cycles += 1
+
+        if not self.path:
+            return
+        line = {
+            'type': 'cycle',
+            'ts': round(current['wall'], 3),
+            'cycle': self.cycles,
+            'duration_ms': round(duration * 1000, 3),
+            'error': exc_type.__name__ if exc_type else None,
+            'spans': [
+                dict({'name': name, 'offset_ms': round((start - current['start']) * 1000, 3),
+                      'duration_ms': round(dur * 1000, 3)}, **(attrs or {}))
+                for name, start, dur, attrs in current['spans']
+            ],
+        }
+        lines = [line]
+        if self.summary_every and self.cycles % self.summary_every == 0:
+            lines.append({'type': 'histogram', 'ts': round(time.time(), 3), 'cycle': self.cycles,
+                          'stages': self.summary()})
+        self._write(lines)
+
+    def _write(self, lines):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for line in lines:
+                    f.write(json.dumps(line, ensure_ascii=False, separators=(',', ':')) + "\n")
+        except OSError as e:
+            log.warning(f"写入追踪日志失败: {e}", extra=event('error'))
+
+
+class TracedExchange:
+    """给交易所的每次接口调用套上span，名称为 exchange.<方法>（K线按周期细分，后台线程加 @线程名）"""
+
+    def __init__(self, exchange, tracer):
+        self._exchange = exchange
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        attr = getattr(self._exchange, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+        tracer = self._tracer
+
+        def traced(*args, **kwargs):
+            span_name = f"exchange.{name}"
+            if name == 'fetch_ohlcv':
+                timeframe = args[1] if len(args) > 1 else kwargs.get('timeframe', '1m')
+                span_name = f"{span_name}.{timeframe}"
+            thread = tracer.thread_tag()
+            if thread is not None:
+                span_name = f"{span_name}@{thread}"
+            with tracer.span(span_name):
+                return attr(*args, **kwargs)
+
+        return traced
+
+
+# 全局默认tracer，由机器人按TRADE_CONFIG['tracing']配置
+tracer = Tracer()
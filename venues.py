@@ -0,0 +1,296 @@
+"""
+多交易所执行
+
+deepseek.py（币安合约）和 deepseek_ok版本.py（OKX永续）原本是两份几乎相同的脚本，区别只在持仓解析
+（positionAmt / contracts）、下单参数（reduceOnly、OKX的tag）和交易对写法；同时跑两个进程就要
+重复取两份行情、问两次LLM。现在由一个进程驱动：行情和LLM决策只在主交易所（OKX）上做一次，
+同一个信号再并发地交给其他交易所的适配器执行:
+
+    VenueAdapter    交易所差异：杠杆设置参数、持仓解析、下单参数、止盈止损条件单
+    plan_orders     与主流程相同的决策规则（挂单/市价/反手/撤单）展开成订单列表，各交易所共用
+    VenueExecutor   每个交易所一个线程并发执行；每个交易所有自己的本地风控（余额、合约规格）
+
+止盈止损是reduceOnly条件单，只有持仓存在时才能挂（币安对没有持仓的reduceOnly单返回-2022）：市价开仓后立即挂；
+限价开仓先记为待保护，每个周期开始时（与有没有信号无关）由protect_pending查询持仓，看到成交再挂，
+挂单已不在且没有持仓时放弃。挂止盈止损失败单独计数，不影响已受理的开仓单，下个周期重试。
+
+每个交易所记录从拿到信号到最后一笔订单被接受的延迟（tracer中的 venue.<名称>）、执行/拒绝/失败次数。
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ccxt
+
+from event_log import event, log
+from risk_engine import RiskEngine
+
+OKX_TAG = 'f1ee03b510d5SUDE'
+
+
+class VenueAdapter:
+    """交易所适配器基类（按ccxt统一接口实现，币安等直接可用）"""
+
+    def __init__(self, name, exchange, symbol, amount, leverage, risk=None):
+        self.name = name
+        self.exchange = exchange
+        self.symbol = symbol
+        self.amount = amount
+        self.leverage = leverage
+        self.risk = risk or RiskEngine(leverage)
+        self.protective_ids = []
+        self.pending_protection = None  # 待挂止盈止损: (持仓方向, 止损, 止盈, 限价开仓单id或None)
+        self.stats = {'executions': 0, 'orders': 0, 'rejected': 0, 'failed': 0, 'protection_failed': 0,
+                      'latency_s': 0.0}
+
+    # ---- 交易所差异 ----
+
+    def leverage_params(self):
+        return {}
+
+    def order_params(self, reduce_only=False):
+        return {'reduceOnly': True} if reduce_only else {}
+
+    def signed_amount(self, pos):
+        """持仓数量，多头为正、空头为负"""
+        contracts = float(pos.get('contracts') or 0)
+        return -contracts if pos.get('side') == 'short' else contracts
+
+    def protect(self, position_side, stop_loss, take_profit):
+        """止损、止盈各挂一张reduceOnly条件单（币安不支持同一张单同时带止盈止损）"""
+        close_side = 'sell' if position_side == 'long' else 'buy'
+        for key, price in (('stopLossPrice', stop_loss), ('takeProfitPrice', take_profit)):
+            if price is not None:
+                order = self.exchange.create_order(self.symbol, 'market', close_side, self.amount, None,
+                                                   {**self.order_params(reduce_only=True), key: price})
+                self.protective_ids.append(order['id'])
+
+    def cancel_protection(self, params=None):
+        for order_id in self.protective_ids:
+            try:
+                self.exchange.cancel_order(order_id, self.symbol, params)
+            except ccxt.OrderNotFound:
+                pass  # 已触发或已被撤销
+        self.protective_ids = []
+
+    # ---- 通用流程 ----
+
+    def setup(self):
+        self.exchange.set_leverage(self.leverage, self.symbol, self.leverage_params())
+        self.refresh_balance()
+
+    def refresh_balance(self):
+        self.risk.update_balance(self.exchange.fetch_balance()['USDT']['free'])
+
+    def fetch_position(self):
+        """与 get_current_position 相同结构的持仓，没有持仓返回None"""
+        for pos in self.exchange.fetch_positions([self.symbol]):
+            if pos['symbol'] != self.symbol:
+                continue
+            amount = self.signed_amount(pos)
+            if amount:
+                return {
+                    'side': 'long' if amount > 0 else 'short',
+                    'size': abs(amount),
+                    'entry_price': float(pos.get('entryPrice') or 0),
+                    'unrealized_pnl': float(pos.get('unrealizedPnl') or 0),
+                    'leverage': float(pos.get('leverage') or self.leverage),
+                    'symbol': pos['symbol'],
+                }
+        return None
+
+    def send(self, leg):
+        if leg['type'] == 'cancel':
+            for order in self.exchange.fetch_open_orders(self.symbol):
+                if order['id'] not in self.protective_ids:  # 币安的未成交列表里也有条件单
+                    self.exchange.cancel_order(order['id'], self.symbol)
+            return None
+        params = self.order_params(leg.get('reduce_only', False))
+        if leg['type'] == 'limit':
+            return self.exchange.create_limit_order(self.symbol, leg['side'], leg['amount'], leg['price'], params=params)
+        return self.exchange.create_market_order(self.symbol, leg['side'], leg['amount'], params=params)
+
+
+class OkxAdapter(VenueAdapter):
+    def leverage_params(self):
+        return {'mgnMode': 'cross'}
+
+    def order_params(self, reduce_only=False):
+        return {**super().order_params(reduce_only), 'tag': OKX_TAG}
+
+    def protect(self, position_side, stop_loss, take_profit):
+        # OKX策略委托可以同时带止盈止损（触发一边另一边自动撤销）
+        close_side = 'sell' if position_side == 'long' else 'buy'
+        params = {'reduceOnly': True, 'tag': f'{OKX_TAG}_STOP'}
+        if stop_loss is not None:
+            params['stopLossPrice'] = stop_loss
+        if take_profit is not None:
+            params['takeProfitPrice'] = take_profit
+        order = self.exchange.create_order(self.symbol, 'market', close_side, self.amount, None, params)
+        self.protective_ids.append(order['id'])
+
+    def cancel_protection(self, params=None):
+        super().cancel_protection({'trigger': True})
+
+
+class BinanceAdapter(VenueAdapter):
+    def signed_amount(self, pos):
+        # 单向持仓模式下 positionAmt 自带方向
+        info = pos.get('info') or {}
+        if 'positionAmt' in info:
+            return float(info['positionAmt'])
+        return super().signed_amount(pos)
+
+
+ADAPTERS = {'okx': OkxAdapter, 'binanceusdm': BinanceAdapter, 'binance': BinanceAdapter}
+
+
+def plan_orders(signal_data, position, amount):
+    """
+    按主流程 execute_trade 的规则把信号展开成订单列表:
+    [{'type': 'market'|'limit'|'cancel', 'side', 'amount', 'price', 'reduce_only'}]
+    """
+    side = {'BUY': 'buy', 'SELL': 'sell'}.get(signal_data.get('signal'))
+    if 'order_suggestion' in signal_data:
+        suggestion = signal_data['order_suggestion']
+        if suggestion == 'CANCEL_EXISTING':
+            return [{'type': 'cancel'}]
+        price = signal_data.get('entry_price') or signal_data.get('limit_price')
+        if suggestion != 'PLACE_ORDER' or side is None or price is None:
+            return []
+        return [{'type': 'limit', 'side': side, 'amount': amount, 'price': price}]
+    if side is None:
+        return []
+    # 信心十足且有市价参考时市价交易，信心不足且有挂单价时挂单，否则市价
+    if signal_data.get('confidence') in ('MEDIUM', 'LOW') and signal_data.get('limit_price') is not None:
+        return [{'type': 'limit', 'side': side, 'amount': amount, 'price': signal_data['limit_price']}]
+
+    opposite = 'short' if side == 'buy' else 'long'
+    if position and position['side'] == opposite:
+        return [{'type': 'market', 'side': side, 'amount': position['size'], 'reduce_only': True},
+                {'type': 'market', 'side': side, 'amount': amount}]
+    if not position:
+        return [{'type': 'market', 'side': side, 'amount': amount}]
+    return []  # 已持有同向仓位
+
+
+class VenueExecutor:
+    def __init__(self, venues, tracer=None):
+        self.venues = venues
+        self.tracer = tracer
+        self._pool = ThreadPoolExecutor(max_workers=max(len(venues), 1), thread_name_prefix='venue')
+
+    def submit(self, signal_data, reference_price):
+        """信号到达后立即在所有交易所并发执行（与主交易所的下单同时进行），返回Future列表"""
+        started = time.perf_counter()
+        signal_data = dict(signal_data)  # 各线程和主流程会改写entry_price，互不影响
+        return [self._pool.submit(self._execute, venue, signal_data, reference_price, started)
+                for venue in self.venues]
+
+    def protect_pending(self, timeout_s=30.0):
+        """每个周期开始时调用：有待保护开仓的交易所并发查询持仓，成交了就挂止盈止损（执行完再返回，不与下单重叠）"""
+        futures = [self._pool.submit(self._protect_filled, venue)
+                   for venue in self.venues if venue.pending_protection is not None]
+        for future in futures:
+            try:
+                future.result(timeout=timeout_s)
+            except Exception as e:
+                log.warning(f"检查待保护持仓超时: {e}", extra=event('error'))
+
+    def _execute(self, venue, signal_data, reference_price, started):
+        if not plan_orders(signal_data, None, venue.amount):
+            return 'skipped'  # 观望等信号不需要查询持仓
+        try:
+            position = venue.fetch_position()
+            legs = plan_orders(signal_data, position, venue.amount)
+            if not legs:
+                return 'skipped'
+
+            venue.risk.mark_price(reference_price)
+            for leg in legs:
+                if leg['type'] == 'cancel':
+                    continue
+                if leg['type'] == 'limit':
+                    leg['price'] = venue.risk.normalize_price(leg['price'])
+                rejection = venue.risk.check(leg['side'], leg['amount'], leg.get('price'), signal_data.get('stop_loss'),
+                                             signal_data.get('take_profit'), position, leg.get('reduce_only', False))
+                if rejection is not None:
+                    venue.stats['rejected'] += 1
+                    log.warning(f"[{venue.name}] 风控拒绝{leg['side']}单（{rejection.reason}）: {rejection.message}",
+                                extra=event('order', action='reject', venue=venue.name, reason=rejection.reason))
+                    return 'rejected'  # 所有订单都通过才发送，不会只做一半
+
+            opened = entry_id = None
+            for leg in legs:
+                order = venue.send(leg)
+                if leg['type'] == 'cancel':
+                    venue.pending_protection = None  # 挂单已撤，不会再成交
+                if order is not None:
+                    venue.stats['orders'] += 1
+                    if not leg.get('reduce_only'):
+                        opened = 'long' if leg['side'] == 'buy' else 'short'
+                        entry_id = order['id'] if leg['type'] == 'limit' else None
+            latency = time.perf_counter() - started
+            venue.stats['executions'] += 1
+            venue.stats['latency_s'] += latency
+            if self.tracer is not None:
+                self.tracer.record(f'venue.{venue.name}', started, latency)
+            log.info(f"[{venue.name}] 执行 {signal_data.get('signal')}: {len(legs)} 笔订单，信号到下单 {latency * 1000:.0f}ms",
+                     extra=event('order', action='ack', venue=venue.name, legs=len(legs), latency_s=latency))
+
+            if opened is not None and (signal_data.get('stop_loss') is not None
+                                       or signal_data.get('take_profit') is not None):
+                venue.pending_protection = (opened, signal_data.get('stop_loss'), signal_data.get('take_profit'),
+                                            entry_id)
+                if entry_id is None:
+                    self._protect(venue)
+        except Exception as e:
+            venue.stats['failed'] += 1
+            log.error(f"[{venue.name}] 执行失败: {e}", extra=event('error', venue=venue.name))
+            return 'failed'
+        try:
+            venue.refresh_balance()
+        except Exception as e:
+            log.warning(f"[{venue.name}] 刷新余额失败: {e}", extra=event('error', venue=venue.name))
+        return 'executed'
+
+    def _protect_filled(self, venue):
+        """查询持仓，看到对应方向的持仓（限价开仓已成交）再挂止盈止损；开仓单已不在且没有持仓时放弃"""
+        side, _, _, entry_id = venue.pending_protection
+        try:
+            # 先查订单再查持仓：两次查询之间成交时持仓里一定能看到
+            status = venue.exchange.fetch_order(entry_id, venue.symbol)['status'] if entry_id else 'closed'
+            position = venue.fetch_position()
+        except Exception as e:
+            log.warning(f"[{venue.name}] 查询持仓失败，稍后再挂止盈止损: {e}", extra=event('error', venue=venue.name))
+            return
+        if position is not None and position['side'] == side:
+            self._protect(venue)
+        elif status != 'open':
+            venue.pending_protection = None
+            log.info(f"[{venue.name}] 开仓单已{status}且无对应持仓，不再挂止盈止损",
+                     extra=event('order', action='protect', venue=venue.name, status=status))
+
+    def _protect(self, venue):
+        """持仓已存在时挂止盈止损；失败只计入protection_failed（开仓单已被受理）"""
+        side, stop_loss, take_profit, _ = venue.pending_protection
+        try:
+            venue.cancel_protection()
+            venue.protect(side, stop_loss, take_profit)
+            venue.pending_protection = None
+        except Exception as e:
+            venue.stats['protection_failed'] += 1  # 保留待保护，下个周期重试
+            log.error(f"[{venue.name}] 设置止盈止损失败，持仓暂无保护，下个周期重试: {e}",
+                      extra=event('error', venue=venue.name, action='protect'))
+
+    def wait(self, futures, timeout_s=30.0):
+        """等待各交易所执行完（主流程结束前调用，避免周期重叠）"""
+        results = {}
+        for venue, future in zip(self.venues, futures):
+            try:
+                results[venue.name] = future.result(timeout=timeout_s)
+            except Exception:
+                results[venue.name] = 'timeout'
+        return results
+
+    def snapshot(self):
+        return {venue.name: dict(venue.stats) for venue in self.venues}